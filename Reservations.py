@@ -1,11 +1,22 @@
 import sqlite3
 import os
 from datetime import datetime
-import pytz
 import bcrypt
 import time
 import re
 
+import availability
+import defrag
+import holds
+import inventory
+import ledger
+import lottery
+import maintenance
+import pricing
+import timeslots
+import waitlist
+from schema import ensure_schema
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB = os.path.join(BASE_DIR, "reservation_system.db")
 
@@ -134,7 +145,7 @@ def setup_db():
     # Default booking rule
     cur.execute("SELECT * FROM booking_rules")
     if not cur.fetchone():
-        cur.execute("INSERT INTO booking_rules VALUES (1,2)")
+        cur.execute("INSERT INTO booking_rules (id, max_active) VALUES (1,2)")
 
     # Default librarian
     cur.execute("SELECT * FROM users WHERE role='librarian'")
@@ -154,6 +165,8 @@ def setup_db():
             cur.execute("INSERT INTO equipment (name,price) VALUES (?,?)", e)
 
     conn.commit()
+    ensure_schema(conn)
+    timeslots.load_grid(cur)
     conn.close()
 
 # ================= USER =================
@@ -186,8 +199,7 @@ def register():
         hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
         
         # Get current timestamp
-        malaysia_tz = pytz.timezone("Asia/Kuala_Lumpur")
-        now = datetime.now(malaysia_tz).strftime("%Y-%m-%d %H:%M:%S")
+        now = timeslots.timestamp()
         
         cur.execute("""
         INSERT INTO users (name,student_id,faculty,email,username,password,role,created_at,updated_at)
@@ -197,6 +209,7 @@ def register():
         uid = cur.lastrowid  # dapatkan ID user baru
         cur.execute("INSERT INTO bank VALUES (?,0)", (uid,))  # system balance
         cur.execute("INSERT INTO user_bank_acc VALUES (?,1000)", (uid,))  # bank account
+        ledger.open_account(cur, uid)
 
         conn.commit()
         print(" Registration successful. Bank account created with balance 1000.")
@@ -236,17 +249,14 @@ def view_rooms(user=None, ai_suggestion=False, date=None, start_time=None, end_t
     # Filter by status - only show available rooms
     cur.execute("SELECT * FROM rooms WHERE status='available'")
     rooms = cur.fetchall()
+    # One occupancy matrix for every room instead of a query per room
+    free = None
+    if date and start_time and end_time:
+        free = set(availability.free_rooms(cur, date, start_time, end_time, [r["id"] for r in rooms]))
     for r in rooms:
         status = "Available"
-        if date and start_time and end_time:
-            # Check overlapping reservations (updated to use 'Confirmed' status)
-            cur.execute("""
-            SELECT * FROM reservations
-            WHERE room_id=? AND date=? AND status IN ('Confirmed', 'Pending')
-            AND NOT (end_time <= ? OR start_time >= ?)
-            """, (r["id"], date, start_time, end_time))
-            if cur.fetchone():
-                status = "Not Available"
+        if free is not None and r["id"] not in free:
+            status = "Not Available"
 
         # Show room with pricing
         print(f"{r['id']}. {r['room_name']} | Capacity: {r['capacity']} | {r['price_per_hour']} credits/hour | Status: {status}")
@@ -260,13 +270,16 @@ def view_rooms(user=None, ai_suggestion=False, date=None, start_time=None, end_t
     conn.close()
 
 
-def view_equipment(user=None, ai_suggestion=False):
+def view_equipment(user=None, ai_suggestion=False, date=None, start_time=None, end_time=None):
     conn = connect_db()
     cur = conn.cursor()
     cur.execute("SELECT * FROM equipment")
+    equipment = cur.fetchall()
+    free = inventory.equipment_availability(cur, date, start_time, end_time) if date else {}
     print("\nAvailable Equipment (Optional, pay from balance):")
-    for e in cur.fetchall():
-        print(f"{e['id']}. {e['name']} - {e['price']} credits")
+    for e in equipment:
+        stock = f" | {free.get(e['id'], 0)} of {e['quantity']} free" if date else f" | {e['quantity']} in stock"
+        print(f"{e['id']}. {e['name']} - {e['price']} credits{stock}")
     if ai_suggestion and user:
         print("\n Suggested equipment based on faculty:")
         if user["faculty"].lower() == "science":
@@ -278,25 +291,14 @@ def view_equipment(user=None, ai_suggestion=False):
 # ================= HELPER FUNCTIONS =================
 def calculate_hours(start_time, end_time):
     """Calculate hours between two time slots"""
-    time_slots = [
-        "08:00 AM","09:00 AM","10:00 AM","11:00 AM",
-        "12:00 PM","01:00 PM","02:00 PM","03:00 PM",
-        "04:00 PM","05:00 PM","06:00 PM","07:00 PM","08:00 PM"
-    ]
-    try:
-        start_idx = time_slots.index(start_time)
-        end_idx = time_slots.index(end_time)
-        return end_idx - start_idx
-    except ValueError:
-        return 0
+    return timeslots.calculate_hours(start_time, end_time)
 
 # ================= STUDENT =================
 def view_balance_and_topup(user):
 
     conn = connect_db()
     cur = conn.cursor()
-    cur.execute("SELECT balance FROM bank WHERE user_id=?", (user["id"],))
-    system_balance = cur.fetchone()["balance"]
+    system_balance = ledger.balance(cur, ledger.wallet(user["id"]))
     print(f" System Balance: {system_balance}")
     conn.close()
 
@@ -339,30 +341,26 @@ Choose Bank:
 
     conn = connect_db()
     cur = conn.cursor()
-    cur.execute("SELECT bank_balance FROM user_bank_acc WHERE user_id=?", (user["id"],))
-    bank_acc = cur.fetchone()["bank_balance"]
+    if not conn.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")
+    bank_acc = ledger.balance(cur, ledger.bank(user["id"]))
     if bank_acc < amt:
         print(f" Not enough money in your bank account (Available: {bank_acc})")
         conn.close()
         return
 
-    malaysia_tz = pytz.timezone("Asia/Kuala_Lumpur")
-    malaysia_time = datetime.now(malaysia_tz)
+    now = timeslots.timestamp("%Y-%m-%d %H:%M")
 
-    cur.execute("UPDATE user_bank_acc SET bank_balance = bank_balance - ? WHERE user_id=?", (amt, user["id"]))
-    cur.execute("UPDATE bank SET balance = balance + ? WHERE user_id=?", (amt, user["id"]))
+    ledger.transfer(cur, ledger.bank(user["id"]), ledger.wallet(user["id"]), amt, f"Top-up via {banks[bank_choice]}")
     cur.execute("""
         INSERT INTO transactions (user_id, bank_name, amount, date, status)
         VALUES (?,?,?,?,?)
-    """, (user["id"], banks[bank_choice], amt, malaysia_time.strftime("%Y-%m-%d %H:%M"), "SUCCESS"))
+    """, (user["id"], banks[bank_choice], amt, now, "SUCCESS"))
 
     conn.commit()
 
-    cur.execute("SELECT balance FROM bank WHERE user_id=?", (user["id"],))
-    print(f" Updated System Balance: {cur.fetchone()['balance']}")
-
-    cur.execute("SELECT bank_balance FROM user_bank_acc WHERE user_id=?", (user["id"],))
-    print(f" Updated Bank Account Balance: {cur.fetchone()['bank_balance']}")
+    print(f" Updated System Balance: {ledger.balance(cur, ledger.wallet(user['id']))}")
+    print(f" Updated Bank Account Balance: {ledger.balance(cur, ledger.bank(user['id']))}")
 
     conn.close()
     print(f" Topup SUCCESS via {banks[bank_choice]} (+{amt} credits)")
@@ -371,17 +369,15 @@ Choose Bank:
 
 # ================= RESERVATION =================
 def choose_time(label):
-    time_slots = [
-        "08:00 AM","09:00 AM","10:00 AM","11:00 AM",
-        "12:00 PM","01:00 PM","02:00 PM","03:00 PM",
-        "04:00 PM","05:00 PM","06:00 PM","07:00 PM","08:00 PM"
-    ]
+    labels = timeslots.grid().labels
     print(f"\nSelect {label}:")
-    for i, t in enumerate(time_slots, 1):
+    for i, t in enumerate(labels, 1):
         print(f"{i}. {t}")
     try:
         choice = int(input("Choose: "))
-        return choice, time_slots[choice-1]
+        if not 1 <= choice <= len(labels):
+            return None, None
+        return choice, labels[choice-1]
     except:
         return None, None
 
@@ -411,23 +407,12 @@ def reserve_room(user):
         return
 
     # Time slots
-    time_slots = [
-        "08:00 AM","09:00 AM","10:00 AM","11:00 AM",
-        "12:00 PM","01:00 PM","02:00 PM","03:00 PM",
-        "04:00 PM","05:00 PM","06:00 PM","07:00 PM","08:00 PM"
-    ]
-
-    print("\nSelect Start Time:")
-    for i, t in enumerate(time_slots, 1):
-        print(f"{i}. {t}")
-    s = int(input("Choose start time: "))
-    start_time = time_slots[s-1]
-
-    print("\nSelect End Time:")
-    for i, t in enumerate(time_slots, 1):
-        print(f"{i}. {t}")
-    e = int(input("Choose end time: "))
-    end_time = time_slots[e-1]
+    s, start_time = choose_time("Start Time")
+    e, end_time = choose_time("End Time")
+    if not start_time or not end_time:
+        print(" Invalid time slot")
+        conn.close()
+        return
 
     if e <= s:
         print(" End time must be after start time")
@@ -447,42 +432,46 @@ def reserve_room(user):
         conn.close()
         return
 
-    # Safety check - updated to use Confirmed/Pending
-    cur.execute("""
-    SELECT * FROM reservations
-    WHERE room_id=? AND date=? AND status IN ('Confirmed', 'Pending')
-    AND NOT (end_time <= ? OR start_time >= ?)
-    """, (room, date, start_time, end_time))
-    if cur.fetchone():
-        print(" Room already booked in this time range")
+    # Lottery dates: only queue the request; it is drawn later in one batch
+    window = lottery.open_window_for(cur, date)
+    if window:
+        try:
+            num_people = int(input("Number of people: "))
+            lottery.queue_request(cur, window["id"], user["id"], room, date, start_time, end_time, num_people)
+        except ValueError as err:
+            print(f" {err}")
+            conn.close()
+            return
+        conn.commit()
         conn.close()
+        print(f" Request entered into the lottery for {date}. Results are drawn at {window['draw_at']}.")
         return
 
-    # Calculate room cost
-    hours = calculate_hours(start_time, end_time)
-    room_cost = room_data['price_per_hour'] * hours
+    # Safety check - opening hours and overlapping Confirmed/Pending bookings
+    try:
+        availability.check_window(cur, room, date, start_time, end_time)
+    except ValueError as err:
+        print(f" {err}")
+        conn.close()
+        return
 
     # Equipment
-    view_equipment(user, ai_suggestion=True)
+    view_equipment(user, ai_suggestion=True, date=date, start_time=start_time, end_time=end_time)
     equip_ids = input("Equipment IDs (comma separated) or Enter to skip: ")
+    equip_list = [i.strip() for i in equip_ids.split(",") if i.strip()] if equip_ids else []
 
-    equipment_cost = 0
-    equip_list = []
-
-    if equip_ids:
-        for i in equip_ids.split(","):
-            cur.execute("SELECT price FROM equipment WHERE id=?", (i.strip(),))
-            row = cur.fetchone()
-            if row:
-                equipment_cost += row["price"]
-                equip_list.append(i.strip())
-            else:
-                print(" Invalid equipment ID")
-                conn.close()
-                return
+    # Quote once (room + equipment in one query); stored on the reservation
+    try:
+        quote = pricing.quote_booking(cur, room, date, start_time, end_time, equip_list)
+    except ValueError as err:
+        print(f" {err}")
+        conn.close()
+        return
 
-    # Total cost
-    total_cost = room_cost + equipment_cost
+    hours = quote['quoted_hours']
+    room_cost = quote['room_cost']
+    equipment_cost = quote['equipment_cost']
+    total_cost = quote['total_cost']
 
     # Number of people
     num_people = int(input("Number of people: "))
@@ -493,26 +482,32 @@ def reserve_room(user):
     print("="*50)
     print(f"Room: {room_data['room_name']}")
     print(f"Duration: {hours} hour(s)")
-    print(f"Room cost: {room_cost} credits ({hours} × {room_data['price_per_hour']} credits/hour)")
+    print(f"Room cost: {room_cost} credits ({hours} × {quote['quoted_rate']} credits/hour avg)")
     print(f"Equipment cost: {equipment_cost} credits")
     print(f"Total: {total_cost} credits")
     print("="*50)
 
     # Get current timestamp
-    malaysia_tz = pytz.timezone("Asia/Kuala_Lumpur")
-    now = datetime.now(malaysia_tz).strftime("%Y-%m-%d %H:%M:%S")
+    now = timeslots.timestamp()
 
     # Insert reservation with Pending status
     cur.execute("""
-    INSERT INTO reservations (user_id, room_id, date, start_time, end_time, num_people, status, created_at, updated_at)
-    VALUES (?,?,?,?,?,?,'Pending',?,?)
-    """,(user["id"], room, date, start_time, end_time, num_people, now, now))
+    INSERT INTO reservations (user_id, room_id, date, start_time, end_time, num_people, status,
+                              quoted_rate, quoted_hours, room_cost, equipment_cost, total_cost,
+                              created_at, updated_at)
+    VALUES (?,?,?,?,?,?,'Pending',?,?,?,?,?,?,?)
+    """,(user["id"], room, date, start_time, end_time, num_people,
+         quote['quoted_rate'], quote['quoted_hours'], room_cost, equipment_cost, total_cost, now, now))
 
     res_id = cur.lastrowid
 
-    # Add equipment
-    for e in equip_list:
-        cur.execute("INSERT INTO reservation_equipment VALUES (?,?)",(res_id,e))
+    # Add equipment and take it out of stock in the same transaction
+    try:
+        inventory.reserve_equipment(cur, res_id, equip_list)
+    except ValueError as err:
+        print(f" {err}")
+        conn.close()  # nothing committed: the reservation is discarded too
+        return
 
     conn.commit()
 
@@ -524,7 +519,7 @@ def reserve_room(user):
     print("PAYMENT")
     print("="*50)
     print("1. Pay Now (Confirm booking)")
-    print("2. Pay Later (Booking will remain Pending)")
+    print(f"2. Pay Later (Booking stays Pending for up to {holds.PENDING_MAX_HOURS} hours)")
     choice = input("Choose: ")
 
     if choice == "1":
@@ -534,7 +529,7 @@ def reserve_room(user):
             print("\n Payment failed. Booking saved as Pending.")
             print("You can pay later to confirm your booking.")
     else:
-        print("\n Booking saved as Pending. Please pay to confirm.")
+        print(f"\n Booking saved as Pending. Please pay within {holds.PENDING_MAX_HOURS} hours to confirm.")
 
     conn.close()
     print(f"\n Reservation process completed!")
@@ -546,8 +541,8 @@ def process_payment(user, reservation_id, amount):
     conn = connect_db()
     cur = conn.cursor()
     
-    # Generate transaction ID
-    transaction_id = f"TXN-{int(time.time())}"
+    # Generate transaction ID (unique even for two payments in the same second)
+    transaction_id = f"TXN-{int(time.time())}-{reservation_id}"
     
     # Get payment details
     print("\n Payment Method:")
@@ -578,20 +573,23 @@ def process_payment(user, reservation_id, amount):
         bank_name = "Credit Card"
     
     # Check balance if using system balance
+    if not conn.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")
+    source = ledger.EXTERNAL    # card / online banking money comes from outside
     if payment_method == "System Balance":
-        cur.execute("SELECT balance FROM bank WHERE user_id=?", (user["id"],))
-        balance = cur.fetchone()["balance"]
+        source = ledger.wallet(user["id"])
+        balance = ledger.balance(cur, source)
         if balance < amount:
             print(f" Insufficient balance (Available: {balance} credits)")
             conn.close()
             return False
-        
-        # Deduct balance
-        cur.execute("UPDATE bank SET balance = balance - ? WHERE user_id=?", (amount, user["id"]))
+    
+    # Deduct balance
+    if amount > 0:
+        ledger.transfer(cur, source, ledger.REVENUE, amount, "Booking payment", transaction_id)
     
     # Create payment record
-    malaysia_tz = pytz.timezone("Asia/Kuala_Lumpur")
-    paid_at = datetime.now(malaysia_tz).strftime("%Y-%m-%d %H:%M:%S")
+    paid_at = timeslots.timestamp()
     
     cur.execute("""
         INSERT INTO payments (
@@ -604,7 +602,7 @@ def process_payment(user, reservation_id, amount):
           transaction_id, 'completed', paid_at, paid_at))
     
     # Update reservation status to Confirmed
-    cur.execute("UPDATE reservations SET status='Confirmed' WHERE id=?", (reservation_id,))
+    cur.execute("UPDATE reservations SET status='Confirmed', held_until=NULL WHERE id=?", (reservation_id,))
     
     conn.commit()
     conn.close()
@@ -649,6 +647,17 @@ def update_reservation(user):
         view_rooms(user, ai_suggestion=True)
         new_room = input("New Room ID: ")
 
+        cur.execute("SELECT date, start_time, end_time FROM reservations WHERE id=? AND user_id=?", (rid, user["id"]))
+        current = cur.fetchone()
+        if current:
+            try:
+                availability.check_window(cur, new_room, current["date"], current["start_time"],
+                                          current["end_time"], rid)
+            except ValueError as err:
+                print(f" {err}")
+                conn.close()
+                return
+
         cur.execute("""
         UPDATE reservations SET room_id=? WHERE id=? AND user_id=?
         """, (new_room, rid, user["id"]))
@@ -676,17 +685,20 @@ def update_reservation(user):
         room_id = cur.fetchone()["room_id"]
 
         # Check overlapping booking (exclude current reservation)
-        cur.execute("""
-        SELECT * FROM reservations
-        WHERE room_id=? AND date=? AND id!=?
-        AND NOT (end_time <= ? OR start_time >= ?)
-        """, (room_id, d, rid, start_time, end_time))
-
-        if cur.fetchone():
-            print(" Room already booked in this time range")
+        try:
+            availability.check_window(cur, room_id, d, start_time, end_time, rid)
+        except ValueError as err:
+            print(f" {err}")
             conn.close()
             return
 
+        # Move the equipment hold along with the booking
+        cur.execute("SELECT status FROM reservations WHERE id=? AND user_id=?", (rid, user["id"]))
+        current = cur.fetchone()
+        active = current is not None and current["status"] in availability.BLOCKING_STATUSES
+        if active:
+            inventory.release_equipment(cur, rid)
+
         # Update reservation
         cur.execute("""
         UPDATE reservations
@@ -694,6 +706,14 @@ def update_reservation(user):
         WHERE id=? AND user_id=?
         """, (d, start_time, end_time, rid, user["id"]))
 
+        if active:
+            try:
+                inventory.claim_equipment(cur, rid)
+            except ValueError as err:
+                print(f" {err}")
+                conn.close()
+                return
+
     conn.commit()
     conn.close()
     print(" Updated reservation")
@@ -724,6 +744,12 @@ def cancel_reservation(user):
         )
 
     rid = input("Reservation ID to cancel: ")
+    # Only an active booking of this user; cancelling twice would refund twice
+    if rid.strip() not in {str(r['id']) for r in rows}:
+        print(" Not one of your active reservations")
+        conn.close()
+        return
+    rid = int(rid)
 
     # Get payment info for refund
     cur.execute("""
@@ -745,17 +771,25 @@ def cancel_reservation(user):
         cur.execute("UPDATE payments SET status='refunded' WHERE id=?", (payment['id'],))
         
         # Refund to balance
-        cur.execute("UPDATE bank SET balance = balance + ? WHERE user_id=?", (refund_amount, user["id"]))
+        ledger.transfer(cur, ledger.REVENUE, ledger.wallet(user["id"]), refund_amount, "Booking refund",
+                        payment['transaction_id'])
         
         print(f" Refunded {refund_amount} credits to your balance")
     else:
         # No payment found (Pending reservation)
         print(" No payment to refund (reservation was Pending)")
 
+    # Return equipment to stock if the booking was still holding it
+    cur.execute("SELECT status, room_id, date, start_time, end_time FROM reservations WHERE id=? AND user_id=?",
+                (rid, user["id"]))
+    current = cur.fetchone()
+    if current and current["status"] in availability.BLOCKING_STATUSES:
+        inventory.release_equipment(cur, rid)
+
     # Update reservation status to Cancelled
     cur.execute("""
     UPDATE reservations
-    SET status='Cancelled'
+    SET status='Cancelled', held_until=NULL
     WHERE id=? AND user_id=?
     """, (rid, user["id"]))
 
@@ -765,7 +799,15 @@ def cancel_reservation(user):
         (rid,)
     )
 
+    # The freed slot goes to the first patron waiting for it, in this same transaction
+    promoted = []
+    if current and current["status"] in availability.BLOCKING_STATUSES:
+        promoted = waitlist.promote(conn, current["room_id"], current["date"], current["start_time"],
+                                    current["end_time"])
+
     conn.commit()
+    if promoted:
+        print(f" Slot passed on to {len(promoted)} patron(s) on the waitlist")
     conn.close()
 
     print(" Reservation cancelled")
@@ -777,18 +819,16 @@ def get_balance(user):
     """Return system balance untuk user"""
     conn = connect_db()
     cur = conn.cursor()
-    cur.execute("SELECT balance FROM bank WHERE user_id=?", (user["id"],))
-    row = cur.fetchone()
+    balance = ledger.balance(cur, ledger.wallet(user["id"]))
     conn.close()
-    return row["balance"] if row else 0
+    return balance
 
 def get_user_bank_balance(user):
     conn = connect_db()
     cur = conn.cursor()
-    cur.execute("SELECT bank_balance FROM user_bank_acc WHERE user_id=?", (user["id"],))
-    row = cur.fetchone()
+    balance = ledger.balance(cur, ledger.bank(user["id"]))
     conn.close()
-    return row["bank_balance"] if row else 0
+    return balance
 
 def view_history(user):
     conn = connect_db()
@@ -894,8 +934,7 @@ def delete_own_account(user):
     cur = conn.cursor()
 
     # Rekod tindakan dalam logs
-    malaysia_tz = pytz.timezone("Asia/Kuala_Lumpur")
-    now = datetime.now(malaysia_tz).strftime("%Y-%m-%d %H:%M:%S")
+    now = timeslots.timestamp()
     
     cur.execute("""
     INSERT INTO user_actions (user_id, action_type, details, date)
@@ -927,8 +966,7 @@ def add_room():
     cur = conn.cursor()
     
     # Get current timestamp
-    malaysia_tz = pytz.timezone("Asia/Kuala_Lumpur")
-    now = datetime.now(malaysia_tz).strftime("%Y-%m-%d %H:%M:%S")
+    now = timeslots.timestamp()
     
     cur.execute("""
         INSERT INTO rooms (room_name, capacity, price_per_hour, status, created_at, updated_at)
@@ -972,8 +1010,7 @@ def update_room_capacity():
     # Log action
     from datetime import datetime
 
-    malaysia_tz = pytz.timezone("Asia/Kuala_Lumpur")
-    now = datetime.now(malaysia_tz).strftime("%Y-%m-%d %H:%M")
+    now = timeslots.timestamp("%Y-%m-%d %H:%M")
     cur.execute("""
         INSERT INTO room_actions (room_id, action, date)
         VALUES (?,?,?)
@@ -989,6 +1026,9 @@ def delete_room():
     rid = input("Room ID to delete: ")
     conn = connect_db()
     cur = conn.cursor()
+    cur.execute("SELECT id FROM reservations WHERE room_id=? AND status IN ('Pending', 'Confirmed')", (rid,))
+    for r in cur.fetchall():
+        inventory.release_equipment(cur, r["id"])
     cur.execute("DELETE FROM reservation_equipment WHERE reservation_id IN (SELECT id FROM reservations WHERE room_id=?)",(rid,))
     cur.execute("DELETE FROM reservations WHERE room_id=?", (rid,))
     cur.execute("DELETE FROM rooms WHERE id=?", (rid,))
@@ -1019,8 +1059,7 @@ def update_room_status():
     new_status = 'available' if choice == '1' else 'maintenance'
     
     # Get current timestamp
-    malaysia_tz = pytz.timezone("Asia/Kuala_Lumpur")
-    now = datetime.now(malaysia_tz).strftime("%Y-%m-%d %H:%M:%S")
+    now = timeslots.timestamp()
     
     cur.execute("UPDATE rooms SET status=?, updated_at=? WHERE id=?", (new_status, now, rid))
     conn.commit()
@@ -1162,25 +1201,331 @@ def view_all_reservations():
 
     conn.close()
 
+def read_clock_time(prompt):
+    """'HH:MM' (24-hour) -> minutes past midnight; '24:00' is end of day"""
+    value = input(prompt).strip()
+    if value == "24:00":
+        return timeslots.DAY_MINUTES
+    t = datetime.strptime(value, "%H:%M")
+    return t.hour * 60 + t.minute
+
 def update_booking_rules():
-    maxa = int(input("Max active reservation: "))
     conn = connect_db()
     cur = conn.cursor()
-    cur.execute("DELETE FROM booking_rules")
-    cur.execute("INSERT INTO booking_rules VALUES (1,?)",(maxa,))
+    grid = timeslots.grid_from_rules(cur)
+    try:
+        maxa = int(input("Max active reservation: "))
+        slot = input(f"Slot size in minutes {timeslots.SLOT_SIZES} (Enter to keep {grid.slot_minutes}): ").strip()
+        hours = input(f"Change opening hours ({timeslots.format_minutes(grid.open_minute)} - "
+                      f"{timeslots.format_minutes(grid.close_minute)})? (y/n): ").strip().lower()
+        open_minute, close_minute = grid.open_minute, grid.close_minute
+        if hours == "y":
+            open_minute = read_clock_time("Opening time (HH:MM, 24-hour): ")
+            close_minute = read_clock_time("Closing time (HH:MM, 24-hour, 24:00 for midnight): ")
+        grid = timeslots.SlotGrid(int(slot) if slot else grid.slot_minutes, open_minute, close_minute)
+    except ValueError as err:
+        print(f" Invalid input: {err}")
+        conn.close()
+        return
+
+    cur.execute("""
+        INSERT OR IGNORE INTO booking_rules (id, max_active) VALUES (1, ?)
+    """, (maxa,))
+    cur.execute("""
+        UPDATE booking_rules SET max_active=?, slot_minutes=?, open_minute=?, close_minute=? WHERE id=1
+    """, (maxa, grid.slot_minutes, grid.open_minute, grid.close_minute))
+    conn.commit()
+    conn.close()
+    timeslots.set_grid(grid)
+    print(f" Rules updated. Booking grid: {grid}")
+    print(" Restart the web app to pick up a new slot grid")
+
+def manage_room_hours():
+    """Room-specific opening hours (rooms without a row use the default hours)"""
+    conn = connect_db()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT h.id, h.room_id, rm.room_name, h.weekday, h.open_minute, h.close_minute
+        FROM room_hours h LEFT JOIN rooms rm ON h.room_id = rm.id
+        ORDER BY h.room_id, h.weekday
+    """)
+    rows = cur.fetchall()
+    grid = timeslots.grid()
+    print(f"\nDefault hours: {timeslots.format_minutes(grid.open_minute)} - {timeslots.format_minutes(grid.close_minute)}")
+    if not rows:
+        print("No room-specific hours")
+    for r in rows:
+        day = "Every day" if r["weekday"] is None else pricing.WEEKDAYS[r["weekday"]]
+        hours = ("Closed" if r["open_minute"] >= r["close_minute"] else
+                 f"{timeslots.format_minutes(r['open_minute'])} - {timeslots.format_minutes(r['close_minute'])}")
+        print(f"{r['id']}. {r['room_name']} | {day} | {hours}")
+
+    print("\n1. Set Hours")
+    print("2. Delete Hours")
+    print("0. Back")
+    c = input("Choose: ")
+
+    if c == "1":
+        try:
+            rid = int(input("Room ID: "))
+            wd = input("Weekday 0=Mon..6=Sun (Enter for every day): ").strip()
+            weekday = int(wd) if wd else None
+            if weekday is not None and not 0 <= weekday <= 6:
+                raise ValueError("weekday out of range")
+            if input("Closed all day? (y/n): ").strip().lower() == "y":
+                open_minute = close_minute = 0
+            else:
+                open_minute = read_clock_time("Opening time (HH:MM, 24-hour): ")
+                close_minute = read_clock_time("Closing time (HH:MM, 24-hour, 24:00 for midnight): ")
+                if close_minute <= open_minute:
+                    raise ValueError("closing time must be after opening time")
+        except ValueError as err:
+            print(f" Invalid input: {err}")
+            conn.close()
+            return
+        cur.execute("DELETE FROM room_hours WHERE room_id=? AND weekday IS ?", (rid, weekday))
+        cur.execute("""
+            INSERT INTO room_hours (room_id, weekday, open_minute, close_minute) VALUES (?,?,?,?)
+        """, (rid, weekday, open_minute, close_minute))
+    elif c == "2":
+        cur.execute("DELETE FROM room_hours WHERE id=?", (input("Hours ID: "),))
+    else:
+        conn.close()
+        return
+
+    conn.commit()
+    conn.close()
+    print(" Room hours updated")
+
+def manage_equipment_stock():
+    """Set how many units of each equipment item the library owns"""
+    conn = connect_db()
+    cur = conn.cursor()
+    cur.execute("SELECT id, name, price, quantity FROM equipment ORDER BY id")
+    for e in cur.fetchall():
+        print(f"{e['id']}. {e['name']} | {e['price']} credits | Quantity: {e['quantity']}")
+
+    print("\n1. Set Quantity")
+    print("2. Rebuild Usage Counters")
+    print("0. Back")
+    c = input("Choose: ")
+
+    if c == "1":
+        try:
+            eid = int(input("Equipment ID: "))
+            qty = int(input("Quantity: "))
+            if qty < 0:
+                raise ValueError
+        except ValueError:
+            print(" Invalid input")
+            conn.close()
+            return
+        cur.execute("UPDATE equipment SET quantity=? WHERE id=?", (qty, eid))
+        print(" Quantity updated" if cur.rowcount else " Equipment not found")
+    elif c == "2":
+        count = inventory.rebuild_usage(cur)
+        print(f" Rebuilt {count} usage counter(s)")
+    else:
+        conn.close()
+        return
+
+    conn.commit()
+    conn.close()
+
+def manage_room_closures():
+    """Take a room offline for a date range (cancels and refunds its bookings)"""
+    conn = connect_db()
+    cur = conn.cursor()
+    closures = maintenance.list_closures(cur, from_date=timeslots.today())
+    if not closures:
+        print("No upcoming closures")
+    for c in closures:
+        print(f"{c['id']}. {c['room_name']} | {c['start_date']} to {c['end_date']} | {c['reason'] or '-'}")
+
+    print("\n1. Take Room Offline")
+    print("2. Reopen (delete closure)")
+    print("0. Back")
+    c = input("Choose: ")
+
+    if c == "1":
+        try:
+            rid = int(input("Room ID: "))
+            start_date = input("From date (YYYY-MM-DD): ").strip()
+            end_date = input("Until date (YYYY-MM-DD, inclusive): ").strip()
+            reason = input("Reason: ").strip()
+            move = input("Move bookings to other free rooms where possible? (y/n): ").strip().lower() == "y"
+            summary = maintenance.take_offline(conn, rid, start_date, end_date, reason, rehome_bookings=move)
+        except ValueError as err:
+            print(f" {err}")
+            conn.close()
+            return
+        for b in summary["bookings"]:
+            outcome = f"moved to {b['moved_to']}" if b["moved_to"] else f"cancelled, refund {b['refund']}"
+            print(f"   #{b['id']} {b['date']} {b['start_time']} - {b['end_time']} | {b['name']} | {outcome}")
+        print(f" {summary['moved']} booking(s) moved, {summary['cancelled']} cancelled, "
+              f"{summary['refunded']} credits refunded to {len(summary['refunds'])} user(s)")
+        # Everything above ran inside the open transaction; closing without commit undoes it
+        if input("Apply? (y/n): ").strip().lower() != "y":
+            conn.close()
+            print(" Nothing changed")
+            return
+        print(" Room offline")
+    elif c == "2":
+        removed = maintenance.remove_closure(cur, input("Closure ID: "))
+        print(" Room reopened for those dates" if removed else " Closure not found")
+    else:
+        conn.close()
+        return
+
     conn.commit()
     conn.close()
-    print(" Rules updated")
+
+def optimize_day():
+    """Repack flexible bookings of one date so more rooms have long free blocks"""
+    date = input("Date (YYYY-MM-DD): ").strip()
+    conn = connect_db()
+    try:
+        hours = float(input("Free block wanted in hours [3]: ").strip() or 3)
+        min_block = max(1, round(hours * 60 / timeslots.grid().slot_minutes))
+        plan = defrag.defragment(conn, date, min_block, apply=True)
+    except ValueError as err:
+        print(f" {err}")
+        conn.close()
+        return
+
+    print(f"\nRooms with a {hours:g}-hour free block: {plan['before']['rooms_with_block']} now, "
+          f"{plan['after']['rooms_with_block']} after")
+    if not plan["moves"]:
+        conn.close()
+        print(" No moves would improve this day")
+        return
+    for m in plan["moves"]:
+        print(f"   #{m['id']} {m['start_time']} - {m['end_time']} | {m['from_room_name']} -> {m['to_room_name']}")
+    # The moves are applied in the open transaction; closing without commit undoes them
+    if input(f"Apply {len(plan['moves'])} move(s)? (y/n): ").strip().lower() == "y":
+        conn.commit()
+        print(" Bookings moved")
+    else:
+        print(" Nothing changed")
+    conn.close()
+
+def manage_lotteries():
+    """Create booking lotteries for high-demand dates and draw them"""
+    conn = connect_db()
+    cur = conn.cursor()
+    windows = lottery.list_windows(cur)
+    if not windows:
+        print("No lotteries")
+    for w in windows:
+        print(f"{w['id']}. {w['start_date']} to {w['end_date']} | draw {w['draw_at']} | {w['status']} | "
+              f"{w['requests']} request(s), {w['won']} won")
+
+    print("\n1. Create Lottery")
+    print("2. Draw Now")
+    print("0. Back")
+    c = input("Choose: ")
+
+    try:
+        if c == "1":
+            start_date = input("From date (YYYY-MM-DD): ").strip()
+            end_date = input("Until date (YYYY-MM-DD, inclusive): ").strip()
+            draw_at = input("Draw at (YYYY-MM-DD HH:MM): ").strip()
+            lottery.create_window(cur, start_date, end_date, draw_at)
+            print(" Lottery created. Bookings for those dates are queued until the draw.")
+        elif c == "2":
+            result = lottery.draw(conn, int(input("Lottery ID: ")))
+            print(f" {result['won']} request(s) booked, {result['lost']} unsuccessful")
+        else:
+            conn.close()
+            return
+    except ValueError as err:
+        print(f" {err}")
+        conn.close()
+        return
+
+    conn.commit()
+    conn.close()
+
+def requote_pending_bookings():
+    """Re-price Pending bookings after room prices change"""
+    rid = input("Room ID (Enter for all rooms): ").strip()
+    conn = connect_db()
+    count = pricing.requote_pending(conn, int(rid) if rid else None)
+    conn.commit()
+    conn.close()
+    print(f" Re-quoted {count} pending booking(s)")
+
+def manage_rate_rules():
+    """List / add / delete peak and off-peak rate rules"""
+    conn = connect_db()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT rr.*, rm.room_name FROM room_rates rr
+        LEFT JOIN rooms rm ON rr.room_id = rm.id
+        ORDER BY rr.id
+    """)
+    rules = cur.fetchall()
+    print("\n Rate Rules")
+    if not rules:
+        print(" No rate rules (base price_per_hour applies)")
+    for r in rules:
+        room = r["room_name"] if r["room_id"] else "All rooms"
+        day = pricing.WEEKDAYS[r["weekday"]] if r["weekday"] is not None else "Every day"
+        print(f"{r['id']}. {room} | {day} | {r['start_minute'] // 60:02d}:{r['start_minute'] % 60:02d}"
+              f"-{r['end_minute'] // 60:02d}:{r['end_minute'] % 60:02d} | {r['rate']} credits/hour | {r['label'] or ''}")
+
+    print("\n1. Add Rule")
+    print("2. Delete Rule")
+    print("0. Back")
+    c = input("Choose: ")
+
+    if c == "1":
+        rid = input("Room ID (Enter for all rooms): ").strip()
+        wd = input("Weekday 0=Mon..6=Sun (Enter for every day): ").strip()
+        s, start_time = choose_time("Start Time")
+        e, end_time = choose_time("End Time")
+        if not start_time or not end_time or e <= s:
+            print(" Invalid time selection")
+            conn.close()
+            return
+        try:
+            rate = float(input("Rate (credits/hour): "))
+            weekday = int(wd) if wd else None
+            if weekday is not None and not 0 <= weekday <= 6:
+                raise ValueError
+        except ValueError:
+            print(" Invalid input")
+            conn.close()
+            return
+        label = input("Label (e.g. Peak): ")
+        cur.execute("""
+            INSERT INTO room_rates (room_id, weekday, start_minute, end_minute, rate, label)
+            VALUES (?,?,?,?,?,?)
+        """, (int(rid) if rid else None, weekday, pricing.label_minutes(start_time),
+              pricing.label_minutes(end_time), rate, label))
+    elif c == "2":
+        cur.execute("DELETE FROM room_rates WHERE id=?", (input("Rule ID: "),))
+    else:
+        conn.close()
+        return
+
+    count = pricing.requote_pending(conn)
+    conn.commit()
+    conn.close()
+    print(f" Rate rules updated. Re-quoted {count} pending booking(s)")
 
 def update_student_balance():
     sid = input("Student ID: ")
     amt = int(input("Credit to add: "))
+    if amt <= 0:
+        print(" Invalid amount")
+        return
     conn = connect_db()
     cur = conn.cursor()
     cur.execute("SELECT id FROM users WHERE student_id=?", (sid,))
     u = cur.fetchone()
     if u:
-        cur.execute("UPDATE bank SET balance=balance+? WHERE user_id=?", (amt,u["id"]))
+        ledger.transfer(cur, ledger.EXTERNAL, ledger.wallet(u["id"]), amt, "Credit added by librarian")
         conn.commit()
         print(" Credit added")
     else:
@@ -1293,6 +1638,13 @@ def librarian_menu():
 8. View All Payments
 9. Update Booking Rules
 10. View User Actions
+11. Re-quote Pending Bookings
+12. Manage Rate Rules
+13. Manage Room Hours
+14. Manage Equipment Stock
+15. Take Room Offline
+16. Optimize a Day
+17. Manage Lotteries
 0. Logout
         """)
         l = input("Choose: ")
@@ -1316,6 +1668,20 @@ def librarian_menu():
             update_booking_rules()
         elif l == "10":
             view_user_actions()
+        elif l == "11":
+            requote_pending_bookings()
+        elif l == "12":
+            manage_rate_rules()
+        elif l == "13":
+            manage_room_hours()
+        elif l == "14":
+            manage_equipment_stock()
+        elif l == "15":
+            manage_room_closures()
+        elif l == "16":
+            optimize_day()
+        elif l == "17":
+            manage_lotteries()
         elif l == "0":
             break
         else:
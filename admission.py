@@ -0,0 +1,115 @@
+"""
+Admission control for the write routes.
+Every booking and checkout ends in a write transaction, and SQLite runs
+one writer at a time. Letting a burst of requests all reach the database
+only makes them queue inside SQLite's busy handler, where they time out
+with "database is locked" after holding a worker thread for seconds.
+
+A Gate admits at most max_in_flight requests at once per worker process.
+Further requests wait in line (at most max_queue of them, for at most
+max_wait seconds); past either budget the request is shed straight away
+and the caller answers 503 with Retry-After, before touching the database.
+Counters are kept per gate and rendered by metrics_text() in the
+Prometheus text format.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+_gates = []
+
+
+class Shed(Exception):
+    """Raised by Gate.admit() when a request is turned away"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Gate:
+    def __init__(self, name, max_in_flight=4, max_queue=16, max_wait=2.0, retry_after=2):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = {"queue_full": 0, "timeout": 0}
+        self.wait_seconds = 0.0
+        _gates.append(self)
+
+    def enter(self):
+        """Take a slot, waiting within the budgets; raises Shed otherwise"""
+        with self._cond:
+            if self.in_flight < self.max_in_flight and not self.waiting:
+                self.in_flight += 1
+                self.admitted += 1
+                return
+            if self.waiting >= self.max_queue:
+                self.shed["queue_full"] += 1
+                raise Shed("queue_full", self.retry_after)
+            self.waiting += 1
+            started = time.monotonic()
+            deadline = started + self.max_wait
+            try:
+                while self.in_flight >= self.max_in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.shed["timeout"] += 1
+                        raise Shed("timeout", self.retry_after)
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            self.admitted += 1
+            self.wait_seconds += time.monotonic() - started
+
+    def leave(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def admit(self):
+        """with gate.admit(): ...  - raises Shed without running the body if turned away"""
+        self.enter()
+        try:
+            yield
+        finally:
+            self.leave()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "in_flight": self.in_flight,
+                "queue_depth": self.waiting,
+                "admitted": self.admitted,
+                "shed": dict(self.shed),
+                "wait_seconds": self.wait_seconds,
+            }
+
+
+def metrics_text():
+    """Counters of every gate in this process, Prometheus text format"""
+    lines = []
+    for name, kind, help_text, value in (
+        ("admission_in_flight", "gauge", "Requests holding a slot", lambda s: [("", s["in_flight"])]),
+        ("admission_queue_depth", "gauge", "Requests waiting for a slot", lambda s: [("", s["queue_depth"])]),
+        ("admission_admitted_total", "counter", "Requests admitted", lambda s: [("", s["admitted"])]),
+        ("admission_shed_total", "counter", "Requests turned away",
+         lambda s: [(f',reason="{reason}"', count) for reason, count in s["shed"].items()]),
+        ("admission_wait_seconds_total", "counter", "Time admitted requests spent waiting",
+         lambda s: [("", round(s["wait_seconds"], 6))]),
+    ):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for gate in _gates:
+            for labels, v in value(gate.stats()):
+                lines.append(f'{name}{{gate="{gate.name}"{labels}}} {v}')
+    return "\n".join(lines) + "\n"
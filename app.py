@@ -4,13 +4,36 @@ Integrates with SQLite database (reservation_system.db)
 Supports both Patron and Admin roles
 """
 
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash
 import sqlite3
 import os
+import json
 from datetime import datetime, date, timedelta
-import pytz
 import bcrypt
 import time
+from functools import wraps
+
+import admission
+import availability
+import bulk
+import defrag
+import events
+import holds
+import idempotency
+import inventory
+import ledger
+import livefeed
+import lottery
+import payqueue
+import maintenance
+import notify
+import pricing
+import ratelimit
+import scheduler
+import timeslots
+import waitlist
+import writer
+from schema import ensure_schema
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this-in-production'  # Change this!
@@ -24,9 +47,155 @@ def connect_db():
     conn.row_factory = sqlite3.Row
     return conn
 
-def get_malaysia_time():
-    malaysia_tz = pytz.timezone("Asia/Kuala_Lumpur")
-    return datetime.now(malaysia_tz).strftime("%Y-%m-%d %H:%M:%S")
+def init_db():
+    conn = connect_db()
+    ensure_schema(conn)
+    timeslots.load_grid(conn.cursor())
+    conn.close()
+
+# Patron writes (book, pay, top up, cancel) go through a writer: in this process by
+# default, or set WRITER_ADDRESS to the socket of a running `python writer.py` so one
+# coordinator process owns every write transaction
+WRITER_ADDRESS = None
+writes = writer.WriterClient(WRITER_ADDRESS) if WRITER_ADDRESS else writer.LocalWriter(connect_db)
+
+# Bank payments at checkout are queued and charged by background workers, so a slow
+# bank never holds a request; swap PAYMENT_BACKEND for a real bank integration
+PAYMENT_BACKEND = payqueue.LocalBank()
+PAYMENT_WORKERS = 4
+PAYMENT_POLL_SECONDS = 2
+payment_pool = payqueue.WorkerPool(writes, PAYMENT_BACKEND, workers=PAYMENT_WORKERS)
+
+# ================= BACKGROUND JOBS =================
+# start_services() starts a scheduler in every worker process; the lease in scheduler_lease
+# makes exactly one of them run the jobs, and each run is recorded in job_runs. Set
+# SCHEDULER_ENABLED to False in processes that should never run jobs (the jobs can be run
+# by hand instead).
+SCHEDULER_ENABLED = True
+# Checkout holds that lapse free their slot at once; expire_pending marks them Expired, along
+# with unheld Pending bookings (CLI "Pay Later") older than PENDING_MAX_HOURS
+PENDING_MAX_HOURS = 24
+# Booking confirmations, cancellations and reminders go out by SMTP; point MAIL_HOST/MAIL_PORT
+# at the real server, or run `python notify.py sink` to see them locally
+MAIL_HOST = notify.MAIL_HOST
+MAIL_PORT = notify.MAIL_PORT
+mailer = notify.Mailer(MAIL_HOST, MAIL_PORT)
+
+def draw_lottery_windows(conn):
+    results = lottery.draw_due(conn)
+    conn.commit()
+    return {"processed": len(results), "windows": results}
+
+def snapshot_ledger(conn):
+    count = ledger.take_snapshot(conn)
+    conn.commit()
+    return count
+
+def optimize_db(conn):
+    conn.execute("PRAGMA optimize")
+
+jobs = scheduler.Scheduler(connect_db)
+jobs.register("expire_pending", "* * * * *", lambda conn: holds.sweep(conn, PENDING_MAX_HOURS))
+jobs.register("lottery_draws", "* * * * *", draw_lottery_windows)
+jobs.register("notifications", "* * * * *", lambda conn: notify.run(conn, mailer))
+jobs.register("ledger_snapshot", "*/15 * * * *", snapshot_ledger)
+jobs.register("idempotency_purge", "@hourly", idempotency.purge_expired)
+jobs.register("events_purge", "30 2 * * *", events.purge)
+jobs.register("optimize", "0 3 * * *", optimize_db)
+
+# ================= LIVE AVAILABILITY =================
+# The booking page follows its room's day over Server-Sent Events instead of being
+# refreshed. With LIVE_STREAM on, each worker's broker tails the events outbox and
+# pushes changes to open pages as they happen, so bookings made through any worker (or
+# the CLI) show up at once; but every open page then holds a worker thread for up to
+# LIVE_STREAM_SECONDS, so only turn it on behind a server with cheap concurrent
+# connections (gevent, eventlet). Off, as on sync WSGI hosting, the same URL answers
+# with one snapshot and the page's EventSource asks again every LIVE_POLL_SECONDS.
+LIVE_STREAM = False
+LIVE_STREAM_SECONDS = livefeed.STREAM_SECONDS
+LIVE_POLL_SECONDS = 15
+live = livefeed.Broker(connect_db)
+
+# ================= STARTUP =================
+def start_services():
+    """
+    Bring the database schema up to date and start this worker process's background threads:
+    payment workers, the job scheduler (if SCHEDULER_ENABLED) and the live availability broker
+    (if LIVE_STREAM).
+    The WSGI entry point (or `python app.py`) calls it once per process; importing app starts
+    nothing and touches no database, so tests and scripts can import it freely.
+    """
+    init_db()
+    payment_pool.start()
+    if SCHEDULER_ENABLED:
+        jobs.start()
+    if LIVE_STREAM:
+        live.start()
+
+@app.context_processor
+def inject_time_slots():
+    """Slot labels for every booking form"""
+    grid = timeslots.grid()
+    return dict(time_slots=grid.labels, start_slots=grid.start_labels, end_slots=grid.end_labels)
+
+@app.context_processor
+def inject_idempotency_key():
+    """idempotency_key() puts a fresh token in a write form; resubmitting the form replays the first result"""
+    return dict(idempotency_key=idempotency.new_key)
+
+# ================= ADMISSION CONTROL =================
+# Booking and checkout POSTs all end in a write transaction; this gate keeps
+# bursts out of SQLite's lock queue (limits are per worker process)
+write_gate = admission.Gate('writes', max_in_flight=4, max_queue=16, max_wait=2.0, retry_after=2)
+
+def admitted(gate):
+    """Run a view's POSTs through an admission gate; shed requests get a fast 503"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'POST':
+                return view(*args, **kwargs)
+            try:
+                with gate.admit():
+                    return view(*args, **kwargs)
+            except admission.Shed as shed:
+                return (render_template('busy.html', retry_after=shed.retry_after), 503,
+                        {'Retry-After': str(shed.retry_after)})
+        return wrapper
+    return decorator
+
+# ================= RATE LIMITING =================
+# Token buckets per client IP and per logged-in user, checked before any DB or bcrypt work
+RATE_LIMITS = {
+    'login': ratelimit.Budget(burst=10, per_minute=10),
+    'register': ratelimit.Budget(burst=5, per_minute=2),
+    'patron_bank_topup': ratelimit.Budget(burst=10, per_minute=10),
+    'patron_book_room': ratelimit.Budget(burst=20, per_minute=30),
+    'patron_book_any_room': ratelimit.Budget(burst=20, per_minute=30),
+}
+# Set to a file path (e.g. os.path.join(BASE_DIR, 'ratelimit.db')) to share buckets between workers
+RATE_LIMIT_DB = None
+limiter = ratelimit.RateLimiter(RATE_LIMITS, ratelimit.SqliteStore(RATE_LIMIT_DB) if RATE_LIMIT_DB else None)
+
+def rate_limited(view):
+    """Refuse a view's POSTs with 429 once the client or user runs out of tokens"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method == 'POST':
+            keys = [f"ip:{request.remote_addr}"]
+            if 'user_id' in session:
+                keys.append(f"user:{session['user_id']}")
+            wait = limiter.check(view.__name__, *keys)
+            if wait:
+                return (render_template('busy.html', retry_after=wait, limited=True), 429,
+                        {'Retry-After': str(wait)})
+        return view(*args, **kwargs)
+    return wrapper
+
+def form_time(field):
+    """Time field from the posted form, mapped onto the slot grid when possible"""
+    value = request.form.get(field)
+    return timeslots.normalize_time(value) or value
 
 # ================= AUTHENTICATION =================
 @app.route('/')
@@ -39,6 +208,7 @@ def index():
     return redirect(url_for('login'))
 
 @app.route('/login', methods=['GET', 'POST'])
+@rate_limited
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -82,6 +252,7 @@ def login():
     return render_template('login.html')
 
 @app.route('/register', methods=['GET', 'POST'])
+@rate_limited
 def register():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -106,7 +277,7 @@ def register():
         
         # Hash password
         hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        now = get_malaysia_time()
+        now = timeslots.timestamp()
         
         try:
             cur.execute("""
@@ -117,6 +288,7 @@ def register():
             user_id = cur.lastrowid
             cur.execute("INSERT INTO bank VALUES (?, 0)", (user_id,))
             cur.execute("INSERT INTO user_bank_acc VALUES (?, 1000)", (user_id,))
+            ledger.open_account(cur, user_id)
             
             conn.commit()
             flash('Registration successful! Please login.', 'success')
@@ -159,9 +331,7 @@ def patron_dashboard():
     upcoming_bookings = cur.fetchall()
     
     # Get balance
-    cur.execute("SELECT balance FROM bank WHERE user_id=?", (session['user_id'],))
-    balance_row = cur.fetchone()
-    balance = balance_row['balance'] if balance_row else 0
+    balance = ledger.balance(cur, ledger.wallet(session['user_id']))
     
     conn.close()
     
@@ -179,13 +349,8 @@ def patron_bank():
     cur = conn.cursor()
     
     # Get balances
-    cur.execute("SELECT balance FROM bank WHERE user_id=?", (session['user_id'],))
-    sys_bal = cur.fetchone()
-    system_balance = sys_bal['balance'] if sys_bal else 0
-    
-    cur.execute("SELECT bank_balance FROM user_bank_acc WHERE user_id=?", (session['user_id'],))
-    bank_bal = cur.fetchone()
-    bank_balance = bank_bal['bank_balance'] if bank_bal else 0
+    system_balance = ledger.balance(cur, ledger.wallet(session['user_id']))
+    bank_balance = ledger.balance(cur, ledger.bank(session['user_id']))
     
     # Get transactions
     cur.execute("SELECT * FROM transactions WHERE user_id=? ORDER BY date DESC LIMIT 10", (session['user_id'],))
@@ -199,6 +364,7 @@ def patron_bank():
                          transactions=transactions)
 
 @app.route('/patron/bank/topup', methods=['POST'])
+@rate_limited
 def patron_bank_topup():
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -209,34 +375,15 @@ def patron_bank_topup():
     except ValueError:
         flash('Invalid amount', 'error')
         return redirect(url_for('patron_bank'))
-        
-    conn = connect_db()
-    cur = conn.cursor()
-    
-    # Check bank balance
-    cur.execute("SELECT bank_balance FROM user_bank_acc WHERE user_id=?", (session['user_id'],))
-    user_acc = cur.fetchone()
     
-    if not user_acc or user_acc['bank_balance'] < amount:
-        flash('Insufficient funds in external bank account', 'error')
-        conn.close()
+    # Deduct from bank, add to system wallet, log the transaction
+    try:
+        writes.call('top_up', user_id=session['user_id'], amount=amount, bank_name=bank_name,
+                    idempotency_key=request.form.get('idempotency_key'))
+    except ValueError as e:
+        flash(str(e), 'error')
         return redirect(url_for('patron_bank'))
     
-    now = get_malaysia_time()
-    
-    # Deduct from bank, add to system wallet
-    cur.execute("UPDATE user_bank_acc SET bank_balance = bank_balance - ? WHERE user_id=?", (amount, session['user_id']))
-    cur.execute("UPDATE bank SET balance = balance + ? WHERE user_id=?", (amount, session['user_id']))
-    
-    # Log transaction
-    cur.execute("""
-        INSERT INTO transactions (user_id, bank_name, amount, date, status)
-        VALUES (?, ?, ?, ?, 'SUCCESS')
-    """, (session['user_id'], bank_name, amount, now))
-    
-    conn.commit()
-    conn.close()
-    
     flash(f'Top-up successful! RM {amount} added to wallet.', 'success')
     return redirect(url_for('patron_bank'))
 
@@ -245,15 +392,60 @@ def patron_rooms():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
+    # Optional window to price every room for
+    window = {
+        'date': request.args.get('date', ''),
+        'start_time': request.args.get('start_time', ''),
+        'end_time': request.args.get('end_time', ''),
+    }
+    
     conn = connect_db()
     cur = conn.cursor()
     cur.execute("SELECT * FROM rooms WHERE status='available' ORDER BY room_name")
     rooms = cur.fetchall()
+    
+    prices = {}
+    free = None
+    if all(window.values()):
+        try:
+            prices = pricing.window_prices(cur, window['date'], window['start_time'], window['end_time'])
+            free = set(availability.free_rooms(cur, window['date'], window['start_time'], window['end_time']))
+        except ValueError:
+            flash('Invalid date', 'error')
     conn.close()
     
-    return render_template('patron/rooms.html', rooms=rooms)
+    return render_template('patron/rooms.html', rooms=rooms, prices=prices, free=free, window=window)
+
+@app.route('/patron/book/any', methods=['GET', 'POST'])
+@rate_limited
+@admitted(write_gate)
+def patron_book_any_room():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    if request.method == 'POST':
+        window = {
+            'date': request.form.get('date', ''),
+            'start_time': form_time('start_time') or '',
+            'end_time': form_time('end_time') or '',
+            'num_people': request.form.get('num_people', 1),
+        }
+        try:
+            # Room choice and insert happen under one write lock
+            reservation_id, room = writes.call('book_any_room', user_id=session['user_id'], **window)
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('patron_book_any_room', **window))
+        
+        flash(f"{room['room_name']} (capacity {room['capacity']}) booked for you.", 'success')
+        return redirect(url_for('patron_checkout', reservation_id=reservation_id))
+    
+    window = {key: request.args.get(key, '') for key in ('date', 'start_time', 'end_time', 'num_people')}
+    return render_template('patron/book_any.html', window=window)
 
 @app.route('/patron/book/<int:room_id>', methods=['GET', 'POST'])
+@rate_limited
+@admitted(write_gate)
 def patron_book_room(room_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -263,47 +455,116 @@ def patron_book_room(room_id):
     
     if request.method == 'POST':
         booking_date = request.form.get('date')
-        start_time = request.form.get('start_time')
-        end_time = request.form.get('end_time')
+        start_time = form_time('start_time')
+        end_time = form_time('end_time')
         num_people = request.form.get('num_people', 1)
         
         # Get room details
         cur.execute("SELECT * FROM rooms WHERE id=?", (room_id,))
         room = cur.fetchone()
         
-        # Calculate cost
-        time_slots = [
-            "08:00 AM","09:00 AM","10:00 AM","11:00 AM",
-            "12:00 PM","01:00 PM","02:00 PM","03:00 PM",
-            "04:00 PM","05:00 PM","06:00 PM","07:00 PM","08:00 PM"
-        ]
-        start_idx = time_slots.index(start_time)
-        end_idx = time_slots.index(end_time)
-        hours = end_idx - start_idx
-        total_cost = hours * room['price_per_hour']
-        
-        # Create reservation
-        now = get_malaysia_time()
-        cur.execute("""
-            INSERT INTO reservations (user_id, room_id, date, start_time, end_time, num_people, status, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, 'Pending', ?, ?)
-        """, (session['user_id'], room_id, booking_date, start_time, end_time, num_people, now, now))
+        # Recurring booking: the whole series is checked and inserted in one transaction
+        if request.form.get('repeat_days') and request.form.get('repeat_until'):
+            conn.close()
+            try:
+                series_id, report = writes.call(
+                    'book_series', user_id=session['user_id'], room_id=room_id, first_date=booking_date,
+                    until_date=request.form.get('repeat_until'), start_time=start_time, end_time=end_time,
+                    interval_days=request.form.get('repeat_days'), num_people=num_people)
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('patron_book_room', room_id=room_id))
+            booked = sum(1 for line in report if line['reservation_id'])
+            return render_template('patron/series_report.html', room=room, report=report, booked=booked,
+                                   start_time=start_time, end_time=end_time)
         
-        reservation_id = cur.lastrowid
-        conn.commit()
+        # Taken slot: wait in line for it; a cancellation books it for the first waiter who fits
+        if request.form.get('waitlist'):
+            conn.close()
+            try:
+                entry = writes.call('join_waitlist', user_id=session['user_id'], room_id=room_id,
+                                    date=booking_date, start_time=start_time, end_time=end_time,
+                                    num_people=num_people)
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('patron_book_room', room_id=room_id))
+            flash(f"You are number {entry['position']} on the waitlist. If the slot frees up it is booked "
+                  f"for you and held for {waitlist.PROMOTION_HOLD_MINUTES} minutes for payment.", 'success')
+            return redirect(url_for('patron_my_bookings'))
+        
+        # Lottery dates: only queue the request (a plain insert); it is drawn later in one batch
+        lottery_window = lottery.open_window_for(cur, booking_date)
         conn.close()
+        if lottery_window:
+            try:
+                entry = writes.call('enter_lottery', user_id=session['user_id'], room_id=room_id,
+                                    date=booking_date, start_time=start_time, end_time=end_time,
+                                    num_people=num_people)
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('patron_book_room', room_id=room_id))
+            flash(f"Request entered into the lottery for {booking_date}. "
+                  f"Results are drawn at {entry['draw_at']}.", 'success')
+            return redirect(url_for('patron_my_bookings'))
         
-        # Redirect to checkout
-        return redirect(url_for('patron_checkout', reservation_id=reservation_id))
+        # Create reservation, quoted once at booking time; checkout and receipt read the quote back
+        # (flexible bookings may be moved to another room by the day optimizer)
+        try:
+            booking = writes.call('create_booking', user_id=session['user_id'], room_id=room_id,
+                                  date=booking_date, start_time=start_time, end_time=end_time,
+                                  num_people=num_people, movable=bool(request.form.get('flexible')))
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('patron_book_room', room_id=room_id))
+        
+        # Redirect to checkout; the slot is held for holds.HOLD_MINUTES
+        return redirect(url_for('patron_checkout', reservation_id=booking['reservation_id']))
     
-    # GET request - show booking form
+    # GET request - show booking form (pre-filled and priced when coming from the rooms list)
     cur.execute("SELECT * FROM rooms WHERE id=?", (room_id,))
     room = cur.fetchone()
+    
+    window = {
+        'date': request.args.get('date', ''),
+        'start_time': request.args.get('start_time', ''),
+        'end_time': request.args.get('end_time', ''),
+    }
+    quote = None
+    if room and all(window.values()):
+        try:
+            quote = pricing.quote_booking(cur, room_id, window['date'], window['start_time'], window['end_time'])
+        except ValueError:
+            quote = None
     conn.close()
     
-    return render_template('patron/booking.html', room=room)
+    return render_template('patron/booking.html', room=room, window=window, quote=quote)
+
+@app.route('/patron/rooms/<int:room_id>/availability')
+def patron_availability_stream(room_id):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    booking_date = request.args.get('date', '')
+    try:
+        datetime.strptime(booking_date, '%Y-%m-%d')
+    except ValueError:
+        return "Invalid date", 400
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    if not LIVE_STREAM:
+        conn = connect_db()
+        try:
+            body = livefeed.snapshot(conn.cursor(), room_id, booking_date, LIVE_POLL_SECONDS)
+        finally:
+            conn.close()
+        return Response(body, mimetype='text/event-stream', headers=headers)
+    if live.full():
+        return "Too many live pages open, try again shortly", 503, {'Retry-After': '30'}
+    live.start()
+    return Response(livefeed.stream(live, room_id, booking_date, lifetime=LIVE_STREAM_SECONDS),
+                    mimetype='text/event-stream', headers=headers)
 
 @app.route('/patron/checkout/<int:reservation_id>', methods=['GET', 'POST'])
+@admitted(write_gate)
 def patron_checkout(reservation_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -329,20 +590,14 @@ def patron_checkout(reservation_id):
         conn.close()
         return redirect(url_for('patron_dashboard'))
     
-    # Calculate cost
-    time_slots = [
-        "08:00 AM","09:00 AM","10:00 AM","11:00 AM",
-        "12:00 PM","01:00 PM","02:00 PM","03:00 PM",
-        "04:00 PM","05:00 PM","06:00 PM","07:00 PM","08:00 PM"
-    ]
-    try:
-        start_idx = time_slots.index(reservation['start_time'])
-        end_idx = time_slots.index(reservation['end_time'])
-        hours = end_idx - start_idx
-        total_cost = hours * reservation['price_per_hour']
-    except ValueError:
-        hours = 0
-        total_cost = 0
+    # Read the quote stored at booking time (older bookings are quoted once here)
+    quote = pricing.stored_quote(reservation)
+    if quote is None:
+        quote = pricing.requote_reservation(cur, reservation_id) or pricing.make_quote(0, 0, 0)
+        conn.commit()
+    hours = quote['quoted_hours']
+    rate = quote['quoted_rate']
+    total_cost = quote['total_cost']
 
     if request.method == 'POST':
         payment_method = request.form.get('payment_method')
@@ -350,57 +605,53 @@ def patron_checkout(reservation_id):
         account_number = request.form.get('account_number')
         account_holder = request.form.get('account_holder')
         
-        # Generate transaction ID
-        transaction_id = f"TXN-{int(time.time())}"
-        now = get_malaysia_time()
-        
-        # Check balance based on payment method
-        if payment_method == 'System Balance':
-            cur.execute("SELECT balance FROM bank WHERE user_id=?", (session['user_id'],))
-            balance = cur.fetchone()['balance']
-            if balance < total_cost:
-                flash('Insufficient system wallet balance. Please top up or use online banking.', 'error')
-                conn.close()
-                return render_template('patron/checkout.html', reservation=reservation, total_cost=total_cost, hours=hours, user=user)
-            
-            # Deduct system balance
-            cur.execute("UPDATE bank SET balance = balance - ? WHERE user_id=?", (total_cost, session['user_id']))
-            
-        else:
-            # External Bank Payment (Online Banking, etc)
-            cur.execute("SELECT bank_balance FROM user_bank_acc WHERE user_id=?", (session['user_id'],))
-            bank_acc = cur.fetchone()
-            
-            if not bank_acc or bank_acc['bank_balance'] < total_cost:
-                flash('Insufficient funds in your external bank account.', 'error')
-                conn.close()
-                return render_template('patron/checkout.html', reservation=reservation, total_cost=total_cost, hours=hours, user=user)
-            
-            # Deduct external bank balance
-            cur.execute("UPDATE user_bank_acc SET bank_balance = bank_balance - ? WHERE user_id=?", (total_cost, session['user_id']))
-
-        # Create payment record
-        cur.execute("""
-            INSERT INTO payments (
-                reservation_id, user_id, amount, payment_method,
-                bank_name, account_number, account_holder,
-                transaction_id, status, paid_at, created_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'completed', ?, ?)
-        """, (reservation_id, session['user_id'], total_cost, payment_method,
-              bank_name, account_number, account_holder,
-              transaction_id, now, now))
-        
-        # Update reservation status
-        cur.execute("UPDATE reservations SET status='Confirmed' WHERE id=?", (reservation_id,))
-        
-        conn.commit()
         conn.close()
         
+        try:
+            if payment_method == 'System Balance':
+                # Wallet payments never leave the database: charge, record and confirm in one transaction
+                writes.call('pay_booking', user_id=session['user_id'], reservation_id=reservation_id,
+                            payment_method=payment_method, idempotency_key=request.form.get('idempotency_key'))
+            else:
+                # Bank payments go to the payment workers; the patron watches the job
+                job = writes.call('queue_payment', user_id=session['user_id'], reservation_id=reservation_id,
+                                  payment_method=payment_method, bank_name=bank_name,
+                                  account_number=account_number, account_holder=account_holder,
+                                  idempotency_key=request.form.get('idempotency_key'))
+                payment_pool.start()
+                payment_pool.wake()
+                return redirect(url_for('patron_payment_status', job_id=job['job_id']))
+        except ValueError as e:
+            flash(str(e), 'error')
+            return render_template('patron/checkout.html', reservation=reservation, total_cost=total_cost, hours=hours, rate=rate, user=user)
+        
         flash('Payment successful! Booking confirmed.', 'success')
         return redirect(url_for('patron_receipt', reservation_id=reservation_id))
     
     conn.close()
-    return render_template('patron/checkout.html', reservation=reservation, total_cost=total_cost, hours=hours, user=user)
+    return render_template('patron/checkout.html', reservation=reservation, total_cost=total_cost, hours=hours, rate=rate, user=user)
+
+@app.route('/patron/payments/<int:job_id>')
+def patron_payment_status(job_id):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    conn = connect_db()
+    job = payqueue.job_status(conn.cursor(), job_id, session['user_id'])
+    conn.close()
+    
+    if not job:
+        flash('Payment not found', 'error')
+        return redirect(url_for('patron_my_bookings'))
+    if job['status'] == 'succeeded':
+        flash('Payment successful! Booking confirmed.', 'success')
+        return redirect(url_for('patron_receipt', reservation_id=job['reservation_id']))
+    if job['status'] == 'failed':
+        flash(f"Payment failed: {job['error']}", 'error')
+        return redirect(url_for('patron_checkout', reservation_id=job['reservation_id']))
+    
+    # Still queued or at the bank: the page refreshes itself until the job is done
+    return render_template('patron/payment_status.html', job=job), 200, {'Refresh': str(PAYMENT_POLL_SECONDS)}
 
 @app.route('/patron/receipt/<int:reservation_id>')
 def patron_receipt(reservation_id):
@@ -443,12 +694,23 @@ def patron_my_bookings():
         ORDER BY r.date DESC, r.start_time DESC
     """, (session['user_id'],))
     bookings = cur.fetchall()
+    cur.execute("""
+        SELECT q.*, rm.room_name, w.draw_at
+        FROM booking_requests q
+        JOIN rooms rm ON q.room_id = rm.id
+        JOIN lottery_windows w ON q.window_id = w.id
+        WHERE q.user_id = ?
+        ORDER BY q.date DESC, q.id DESC
+    """, (session['user_id'],))
+    requests = cur.fetchall()
+    waiting = waitlist.for_user(cur, session['user_id'])
     conn.close()
     
 
     
     # Pass 'today' (as string for comparison) to the template
-    return render_template('patron/my_bookings.html', bookings=bookings, today=date.today().strftime("%Y-%m-%d"))
+    return render_template('patron/my_bookings.html', bookings=bookings, requests=requests,
+                           waiting=waiting, today=timeslots.today())
 
 @app.route('/patron/edit-booking/<int:booking_id>', methods=['GET', 'POST'])
 def patron_edit_booking(booking_id):
@@ -473,20 +735,15 @@ def patron_edit_booking(booking_id):
         return redirect(url_for('patron_my_bookings'))
     
     if request.method == 'POST':
-        new_room_id = request.form.get('room_id')
-        new_date = request.form.get('date')
-        new_start_time = request.form.get('start_time')
-        new_end_time = request.form.get('end_time')
-        
-        now = get_malaysia_time()
-        cur.execute("""
-            UPDATE reservations 
-            SET room_id=?, date=?, start_time=?, end_time=?, updated_at=?
-            WHERE id=?
-        """, (new_room_id, new_date, new_start_time, new_end_time, now, booking_id))
-        
-        conn.commit()
         conn.close()
+        # Equipment moves with the booking; unpaid bookings are re-quoted for the new room/time
+        try:
+            writes.call('edit_booking', user_id=session['user_id'], booking_id=booking_id,
+                        room_id=request.form.get('room_id'), date=request.form.get('date'),
+                        start_time=form_time('start_time'), end_time=form_time('end_time'))
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('patron_edit_booking', booking_id=booking_id))
         
         flash('Booking updated successfully', 'success')
         return redirect(url_for('patron_my_bookings'))
@@ -503,41 +760,31 @@ def patron_cancel_booking(booking_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = connect_db()
-    cur = conn.cursor()
-    
-    # Get booking details
-    cur.execute("""
-        SELECT r.*, p.amount, p.id as payment_id
-        FROM reservations r
-        LEFT JOIN payments p ON p.reservation_id = r.id
-        WHERE r.id = ? AND r.user_id = ?
-    """, (booking_id, session['user_id']))
-    booking = cur.fetchone()
-    
-    if not booking:
-        flash('Booking not found', 'error')
-        conn.close()
+    # Refund if payment exists, return equipment to stock, mark cancelled
+    try:
+        result = writes.call('cancel_booking', user_id=session['user_id'], booking_id=booking_id,
+                             idempotency_key=request.form.get('idempotency_key'))
+    except ValueError as e:
+        flash(str(e), 'error')
         return redirect(url_for('patron_my_bookings'))
     
-    # Refund if payment exists
-    if booking['payment_id'] and booking['amount']:
-        cur.execute("UPDATE bank SET balance = balance + ? WHERE user_id=?", 
-                   (booking['amount'], session['user_id']))
-        cur.execute("UPDATE payments SET status='refunded' WHERE id=?", 
-                   (booking['payment_id'],))
-        flash(f'Booking cancelled. Refund of {booking["amount"]} credits processed.', 'success')
+    if result['refund']:
+        flash(f"Booking cancelled. Refund of {result['refund']} credits processed.", 'success')
     else:
         flash('Booking cancelled.', 'success')
     
-    # Update reservation status
-    now = get_malaysia_time()
-    cur.execute("UPDATE reservations SET status='Cancelled', updated_at=? WHERE id=?", 
-               (now, booking_id))
-    
-    conn.commit()
-    conn.close()
+    return redirect(url_for('patron_my_bookings'))
+
+@app.route('/patron/waitlist/leave/<int:waitlist_id>', methods=['POST'])
+def patron_leave_waitlist(waitlist_id):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
     
+    try:
+        writes.call('leave_waitlist', user_id=session['user_id'], waitlist_id=waitlist_id)
+        flash('You have left the waitlist.', 'success')
+    except ValueError as e:
+        flash(str(e), 'error')
     return redirect(url_for('patron_my_bookings'))
 
 @app.route('/patron/delete-account', methods=['POST'])
@@ -552,7 +799,7 @@ def patron_delete_account():
     username = session.get('username', 'Unknown')
     
     # Log the deletion action before deleting the user
-    now = get_malaysia_time()
+    now = timeslots.timestamp()
     cur.execute("""
         INSERT INTO user_actions (user_id, action_type, details, date)
         VALUES (?, ?, ?, ?)
@@ -573,6 +820,7 @@ def patron_delete_account():
     return redirect(url_for('login'))
 
 # ================= ADMIN ROUTES =================
+# Staff writes use their own connection rather than `writes`; see writer.py for why
 @app.route('/admin/dashboard')
 def admin_dashboard():
     if 'user_id' not in session or session.get('role') not in ['admin', 'librarian']:
@@ -639,7 +887,7 @@ def admin_add_room():
         
         conn = connect_db()
         cur = conn.cursor()
-        now = get_malaysia_time()
+        now = timeslots.timestamp()
         
         cur.execute("""
             INSERT INTO rooms (room_name, capacity, price_per_hour, status, created_at, updated_at)
@@ -677,22 +925,91 @@ def admin_edit_room(room_id):
         price_per_hour = request.form.get('price_per_hour')
         status = request.form.get('status', 'available')
         
-        now = get_malaysia_time()
+        now = timeslots.timestamp()
         cur.execute("""
             UPDATE rooms 
             SET room_name=?, capacity=?, price_per_hour=?, status=?, updated_at=?
             WHERE id=?
         """, (room_name, capacity, price_per_hour, status, now, room_id))
         
+        # Pending (unpaid) bookings follow the new price
+        requoted = 0
+        if float(price_per_hour or 0) != (room['price_per_hour'] or 0):
+            requoted = pricing.requote_pending(conn, room_id)
+        
         conn.commit()
         conn.close()
         
-        flash('Room updated successfully', 'success')
+        if requoted:
+            flash(f'Room updated successfully. {requoted} pending booking(s) re-quoted.', 'success')
+        else:
+            flash('Room updated successfully', 'success')
         return redirect(url_for('admin_rooms'))
     
     conn.close()
     return render_template('admin/edit_room.html', room=room)
 
+@app.route('/admin/rooms/offline/<int:room_id>', methods=['GET', 'POST'])
+def admin_room_offline(room_id):
+    if 'user_id' not in session or session.get('role') not in ['admin', 'librarian']:
+        return redirect(url_for('login'))
+
+    conn = connect_db()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM rooms WHERE id=?", (room_id,))
+    room = cur.fetchone()
+    if not room:
+        flash('Room not found', 'error')
+        conn.close()
+        return redirect(url_for('admin_rooms'))
+
+    summary = None
+    preview = 'preview' in request.form
+    if request.method == 'POST':
+        try:
+            summary = maintenance.take_offline(conn, room_id, request.form.get('start_date'),
+                                               request.form.get('end_date'), request.form.get('reason', ''),
+                                               rehome_bookings=bool(request.form.get('rehome')))
+        except ValueError as e:
+            conn.rollback()
+            flash(str(e), 'error')
+        else:
+            # A preview runs the whole operation and rolls it back
+            if preview:
+                conn.rollback()
+            else:
+                conn.commit()
+            message = ("Preview only, nothing was changed: " if preview else "Room offline. ")
+            message += f"{summary['moved']} booking(s) moved, {summary['cancelled']} cancelled"
+            if summary['refunds']:
+                message += f", {summary['refunded']} credits refunded to {len(summary['refunds'])} user(s)"
+            flash(message + '.', 'warning' if preview else 'success')
+
+    closures = maintenance.list_closures(cur, room_id, timeslots.today())
+    conn.close()
+    return render_template('admin/room_offline.html', room=room, closures=closures, summary=summary,
+                           preview=preview, form=request.form, today=timeslots.today())
+
+@app.route('/admin/rooms/closures/delete/<int:closure_id>', methods=['POST'])
+def admin_delete_closure(closure_id):
+    if 'user_id' not in session or session.get('role') not in ['admin', 'librarian']:
+        return redirect(url_for('login'))
+
+    conn = connect_db()
+    cur = conn.cursor()
+    cur.execute("SELECT room_id FROM room_closures WHERE id=?", (closure_id,))
+    closure = cur.fetchone()
+    if not closure:
+        conn.close()
+        flash('Closure not found', 'error')
+        return redirect(url_for('admin_rooms'))
+    maintenance.remove_closure(cur, closure_id)
+    conn.commit()
+    conn.close()
+
+    flash('Room is back online for those dates', 'success')
+    return redirect(url_for('admin_room_offline', room_id=closure['room_id']))
+
 @app.route('/admin/rooms/delete/<int:room_id>', methods=['POST'])
 def admin_delete_room(room_id):
     if 'user_id' not in session or session.get('role') not in ['admin', 'librarian']:
@@ -700,17 +1017,20 @@ def admin_delete_room(room_id):
     
     conn = connect_db()
     cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
     
-    # Delete related records first (cascade)
-    cur.execute("DELETE FROM reservation_equipment WHERE reservation_id IN (SELECT id FROM reservations WHERE room_id=?)", (room_id,))
-    cur.execute("DELETE FROM payments WHERE reservation_id IN (SELECT id FROM reservations WHERE room_id=?)", (room_id,))
-    cur.execute("DELETE FROM reservations WHERE room_id=?", (room_id,))
+    # Delete the room's bookings first: equipment returned, payments refunded, bank charges in flight refunded
+    cur.execute("SELECT id FROM reservations WHERE room_id=?", (room_id,))
+    _, refunds = bulk.delete_reservations(cur, json.dumps([row['id'] for row in cur.fetchall()]))
     cur.execute("DELETE FROM rooms WHERE id=?", (room_id,))
     
     conn.commit()
     conn.close()
     
-    flash('Room deleted successfully', 'success')
+    message = 'Room deleted successfully'
+    if refunds:
+        message += f". Refunded {round(sum(refunds.values()), 2)} credits to {len(refunds)} user(s)"
+    flash(message, 'success')
     return redirect(url_for('admin_rooms'))
 
 @app.route('/admin/bookings')
@@ -745,20 +1065,32 @@ def admin_add_booking():
         user_id = request.form.get('user_id')
         room_id = request.form.get('room_id')
         booking_date = request.form.get('date')
-        start_time = request.form.get('start_time')
-        end_time = request.form.get('end_time')
+        start_time = form_time('start_time')
+        end_time = form_time('end_time')
         status = request.form.get('status', 'Pending')
         
-        now = get_malaysia_time()
+        now = timeslots.timestamp()
         
         # Determine num_people (optional, default 1)
         cur.execute("SELECT capacity FROM rooms WHERE id=?", (room_id,))
         capacity = cur.fetchone()['capacity']
         
+        try:
+            availability.check_window(cur, room_id, booking_date, start_time, end_time)
+            quote = pricing.quote_booking(cur, room_id, booking_date, start_time, end_time)
+        except ValueError as e:
+            flash(str(e), 'error')
+            conn.close()
+            return redirect(url_for('admin_add_booking'))
+        
         cur.execute("""
-            INSERT INTO reservations (user_id, room_id, date, start_time, end_time, num_people, status, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (user_id, room_id, booking_date, start_time, end_time, str(capacity), status, now, now))
+            INSERT INTO reservations (user_id, room_id, date, start_time, end_time, num_people, status,
+                                      quoted_rate, quoted_hours, room_cost, equipment_cost, total_cost,
+                                      created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, room_id, booking_date, start_time, end_time, str(capacity), status,
+              quote['quoted_rate'], quote['quoted_hours'], quote['room_cost'],
+              quote['equipment_cost'], quote['total_cost'], now, now))
         
         conn.commit()
         conn.close()
@@ -788,17 +1120,36 @@ def admin_edit_booking(booking_id):
         user_id = request.form.get('user_id')
         room_id = request.form.get('room_id')
         booking_date = request.form.get('date')
-        start_time = request.form.get('start_time')
-        end_time = request.form.get('end_time')
+        start_time = form_time('start_time')
+        end_time = form_time('end_time')
         status = request.form.get('status')
         
-        now = get_malaysia_time()
+        cur.execute("SELECT status FROM reservations WHERE id=?", (booking_id,))
+        current = cur.fetchone()
+        was_active = current is not None and current['status'] in availability.BLOCKING_STATUSES
+        try:
+            if status in availability.BLOCKING_STATUSES:
+                availability.check_window(cur, room_id, booking_date, start_time, end_time, booking_id)
+            
+            # Release the old equipment hold, then claim it again for the new time/status
+            if was_active:
+                inventory.release_equipment(cur, booking_id)
+            now = timeslots.timestamp()
+            cur.execute("""
+                UPDATE reservations 
+                SET user_id=?, room_id=?, date=?, start_time=?, end_time=?, status=?, updated_at=?,
+                    held_until=CASE WHEN ?='Pending' THEN held_until END
+                WHERE id=?
+            """, (user_id, room_id, booking_date, start_time, end_time, status, now, status, booking_id))
+            if status in availability.BLOCKING_STATUSES:
+                inventory.claim_equipment(cur, booking_id)
+        except ValueError as e:
+            flash(str(e), 'error')
+            conn.close()
+            return redirect(url_for('admin_edit_booking', booking_id=booking_id))
         
-        cur.execute("""
-            UPDATE reservations 
-            SET user_id=?, room_id=?, date=?, start_time=?, end_time=?, status=?, updated_at=?
-            WHERE id=?
-        """, (user_id, room_id, booking_date, start_time, end_time, status, now, booking_id))
+        if status == 'Pending':
+            pricing.requote_reservation(cur, booking_id)
         
         conn.commit()
         conn.close()
@@ -831,17 +1182,108 @@ def admin_delete_booking(booking_id):
         return redirect(url_for('login'))
     
     conn = connect_db()
-    cur = conn.cursor()
-    
-    # Delete related payments first
-    cur.execute("DELETE FROM payments WHERE reservation_id=?", (booking_id,))
-    cur.execute("DELETE FROM reservation_equipment WHERE reservation_id=?", (booking_id,))
-    cur.execute("DELETE FROM reservations WHERE id=?", (booking_id,))
-    
+    # Refunds what was paid, then removes the booking and hands the freed slot to the waitlist
+    summary = bulk.bulk_update(conn, "delete", [booking_id])
     conn.commit()
     conn.close()
     
-    flash('Booking deleted successfully', 'success')
+    message = 'Booking deleted successfully'
+    if summary['refunds']:
+        message += f". Refunded {summary['refunded']} credits"
+    flash(message, 'success')
+    return redirect(url_for('admin_bookings'))
+
+@app.route('/admin/lotteries', methods=['GET', 'POST'])
+def admin_lotteries():
+    if 'user_id' not in session or session.get('role') not in ['admin', 'librarian']:
+        return redirect(url_for('login'))
+
+    conn = connect_db()
+    cur = conn.cursor()
+    if request.method == 'POST':
+        try:
+            lottery.create_window(cur, request.form.get('start_date'), request.form.get('end_date'),
+                                  request.form.get('draw_at'))
+            conn.commit()
+            flash('Lottery created. Bookings for those dates are now queued until the draw.', 'success')
+        except ValueError as e:
+            flash(str(e), 'error')
+    windows = lottery.list_windows(cur)
+    conn.close()
+    return render_template('admin/lotteries.html', windows=windows, today=timeslots.today())
+
+@app.route('/admin/lotteries/draw/<int:window_id>', methods=['POST'])
+def admin_draw_lottery(window_id):
+    if 'user_id' not in session or session.get('role') not in ['admin', 'librarian']:
+        return redirect(url_for('login'))
+
+    conn = connect_db()
+    try:
+        result = lottery.draw(conn, window_id)
+        conn.commit()
+        flash(f"Lottery drawn: {result['won']} request(s) booked, {result['lost']} unsuccessful.", 'success')
+    except ValueError as e:
+        flash(str(e), 'error')
+    finally:
+        conn.close()
+    return redirect(url_for('admin_lotteries'))
+
+@app.route('/admin/defrag', methods=['GET', 'POST'])
+def admin_defrag():
+    if 'user_id' not in session or session.get('role') not in ['admin', 'librarian']:
+        return redirect(url_for('login'))
+
+    values = request.form if request.method == 'POST' else request.args
+    date = values.get('date', '')
+    min_hours = values.get('min_hours', '3')
+    plan = None
+    try:
+        min_block = max(1, round(float(min_hours) * 60 / timeslots.grid().slot_minutes))
+    except ValueError:
+        flash('Invalid block length', 'error')
+        date = ''
+    if date:
+        conn = connect_db()
+        try:
+            plan = defrag.defragment(conn, date, min_block, apply=request.method == 'POST')
+            conn.commit()
+        except ValueError as e:
+            flash(str(e), 'error')
+        finally:
+            conn.close()
+        if plan and request.method == 'POST':
+            flash(f"{len(plan['moves'])} booking(s) moved.", 'success')
+            return redirect(url_for('admin_defrag', date=date, min_hours=min_hours))
+
+    return render_template('admin/defrag.html', plan=plan, date=date, min_hours=min_hours,
+                           slot_minutes=timeslots.grid().slot_minutes)
+
+@app.route('/admin/bookings/bulk', methods=['POST'])
+def admin_bulk_bookings():
+    if 'user_id' not in session or session.get('role') not in ['admin', 'librarian']:
+        return redirect(url_for('login'))
+
+    conn = connect_db()
+    try:
+        summary = bulk.bulk_update(conn, request.form.get('action'), request.form.getlist('booking_ids'))
+        conn.commit()
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('admin_bookings'))
+    finally:
+        conn.close()
+
+    verb = {'confirm': 'confirmed', 'cancel': 'cancelled', 'delete': 'deleted'}[summary['action']]
+    message = f"{summary['changed']} booking(s) {verb}"
+    if summary['skipped_ids'] and summary['action'] == 'confirm':
+        message += f", {summary['skipped']} skipped (#{', #'.join(map(str, summary['skipped_ids']))})"
+    elif summary['skipped']:
+        message += f", {summary['skipped']} skipped"
+    if summary['refunds']:
+        message += f". Refunded {summary['refunded']} credits to {len(summary['refunds'])} user(s)"
+    if summary['promoted']:
+        message += f". {summary['promoted']} waitlisted patron(s) got a freed slot"
+    flash(message + '.', 'success')
     return redirect(url_for('admin_bookings'))
 
 @app.route('/admin/payments')
@@ -865,6 +1307,16 @@ def admin_payments():
     
     return render_template('admin/payments.html', payments=payments)
 
+@app.route('/admin/metrics')
+def admin_metrics():
+    if 'user_id' not in session or session.get('role') not in ['admin', 'librarian']:
+        return redirect(url_for('login'))
+    conn = connect_db()
+    body = (admission.metrics_text() + limiter.metrics_text() + scheduler.metrics_text(conn.cursor())
+            + livefeed.metrics_text(live))
+    conn.close()
+    return body, 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
 # ================= ERROR HANDLERS =================
 @app.errorhandler(404)
 def not_found(e):
@@ -876,4 +1328,5 @@ def server_error(e):
 
 # ================= RUN APP =================
 if __name__ == '__main__':
+    start_services()
     app.run(debug=True, host='0.0.0.0', port=5002)
@@ -0,0 +1,69 @@
+"""
+"Any room for N people" bookings.
+Candidate rooms come from the (status, capacity) index, smallest first, so
+a pair does not take a room meant for twelve. The day's occupancy for just
+those rooms decides which are free, and the first free one is booked. The
+lookup and the insert run under one write lock (BEGIN IMMEDIATE), so two
+concurrent requests cannot both pick the same room.
+"""
+
+from datetime import datetime
+
+import availability
+import holds
+import lottery
+import pricing
+import timeslots
+
+
+def pick_room(cur, date, start_time, end_time, num_people):
+    """Smallest free room (Row) that holds num_people for the window, or None"""
+    window = timeslots.grid().window(start_time, end_time)
+    if not window:
+        raise ValueError("End time must be after start time")
+    cur.execute("""
+        SELECT * FROM rooms WHERE status='available' AND capacity >= ?
+        ORDER BY capacity, id
+    """, (num_people,))
+    rooms = cur.fetchall()
+    if not rooms:
+        raise ValueError(f"No room holds {num_people} people")
+    occupancy = availability.DayOccupancy.load(cur, date, [r["id"] for r in rooms])
+    free = {int(r) for r in occupancy.free_rooms(*window)}
+    return next((r for r in rooms if r["id"] in free), None)
+
+
+def book_any_room(conn, user_id, date, start_time, end_time, num_people):
+    """
+    Book the smallest free room for the group as a Pending reservation held for checkout.
+    Returns (reservation_id, room dict); ValueError if nothing fits. The caller commits.
+    """
+    try:
+        num_people = int(num_people)
+        datetime.strptime(date, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        raise ValueError("Invalid date or group size")
+    if num_people < 1:
+        raise ValueError("Group size must be at least 1")
+
+    cur = conn.cursor()
+    if lottery.open_window_for(cur, date):
+        raise ValueError("Rooms on this date are allocated by lottery; choose a room to enter it")
+    if not conn.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")
+    room = pick_room(cur, date, start_time, end_time, num_people)
+    if room is None:
+        raise ValueError(f"No room for {num_people} people is free at that time")
+
+    quote = pricing.quote_booking(cur, room["id"], date, start_time, end_time)
+    now = timeslots.timestamp()
+    # The patron asked for any room, so the day optimizer may move it later
+    cur.execute("""
+        INSERT INTO reservations (user_id, room_id, date, start_time, end_time, num_people, status,
+                                  quoted_rate, quoted_hours, room_cost, equipment_cost, total_cost,
+                                  movable, held_until, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, 'Pending', ?, ?, ?, ?, ?, 1, ?, ?, ?)
+    """, (user_id, room["id"], date, start_time, end_time, num_people,
+          quote["quoted_rate"], quote["quoted_hours"], quote["room_cost"],
+          quote["equipment_cost"], quote["total_cost"], holds.hold_until(), now, now))
+    return cur.lastrowid, dict(room)
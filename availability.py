@@ -0,0 +1,181 @@
+"""
+Room availability on the configurable slot grid.
+A day is loaded as a NumPy occupancy matrix (room x slot) in a few queries:
+opening hours and maintenance closures mark closed slots, and the day's
+Pending/Confirmed reservations are painted on with a difference array. Free rooms for any
+window are then a single any() over a column slice, which stays fast at
+96 slots/day across thousands of rooms.
+
+Single-booking checks (check_window) go straight to SQL instead, using the
+numeric start_minute/end_minute columns and the (date, room_id) index.
+Both skip Pending bookings whose checkout hold has lapsed (holds.py).
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+import holds
+import timeslots
+
+BLOCKING_STATUSES = ("Pending", "Confirmed")
+
+
+class Conflict(ValueError):
+    """The window is valid and open, but another booking holds part of it"""
+
+
+def closed_rooms(cur, date, room_ids=None):
+    """Ids of rooms taken offline (room_closures) on a date"""
+    cur.execute("SELECT DISTINCT room_id FROM room_closures WHERE start_date <= ? AND end_date >= ?", (date, date))
+    closed = {row["room_id"] for row in cur.fetchall()}
+    if room_ids is not None:
+        closed &= {int(r) for r in room_ids}
+    return closed
+
+
+def room_hours(cur, room_ids, weekday, grid=None, date=None):
+    """
+    (open, close) minute arrays aligned with room_ids, clamped to the grid.
+    With a date, rooms offline that day come back closed.
+    """
+    grid = grid or timeslots.grid()
+    index = {int(r): i for i, r in enumerate(room_ids)}
+    opens = np.full(len(index), grid.open_minute, dtype=np.int64)
+    closes = np.full(len(index), grid.close_minute, dtype=np.int64)
+    # Every-day rows first so weekday-specific rows override them
+    room_filter, params = "", ()
+    if len(index) <= 100:
+        room_filter = f" AND room_id IN ({','.join('?' * len(index))})"
+        params = tuple(index)
+    cur.execute(f"""
+        SELECT room_id, open_minute, close_minute FROM room_hours
+        WHERE (weekday IS NULL OR weekday=?){room_filter}
+        ORDER BY weekday IS NOT NULL
+    """, (weekday, *params))
+    for row in cur.fetchall():
+        i = index.get(row["room_id"])
+        if i is not None:
+            opens[i] = row["open_minute"]
+            closes[i] = row["close_minute"]
+    if date is not None:
+        for room_id in closed_rooms(cur, date, index):
+            opens[index[room_id]] = closes[index[room_id]] = 0
+    return (np.clip(opens, grid.open_minute, grid.close_minute),
+            np.clip(closes, grid.open_minute, grid.close_minute))
+
+
+def occupancy_matrix(grid, opens, closes, rows, starts, ends):
+    """
+    Boolean room x slot matrix, True where a slot is closed or booked.
+    rows/starts/ends describe bookings: room row index and start/end minute.
+    """
+    slot = grid.slot_minutes
+    slot_starts = np.array(grid.minutes[:-1])
+    busy = (slot_starts < opens[:, None]) | (slot_starts + slot > closes[:, None])
+    if len(rows):
+        # Any slot a booking touches is taken (floor the start, ceil the end)
+        first = np.clip((np.asarray(starts) - grid.open_minute) // slot, 0, grid.n_slots)
+        last = np.clip((np.asarray(ends) - grid.open_minute + slot - 1) // slot, 0, grid.n_slots)
+        diff = np.zeros((len(opens), grid.n_slots + 1), dtype=np.int32)
+        np.add.at(diff, (rows, first), 1)
+        np.add.at(diff, (rows, last), -1)
+        busy |= np.cumsum(diff[:, :-1], axis=1) > 0
+    return busy
+
+
+class DayOccupancy:
+    """Occupancy of a set of rooms on one date"""
+
+    def __init__(self, room_ids, busy, grid):
+        self.room_ids = np.asarray(room_ids, dtype=np.int64)
+        self.busy = busy
+        self.grid = grid
+
+    @classmethod
+    def load(cls, cur, date, room_ids=None, grid=None):
+        grid = grid or timeslots.grid()
+        if room_ids is None:
+            cur.execute("SELECT id FROM rooms ORDER BY id")
+            room_ids = [r["id"] for r in cur.fetchall()]
+        room_ids = np.array(sorted(int(r) for r in room_ids), dtype=np.int64)
+
+        opens, closes = room_hours(cur, room_ids, datetime.strptime(date, "%Y-%m-%d").weekday(), grid, date)
+        placeholders = ",".join("?" * len(BLOCKING_STATUSES))
+        raw = cur.connection.cursor()
+        raw.row_factory = None  # plain tuples go straight into NumPy
+        raw.execute(f"""
+            SELECT CAST(room_id AS INTEGER), start_minute, end_minute FROM reservations
+            WHERE date=? AND status IN ({placeholders}) AND {holds.ACTIVE_HOLD_SQL}
+            AND start_minute IS NOT NULL AND end_minute IS NOT NULL
+        """, (date, *BLOCKING_STATUSES, timeslots.timestamp()))
+        bookings = np.array(raw.fetchall(), dtype=np.int64).reshape(-1, 3)
+        raw.close()
+
+        # Map booking room ids onto matrix rows, dropping rooms not loaded
+        rows = np.searchsorted(room_ids, bookings[:, 0])
+        known = rows < len(room_ids)
+        known[known] = room_ids[rows[known]] == bookings[known, 0]
+        busy = occupancy_matrix(grid, opens, closes, rows[known], bookings[known, 1], bookings[known, 2])
+        return cls(room_ids, busy, grid)
+
+    def span(self, start_minute, end_minute):
+        """Slot indices [first, last) a minute window touches, clipped to the grid"""
+        slot, n = self.grid.slot_minutes, self.grid.n_slots
+        first = min(max((start_minute - self.grid.open_minute) // slot, 0), n)
+        last = min(max((end_minute - self.grid.open_minute + slot - 1) // slot, 0), n)
+        return first, last
+
+    def free_rooms(self, start_idx, end_idx):
+        """Room ids with every slot in [start_idx, end_idx) free"""
+        return self.room_ids[~self.busy[:, start_idx:end_idx].any(axis=1)]
+
+    def free_slots(self, room_id):
+        """Start labels of the free slots of one room"""
+        row = int(np.searchsorted(self.room_ids, room_id))
+        if row >= len(self.room_ids) or self.room_ids[row] != room_id:
+            return []
+        return [self.grid.labels[i] for i in np.flatnonzero(~self.busy[row])]
+
+
+def free_rooms(cur, date, start_time, end_time, room_ids=None):
+    """Ids of rooms open and unbooked for the whole window ([] for an invalid window)"""
+    grid = timeslots.grid()
+    window = grid.window(start_time, end_time)
+    if not window:
+        return []
+    occupancy = DayOccupancy.load(cur, date, room_ids, grid)
+    return [int(r) for r in occupancy.free_rooms(*window)]
+
+
+def check_window(cur, room_id, date, start_time, end_time, exclude_id=None):
+    """Raise ValueError unless the room is open and free for the window"""
+    grid = timeslots.grid()
+    if start_time not in grid.index or end_time not in grid.index:
+        raise ValueError("Invalid time slot")
+    if grid.index[end_time] <= grid.index[start_time]:
+        raise ValueError("End time must be after start time")
+    try:
+        weekday = datetime.strptime(date, "%Y-%m-%d").weekday()
+    except (TypeError, ValueError):
+        raise ValueError("Invalid date")
+
+    if closed_rooms(cur, date, [room_id]):
+        raise ValueError("Room is offline for maintenance on that day")
+    start, end = timeslots.label_minutes(start_time), timeslots.label_minutes(end_time)
+    opens, closes = room_hours(cur, [room_id], weekday, grid)
+    if opens[0] >= closes[0]:
+        raise ValueError("Room is closed on that day")
+    if start < opens[0] or end > closes[0]:
+        raise ValueError(f"Room is open {timeslots.format_minutes(opens[0])} - "
+                         f"{timeslots.format_minutes(closes[0])} on that day")
+
+    placeholders = ",".join("?" * len(BLOCKING_STATUSES))
+    cur.execute(f"""
+        SELECT 1 FROM reservations
+        WHERE date=? AND room_id=? AND status IN ({placeholders}) AND {holds.ACTIVE_HOLD_SQL}
+        AND start_minute < ? AND end_minute > ? AND id != ?
+        LIMIT 1
+    """, (date, room_id, *BLOCKING_STATUSES, timeslots.timestamp(), end, start, exclude_id or -1))
+    if cur.fetchone():
+        raise Conflict("Room already booked in this time range")
@@ -0,0 +1,873 @@
+"""
+Performance benchmarks for the reservation system.
+Each benchmark builds its own synthetic data and prints timings; nothing
+touches reservation_system.db.
+
+Usage:
+    python benchmarks.py             # run every benchmark
+    python benchmarks.py pricing     # run one benchmark by name
+"""
+
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import availability
+import bulk
+import defrag
+import events
+import inventory
+import ledger
+import livefeed
+import lottery
+import notify
+import operations
+import payqueue
+import pricing
+import ratelimit
+import recurring
+import rehome
+import setup_db
+import timeslots
+import waitlist
+import writer
+
+
+def time_call(fn, repeat=200):
+    """Median seconds per call of fn()"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples))
+
+
+def temp_db():
+    """Fresh, fully migrated database in a temp file"""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    original = setup_db.DB_PATH
+    setup_db.DB_PATH = path
+    try:
+        setup_db.create_tables()
+    finally:
+        setup_db.DB_PATH = original
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn, path
+
+
+def print_header(text):
+    print("\n" + "=" * 60)
+    print(f" {text}")
+    print("=" * 60)
+
+
+# ================= PRICING =================
+def bench_pricing():
+    print_header("PRICING ENGINE")
+    rng = np.random.default_rng(1)
+    n_rooms = 1000
+    room_ids = np.arange(1, n_rooms + 1)
+    base = rng.uniform(3, 25, n_rooms).round(2)
+    rules = [{"room_id": None, "weekday": None, "start_minute": 720, "end_minute": 840, "rate": 30.0}]
+    rules += [{"room_id": int(r), "weekday": int(rng.integers(0, 7)), "start_minute": 480,
+               "end_minute": 600, "rate": 2.0} for r in rng.choice(room_ids, 100, replace=False)]
+
+    start = time.perf_counter()
+    table = pricing.RateTable(room_ids, base, rules)
+    print(f"Build rate table ({n_rooms} rooms, {len(rules)} rules): {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    t = time_call(lambda: table.quote_window(2, 2, 6), repeat=2000)
+    print(f"Quote one window for {n_rooms} rooms: {t * 1e6:.1f} us")
+
+    n = 10000
+    rooms = rng.choice(room_ids, n)
+    days = rng.integers(0, 7, n)
+    starts = rng.integers(0, 11, n)
+    ends = np.minimum(starts + rng.integers(1, 4, n), table.grid.n_slots)
+    t = time_call(lambda: table.quote_many(rooms, days, starts, ends), repeat=200)
+    print(f"Quote {n} (room, weekday, window) combinations: {t * 1000:.2f} ms")
+
+
+# ================= AVAILABILITY =================
+def bench_availability():
+    print_header("AVAILABILITY (15-minute slots, 96 per day)")
+    rng = np.random.default_rng(2)
+    n_rooms, per_room, date = 1000, 8, "2030-01-07"
+    grid = timeslots.SlotGrid(15, 0, timeslots.DAY_MINUTES)
+    previous = timeslots.grid()
+    timeslots.set_grid(grid)
+    conn, path = temp_db()
+    try:
+        cur = conn.cursor()
+        cur.executemany("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES (?, 4, 10, 'available')",
+                        [(f"Room {i}",) for i in range(n_rooms)])
+        cur.executemany("INSERT INTO room_hours (room_id, weekday, open_minute, close_minute) VALUES (?, NULL, 420, 1320)",
+                        [(int(r),) for r in rng.choice(np.arange(1, n_rooms + 1), n_rooms // 4, replace=False)])
+        starts = rng.integers(0, 90, n_rooms * per_room)
+        lengths = rng.integers(1, 7, n_rooms * per_room)
+        cur.executemany("""
+            INSERT INTO reservations (user_id, room_id, date, start_time, end_time, status)
+            VALUES (1, ?, ?, ?, ?, 'Confirmed')
+        """, [(i // per_room + 1, date, grid.labels[s], grid.labels[s + l])
+              for i, (s, l) in enumerate(zip(starts, lengths))])
+        conn.commit()
+        print(f"{n_rooms} rooms x {grid.n_slots} slots, {n_rooms * per_room} bookings on {date}")
+
+        t = time_call(lambda: availability.DayOccupancy.load(cur, date), repeat=50)
+        print(f"Load day occupancy (2 queries + matrix): {t * 1000:.2f} ms")
+
+        room_ids = np.arange(1, n_rooms + 1)
+        opens, closes = availability.room_hours(cur, room_ids, 0, grid)
+        rows = np.repeat(np.arange(n_rooms), per_room)
+        t = time_call(lambda: availability.occupancy_matrix(grid, opens, closes, rows, starts * 15, (starts + lengths) * 15),
+                      repeat=200)
+        print(f"Build occupancy matrix only: {t * 1000:.2f} ms")
+
+        occupancy = availability.DayOccupancy.load(cur, date)
+        t = time_call(lambda: occupancy.free_rooms(40, 48), repeat=2000)
+        print(f"Free rooms for one window (loaded day): {t * 1e6:.1f} us "
+              f"({len(occupancy.free_rooms(40, 48))} free)")
+
+        t = time_call(lambda: availability.free_rooms(cur, date, grid.labels[40], grid.labels[48]), repeat=50)
+        print(f"free_rooms() end to end: {t * 1000:.2f} ms")
+
+        def check():
+            try:
+                availability.check_window(cur, 500, date, grid.labels[40], grid.labels[44])
+            except ValueError:
+                pass
+        t = time_call(check, repeat=2000)
+        print(f"Single-room conflict check (indexed SQL): {t * 1e6:.1f} us")
+    finally:
+        conn.close()
+        os.remove(path)
+        timeslots.set_grid(previous)
+
+
+# ================= RECURRING =================
+def bench_recurring():
+    print_header("RECURRING BOOKINGS (52-week series)")
+    rng = np.random.default_rng(3)
+    conn, path = temp_db()
+    try:
+        cur = conn.cursor()
+        cur.executemany("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES (?, 4, 10, 'available')",
+                        [(f"Room {i}",) for i in range(50)])
+        # A year of background bookings across the rooms
+        dates = np.datetime64("2030-01-01") + rng.integers(0, 365, 20000)
+        starts = rng.integers(0, 11, 20000)
+        labels = timeslots.grid().labels
+        cur.executemany("""
+            INSERT INTO reservations (user_id, room_id, date, start_time, end_time, status)
+            VALUES (2, ?, ?, ?, ?, 'Confirmed')
+        """, [(int(r), str(d), labels[s], labels[s + 1])
+              for r, d, s in zip(rng.integers(1, 51, 20000), dates, starts)])
+        conn.commit()
+
+        def book():
+            series_id, report = recurring.book_series(conn, 1, 7, "2030-01-07", "2030-12-30", "10:00 AM", "12:00 PM")
+            conn.rollback()
+            return report
+
+        report = book()
+        booked = sum(1 for line in report if line["reservation_id"])
+        t = time_call(book, repeat=50)
+        print(f"Book a 52-week series ({booked} booked, {len(report) - booked} conflicts, 20k existing rows): "
+              f"{t * 1000:.2f} ms")
+    finally:
+        conn.close()
+        os.remove(path)
+
+
+# ================= BULK OPERATIONS =================
+def bench_bulk():
+    print_header("BULK BOOKING OPERATIONS (10k-row batch)")
+    rng = np.random.default_rng(4)
+    n, n_users = 10000, 500
+    conn, path = temp_db()
+    try:
+        cur = conn.cursor()
+        cur.executemany("INSERT INTO bank (user_id, balance) VALUES (?, 0)", [(u,) for u in range(1, n_users + 1)])
+        cur.execute("INSERT INTO equipment (name, price, quantity) VALUES ('Laptop', 15, 100000)")
+        labels = timeslots.grid().labels
+        users = rng.integers(1, n_users + 1, n)
+        dates = np.datetime64("2030-01-01") + rng.integers(0, 120, n)
+        starts = rng.integers(0, 11, n)
+        cur.executemany("""
+            INSERT INTO reservations (user_id, room_id, date, start_time, end_time, status)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(int(u), int(r), str(d), labels[s], labels[s + 1], "Confirmed" if i % 2 else "Pending")
+              for i, (u, r, d, s) in enumerate(zip(users, rng.integers(1, 201, n), dates, starts))])
+        cur.execute("SELECT id, user_id, status FROM reservations")
+        rows = cur.fetchall()
+        ids = [r["id"] for r in rows]
+        cur.executemany("""
+            INSERT INTO payments (reservation_id, user_id, amount, payment_method, status)
+            VALUES (?, ?, 10, 'wallet', 'completed')
+        """, [(r["id"], r["user_id"]) for r in rows if r["status"] == "Confirmed"])
+        cur.executemany("INSERT INTO reservation_equipment (reservation_id, equipment_id) VALUES (?, 1)",
+                        [(i,) for i in ids[::4]])
+        inventory.rebuild_usage(cur)
+        conn.commit()
+
+        for action in bulk.ACTIONS:
+            def run():
+                summary = bulk.bulk_update(conn, action, ids)
+                conn.rollback()
+                return summary
+
+            summary = run()
+            t = time_call(run, repeat=5)
+            refunds = f", {len(summary['refunds'])} users refunded" if summary["refunds"] else ""
+            print(f"{action:>8}: {summary['changed']} rows{refunds} in {t * 1000:.1f} ms "
+                  f"({summary['selected'] / t:,.0f} rows/sec)")
+    finally:
+        conn.close()
+        os.remove(path)
+
+
+# ================= RE-HOMING =================
+def bench_rehome():
+    print_header("RE-HOMING DISPLACED BOOKINGS (1000 rooms)")
+    rng = np.random.default_rng(5)
+    n_rooms, n_days, per_room = 1000, 5, 6
+    conn, path = temp_db()
+    try:
+        cur = conn.cursor()
+        cur.executemany("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES (?, ?, 10, 'available')",
+                        [(f"Room {i}", int(c)) for i, c in enumerate(rng.integers(2, 21, n_rooms))])
+        labels = timeslots.grid().labels
+        dates = [f"2030-01-{7 + d:02d}" for d in range(n_days)]
+        rows = []
+        for date in dates:
+            for room in range(1, n_rooms + 1):
+                for s in rng.choice(timeslots.grid().n_slots - 1, per_room, replace=False):
+                    rows.append((room, date, labels[s], labels[s + 1], int(rng.integers(1, 9))))
+        cur.executemany("""
+            INSERT INTO reservations (user_id, room_id, date, start_time, end_time, num_people, status)
+            VALUES (2, ?, ?, ?, ?, ?, 'Confirmed')
+        """, rows)
+        conn.commit()
+
+        # Every booking of 10 rooms across the 5 days is displaced
+        cur.execute("SELECT id FROM reservations WHERE room_id <= 10")
+        displaced = [r["id"] for r in cur.fetchall()]
+        plan = rehome.plan_moves(cur, displaced)
+        moved = sum(1 for line in plan if line["status"] == "moved")
+        t = time_call(lambda: rehome.plan_moves(cur, displaced), repeat=10)
+        print(f"Plan {len(displaced)} displaced bookings over {n_days} days, {len(rows)} existing rows: "
+              f"{t * 1000:.1f} ms ({moved} moved)")
+
+        def apply():
+            rehome.rehome_bookings(conn, displaced)
+            conn.rollback()
+
+        t = time_call(apply, repeat=10)
+        print(f"Plan and apply in one transaction: {t * 1000:.1f} ms")
+    finally:
+        conn.close()
+        os.remove(path)
+
+
+# ================= DEFRAGMENTATION =================
+def bench_defrag():
+    print_header("DAY DEFRAGMENTATION (1000 rooms x 13 slots)")
+    rng = np.random.default_rng(6)
+    n_rooms, per_room, date = 1000, 4, "2030-01-07"
+    grid = timeslots.SlotGrid(60, 480, 1260)
+    previous = timeslots.grid()
+    timeslots.set_grid(grid)
+    conn, path = temp_db()
+    try:
+        cur = conn.cursor()
+        capacity = rng.integers(2, 21, n_rooms)
+        cur.executemany("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES (?, ?, 10, 'available')",
+                        [(f"Room {i}", int(c)) for i, c in enumerate(capacity)])
+        # Non-overlapping 1-2 hour bookings per room, 60% of them flexible
+        rows = []
+        for room in range(n_rooms):
+            s = 0
+            for _ in range(per_room):
+                s += int(rng.integers(0, 3))
+                length = int(rng.integers(1, 3))
+                if s + length > grid.n_slots:
+                    break
+                rows.append((room + 1, grid.labels[s], grid.labels[s + length],
+                             int(rng.integers(1, capacity[room] + 1)), int(rng.random() < 0.6)))
+                s += length
+        cur.executemany("""
+            INSERT INTO reservations (user_id, room_id, date, start_time, end_time, num_people, status, movable)
+            VALUES (2, ?, ?, ?, ?, ?, 'Confirmed', ?)
+        """, [(r, date, a, b, n, m) for r, a, b, n, m in rows])
+        conn.commit()
+
+        plan = defrag.plan_defrag(cur, date, 3)
+        print(f"{len(rows)} bookings ({sum(r[4] for r in rows)} flexible)")
+        print(f"Rooms with a 3-hour free block: {plan['before']['rooms_with_block']} -> "
+              f"{plan['after']['rooms_with_block']} ({len(plan['moves'])} moves)")
+        t = time_call(lambda: defrag.plan_defrag(cur, date, 3), repeat=5)
+        print(f"Plan: {t * 1000:.1f} ms")
+
+        def apply():
+            defrag.defragment(conn, date, 3, apply=True)
+            conn.rollback()
+
+        t = time_call(apply, repeat=5)
+        print(f"Plan and apply in one transaction: {t * 1000:.1f} ms")
+    finally:
+        conn.close()
+        os.remove(path)
+        timeslots.set_grid(previous)
+
+
+def bench_lottery():
+    print_header("LOTTERY (5000 requests, 2000 users, 100 rooms)")
+    rng = np.random.default_rng(7)
+    n_rooms, n_users, n_requests = 100, 2000, 5000
+    grid = timeslots.grid()
+    conn, path = temp_db()
+    try:
+        cur = conn.cursor()
+        cur.executemany("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES (?, 8, 10, 'available')",
+                        [(f"Room {i}",) for i in range(n_rooms)])
+        window = lottery.create_window(cur, "2030-01-07", "2030-01-09", "2030-01-01 10:00")
+        conn.commit()
+        # Demand skewed towards a few popular rooms and the middle of the day
+        requests = []
+        for _ in range(n_requests):
+            start = int(np.clip(rng.normal(grid.n_slots / 2, 2), 0, grid.n_slots - 2))
+            requests.append((int(rng.integers(1, n_users + 1)), int(rng.zipf(1.5) % n_rooms) + 1,
+                             f"2030-01-0{rng.integers(7, 10)}", grid.labels[start], grid.labels[start + 1]))
+
+        # One transaction per request, as the booking form does
+        t = time.perf_counter()
+        for user_id, room_id, date, start, end in requests:
+            try:
+                lottery.queue_request(cur, window, user_id, room_id, date, start, end)
+                conn.commit()
+            except ValueError:
+                conn.rollback()    # duplicate
+        elapsed = time.perf_counter() - t
+        cur.execute("SELECT COUNT(*) FROM booking_requests")
+        queued = cur.fetchone()[0]
+        print(f"Queue requests: {elapsed / n_requests * 1e6:.1f} us/request, {queued} queued")
+
+        t = time.perf_counter()
+        result = lottery.draw(conn, window, seed=1)
+        elapsed = time.perf_counter() - t
+        conn.rollback()
+        print(f"Draw in one transaction: {elapsed * 1000:.1f} ms ({result['won']} won, {result['lost']} lost)")
+    finally:
+        conn.close()
+        os.remove(path)
+
+
+def bench_ratelimit():
+    print_header("RATE LIMITER (10000 clients)")
+    budgets = {"login": ratelimit.Budget(burst=10, per_minute=10)}
+    keys = [f"ip:10.0.{i // 256}.{i % 256}" for i in range(10000)]
+    memory = ratelimit.RateLimiter(budgets)
+    i = iter(range(10 ** 9))
+    t = time_call(lambda: memory.check("login", keys[next(i) % len(keys)]), repeat=20000)
+    print(f"In-process buckets: {t * 1e6:.2f} us/check")
+
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        shared = ratelimit.RateLimiter(budgets, ratelimit.SqliteStore(path))
+        t = time_call(lambda: shared.check("login", keys[next(i) % len(keys)]), repeat=5000)
+        print(f"SQLite-shared buckets: {t * 1e6:.2f} us/check")
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def _connect_row(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _serve_writer(path, address, ready):
+    writer.Coordinator(path, address).serve(ready)
+
+
+def _write_worker(path, address, worker, n_ops, start, results):
+    """One web worker: alternate a booking (own date) and a top-up, timing each call"""
+    writes = writer.WriterClient(address) if address else writer.LocalWriter(lambda: _connect_row(path))
+    first = date(2030, 1, 1) + timedelta(days=worker * n_ops)
+    latencies, errors = [], 0
+    start.wait()
+    for i in range(n_ops):
+        t = time.perf_counter()
+        try:
+            if i % 2:
+                writes.call("top_up", user_id=worker + 1, amount=1, bank_name="Bench")
+            else:
+                writes.call("create_booking", user_id=worker + 1, room_id=1,
+                            date=(first + timedelta(days=i)).isoformat(), start_time="09:00 AM", end_time="10:00 AM")
+        except (ValueError, sqlite3.OperationalError):
+            errors += 1
+        latencies.append(time.perf_counter() - t)
+    results.put((latencies, errors))
+
+
+def bench_writer():
+    print_header("WRITES: DIRECT vs SINGLE-WRITER COORDINATOR (200 writes per worker)")
+    n_ops = 200
+    ctx = multiprocessing.get_context("fork")
+    for workers in (4, 8, 16):
+        for mode in ("direct", "coordinator"):
+            conn, path = temp_db()
+            conn.execute("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES ('Bench', 4, 10, 'available')")
+            conn.executemany("INSERT INTO bank (user_id, balance) VALUES (?, 0)", [(u,) for u in range(1, workers + 1)])
+            conn.executemany("INSERT INTO user_bank_acc (user_id, bank_balance) VALUES (?, 1000000)",
+                             [(u,) for u in range(1, workers + 1)])
+            ledger.open_missing_accounts(conn.cursor())
+            conn.commit()
+            conn.close()
+            address, server = None, None
+            if mode == "coordinator":
+                address = path + ".sock"
+                ready = ctx.Event()
+                server = ctx.Process(target=_serve_writer, args=(path, address, ready), daemon=True)
+                server.start()
+                ready.wait(10)
+
+            start, results = ctx.Event(), ctx.Queue()
+            procs = [ctx.Process(target=_write_worker, args=(path, address, w, n_ops, start, results))
+                     for w in range(workers)]
+            for p in procs:
+                p.start()
+            t = time.perf_counter()
+            start.set()
+            outcomes = [results.get() for _ in procs]
+            elapsed = time.perf_counter() - t
+            for p in procs:
+                p.join()
+            if server is not None:
+                server.terminate()
+                server.join()
+
+            latencies = np.array([x for lat, _ in outcomes for x in lat])
+            errors = sum(e for _, e in outcomes)
+            print(f"{workers:>2} workers, {mode:<11}: {len(latencies) / elapsed:8.0f} writes/s, "
+                  f"p50 {np.percentile(latencies, 50) * 1000:6.1f} ms, "
+                  f"p99 {np.percentile(latencies, 99) * 1000:7.1f} ms, {errors} failed")
+            for suffix in ("", "-wal", "-shm", ".sock"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+
+def _wallet_worker(path, mode, worker, n_ops, hot, start, results):
+    """Alternate a top-up and a 1-credit wallet payment on one of `hot` shared accounts"""
+    conn = _connect_row(path)
+    cur = conn.cursor()
+    user_id = worker % hot + 1
+    latencies = []
+    start.wait()
+    for i in range(n_ops):
+        t = time.perf_counter()
+        cur.execute("BEGIN IMMEDIATE")
+        if mode == "ledger":
+            if i % 2:
+                if ledger.balance(cur, ledger.wallet(user_id)) >= 1:
+                    ledger.transfer(cur, ledger.wallet(user_id), ledger.REVENUE, 1, "Bench payment")
+            else:
+                operations.top_up(conn, user_id, 2, "Bench")
+        else:
+            # What top-up and payment did before the ledger: update two balance rows in place
+            if i % 2:
+                cur.execute("UPDATE bank SET balance = balance - 1 WHERE user_id=? AND balance >= 1", (user_id,))
+            else:
+                cur.execute("UPDATE user_bank_acc SET bank_balance = bank_balance - 2 WHERE user_id=? "
+                            "AND bank_balance >= 2", (user_id,))
+                cur.execute("UPDATE bank SET balance = balance + 2 WHERE user_id=?", (user_id,))
+                cur.execute("INSERT INTO transactions (user_id, bank_name, amount, date, status) "
+                            "VALUES (?, 'Bench', 2, '', 'SUCCESS')", (user_id,))
+        conn.commit()
+        latencies.append(time.perf_counter() - t)
+        if mode == "ledger" and worker == 0 and i % 50 == 49:
+            # Stands in for the periodic snapshot job
+            ledger.take_snapshot(conn)
+            conn.commit()
+    conn.close()
+    results.put(latencies)
+
+
+def bench_ledger():
+    print_header("WALLET LEDGER (8 workers x 500 writes on 4 hot accounts)")
+    workers, n_ops, hot = 8, 500, 4
+    ctx = multiprocessing.get_context("fork")
+    for mode in ("rows", "ledger"):
+        conn, path = temp_db()
+        cur = conn.cursor()
+        cur.executemany("INSERT INTO bank (user_id, balance) VALUES (?, 0)", [(u,) for u in range(1, hot + 1)])
+        cur.executemany("INSERT INTO user_bank_acc (user_id, bank_balance) VALUES (?, 1000000)",
+                        [(u,) for u in range(1, hot + 1)])
+        ledger.open_missing_accounts(cur)
+        conn.commit()
+        start, results = ctx.Event(), ctx.Queue()
+        procs = [ctx.Process(target=_wallet_worker, args=(path, mode, w, n_ops, hot, start, results))
+                 for w in range(workers)]
+        for p in procs:
+            p.start()
+        t = time.perf_counter()
+        start.set()
+        latencies = np.array([x for _ in procs for x in results.get()])
+        elapsed = time.perf_counter() - t
+        for p in procs:
+            p.join()
+        print(f"{mode:<6}: {len(latencies) / elapsed:6.0f} writes/s, p50 {np.percentile(latencies, 50) * 1000:5.2f} ms, "
+              f"p99 {np.percentile(latencies, 99) * 1000:6.2f} ms")
+
+        if mode == "ledger":
+            assert ledger.verify(cur) == []
+            account = ledger.wallet(1)
+            cur.execute("SELECT COUNT(*) FROM ledger_entries WHERE account=?", (account,))
+            tail = cur.fetchone()[0]
+            t = time_call(lambda: ledger.balance(cur, account), repeat=200)
+            print(f"Balance read, {tail} entries in the account: {t * 1e6:.0f} us")
+            t = time.perf_counter()
+            ledger.take_snapshot(conn)
+            conn.commit()
+            print(f"Snapshot of every account: {(time.perf_counter() - t) * 1000:.1f} ms")
+            t = time_call(lambda: ledger.balance(cur, account), repeat=200)
+            print(f"Balance read after snapshot: {t * 1e6:.0f} us")
+            t = time_call(lambda: ledger.verify(cur), repeat=5)
+            print(f"Verify: {t * 1000:.1f} ms")
+        conn.close()
+        os.remove(path)
+
+
+def _checkout_threads(path, mode, bank, request_threads, n_checkouts):
+    """`request_threads` web threads each run checkouts; returns request latencies and the elapsed time"""
+    writes = writer.LocalWriter(lambda: _connect_row(path))
+    pool = payqueue.WorkerPool(writes, bank, workers=16, poll_interval=0.01)
+    rids = [writes.call("create_booking", user_id=1, room_id=1,
+                        date=(date(2030, 1, 1) + timedelta(days=i)).isoformat(),
+                        start_time="09:00 AM", end_time="10:00 AM")["reservation_id"] for i in range(n_checkouts)]
+    latencies = []
+    lock = threading.Lock()
+
+    def web_thread(mine):
+        for rid in mine:
+            t = time.perf_counter()
+            if mode == "sync":
+                # What checkout would do with a real bank: call it inside the request
+                reference = bank.charge({"id": rid})
+                writes.call("pay_booking", user_id=1, reservation_id=rid, payment_method="Online Banking",
+                            transaction_id=reference)
+            else:
+                writes.call("queue_payment", user_id=1, reservation_id=rid, payment_method="Online Banking")
+                pool.wake()
+            with lock:
+                latencies.append(time.perf_counter() - t)
+
+    if mode == "queued":
+        pool.start()
+    t = time.perf_counter()
+    threads = [threading.Thread(target=web_thread, args=(rids[n::request_threads],)) for n in range(request_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    requests_done = time.perf_counter() - t
+    while mode == "queued" and pool.processed < n_checkouts:
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - t
+    pool.stop()
+    return np.array(latencies), requests_done, elapsed
+
+
+def bench_payqueue():
+    print_header("CHECKOUT: BANK CALL IN THE REQUEST vs PAYMENT QUEUE (300 checkouts, 8 web threads)")
+    n_checkouts, request_threads = 300, 8
+    for latency in (0.05, 0.2):
+        for mode in ("sync", "queued"):
+            conn, path = temp_db()
+            conn.execute("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES ('Bench', 4, 10, 'available')")
+            ledger.open_account(conn.cursor(), 1, 0, 1000000)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.commit()
+            latencies, requests_done, elapsed = _checkout_threads(
+                path, mode, payqueue.LocalBank(latency=latency), request_threads, n_checkouts)
+            cur = conn.cursor()
+            cur.execute("SELECT COUNT(*) FROM reservations WHERE status='Confirmed'")
+            assert cur.fetchone()[0] == n_checkouts
+            print(f"bank {latency * 1000:3.0f} ms, {mode:<6}: requests p50 {np.percentile(latencies, 50) * 1000:6.1f} ms, "
+                  f"p90 {np.percentile(latencies, 90) * 1000:6.1f} ms, p99 {np.percentile(latencies, 99) * 1000:6.1f} ms, {n_checkouts / requests_done:6.0f} requests/s, "
+                  f"{n_checkouts / elapsed:5.0f} confirmed/s")
+            conn.close()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+
+def bench_events():
+    print_header("CHANGE FEED: POLL AND DIFF vs OUTBOX CURSOR (100 changes per round)")
+    changes = 100
+    for n_rows in (10000, 100000):
+        conn, path = temp_db()
+        cur = conn.cursor()
+        cur.execute("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES ('Bench', 4, 10, 'available')")
+        rows = [(1, 1, (date(2030, 1, 1) + timedelta(days=n // 10)).isoformat(), "09:00 AM", "10:00 AM", "Confirmed")
+                for n in range(n_rows // 2)]
+        insert = "INSERT INTO reservations (user_id, room_id, date, start_time, end_time, status) VALUES (?, ?, ?, ?, ?, ?)"
+        t = time.perf_counter()
+        cur.executemany(insert, rows)
+        conn.commit()
+        with_triggers = time.perf_counter() - t
+        cur.execute("DROP TRIGGER events_reservations_created")
+        t = time.perf_counter()
+        cur.executemany(insert, rows)
+        conn.commit()
+        without = time.perf_counter() - t
+        events.install_triggers(cur)
+        conn.commit()
+        print(f"{len(rows):>6} inserts: {with_triggers * 1000:6.0f} ms with the outbox trigger, {without * 1000:6.0f} ms without")
+
+        snapshot = {row[0]: tuple(row[1:]) for row in conn.execute("SELECT id, status, updated_at FROM reservations")}
+        round_no = [0]
+
+        def change():
+            round_no[0] += 1
+            cur.executemany("UPDATE reservations SET updated_at=? WHERE id=?",
+                            [(f"round {round_no[0]}", rid) for rid in range(round_no[0], round_no[0] + changes * 97, 97)])
+            conn.commit()
+
+        def poll_and_diff():
+            seen = {row[0]: tuple(row[1:]) for row in conn.execute("SELECT id, status, updated_at FROM reservations")}
+            diff = [rid for rid, value in seen.items() if snapshot.get(rid) != value]
+            snapshot.update(seen)
+            assert len(diff) == changes
+
+        def cursor():
+            assert events.consume(conn, "bench", lambda conn, batch: None) == changes
+        for name, read in (("poll and diff", poll_and_diff), ("outbox cursor", cursor)):
+            events.consume(conn, "bench", lambda conn, batch: None, batch_size=100000)
+            samples = []
+            for _ in range(10):
+                change()
+                t = time.perf_counter()
+                read()
+                samples.append(time.perf_counter() - t)
+            print(f"{n_rows:>6} rows, {name}: {np.median(samples) * 1000:7.2f} ms per round")
+        conn.close()
+        os.remove(path)
+
+
+class _ConnectionPerMessage:
+    """Mailer stand-in that opens a new SMTP connection for every message"""
+
+    def __init__(self, port):
+        self.port = port
+        self.sender = notify.SENDER
+
+    def send(self, messages):
+        results = {}
+        for message_id, message in messages:
+            mailer = notify.Mailer("localhost", self.port)
+            results.update(mailer.send([(message_id, message)])[0])
+            mailer.close()
+        return results, None
+
+
+def bench_notify():
+    print_header("NOTIFICATIONS: SMTP DELIVERY AND REMINDER SELECTION")
+    n_messages = 2000
+    sink = notify.Sink().start()
+    for name, make_mailer, batch_size in (("connection per message", lambda: _ConnectionPerMessage(sink.port), 1),
+                                          ("reused connection, batch 100", lambda: notify.Mailer("localhost", sink.port), 100)):
+        conn, path = temp_db()
+        conn.executemany("INSERT INTO notifications (user_id, reservation_id, kind, recipient, subject, body) "
+                         "VALUES (1, ?, 'confirmed', 'pat@example.com', 'Booking confirmed', 'Hello')",
+                         [(n,) for n in range(n_messages)])
+        conn.commit()
+        mailer = make_mailer()
+        t = time.perf_counter()
+        totals = notify.deliver(conn, mailer, batch_size=batch_size)
+        elapsed = time.perf_counter() - t
+        assert totals["sent"] == n_messages
+        print(f"{name:<30}: {n_messages / elapsed:6.0f} messages/s")
+        if hasattr(mailer, "close"):
+            mailer.close()
+        conn.close()
+        os.remove(path)
+    sink.stop()
+
+    n_users, per_user = 1000, 50
+    conn, path = temp_db()
+    cur = conn.cursor()
+    cur.execute("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES ('Bench', 4, 10, 'available')")
+    cur.executemany("INSERT INTO users (name, email, username, password, role) VALUES (?, ?, ?, 'x', 'student')",
+                    [(f"User {u}", f"u{u}@example.com", f"u{u}") for u in range(n_users)])
+    slots = [label for label in timeslots.grid().start_labels]
+    rng = np.random.default_rng(1)
+    days, starts = rng.integers(0, 60, n_users * per_user), rng.integers(0, len(slots), n_users * per_user)
+    cur.executemany("INSERT INTO reservations (user_id, room_id, date, start_time, end_time, status) "
+                    "VALUES (?, 1, ?, ?, ?, 'Confirmed')",
+                    [(n // per_user + 1, (date(2030, 1, 1) + timedelta(days=int(days[n]))).isoformat(),
+                      slots[starts[n]], slots[starts[n]]) for n in range(n_users * per_user)])
+    conn.commit()
+    cur.execute("ANALYZE")
+    now = datetime(2030, 1, 20, 9, 0)
+
+    def per_user_scan():
+        due = []
+        window_end = now + timedelta(minutes=notify.REMINDER_MINUTES)
+        for (user_id,) in conn.execute("SELECT id FROM users").fetchall():
+            for row in conn.execute("SELECT id, date, start_time FROM reservations WHERE user_id=? AND status='Confirmed'",
+                                    (user_id,)):
+                starts = datetime.strptime(f"{row[1]} {row[2]}", "%Y-%m-%d %I:%M %p")
+                if now < starts <= window_end:
+                    due.append(row[0])
+        return due
+
+    def range_query():
+        with timeslots.frozen_time(now):
+            queued = notify.queue_reminders(conn)
+        conn.execute("DELETE FROM notifications")
+        conn.commit()
+        return queued
+    due = len(per_user_scan())
+    assert range_query() == due
+    print(f"{n_users * per_user} confirmed bookings, {due} due within {notify.REMINDER_MINUTES} min:")
+    print(f"  per-user scan:       {time_call(per_user_scan, repeat=1) * 1000:8.1f} ms per tick")
+    print(f"  one range query:     {time_call(range_query, repeat=20) * 1000:8.1f} ms per tick (queueing included)")
+    conn.close()
+    os.remove(path)
+
+
+def bench_waitlist():
+    print_header("WAITLIST: CANCELLATION LATENCY AS WAITLISTS GROW")
+    print("cancel + promote, rolled back each time (the freed slot has one waiter who fits):")
+    for n_waiting in (1000, 10000, 100000):
+        conn, path = temp_db()
+        cur = conn.cursor()
+        cur.executemany("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES (?, 4, 10, 'available')",
+                        [(f"Room {n}",) for n in range(20)])
+        cur.executemany("INSERT INTO users (name, email, username, password, role) VALUES (?, ?, ?, 'x', 'student')",
+                        [(f"User {u}", f"u{u}@example.com", f"u{u}") for u in range(2)])
+        ledger.open_account(cur, 1, 100, 0)
+        slots = timeslots.grid().start_labels
+        rng = np.random.default_rng(1)
+        rooms, days, starts = (rng.integers(2, 21, n_waiting), rng.integers(0, 60, n_waiting),
+                               rng.integers(0, len(slots) - 1, n_waiting))
+        # Everyone else waits for other rooms
+        cur.executemany("INSERT INTO waitlist (user_id, room_id, date, start_time, end_time, created_at) "
+                        "VALUES (2, ?, ?, ?, ?, '2030-01-01 00:00:00')",
+                        [(int(rooms[n]), (date(2030, 1, 1) + timedelta(days=int(days[n]))).isoformat(),
+                          slots[starts[n]], slots[starts[n] + 1]) for n in range(n_waiting)])
+        conn.commit()
+        with timeslots.frozen_time(datetime(2030, 1, 6, 12, 0)):
+            rid = operations.create_booking(conn, 1, 1, "2030-01-07", "09:00 AM", "10:00 AM")["reservation_id"]
+            operations.pay_booking(conn, 1, rid, "System Balance")
+            waitlist.join(conn, 2, 1, "2030-01-07", "09:00 AM", "10:00 AM")
+            conn.commit()
+            cur.execute("ANALYZE")
+
+            def cancel():
+                operations.cancel_booking(conn, 1, rid)
+                conn.rollback()
+            indexed = time_call(cancel, repeat=50)
+            cur.execute("DROP INDEX idx_waitlist_waiting")
+            scanned = time_call(cancel, repeat=10)
+        print(f"  {n_waiting:>7} waiting: {indexed * 1000:6.2f} ms with the partial index, "
+              f"{scanned * 1000:6.2f} ms scanning the table")
+        conn.close()
+        os.remove(path)
+
+
+def bench_livefeed():
+    print_header("LIVE AVAILABILITY: IDLE STREAMS VS PAGE REFRESHES")
+    n_rooms, refresh_seconds, idle_seconds = 50, 10, 3
+    conn, path = temp_db()
+    cur = conn.cursor()
+    cur.executemany("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES (?, 4, 10, 'available')",
+                    [(f"Room {n}",) for n in range(n_rooms)])
+    cur.execute("INSERT INTO users (name, email, username, password, role) VALUES ('Pat', NULL, 'pat', 'x', 'student')")
+    ledger.open_account(cur, 1, 100, 0)
+    conn.commit()
+
+    def connect():
+        db = sqlite3.connect(path)
+        db.row_factory = sqlite3.Row
+        return db
+    reload_ms = time_call(lambda: livefeed.day_slots(cur, 1, "2030-01-07"), repeat=200) * 1000
+    for n_subscribers in (1000, 5000):
+        broker = livefeed.Broker(connect).start()
+        subscribers = [broker.subscribe(n % n_rooms + 1, "2030-01-07")[0] for n in range(n_subscribers)]
+        # Each stream's thread parks in take() between heartbeats, as in the app
+        woken = threading.Barrier(n_subscribers // n_rooms + 1)
+        streams = [threading.Thread(target=lambda s=s: s.take(60) and s.topic[0] == 1 and woken.wait(), daemon=True)
+                   for s in subscribers]
+        for thread in streams:
+            thread.start()
+        cpu = time.process_time()
+        time.sleep(idle_seconds)
+        idle_cpu = (time.process_time() - cpu) / idle_seconds * 100
+
+        t = time.perf_counter()
+        with timeslots.frozen_time(datetime(2030, 1, 6, 12, 0)):
+            operations.create_booking(conn, 1, 1, "2030-01-07", "09:00 AM", "10:00 AM")
+            conn.commit()
+            woken.wait()
+        fanout_ms = (time.perf_counter() - t) * 1000
+        conn.execute("DELETE FROM reservations")
+        conn.commit()
+        for subscriber in subscribers:
+            broker.unsubscribe(subscriber)
+        for thread in streams:
+            thread.join()
+        broker.stop()
+        print(f"{n_subscribers} idle streams on {n_rooms} room days:")
+        print(f"  broker while idle:      {idle_cpu:6.1f}% of a core")
+        print(f"  booking -> {n_subscribers // n_rooms} pages:     {fanout_ms:6.1f} ms (poll interval {livefeed.POLL_SECONDS * 1000:.0f} ms)")
+        print(f"  refreshing every {refresh_seconds}s:   {n_subscribers / refresh_seconds * reload_ms / 10:6.1f}% of a core "
+              f"({n_subscribers / refresh_seconds:.0f} day reloads/s at {reload_ms:.2f} ms, page rendering not counted)")
+    conn.close()
+    os.remove(path)
+
+
+BENCHMARKS = {
+    "pricing": bench_pricing,
+    "availability": bench_availability,
+    "recurring": bench_recurring,
+    "bulk": bench_bulk,
+    "rehome": bench_rehome,
+    "defrag": bench_defrag,
+    "lottery": bench_lottery,
+    "ratelimit": bench_ratelimit,
+    "writer": bench_writer,
+    "ledger": bench_ledger,
+    "payqueue": bench_payqueue,
+    "events": bench_events,
+    "notify": bench_notify,
+    "waitlist": bench_waitlist,
+    "livefeed": bench_livefeed,
+}
+
+
+def main():
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark '{name}'. Choose from: {', '.join(BENCHMARKS)}")
+            sys.exit(1)
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Bulk booking operations for librarians.
+A selection of reservations is confirmed, cancelled or deleted with a
+handful of set-based statements over a JSON id list (json_each), instead
+of one round trip per booking. Cancelling or deleting refunds completed
+payments with one ledger transfer per user, not per booking; each window
+they free then goes to the waitlist (waitlist.promote). Everything runs
+in one transaction; the caller commits.
+"""
+
+import json
+
+import availability
+import holds
+import inventory
+import ledger
+import timeslots
+import waitlist
+
+ACTIONS = ("confirm", "cancel", "delete")
+
+_IDS = "(SELECT value FROM json_each(?))"
+_BLOCKING = "(" + ",".join(f"'{s}'" for s in availability.BLOCKING_STATUSES) + ")"
+
+
+def refund_payments(cur, reservation_ids_json):
+    """
+    Refund the completed payments of the given Pending/Confirmed
+    reservations into the users' wallets. Returns {user_id: amount}.
+    """
+    cur.execute(f"""
+        SELECT p.user_id, SUM(p.amount) AS total
+        FROM payments p JOIN reservations r ON r.id = p.reservation_id
+        WHERE p.reservation_id IN {_IDS} AND p.status='completed' AND r.status IN {_BLOCKING}
+        GROUP BY p.user_id
+    """, (reservation_ids_json,))
+    refunds = {row["user_id"]: row["total"] for row in cur.fetchall() if row["total"]}
+    ledger.transfer_many(cur, [(ledger.REVENUE, ledger.wallet(user_id), total, "Booking refund", None)
+                               for user_id, total in refunds.items()])
+    cur.execute(f"""
+        UPDATE payments SET status='refunded'
+        WHERE reservation_id IN {_IDS} AND status='completed'
+        AND reservation_id IN (SELECT id FROM reservations WHERE status IN {_BLOCKING})
+    """, (reservation_ids_json,))
+    return refunds
+
+
+def delete_reservations(cur, reservation_ids_json):
+    """
+    Remove the given reservations with their payments, payment jobs and equipment links, refunding
+    completed payments first (refund_payments). A queued or processing job the bank has already
+    charged (charged_reference) is kept: the worker that settles it finds the booking gone, fails
+    the job and refunds the charge. Returns (deleted count, {user_id: amount refunded}).
+    """
+    inventory.release_many(cur, reservation_ids_json)
+    refunds = refund_payments(cur, reservation_ids_json)
+    cur.execute(f"DELETE FROM payments WHERE reservation_id IN {_IDS}", (reservation_ids_json,))
+    cur.execute(f"""
+        DELETE FROM payment_jobs WHERE reservation_id IN {_IDS}
+        AND NOT (status IN ('queued', 'processing') AND charged_reference IS NOT NULL)
+    """, (reservation_ids_json,))
+    cur.execute(f"DELETE FROM reservation_equipment WHERE reservation_id IN {_IDS}", (reservation_ids_json,))
+    cur.execute(f"DELETE FROM reservations WHERE id IN {_IDS}", (reservation_ids_json,))
+    return cur.rowcount, refunds
+
+
+def _confirm(cur, ids_json, now):
+    """
+    Confirm the selected Pending bookings whose window is still free of other bookings, one at a
+    time so overlapping selections cannot both win. A lapsed hold is confirmed if nobody took its
+    slot, as when it is paid; one whose slot was rebooked is expired with the other lapsed holds on
+    its day. Returns (confirmed count, ids of the selected bookings not confirmed).
+    """
+    cur.execute(f"""
+        SELECT id, room_id, date, start_time, end_time FROM reservations
+        WHERE id IN {_IDS} AND status='Pending' ORDER BY id
+    """, (ids_json,))
+    rows = cur.fetchall()
+    confirmed = []
+    for row in rows:
+        try:
+            availability.check_window(cur, row["room_id"], row["date"], row["start_time"], row["end_time"],
+                                      exclude_id=row["id"])
+        except ValueError:
+            continue
+        cur.execute("UPDATE reservations SET status='Confirmed', held_until=NULL, updated_at=? WHERE id=?",
+                    (now, row["id"]))
+        confirmed.append(row["id"])
+    for room_id, date in dict.fromkeys((row["room_id"], row["date"]) for row in rows):
+        holds.expire_for_window(cur, room_id, date)
+    return len(confirmed), sorted(set(json.loads(ids_json)) - set(confirmed))
+
+
+def bulk_update(conn, action, reservation_ids):
+    """
+    Apply action to every selected reservation:
+      confirm - Pending bookings become Confirmed, unless their hold lapsed and their window
+                has been taken since
+      cancel  - Pending/Confirmed bookings are cancelled, equipment released, payments refunded
+      delete  - completed payments are refunded as for cancel, then bookings are removed with their
+                payments, payment jobs and equipment links (delete_reservations)
+    Returns a summary dict (with how many waiters got a freed window and, for confirm, the ids
+    left unconfirmed); the caller commits.
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown bulk action '{action}'")
+    try:
+        ids = sorted({int(i) for i in reservation_ids})
+    except (TypeError, ValueError):
+        raise ValueError("Invalid booking selection")
+    if not ids:
+        raise ValueError("No bookings selected")
+    ids_json = json.dumps(ids)
+
+    cur = conn.cursor()
+    if not conn.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")
+    now = timeslots.timestamp()
+    refunds = {}
+    freed = []
+    skipped_ids = []
+    if action != "confirm":
+        cur.execute(f"""
+            SELECT DISTINCT room_id, date, start_time, end_time FROM reservations
+            WHERE id IN {_IDS} AND status IN {_BLOCKING}
+        """, (ids_json,))
+        freed = [tuple(row) for row in cur.fetchall()]
+
+    if action == "confirm":
+        changed, skipped_ids = _confirm(cur, ids_json, now)
+    elif action == "cancel":
+        inventory.release_many(cur, ids_json)
+        refunds = refund_payments(cur, ids_json)
+        cur.execute(f"""
+            UPDATE reservations SET status='Cancelled', held_until=NULL, updated_at=?
+            WHERE id IN {_IDS} AND status IN {_BLOCKING}
+        """, (now, ids_json))
+        changed = cur.rowcount
+    else:
+        changed, refunds = delete_reservations(cur, ids_json)
+    promoted = sum(len(waitlist.promote(conn, *window)) for window in freed)
+
+    return {
+        "action": action,
+        "selected": len(ids),
+        "changed": changed,
+        "skipped": len(ids) - changed,
+        "skipped_ids": skipped_ids,
+        "refunds": refunds,
+        "refunded": round(sum(refunds.values()), 2),
+        "promoted": promoted,
+    }
@@ -0,0 +1,162 @@
+"""
+Day-level schedule defragmentation.
+Scattered one-hour bookings leave every room with short gaps and none free
+for a long block. For one date this optimizer lifts the movable bookings
+(reservations.movable = 1) off the occupancy matrix and places them back
+one by one, in start order, with a packing heuristic: among the rooms that
+are free and big enough, prefer the one whose neighbouring slots are
+already taken (so gaps close up), then the busiest room (so bookings
+collect in fewer rooms), then the smallest room. A second pass sends
+bookings back to their own room wherever that costs no long free block,
+so only moves that help are kept. Fixed bookings, opening hours and
+closures stay where they are.
+
+The plan is only worth applying if it leaves more rooms with a free block
+of at least min_block slots; otherwise no moves are returned. Move lines
+use the rehome.py format, so rehome.apply_moves() applies them.
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+import availability
+import rehome
+import timeslots
+
+
+def longest_free_runs(busy):
+    """Longest run of free slots per room (one pass over the columns)"""
+    run = np.zeros(busy.shape[0], dtype=np.int64)
+    best = np.zeros(busy.shape[0], dtype=np.int64)
+    for column in (~busy).T:
+        run = (run + 1) * column
+        np.maximum(best, run, out=best)
+    return best
+
+
+def block_stats(busy, min_block):
+    """Summary of how fragmented a day is"""
+    runs = longest_free_runs(busy)
+    return {
+        "rooms_with_block": int((runs >= min_block).sum()),
+        "longest_block": int(runs.max()) if len(runs) else 0,
+        "free_slots": int((~busy).sum()),
+    }
+
+
+def _day(cur, date):
+    cur.execute("SELECT id, room_name, capacity FROM rooms WHERE status='available' ORDER BY id")
+    rooms = cur.fetchall()
+    room_ids = np.array([r["id"] for r in rooms], dtype=np.int64)
+    placeholders = ",".join("?" * len(availability.BLOCKING_STATUSES))
+    cur.execute(f"""
+        SELECT r.id, r.room_id, rm.room_name, r.date, r.start_time, r.end_time, r.start_minute, r.end_minute,
+               COALESCE(r.num_people, 1) AS num_people, COALESCE(r.movable, 0) AS movable
+        FROM reservations r JOIN rooms rm ON rm.id = r.room_id
+        WHERE r.date=? AND r.status IN ({placeholders}) AND rm.status='available'
+        AND r.start_minute IS NOT NULL AND r.end_minute IS NOT NULL
+    """, (date, *availability.BLOCKING_STATUSES))
+    return rooms, room_ids, [dict(row) for row in cur.fetchall()]
+
+
+def plan_defrag(cur, date, min_block=3):
+    """
+    Move plan for one date: {date, min_block, before, after, moves}.
+    min_block is in grid slots. Nothing is written.
+    """
+    grid = timeslots.grid()
+    weekday = datetime.strptime(date, "%Y-%m-%d").weekday()
+    rooms, room_ids, bookings = _day(cur, date)
+    empty = {"rooms_with_block": 0, "longest_block": 0, "free_slots": 0}
+    plan = {"date": date, "min_block": min_block, "before": empty, "after": empty, "moves": []}
+    if not len(room_ids):
+        return plan
+
+    opens, closes = availability.room_hours(cur, room_ids, weekday, grid, date)
+    capacity = np.array([r["capacity"] or 0 for r in rooms], dtype=np.int64)
+    names = {r["id"]: r["room_name"] for r in rooms}
+    rows = np.searchsorted(room_ids, [b["room_id"] for b in bookings]).astype(np.int64)
+    starts = np.array([b["start_minute"] for b in bookings], dtype=np.int64)
+    ends = np.array([b["end_minute"] for b in bookings], dtype=np.int64)
+    movable = np.array([bool(b["movable"]) for b in bookings], dtype=bool)
+
+    before = availability.occupancy_matrix(grid, opens, closes, rows, starts, ends)
+    busy = availability.occupancy_matrix(grid, opens, closes, rows[~movable], starts[~movable], ends[~movable])
+    plan["before"] = block_stats(before, min_block)
+
+    # Edges of the day count as taken, so packing against them is preferred
+    edge = np.ones(len(room_ids), dtype=bool)
+    load = busy.sum(axis=1)
+    occupancy = availability.DayOccupancy(room_ids, busy, grid)
+    lifted = sorted((b for b, m in zip(bookings, movable) if m),
+                    key=lambda b: (b["start_minute"], b["start_minute"] - b["end_minute"], b["id"]))
+    placement = {}
+    for b in lifted:
+        first, last = occupancy.span(b["start_minute"], b["end_minute"])
+        original = int(np.searchsorted(room_ids, b["room_id"]))
+        if first >= last:
+            placement[b["id"]] = original   # entirely outside the grid, nothing to pack
+            continue
+        fits = ~busy[:, first:last].any(axis=1) & (capacity >= b["num_people"])
+        if not fits.any():
+            # Nothing big enough is free: stay put if an earlier move left the room free, else give up
+            fits[original] = not busy[original, first:last].any()
+            if not fits.any():
+                return dict(plan, after=plan["before"])
+        left = busy[:, first - 1] if first > 0 else edge
+        right = busy[:, last] if last < grid.n_slots else edge
+        touching = left.astype(np.int64) + right
+        candidates = np.flatnonzero(fits)
+        # lexsort: last key is primary
+        order = np.lexsort((capacity[candidates], candidates != original, -load[candidates], -touching[candidates]))
+        row = int(candidates[order[0]])
+        busy[row, first:last] = True
+        load[row] += last - first
+        placement[b["id"]] = row
+
+    # Undo moves that did not help: send a booking home if its room is still
+    # free then and neither room loses its long free block by it
+    for b in lifted:
+        row, original = placement[b["id"]], int(np.searchsorted(room_ids, b["room_id"]))
+        first, last = occupancy.span(b["start_minute"], b["end_minute"])
+        if row == original or busy[original, first:last].any():
+            continue
+        pair = [row, original]
+        had = (longest_free_runs(busy[pair]) >= min_block).sum()
+        busy[row, first:last], busy[original, first:last] = False, True
+        if (longest_free_runs(busy[pair]) >= min_block).sum() < had:
+            busy[row, first:last], busy[original, first:last] = True, False
+        else:
+            placement[b["id"]] = original
+
+    plan["after"] = block_stats(busy, min_block)
+    if (plan["after"]["rooms_with_block"], plan["after"]["longest_block"]) <= \
+            (plan["before"]["rooms_with_block"], plan["before"]["longest_block"]):
+        plan["after"] = plan["before"]
+        return plan
+
+    for b in lifted:
+        to_room = int(room_ids[placement[b["id"]]])
+        if to_room != b["room_id"]:
+            plan["moves"].append({
+                "id": b["id"], "date": date, "start_time": b["start_time"], "end_time": b["end_time"],
+                "num_people": b["num_people"], "from_room": b["room_id"], "from_room_name": b["room_name"],
+                "to_room": to_room, "to_room_name": names[to_room], "status": "moved", "reason": "",
+            })
+    return plan
+
+
+def defragment(conn, date, min_block=3, apply=False):
+    """Plan (and with apply=True, apply) a defragmentation under one write lock; the caller commits"""
+    try:
+        datetime.strptime(date, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        raise ValueError("Invalid date")
+    cur = conn.cursor()
+    if apply and not conn.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")
+    plan = plan_defrag(cur, date, int(min_block))
+    if apply:
+        rehome.apply_moves(cur, plan["moves"])
+    return plan
@@ -0,0 +1,217 @@
+"""
+Transactional outbox of data changes.
+Triggers on reservations, payments, rooms and bank (and on ledger_entries
+for wallet movements, since bank.balance no longer changes) append a row
+to `events` for every insert, update and delete, inside the same
+transaction as the change: an event exists exactly when its change was
+committed. Each event has a seq (increasing in commit order, because
+SQLite runs one write transaction at a time), a type such as
+'reservation.updated', the entity's id and a JSON payload of the row
+(the new row; the old one for deletes; updates also carry old_status,
+and reservation updates the old room_id and date as old_room_id/old_date).
+
+A consumer keeps its position in event_cursors (from the first event, or
+from the end of the outbox when started with subscribe()) and reads the events
+after it through the seq primary key, so catching up costs O(new events)
+however big the tables are. consume() hands each batch to a handler and
+moves the cursor in one transaction: a handler that writes to this
+database gets exactly-once effects, anything external at-least-once.
+
+Events every consumer has read are purged after RETENTION_DAYS, in
+batches of PURGE_BATCH (the app's scheduler does this nightly).
+
+    python events.py                # consumers and how far behind they are
+    python events.py tail [N]       # the last N events
+"""
+
+import json
+import os
+import sqlite3
+import sys
+from datetime import timedelta
+
+import timeslots
+
+BATCH_SIZE = 500
+RETENTION_DAYS = 7
+PURGE_BATCH = 1000
+
+# table -> (event prefix, id column, columns left out of the payload)
+TRACKED = {
+    "reservations": ("reservation", "id", ()),
+    "payments": ("payment", "id", ("account_number", "account_holder")),
+    "rooms": ("room", "id", ()),
+    "bank": ("wallet", "user_id", ()),
+}
+_NOW_SQL = "strftime('%Y-%m-%d %H:%M:%S', 'now', '+8 hours')"    # Malaysia time, as timeslots.timestamp()
+
+_WALLET_ENTRY_SQL = f"""CREATE TRIGGER events_ledger_entries_wallet AFTER INSERT ON ledger_entries
+        WHEN NEW.account LIKE 'wallet:%'
+        BEGIN
+            INSERT INTO events (type, entity_id, payload, created_at)
+            VALUES ('wallet.entry', CAST(substr(NEW.account, 8) AS INTEGER),
+                    json_object('txn', NEW.txn, 'amount', NEW.amount, 'memo', NEW.memo,
+                                'reference', NEW.reference),
+                    {_NOW_SQL});
+        END"""
+
+
+def _payload_sql(cur, table, row, excluded):
+    cur.execute(f"PRAGMA table_info({table})")
+    pairs = [f"'{col[1]}', {row}.{col[1]}" for col in cur.fetchall() if col[1] not in excluded]
+    return f"json_object({', '.join(pairs)})"
+
+
+def _trigger_sql(cur, table):
+    prefix, id_column, excluded = TRACKED[table]
+    statements = {}
+    for action, row, verb in (("INSERT", "NEW", "created"), ("UPDATE", "NEW", "updated"), ("DELETE", "OLD", "deleted")):
+        payload = _payload_sql(cur, table, row, excluded)
+        if action == "UPDATE" and table == "reservations":
+            payload = (f"json_set({payload}, '$.old_status', OLD.status, '$.old_room_id', OLD.room_id, "
+                       f"'$.old_date', OLD.date)")
+        elif action == "UPDATE" and table == "payments":
+            payload = f"json_set({payload}, '$.old_status', OLD.status)"
+        name = f"events_{table}_{verb}"
+        statements[name] = f"""CREATE TRIGGER {name} AFTER {action} ON {table}
+            BEGIN
+                INSERT INTO events (type, entity_id, payload, created_at)
+                VALUES ('{prefix}.{verb}', {row}.{id_column}, {payload}, {_NOW_SQL});
+            END"""
+    return statements
+
+
+def install_triggers(cur):
+    """Create the outbox triggers, rebuilding any whose table gained columns since (part of ensure_schema)"""
+    wanted = {}
+    for table in TRACKED:
+        wanted.update(_trigger_sql(cur, table))
+    wanted["events_ledger_entries_wallet"] = _WALLET_ENTRY_SQL
+    cur.execute("SELECT name, sql FROM sqlite_master WHERE type='trigger' AND name LIKE 'events\\_%' ESCAPE '\\'")
+    existing = dict(cur.fetchall())
+    for name, sql in wanted.items():
+        if existing.get(name) != sql:
+            cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cur.execute(sql)
+
+
+def _event(row):
+    return {"seq": row[0], "type": row[1], "entity_id": row[2], "payload": json.loads(row[3]),
+            "created_at": row[4]}
+
+
+def read(cur, after_seq=0, limit=BATCH_SIZE, types=None):
+    """Up to `limit` events after after_seq, oldest first; types limits it to some event types"""
+    query = "SELECT seq, type, entity_id, payload, created_at FROM events WHERE seq > ?"
+    params = [after_seq]
+    if types:
+        query += f" AND type IN ({','.join('?' * len(types))})"
+        params += list(types)
+    cur.execute(query + " ORDER BY seq LIMIT ?", (*params, limit))
+    return [_event(row) for row in cur.fetchall()]
+
+
+def position(cur, consumer):
+    """The last seq `consumer` has processed (0 for a new consumer)"""
+    cur.execute("SELECT seq FROM event_cursors WHERE consumer=?", (consumer,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def advance(cur, consumer, seq):
+    """Move consumer's cursor to seq (the caller commits)"""
+    cur.execute("""
+        INSERT INTO event_cursors (consumer, seq, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(consumer) DO UPDATE SET seq = excluded.seq, updated_at = excluded.updated_at
+    """, (consumer, seq, timeslots.timestamp()))
+
+
+def subscribe(conn, consumer):
+    """Start a consumer that has no cursor yet at the end of the outbox, skipping past events (committed)"""
+    conn.execute("""
+        INSERT OR IGNORE INTO event_cursors (consumer, seq, updated_at)
+        SELECT ?, COALESCE(MAX(seq), 0), ? FROM events
+    """, (consumer, timeslots.timestamp()))
+    conn.commit()
+
+
+def consume(conn, consumer, handler, batch_size=BATCH_SIZE, types=None, max_batches=None):
+    """
+    Feed the events after consumer's cursor to handler(conn, events) a batch at a time,
+    advancing the cursor in the batch's transaction; returns how many events were handled.
+    If the handler raises, that batch is rolled back and the cursor stays where it was.
+    """
+    handled = batches = 0
+    while max_batches is None or batches < max_batches:
+        cur = conn.cursor()
+        if not conn.in_transaction:
+            cur.execute("BEGIN IMMEDIATE")
+        try:
+            after = position(cur, consumer)
+            # Read past filtered-out events too, so the cursor moves over them
+            events = read(cur, after, batch_size)
+            if not events:
+                conn.commit()
+                return handled
+            wanted = [event for event in events if not types or event["type"] in types]
+            if wanted:
+                handler(conn, wanted)
+            advance(cur, consumer, events[-1]["seq"])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        handled += len(wanted)
+        batches += 1
+        if len(events) < batch_size:
+            break
+    return handled
+
+
+def lag(cur):
+    """{consumer: events it has not read yet}"""
+    cur.execute("""
+        SELECT c.consumer, (SELECT COUNT(*) FROM events e WHERE e.seq > c.seq)
+        FROM event_cursors c ORDER BY c.consumer
+    """)
+    return dict(cur.fetchall())
+
+
+def purge(conn, retention_days=RETENTION_DAYS, batch_size=PURGE_BATCH):
+    """Delete events older than retention_days that every consumer has read, committing each batch; returns how many"""
+    cutoff = (timeslots.now() - timedelta(days=retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+    deleted = 0
+    while True:
+        cur = conn.cursor()
+        if not conn.in_transaction:
+            cur.execute("BEGIN IMMEDIATE")
+        cur.execute("""
+            DELETE FROM events WHERE seq IN (
+                SELECT seq FROM events
+                WHERE seq <= COALESCE((SELECT MIN(seq) FROM event_cursors), (SELECT MAX(seq) FROM events))
+                AND created_at < ?
+                ORDER BY seq LIMIT ?
+            )
+        """, (cutoff, batch_size))
+        count = cur.rowcount
+        conn.commit()
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(os.path.join(os.path.dirname(os.path.abspath(__file__)), "reservation_system.db"))
+    cur = conn.cursor()
+    if sys.argv[1:2] == ["tail"]:
+        cur.execute("SELECT COALESCE(MAX(seq), 0) FROM events")
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+        for event in read(cur, max(cur.fetchone()[0] - count, 0), count):
+            print(f" {event['seq']:>8}  {event['created_at']}  {event['type']:<22} {event['entity_id']}")
+    else:
+        behind = lag(cur)
+        if not behind:
+            print(" No consumers yet")
+        for consumer, count in behind.items():
+            print(f" {consumer:<24} {count} event(s) behind")
+    conn.close()
@@ -0,0 +1,142 @@
+"""
+Temporary slot holds for checkout, and expiry of stale Pending bookings.
+A patron booking starts as a Pending reservation held for HOLD_MINUTES
+(reservations.held_until). While the hold runs the slot is taken; once
+it lapses the slot is free again even before anything is cleaned up:
+the availability checks and the lottery's max_active count ignore
+Pending rows whose hold has passed. Paying in time clears the hold and
+confirms the booking; paying after it lapsed still works if nobody has
+taken the slot meanwhile.
+
+Lapsed holds become Expired, returning their equipment to stock:
+lazily, for the room and day being booked, just before each new booking,
+and for everything else by expire_lapsed(), in short batches.
+
+Recurring series occurrences and lottery wins are booked without a
+checkout, so they are held for PAYMENT_DEADLINE_HOURS instead
+(payment_deadline()) and lapse like any other hold. Bookings without a
+hold (CLI "Pay Later", admin, rows from before the deadlines) that are
+still Pending PENDING_MAX_HOURS after they were last changed expire the
+same way (expire_stale). Neither sweep touches a booking whose payment
+is in the queue, and both hand the windows they free to
+the waitlist (waitlist.promote). sweep() does both; the app's scheduler
+runs it every minute as job "expire_pending" and records each run's
+counts and duration in job_runs.
+
+    python holds.py      # sweep once
+"""
+
+import os
+import sqlite3
+from datetime import timedelta
+
+import inventory
+import scheduler
+import timeslots
+import waitlist
+
+HOLD_MINUTES = 10
+PENDING_MAX_HOURS = 24
+PAYMENT_DEADLINE_HOURS = 24
+SWEEP_BATCH = 200
+
+# The sweeps leave a booking alone while a payment for it is queued or being charged
+_PAYING = "id IN (SELECT reservation_id FROM payment_jobs WHERE status IN ('queued', 'processing'))"
+_NOT_PAYING = f"NOT {_PAYING}"
+# Holds that still count: append to a WHERE clause on reservations, with the current timestamp as parameter.
+# Only a Pending booking's hold can lapse; every move out of Pending clears held_until as well.
+# A lapsed hold that is being paid for still counts, since no sweep will expire it.
+ACTIVE_HOLD_SQL = f"(status != 'Pending' OR held_until IS NULL OR held_until >= ? OR {_PAYING})"
+
+
+def hold_until(minutes=HOLD_MINUTES):
+    """Timestamp a hold taken now runs until"""
+    return (timeslots.now() + timedelta(minutes=minutes)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def payment_deadline(hours=PAYMENT_DEADLINE_HOURS):
+    """held_until for a booking made without a checkout (series occurrence, lottery win)"""
+    return hold_until(minutes=hours * 60)
+
+
+def lapsed(reservation):
+    """True if a Pending reservation's hold has run out"""
+    return (reservation['status'] == 'Pending' and reservation['held_until'] is not None
+            and reservation['held_until'] < timeslots.timestamp())
+
+
+def _expire(cur, ids):
+    for reservation_id in ids:
+        inventory.release_equipment(cur, reservation_id)
+    cur.executemany("UPDATE reservations SET status='Expired', held_until=NULL, updated_at=? "
+                    "WHERE id=? AND status='Pending'",
+                    [(timeslots.timestamp(), reservation_id) for reservation_id in ids])
+    return len(ids)
+
+
+def expire_for_window(cur, room_id, date):
+    """Expire the lapsed holds on one room and day (inside the caller's write transaction)"""
+    cur.execute(f"""
+        SELECT id FROM reservations
+        WHERE date=? AND room_id=? AND status='Pending' AND held_until < ? AND {_NOT_PAYING}
+    """, (date, room_id, timeslots.timestamp()))
+    return _expire(cur, [row[0] for row in cur.fetchall()])
+
+
+def _expire_batches(conn, query, params, batch_size):
+    """
+    Expire the bookings `query` selects (id, room_id, date, start_time, end_time), batch_size
+    per transaction, promoting waiters into the freed windows, until it runs dry: (count, batches)
+    """
+    total = batches = 0
+    while True:
+        cur = conn.cursor()
+        if not conn.in_transaction:
+            cur.execute("BEGIN IMMEDIATE")
+        cur.execute(query + " LIMIT ?", (*params, batch_size))
+        rows = cur.fetchall()
+        count = _expire(cur, [row[0] for row in rows])
+        for window in dict.fromkeys(tuple(row[1:5]) for row in rows):
+            waitlist.promote(conn, *window)
+        conn.commit()
+        total += count
+        batches += 1
+        if count < batch_size:
+            return total, batches
+
+
+def expire_lapsed(conn, batch_size=SWEEP_BATCH):
+    """Expire every lapsed hold, batch_size per transaction; returns how many"""
+    return _expire_batches(conn, f"""
+        SELECT id, room_id, date, start_time, end_time FROM reservations
+        WHERE status='Pending' AND held_until < ? AND {_NOT_PAYING}
+        ORDER BY held_until
+    """, (timeslots.timestamp(),), batch_size)[0]
+
+
+def expire_stale(conn, max_age_hours=PENDING_MAX_HOURS, batch_size=SWEEP_BATCH):
+    """Expire unheld Pending bookings left unchanged for more than max_age_hours, batch_size per transaction"""
+    cutoff = (timeslots.now() - timedelta(hours=max_age_hours)).strftime("%Y-%m-%d %H:%M:%S")
+    return _expire_batches(conn, f"""
+        SELECT id, room_id, date, start_time, end_time FROM reservations
+        WHERE status='Pending' AND updated_at < ? AND held_until IS NULL AND {_NOT_PAYING}
+        ORDER BY updated_at
+    """, (cutoff,), batch_size)[0]
+
+
+def sweep(conn, max_age_hours=PENDING_MAX_HOURS, batch_size=SWEEP_BATCH):
+    """Expire lapsed holds and stale Pending bookings: {processed, lapsed, stale}"""
+    lapsed_count = expire_lapsed(conn, batch_size)
+    stale_count = expire_stale(conn, max_age_hours, batch_size)
+    return {"processed": lapsed_count + stale_count, "lapsed": lapsed_count, "stale": stale_count}
+
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(os.path.join(os.path.dirname(os.path.abspath(__file__)), "reservation_system.db"))
+    conn.row_factory = sqlite3.Row
+    result = scheduler.run_job(conn, "expire_pending", sweep, runner="cli")
+    if result is None:
+        print(" Sweep failed; see job_runs")
+    else:
+        print(f" Expired {result['lapsed']} lapsed hold(s) and {result['stale']} stale Pending booking(s)")
+    conn.close()
@@ -0,0 +1,82 @@
+"""
+Idempotency keys for patron POSTs (checkout, top-up, cancel).
+Each form carries a fresh hidden token. The first request with a token
+runs the operation and stores its result under the token in the same
+transaction, so the two commit or roll back together; a resubmission
+with the same token finds the row and gets the stored result back
+without touching anything else. Refused operations store nothing (the
+transaction rolls back), so retrying one simply asks again.
+
+Keys live for TTL_SECONDS. purge_expired() deletes old ones in small
+batches, one short transaction each, so it never holds the write lock
+for long.
+
+    python idempotency.py purge
+"""
+
+import json
+import os
+import sqlite3
+import uuid
+from datetime import timedelta
+
+import timeslots
+
+TTL_SECONDS = 24 * 3600
+PURGE_BATCH = 500
+MAX_KEY_LENGTH = 64
+
+
+def new_key():
+    """A fresh token for one form"""
+    return uuid.uuid4().hex
+
+
+def run(conn, key, user_id, operation, func, kwargs):
+    """
+    func(conn, **kwargs) once per key. A repeated key returns the stored result;
+    a key already used by another user or operation is refused. The caller commits.
+    """
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValueError("Invalid form token")
+    cur = conn.cursor()
+    if not conn.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")
+    now = timeslots.timestamp()
+    cur.execute("SELECT user_id, operation, result FROM idempotency_keys WHERE key=? AND expires_at >= ?",
+                (key, now))
+    row = cur.fetchone()
+    if row:
+        if row[0] != user_id or row[1] != operation:
+            raise ValueError("This form has already been used")
+        return json.loads(row[2])
+
+    result = func(conn, **kwargs)
+    expires = (timeslots.now() + timedelta(seconds=TTL_SECONDS)).strftime("%Y-%m-%d %H:%M:%S")
+    # REPLACE takes over an expired row with the same key
+    cur.execute("""
+        INSERT OR REPLACE INTO idempotency_keys (key, user_id, operation, result, created_at, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (key, user_id, operation, json.dumps(result), now, expires))
+    return result
+
+
+def purge_expired(conn, batch_size=PURGE_BATCH):
+    """Delete expired keys batch by batch, committing each; returns the number deleted"""
+    now = timeslots.timestamp()
+    deleted = 0
+    while True:
+        cur = conn.execute("""
+            DELETE FROM idempotency_keys WHERE key IN (
+                SELECT key FROM idempotency_keys WHERE expires_at < ? LIMIT ?)
+        """, (now, batch_size))
+        conn.commit()
+        deleted += cur.rowcount
+        if cur.rowcount < batch_size:
+            return deleted
+
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(os.path.join(os.path.dirname(os.path.abspath(__file__)), "reservation_system.db"))
+    print(f" Deleted {purge_expired(conn)} expired key(s)")
+    conn.close()
@@ -0,0 +1,147 @@
+"""
+Equipment stock.
+Every equipment item has a quantity. equipment_usage counts how many units
+are taken per (equipment, date, 15-minute block) by Pending/Confirmed
+reservations. The blocks are finer than any slot size, so counters stay
+valid when the booking grid changes.
+
+Booking increments the counters and then verifies none exceeds its
+quantity, all in the caller's transaction. The write takes SQLite's write
+lock before the check, so two bookings cannot both take the last unit. On
+ValueError the caller rolls back (or closes without committing).
+"""
+
+import timeslots
+
+BLOCK_MINUTES = min(timeslots.SLOT_SIZES)
+
+
+def usage_blocks(start_minute, end_minute):
+    """Start minutes of the blocks a window touches"""
+    return range(start_minute - start_minute % BLOCK_MINUTES, end_minute, BLOCK_MINUTES)
+
+
+def _window(cur, reservation_id):
+    cur.execute("SELECT date, start_minute, end_minute FROM reservations WHERE id=?", (reservation_id,))
+    row = cur.fetchone()
+    if not row or row["start_minute"] is None or row["end_minute"] is None:
+        return None
+    return row["date"], row["start_minute"], row["end_minute"]
+
+
+def _linked_counts(cur, reservation_id):
+    cur.execute("""
+        SELECT equipment_id, COUNT(*) AS units FROM reservation_equipment
+        WHERE reservation_id=? GROUP BY equipment_id
+    """, (reservation_id,))
+    return {row["equipment_id"]: row["units"] for row in cur.fetchall()}
+
+
+def _apply(cur, counts, date, start_minute, end_minute, sign):
+    blocks = usage_blocks(start_minute, end_minute)
+    cur.executemany("""
+        INSERT INTO equipment_usage (equipment_id, date, block_minute, used) VALUES (?, ?, ?, ?)
+        ON CONFLICT(equipment_id, date, block_minute) DO UPDATE SET used = used + excluded.used
+    """, [(eid, date, b, sign * units) for eid, units in counts.items() for b in blocks])
+
+
+def claim_equipment(cur, reservation_id):
+    """Count a reservation's linked equipment as in use; ValueError if stock runs out"""
+    window = _window(cur, reservation_id)
+    counts = _linked_counts(cur, reservation_id)
+    if not window or not counts:
+        return
+    date, start, end = window
+    _apply(cur, counts, date, start, end, 1)
+
+    # Verify after the write: the write lock is held, so this sees every competing booking
+    placeholders = ",".join("?" * len(counts))
+    cur.execute(f"""
+        SELECT e.name, e.quantity, MAX(u.used) AS used
+        FROM equipment_usage u JOIN equipment e ON e.id = u.equipment_id
+        WHERE u.equipment_id IN ({placeholders}) AND u.date=? AND u.block_minute >= ? AND u.block_minute < ?
+        GROUP BY u.equipment_id
+        HAVING MAX(u.used) > COALESCE(e.quantity, 1)
+    """, (*counts, date, start - start % BLOCK_MINUTES, end))
+    short = cur.fetchone()
+    if short:
+        raise ValueError(f"Not enough {short['name']} available "
+                         f"({short['quantity']} in stock, {short['used']} requested at that time)")
+
+
+def release_equipment(cur, reservation_id):
+    """Return a reservation's equipment to stock (call once, when it stops being Pending/Confirmed)"""
+    window = _window(cur, reservation_id)
+    counts = _linked_counts(cur, reservation_id)
+    if not window or not counts:
+        return
+    _apply(cur, counts, *window, -1)
+    placeholders = ",".join("?" * len(counts))
+    cur.execute(f"DELETE FROM equipment_usage WHERE equipment_id IN ({placeholders}) AND date=? AND used <= 0",
+                (*counts, window[0]))
+
+
+def reserve_equipment(cur, reservation_id, equipment_ids):
+    """Link equipment (one row per unit) to a new reservation and claim the stock"""
+    ids = [int(i) for i in equipment_ids]
+    if not ids:
+        return
+    cur.executemany("INSERT INTO reservation_equipment (reservation_id, equipment_id) VALUES (?, ?)",
+                    [(reservation_id, i) for i in ids])
+    claim_equipment(cur, reservation_id)
+
+
+def equipment_availability(cur, date, start_time, end_time):
+    """{equipment_id: units free for the whole window}, from one grouped query"""
+    start, end = timeslots.label_minutes(start_time), timeslots.label_minutes(end_time)
+    cur.execute("""
+        SELECT e.id, COALESCE(e.quantity, 1) - COALESCE(MAX(u.used), 0) AS free
+        FROM equipment e
+        LEFT JOIN equipment_usage u
+            ON u.equipment_id = e.id AND u.date=? AND u.block_minute >= ? AND u.block_minute < ?
+        GROUP BY e.id
+    """, (date, start - start % BLOCK_MINUTES, end))
+    return {row["id"]: max(row["free"], 0) for row in cur.fetchall()}
+
+
+# Per-block unit counts of Pending/Confirmed reservations, filtered by {where}.
+# Each link is expanded only over the blocks it covers.
+_USAGE_SELECT = f"""
+    WITH RECURSIVE spans(equipment_id, date, m, end_minute) AS (
+        SELECT re.equipment_id, r.date, r.start_minute - r.start_minute % {BLOCK_MINUTES}, r.end_minute
+        FROM reservation_equipment re
+        JOIN reservations r ON r.id = re.reservation_id
+        WHERE r.status IN ('Pending', 'Confirmed') AND r.start_minute < r.end_minute{{where}}
+        UNION ALL
+        SELECT equipment_id, date, m + {BLOCK_MINUTES}, end_minute FROM spans WHERE m + {BLOCK_MINUTES} < end_minute
+    )
+    SELECT equipment_id, date, m, {{sign}}COUNT(*) FROM spans
+    GROUP BY equipment_id, date, m
+"""
+
+
+def release_many(cur, reservation_ids_json):
+    """
+    Set-based release_equipment for a JSON list of reservation ids.
+    Only reservations still Pending/Confirmed are released, so call it
+    before changing their status.
+    """
+    cur.execute(f"""
+        INSERT INTO equipment_usage (equipment_id, date, block_minute, used)
+        {_USAGE_SELECT.format(sign="-", where=" AND r.id IN (SELECT value FROM json_each(?))")}
+        ON CONFLICT(equipment_id, date, block_minute) DO UPDATE SET used = used + excluded.used
+    """, (reservation_ids_json,))
+    cur.execute("""
+        DELETE FROM equipment_usage WHERE used <= 0
+        AND date IN (SELECT date FROM reservations WHERE id IN (SELECT value FROM json_each(?)))
+    """, (reservation_ids_json,))
+
+
+def rebuild_usage(cur):
+    """Recompute every counter from the Pending/Confirmed reservations (set-based)"""
+    cur.execute("DELETE FROM equipment_usage")
+    cur.execute(f"""
+        INSERT INTO equipment_usage (equipment_id, date, block_minute, used)
+        {_USAGE_SELECT.format(sign="", where="")}
+    """)
+    return cur.rowcount
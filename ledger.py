@@ -0,0 +1,172 @@
+"""
+Double-entry wallet ledger.
+Money never lives in a mutable balance row. Every movement is one
+transaction of ledger_entries rows whose amounts (integer cents) sum to
+zero, and the table only ever gets inserts (triggers refuse UPDATE and
+DELETE). Accounts are strings:
+
+    wallet:<user_id>    the patron's system wallet
+    bank:<user_id>      the patron's (simulated) external bank account
+    revenue             what the library has been paid
+    external            the outside world: opening balances, admin credits,
+                        card payments
+
+A balance is the account's latest snapshot plus the sum of its entries
+after it, read through the (account, id) index. take_snapshot() stores a
+new balance for every account that moved since the previous run, so the
+tail stays short; verify() checks that every transaction balances and
+every snapshot matches the entries it summarizes.
+
+bank.balance and user_bank_acc.bank_balance still hold each user's
+opening balance and are no longer updated.
+
+    python ledger.py snapshot | verify
+"""
+
+import os
+import sqlite3
+import sys
+import uuid
+
+import timeslots
+
+REVENUE = "revenue"
+EXTERNAL = "external"
+OPENING_BANK_BALANCE = 1000
+
+
+def wallet(user_id):
+    return f"wallet:{user_id}"
+
+
+def bank(user_id):
+    return f"bank:{user_id}"
+
+
+def cents(amount):
+    return int(round(float(amount) * 100))
+
+
+def transfer_many(cur, transfers):
+    """Post [(source, target, amount, memo, reference)], one transaction each; amounts in credits"""
+    now = timeslots.timestamp()
+    rows = []
+    for source, target, amount, memo, reference in transfers:
+        amount = cents(amount)
+        if amount <= 0:
+            raise ValueError("Transfer amount must be positive")
+        txn = uuid.uuid4().hex
+        rows.append((txn, source, -amount, memo, reference, now))
+        rows.append((txn, target, amount, memo, reference, now))
+    cur.executemany("""
+        INSERT INTO ledger_entries (txn, account, amount, memo, reference, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, rows)
+    return len(rows) // 2
+
+
+def transfer(cur, source, target, amount, memo, reference=None):
+    """Move amount (credits) from source to target as one balanced transaction"""
+    transfer_many(cur, [(source, target, amount, memo, reference)])
+
+
+_BALANCE = """
+    SELECT COALESCE(s.balance, 0) + COALESCE((
+        SELECT SUM(e.amount) FROM ledger_entries e
+        WHERE e.account = a.account AND e.id > COALESCE(s.last_entry_id, 0)), 0)
+    FROM (SELECT ? AS account) a
+    LEFT JOIN (SELECT balance, last_entry_id FROM ledger_snapshots
+               WHERE account = ? ORDER BY last_entry_id DESC LIMIT 1) s
+"""
+
+
+def balance(cur, account):
+    """Current balance of an account in credits: latest snapshot + the entries after it"""
+    cur.execute(_BALANCE, (account, account))
+    return cur.fetchone()[0] / 100
+
+
+def open_account(cur, user_id, wallet_balance=0, bank_balance=OPENING_BANK_BALANCE):
+    """Opening balances of a new user (the bank/user_bank_acc rows are inserted by the caller)"""
+    transfer_many(cur, [(EXTERNAL, account, amount, "Opening balance", None)
+                        for account, amount in ((wallet(user_id), wallet_balance), (bank(user_id), bank_balance))
+                        if amount and amount > 0])
+
+
+def open_missing_accounts(cur):
+    """Post opening balances for bank/user_bank_acc rows whose account has no entries yet"""
+    cur.execute("""
+        SELECT 'wallet:' || user_id AS account, balance AS amount FROM bank
+        UNION ALL
+        SELECT 'bank:' || user_id, bank_balance FROM user_bank_acc
+    """)
+    openings = [(row[0], row[1]) for row in cur.fetchall() if row[1] and row[1] > 0]
+    if not openings:
+        return 0
+    cur.execute("SELECT DISTINCT account FROM ledger_entries WHERE account LIKE 'wallet:%' OR account LIKE 'bank:%'")
+    known = {row[0] for row in cur.fetchall()}
+    return transfer_many(cur, [(EXTERNAL, account, amount, "Opening balance", None)
+                               for account, amount in openings if account not in known])
+
+
+def take_snapshot(conn):
+    """
+    Snapshot every account that has entries since the previous snapshot,
+    as of the newest entry. Returns the number of accounts snapshotted; the caller commits.
+    """
+    cur = conn.cursor()
+    if not conn.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")
+    cur.execute("SELECT COALESCE(MAX(last_entry_id), 0) FROM ledger_snapshots")
+    since = cur.fetchone()[0]
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM ledger_entries")
+    upto = cur.fetchone()[0]
+    if upto <= since:
+        return 0
+    cur.execute("""
+        INSERT INTO ledger_snapshots (account, last_entry_id, balance, taken_at)
+        SELECT t.account, :upto, COALESCE((
+            SELECT s.balance FROM ledger_snapshots s
+            WHERE s.account = t.account ORDER BY s.last_entry_id DESC LIMIT 1), 0) + t.tail, :now
+        FROM (SELECT account, SUM(amount) AS tail FROM ledger_entries
+              WHERE id > :since AND id <= :upto GROUP BY account) t
+    """, {"since": since, "upto": upto, "now": timeslots.timestamp()})
+    return cur.rowcount
+
+
+def verify(cur):
+    """List of problems found (empty when the ledger is consistent)"""
+    problems = []
+    cur.execute("SELECT txn, SUM(amount) FROM ledger_entries GROUP BY txn HAVING SUM(amount) != 0")
+    problems += [f"Transaction {txn} is off by {total / 100}" for txn, total in cur.fetchall()]
+    cur.execute("""
+        SELECT s.account, s.last_entry_id, s.balance,
+               (SELECT COALESCE(SUM(e.amount), 0) FROM ledger_entries e
+                WHERE e.account = s.account AND e.id <= s.last_entry_id) AS actual
+        FROM ledger_snapshots s
+        WHERE s.last_entry_id = (SELECT MAX(last_entry_id) FROM ledger_snapshots WHERE account = s.account)
+    """)
+    problems += [f"Snapshot of {account} at entry {last} says {snap / 100}, entries say {actual / 100}"
+                 for account, last, snap, actual in cur.fetchall() if snap != actual]
+    cur.execute("""
+        SELECT account, SUM(amount) FROM ledger_entries
+        WHERE account LIKE 'wallet:%' OR account LIKE 'bank:%'
+        GROUP BY account HAVING SUM(amount) < 0
+    """)
+    problems += [f"{account} is overdrawn ({total / 100})" for account, total in cur.fetchall()]
+    return problems
+
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(os.path.join(os.path.dirname(os.path.abspath(__file__)), "reservation_system.db"))
+    command = sys.argv[1] if len(sys.argv) > 1 else "verify"
+    if command == "snapshot":
+        count = take_snapshot(conn)
+        conn.commit()
+        print(f" Snapshot taken for {count} account(s)")
+    else:
+        found = verify(conn.cursor())
+        for problem in found:
+            print(f" {problem}")
+        print(" Ledger is consistent" if not found else f" {len(found)} problem(s) found")
+    conn.close()
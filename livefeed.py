@@ -0,0 +1,285 @@
+"""
+Live slot availability for the booking page, as Server-Sent Events.
+Every worker process runs one Broker. Its thread tails the events outbox
+(events.py) from the last seq it has seen, so a booking, payment,
+cancellation or edit committed by any worker, the CLI or the writer
+process reaches every worker's subscribers within POLL_SECONDS: the
+outbox carries changes between processes and the Broker fans them out
+inside one.
+
+Subscribers are grouped by topic, a (room_id, date). A reservation event
+touches the topics of its row before and after the change (an edit can
+move a booking to another room or day), a room event every topic of
+that room. For each touched topic the Broker reloads the room's day once
+(availability.DayOccupancy) and diffs it with the state it last sent,
+so a change costs one small query however many patrons are watching it,
+and only the slots that changed go out. Every REFRESH_SECONDS all topics
+are reloaded anyway, for changes that leave no event (a checkout hold
+lapsing, a maintenance closure).
+
+A Subscriber is a dict and a Condition: deltas are merged slot by slot
+until its stream takes them, so a slow client gets the latest state of
+each slot rather than a backlog, and an idle one costs a parked thread
+and a keep-alive comment every HEARTBEAT_SECONDS. The Broker only polls
+while somebody is subscribed, and never holds its lock over a query.
+Streams end after STREAM_SECONDS; the browser's EventSource reconnects
+on its own and starts from a fresh snapshot.
+
+Each open stream holds a server thread, which a sync WSGI deployment
+cannot spare. There snapshot() answers instead: the current slots and a
+retry interval, then the response ends and the same EventSource asks
+again after the interval. That is plain short polling with no Broker.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+import availability
+import events
+
+POLL_SECONDS = 0.5
+REFRESH_SECONDS = 60
+HEARTBEAT_SECONDS = 15
+STREAM_SECONDS = 600
+RETRY_MS = 2000
+MAX_SUBSCRIBERS = 5000
+
+
+def day_slots(cur, room_id, date):
+    """{slot start label: 'free' | 'taken'} for one room's day; closed slots count as taken"""
+    occupancy = availability.DayOccupancy.load(cur, date, [room_id])
+    labels = occupancy.grid.labels
+    return {labels[i]: "taken" if busy else "free" for i, busy in enumerate(occupancy.busy[0])}
+
+
+class Subscriber:
+    def __init__(self, topic):
+        self.topic = topic
+        self.closed = False
+        self._changes = {}
+        self._cond = threading.Condition()
+
+    def put(self, changes):
+        with self._cond:
+            self._changes.update(changes)
+            self._cond.notify()
+
+    def take(self, timeout):
+        """The slots that changed since the last take, waiting up to timeout ({} if none)"""
+        with self._cond:
+            if not self._changes and not self.closed:
+                self._cond.wait(timeout)
+            changes, self._changes = self._changes, {}
+            return changes
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+class Broker:
+    def __init__(self, connect, poll_seconds=POLL_SECONDS, refresh_seconds=REFRESH_SECONDS,
+                 max_subscribers=MAX_SUBSCRIBERS):
+        self.connect = connect
+        self.poll_seconds = poll_seconds
+        self.refresh_seconds = refresh_seconds
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._thread = None
+        self._topics = {}       # (room_id, date) -> set of Subscribers
+        self._state = {}        # (room_id, date) -> slots last sent
+        self._stale = set()     # topics whose snapshot may predate the last event read
+        self._seq = None        # last outbox event read; None while nobody is subscribed
+        self._next_refresh = 0.0
+        self.subscribers = 0
+        self.polls = 0
+        self.deltas = 0
+
+    def full(self):
+        return self.subscribers >= self.max_subscribers
+
+    def subscribe(self, room_id, date):
+        """(Subscriber, current slots) for a room's day; later changes arrive through Subscriber.take()"""
+        topic = (int(room_id), date)
+        subscriber = Subscriber(topic)
+        conn = self.connect()
+        try:
+            cur = conn.cursor()
+            # Read outside the lock: the outbox position first, so the slots are at least that recent
+            cur.execute("SELECT COALESCE(MAX(seq), 0) FROM events")
+            seen = cur.fetchone()[0]
+            slots = day_slots(cur, *topic)
+        finally:
+            conn.close()
+        with self._lock:
+            if self._seq is None:
+                self._seq = seen
+                self._next_refresh = time.monotonic() + self.refresh_seconds
+            if topic not in self._topics:
+                self._state[topic] = slots
+                self._topics[topic] = set()
+                if self._seq > seen:
+                    # A poll already read events this snapshot may have missed: reload on the next one
+                    self._stale.add(topic)
+            self._topics[topic].add(subscriber)
+            self.subscribers += 1
+            self._wake.notify()
+            return subscriber, dict(self._state[topic])
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            waiting = self._topics.get(subscriber.topic)
+            if waiting is not None and subscriber in waiting:
+                waiting.discard(subscriber)
+                self.subscribers -= 1
+                if not waiting:
+                    del self._topics[subscriber.topic], self._state[subscriber.topic]
+                    self._stale.discard(subscriber.topic)
+                if not self._topics:
+                    self._seq = None
+        subscriber.close()
+
+    def poll(self, conn):
+        """Read the outbox past the last seen event and push changed slots; returns how many topics changed"""
+        cur = conn.cursor()
+        with self._lock:
+            after = self._seq
+        if after is None:
+            return 0
+        touched, rooms = set(), set()
+        while True:
+            batch = events.read(cur, after)
+            for event in batch:
+                payload = event["payload"]
+                if event["type"].startswith("reservation."):
+                    touched.add((int(payload["room_id"]), payload["date"]))
+                    if payload.get("old_room_id") is not None:
+                        touched.add((int(payload["old_room_id"]), payload["old_date"]))
+                elif event["type"] in ("room.updated", "room.deleted"):
+                    rooms.add(event["entity_id"])
+            if batch:
+                after = batch[-1]["seq"]
+            if len(batch) < events.BATCH_SIZE:
+                break
+
+        with self._lock:
+            if self._seq is None:       # everybody left meanwhile
+                return 0
+            self._seq = max(self._seq, after)
+            self.polls += 1
+            if time.monotonic() >= self._next_refresh:
+                self._next_refresh = time.monotonic() + self.refresh_seconds
+                targets = list(self._topics)
+            else:
+                targets = [topic for topic in self._topics
+                           if topic in touched or topic[0] in rooms or topic in self._stale]
+            self._stale.clear()
+
+        # Reload outside the lock, so subscribing and unsubscribing never wait on a query
+        states = {topic: day_slots(cur, *topic) for topic in targets}
+
+        changed = 0
+        with self._lock:
+            for topic, state in states.items():
+                last = self._state.get(topic)
+                if last is None:        # its last subscriber left meanwhile
+                    continue
+                delta = {label: value for label, value in state.items() if last.get(label) != value}
+                if not delta:
+                    continue
+                self._state[topic] = state
+                for subscriber in self._topics[topic]:
+                    subscriber.put(delta)
+                changed += 1
+            self.deltas += changed
+        return changed
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                while not self._topics and not self._stop.is_set():
+                    self._wake.wait()
+            # A connection for as long as somebody is subscribed
+            conn = self.connect()
+            try:
+                while self._topics and not self._stop.is_set():
+                    try:
+                        self.poll(conn)
+                    except sqlite3.OperationalError:
+                        conn.rollback()     # locked or busy: try again next tick
+                    self._stop.wait(self.poll_seconds)
+            finally:
+                conn.close()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="livefeed", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            self._wake.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return {"subscribers": self.subscribers, "topics": len(self._topics), "polls": self.polls,
+                    "deltas": self.deltas}
+
+
+def _message(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def snapshot(cur, room_id, date, retry_seconds):
+    """SSE body for polling: a 'snapshot' of every slot, asking the browser back after retry_seconds"""
+    slots = day_slots(cur, room_id, date)
+    return f"retry: {int(retry_seconds * 1000)}\n" + _message("snapshot", {"room_id": room_id, "date": date,
+                                                                         "slots": slots})
+
+
+def stream(broker, room_id, date, heartbeat=HEARTBEAT_SECONDS, lifetime=STREAM_SECONDS):
+    """
+    SSE body for a room's day: a 'snapshot' of every slot, then a 'delta' of the slots
+    that changed whenever some did, with keep-alive comments in between
+    """
+    subscriber, slots = broker.subscribe(room_id, date)
+    try:
+        yield f"retry: {RETRY_MS}\n" + _message("snapshot", {"room_id": room_id, "date": date, "slots": slots})
+        deadline = time.monotonic() + lifetime
+        while not subscriber.closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            changes = subscriber.take(min(heartbeat, remaining))
+            if changes:
+                yield _message("delta", {"room_id": room_id, "date": date, "slots": changes})
+            else:
+                yield ": keep-alive\n\n"
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+def metrics_text(broker):
+    """The broker's gauges and counters, Prometheus text format"""
+    stats = broker.stats()
+    lines = []
+    for name, kind, help_text, key in (
+        ("livefeed_subscribers", "gauge", "Open availability streams", "subscribers"),
+        ("livefeed_topics", "gauge", "Room days being watched", "topics"),
+        ("livefeed_polls_total", "counter", "Outbox polls", "polls"),
+        ("livefeed_deltas_total", "counter", "Slot deltas fanned out, one per changed room day", "deltas"),
+    ):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {stats[key]}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,184 @@
+"""
+Booking lottery for high-demand dates.
+While a lottery window is open, booking a date inside it only queues a
+row in booking_requests - a plain insert with no availability check, so
+nobody races anyone for SQLite's write lock. When the window is drawn,
+all its requests are resolved in one transaction:
+
+- every user gets a random draw order, weighted so users who lost in
+  earlier lotteries tend to pick earlier (weighted random keys,
+  u ** (1 / weight));
+- users pick in rounds, one request per user per round, reversing the
+  order each round (a snake draft), so nobody gets a second booking
+  before everyone has had a first;
+- a request wins if the room is still free (availability.check_window)
+  and the user is under booking_rules.max_active; winners become Pending
+  reservations held until the payment deadline (holds.payment_deadline),
+  everything else is marked lost with the reason.
+"""
+
+import random
+from datetime import datetime
+
+import availability
+import holds
+import pricing
+import timeslots
+
+MAX_WEIGHT = 3
+
+
+def create_window(cur, start_date, end_date, draw_at):
+    """Open a lottery for [start_date, end_date], drawn at draw_at ('YYYY-MM-DD HH:MM')"""
+    try:
+        start = datetime.strptime(start_date, "%Y-%m-%d")
+        end = datetime.strptime(end_date, "%Y-%m-%d")
+        draw = datetime.strptime(draw_at.replace("T", " ")[:16], "%Y-%m-%d %H:%M")
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError("Invalid lottery dates")
+    if end < start:
+        raise ValueError("End date must be on or after the start date")
+    if draw.date() >= start.date():
+        raise ValueError("The draw must happen before the first lottery date")
+    cur.execute("""
+        INSERT INTO lottery_windows (start_date, end_date, draw_at, status, created_at)
+        VALUES (?, ?, ?, 'open', ?)
+    """, (start_date, end_date, draw.strftime("%Y-%m-%d %H:%M:%S"), timeslots.timestamp()))
+    return cur.lastrowid
+
+
+def open_window_for(cur, date):
+    """The open lottery window covering a date (Row), or None"""
+    cur.execute("""
+        SELECT * FROM lottery_windows
+        WHERE status='open' AND start_date <= ? AND end_date >= ?
+        ORDER BY id LIMIT 1
+    """, (date, date))
+    return cur.fetchone()
+
+
+def queue_request(cur, window_id, user_id, room_id, date, start_time, end_time, num_people=1):
+    """Enter a booking request into a lottery (validated, not checked for availability)"""
+    if not timeslots.grid().window(start_time, end_time):
+        raise ValueError("End time must be after start time")
+    cur.execute("SELECT id FROM rooms WHERE id=?", (room_id,))
+    if not cur.fetchone():
+        raise ValueError("Invalid room ID")
+    cur.execute("""
+        INSERT OR IGNORE INTO booking_requests (window_id, user_id, room_id, date, start_time, end_time,
+                                                num_people, status, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?)
+    """, (window_id, user_id, room_id, date, start_time, end_time, num_people, timeslots.timestamp()))
+    if not cur.rowcount:
+        raise ValueError("You already entered this slot into the lottery")
+    return cur.lastrowid
+
+
+def enter(conn, user_id, room_id, date, start_time, end_time, num_people=1):
+    """Queue a request in the lottery open for its date: {request_id, draw_at}. The caller commits."""
+    cur = conn.cursor()
+    if not conn.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")
+    window = open_window_for(cur, date)
+    if not window:
+        raise ValueError("No lottery is open for that date any more")
+    request_id = queue_request(cur, window["id"], user_id, room_id, date, start_time, end_time, num_people)
+    return {"request_id": request_id, "draw_at": window["draw_at"]}
+
+
+def user_weights(cur, user_ids, window_id):
+    """1 + requests lost in earlier lotteries, capped at MAX_WEIGHT"""
+    cur.execute("""
+        SELECT user_id, COUNT(*) AS lost FROM booking_requests
+        WHERE status='lost' AND window_id != ? GROUP BY user_id
+    """, (window_id,))
+    lost = {row["user_id"]: row["lost"] for row in cur.fetchall()}
+    return {u: min(1 + lost.get(u, 0), MAX_WEIGHT) for u in user_ids}
+
+
+def draw(conn, window_id, seed=None):
+    """
+    Resolve every queued request of a window in one transaction.
+    Returns {'won': n, 'lost': n}; the caller commits.
+    """
+    cur = conn.cursor()
+    if not conn.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")
+    cur.execute("SELECT * FROM lottery_windows WHERE id=?", (window_id,))
+    window = cur.fetchone()
+    if not window:
+        raise ValueError("Lottery not found")
+    if window["status"] != "open":
+        raise ValueError("This lottery has already been drawn")
+
+    cur.execute("SELECT * FROM booking_requests WHERE window_id=? AND status='queued' ORDER BY id", (window_id,))
+    queues = {}
+    for req in cur.fetchall():
+        queues.setdefault(req["user_id"], []).append(req)
+
+    cur.execute("SELECT max_active FROM booking_rules WHERE id=1")
+    rule = cur.fetchone()
+    max_active = rule["max_active"] if rule and rule["max_active"] else 2
+    cur.execute(f"""
+        SELECT user_id, COUNT(*) AS active FROM reservations
+        WHERE status IN ({','.join('?' * len(availability.BLOCKING_STATUSES))}) AND {holds.ACTIVE_HOLD_SQL}
+        GROUP BY user_id
+    """, (*availability.BLOCKING_STATUSES, timeslots.timestamp()))
+    active = {row["user_id"]: row["active"] for row in cur.fetchall()}
+
+    # Weighted random order: larger key picks first
+    rng = random.Random(seed)
+    weights = user_weights(cur, queues, window_id)
+    order = sorted(queues, key=lambda u: rng.random() ** (1.0 / weights[u]), reverse=True)
+
+    now = timeslots.timestamp()
+    held_until = holds.payment_deadline()
+    results = []    # (status, reason, reservation_id, request_id)
+    while order:
+        for user_id in order:
+            req = queues[user_id].pop(0)
+            if active.get(user_id, 0) >= max_active:
+                results.append(("lost", "Booking limit reached", None, req["id"]))
+                continue
+            try:
+                availability.check_window(cur, req["room_id"], req["date"], req["start_time"], req["end_time"])
+                quote = pricing.quote_booking(cur, req["room_id"], req["date"], req["start_time"], req["end_time"])
+            except ValueError as e:
+                results.append(("lost", str(e), None, req["id"]))
+                continue
+            cur.execute("""
+                INSERT INTO reservations (user_id, room_id, date, start_time, end_time, num_people, status,
+                                          quoted_rate, quoted_hours, room_cost, equipment_cost, total_cost,
+                                          held_until, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, 'Pending', ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (user_id, req["room_id"], req["date"], req["start_time"], req["end_time"], req["num_people"],
+                  quote["quoted_rate"], quote["quoted_hours"], quote["room_cost"],
+                  quote["equipment_cost"], quote["total_cost"], held_until, now, now))
+            results.append(("won", "", cur.lastrowid, req["id"]))
+            active[user_id] = active.get(user_id, 0) + 1
+        # Snake draft: whoever picked last this round picks first next round
+        order = [u for u in reversed(order) if queues[u]]
+
+    cur.executemany("UPDATE booking_requests SET status=?, reason=?, reservation_id=? WHERE id=?", results)
+    cur.execute("UPDATE lottery_windows SET status='drawn', drawn_at=? WHERE id=?", (now, window_id))
+    won = sum(1 for r in results if r[0] == "won")
+    return {"won": won, "lost": len(results) - won}
+
+
+def draw_due(conn, seed=None):
+    """Draw every open window whose draw time has passed; returns {window_id: result}"""
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM lottery_windows WHERE status='open' AND draw_at <= ? ORDER BY draw_at",
+                (timeslots.timestamp(),))
+    return {row["id"]: draw(conn, row["id"], seed) for row in cur.fetchall()}
+
+
+def list_windows(cur):
+    """Lottery windows with their request counts, newest first"""
+    cur.execute("""
+        SELECT w.*,
+               (SELECT COUNT(*) FROM booking_requests r WHERE r.window_id = w.id) AS requests,
+               (SELECT COUNT(*) FROM booking_requests r WHERE r.window_id = w.id AND r.status='won') AS won
+        FROM lottery_windows w ORDER BY w.start_date DESC
+    """)
+    return cur.fetchall()
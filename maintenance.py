@@ -0,0 +1,103 @@
+"""
+Taking rooms offline for maintenance.
+A closure row blocks the room for a date range in availability (free
+rooms, check_window, recurring series). Creating one also cancels the
+room's Pending/Confirmed bookings in that range through bulk.bulk_update,
+so refunds are summed per user and credited with one ledger transfer each,
+all in the same transaction as the closure. The freed windows go to the
+waitlist there as well, which only promotes a waiter once the room is
+open again for their day: for the closed range nobody moves up. With rehome=True bookings are
+first moved to equivalent rooms where possible (rehome.py) and only the
+rest are cancelled. The caller commits, or rolls back for a preview.
+"""
+
+from datetime import datetime
+
+import availability
+import bulk
+import rehome
+import timeslots
+
+
+def _check_dates(start_date, end_date):
+    try:
+        start = datetime.strptime(start_date, "%Y-%m-%d").date()
+        end = datetime.strptime(end_date, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        raise ValueError("Invalid date")
+    if end < start:
+        raise ValueError("End date must be on or after the start date")
+
+
+def affected_bookings(cur, room_id, start_date, end_date):
+    """Pending/Confirmed bookings of a room in a date range, with what each would refund"""
+    placeholders = ",".join("?" * len(availability.BLOCKING_STATUSES))
+    cur.execute(f"""
+        SELECT r.id, r.user_id, u.name, r.date, r.start_time, r.end_time, r.status,
+               COALESCE((SELECT SUM(p.amount) FROM payments p
+                         WHERE p.reservation_id = r.id AND p.status='completed'), 0) AS refund
+        FROM reservations r LEFT JOIN users u ON u.id = r.user_id
+        WHERE r.room_id=? AND r.date BETWEEN ? AND ? AND r.status IN ({placeholders})
+        ORDER BY r.date, r.start_minute
+    """, (room_id, start_date, end_date, *availability.BLOCKING_STATUSES))
+    return [dict(row) for row in cur.fetchall()]
+
+
+def take_offline(conn, room_id, start_date, end_date, reason="", rehome_bookings=False):
+    """
+    Close a room for [start_date, end_date] and cancel (or move) its bookings there.
+    Each booking dict gets moved_to (room name or None).
+    Returns {closure_id, bookings, moved, cancelled, refunds, refunded, promoted}; the caller commits.
+    """
+    _check_dates(start_date, end_date)
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM rooms WHERE id=?", (room_id,))
+    if not cur.fetchone():
+        raise ValueError("Invalid room ID")
+
+    if not conn.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")
+    cur.execute("""
+        INSERT INTO room_closures (room_id, start_date, end_date, reason, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, (room_id, start_date, end_date, reason, timeslots.timestamp()))
+    closure_id = cur.lastrowid
+
+    bookings = affected_bookings(cur, room_id, start_date, end_date)
+    moved_to = {}
+    if rehome_bookings and bookings:
+        plan = rehome.plan_moves(cur, [b["id"] for b in bookings])
+        rehome.apply_moves(cur, plan)
+        moved_to = {line["id"]: line["to_room_name"] for line in plan if line["status"] == "moved"}
+    for b in bookings:
+        b["moved_to"] = moved_to.get(b["id"])
+
+    cancel_ids = [b["id"] for b in bookings if b["id"] not in moved_to]
+    summary = {"refunds": {}, "refunded": 0, "promoted": 0}
+    if cancel_ids:
+        summary = bulk.bulk_update(conn, "cancel", cancel_ids)
+    return {
+        "closure_id": closure_id,
+        "bookings": bookings,
+        "moved": len(moved_to),
+        "cancelled": len(cancel_ids),
+        "refunds": summary["refunds"],
+        "refunded": summary["refunded"],
+        "promoted": summary["promoted"],
+    }
+
+
+def list_closures(cur, room_id=None, from_date=None):
+    """Closures (newest range first), optionally for one room and ending on/after from_date"""
+    cur.execute("""
+        SELECT c.*, rm.room_name FROM room_closures c LEFT JOIN rooms rm ON rm.id = c.room_id
+        WHERE (? IS NULL OR c.room_id=?) AND (? IS NULL OR c.end_date >= ?)
+        ORDER BY c.start_date DESC
+    """, (room_id, room_id, from_date, from_date))
+    return cur.fetchall()
+
+
+def remove_closure(cur, closure_id):
+    """Bring a room back online for a closure's dates (cancelled bookings stay cancelled)"""
+    cur.execute("DELETE FROM room_closures WHERE id=?", (closure_id,))
+    return cur.rowcount
@@ -12,7 +12,9 @@ import sqlite3
 import os
 import bcrypt
 from datetime import datetime
-import pytz
+
+import timeslots
+from schema import ensure_schema
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB = os.path.join(BASE_DIR, "reservation_system.db")
@@ -43,7 +45,7 @@ def migrate_database():
     
     try:
         # Step 1: Add email to users table (without UNIQUE constraint initially)
-        print("\n[1/7] Adding email field to users table...")
+        print("\n[1/10] Adding email field to users table...")
         try:
             cur.execute("ALTER TABLE users ADD COLUMN email TEXT")
             print(" Email field added")
@@ -55,13 +57,12 @@ def migrate_database():
                 raise
         
         # Step 2: Add timestamps to users
-        print("\n[2/7] Adding timestamps to users table...")
+        print("\n[2/10] Adding timestamps to users table...")
         try:
             cur.execute("ALTER TABLE users ADD COLUMN created_at TEXT")
             cur.execute("ALTER TABLE users ADD COLUMN updated_at TEXT")
             # Set current timestamp for existing users
-            malaysia_tz = pytz.timezone("Asia/Kuala_Lumpur")
-            now = datetime.now(malaysia_tz).strftime("%Y-%m-%d %H:%M:%S")
+            now = timeslots.timestamp()
             cur.execute("UPDATE users SET created_at=?, updated_at=? WHERE created_at IS NULL", (now, now))
             print(" Timestamps added to users")
         except sqlite3.OperationalError as e:
@@ -71,7 +72,7 @@ def migrate_database():
                 raise
         
         # Step 3: Add price and status to rooms
-        print("\n[3/7] Adding pricing and status to rooms table...")
+        print("\n[3/10] Adding pricing and status to rooms table...")
         try:
             cur.execute("ALTER TABLE rooms ADD COLUMN price_per_hour REAL DEFAULT 0.0")
             cur.execute("ALTER TABLE rooms ADD COLUMN status TEXT DEFAULT 'available'")
@@ -83,13 +84,12 @@ def migrate_database():
                 raise
         
         # Step 4: Add timestamps to rooms
-        print("\n[4/7] Adding timestamps to rooms table...")
+        print("\n[4/10] Adding timestamps to rooms table...")
         try:
             cur.execute("ALTER TABLE rooms ADD COLUMN created_at TEXT")
             cur.execute("ALTER TABLE rooms ADD COLUMN updated_at TEXT")
             # Set current timestamp for existing rooms
-            malaysia_tz = pytz.timezone("Asia/Kuala_Lumpur")
-            now = datetime.now(malaysia_tz).strftime("%Y-%m-%d %H:%M:%S")
+            now = timeslots.timestamp()
             cur.execute("UPDATE rooms SET created_at=?, updated_at=? WHERE created_at IS NULL", (now, now))
             print(" Timestamps added to rooms")
         except sqlite3.OperationalError as e:
@@ -99,13 +99,12 @@ def migrate_database():
                 raise
         
         # Step 5: Add timestamps to reservations
-        print("\n[5/7] Adding timestamps to reservations table...")
+        print("\n[5/10] Adding timestamps to reservations table...")
         try:
             cur.execute("ALTER TABLE reservations ADD COLUMN created_at TEXT")
             cur.execute("ALTER TABLE reservations ADD COLUMN updated_at TEXT")
             # Set current timestamp for existing reservations
-            malaysia_tz = pytz.timezone("Asia/Kuala_Lumpur")
-            now = datetime.now(malaysia_tz).strftime("%Y-%m-%d %H:%M:%S")
+            now = timeslots.timestamp()
             cur.execute("UPDATE reservations SET created_at=?, updated_at=? WHERE created_at IS NULL", (now, now))
             print(" Timestamps added to reservations")
         except sqlite3.OperationalError as e:
@@ -115,7 +114,7 @@ def migrate_database():
                 raise
         
         # Step 6: Create payments table
-        print("\n[6/7] Creating payments table...")
+        print("\n[6/10] Creating payments table...")
         cur.execute("""
             CREATE TABLE IF NOT EXISTS payments(
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -135,7 +134,7 @@ def migrate_database():
         print(" Payments table created")
         
         # Step 7: Migrate existing passwords to bcrypt
-        print("\n[7/7] Migrating passwords to bcrypt...")
+        print("\n[7/10] Migrating passwords to bcrypt...")
         cur.execute("SELECT id, password FROM users")
         users = cur.fetchall()
         
@@ -158,19 +157,24 @@ def migrate_database():
         print(f" Passwords migrated: {migrated}, Already hashed: {skipped}")
         
         # Step 8: Set default prices for existing rooms
-        print("\n[8/7] Setting default prices for existing rooms...")
+        print("\n[8/10] Setting default prices for existing rooms...")
         cur.execute("UPDATE rooms SET price_per_hour = 10.0 WHERE price_per_hour = 0.0")
         rows_updated = cur.rowcount
         print(f" Updated {rows_updated} rooms with default price (10.0 credits/hour)")
         
         # Step 9: Update 'Active' status to 'Confirmed' for backward compatibility
-        print("\n[9/7] Updating reservation statuses...")
+        print("\n[9/10] Updating reservation statuses...")
         cur.execute("UPDATE reservations SET status = 'Confirmed' WHERE status = 'Active'")
         rows_updated = cur.rowcount
         print(f" Updated {rows_updated} reservations from 'Active' to 'Confirmed'")
         
         conn.commit()
         
+        # Step 10: Feature upgrades (price quotes, ...)
+        print("\n[10/10] Applying feature schema upgrades...")
+        ensure_schema(conn)
+        print(" Feature schema is up to date")
+        
         # Verification
         print("\n" + "="*60)
         print("MIGRATION VERIFICATION")
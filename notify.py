@@ -0,0 +1,346 @@
+"""
+Email notifications: booking confirmed, booking cancelled, and a
+reminder REMINDER_MINUTES before a confirmed booking starts.
+
+Confirmations and cancellations are read off the events outbox (see
+events.py) by the "notifications" consumer, so every path that confirms
+or cancels a booking (web checkout, the payment queue, the CLI, admin
+bookings, maintenance closures) is covered without touching it; the
+messages are queued in the consumer's transaction. Reminders come from
+one range query per run over the (date, start_minute) index of
+confirmed bookings. UNIQUE (reservation_id, kind) keeps every notice to
+one message however often either step runs. The consumer starts at the
+end of the outbox the first time it runs, so turning notifications on
+does not mail out old bookings. waitlist.py queues its "slot is yours"
+notice itself, with queue_notice(), in the promoting transaction.
+
+deliver() sends the queue in batches of BATCH_SIZE over one SMTP
+connection that the Mailer keeps open between batches and runs, and
+never holds a database lock while talking to the server. A refused
+recipient fails that message; a lost connection leaves the rest queued
+for the next run, up to MAX_ATTEMPTS.
+
+Sink is a minimal SMTP server that keeps what it receives, for tests
+and local development:
+
+    python notify.py sink [port]    # print incoming mail (default port 1025)
+    python notify.py send           # queue and send once against localhost:1025
+"""
+
+import os
+import smtplib
+import socketserver
+import sqlite3
+import sys
+import threading
+from datetime import timedelta
+from email import message_from_bytes
+from email.message import EmailMessage
+
+import events
+import timeslots
+
+MAIL_HOST = "localhost"
+MAIL_PORT = 1025
+SENDER = "Library Room Reservations <no-reply@library.local>"
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+REMINDER_MINUTES = 60
+CONSUMER = "notifications"
+
+_SUBJECTS = {
+    "confirmed": "Booking confirmed: {room_name} on {date}",
+    "cancelled": "Booking cancelled: {room_name} on {date}",
+    "reminder": "Reminder: {room_name} at {start_time} on {date}",
+    "waitlist": "A slot you waited for is yours: {room_name} on {date}",
+}
+_BODIES = {
+    "confirmed": "Your booking of {room_name} on {date}, {start_time} - {end_time} is confirmed.",
+    "cancelled": "Your booking of {room_name} on {date}, {start_time} - {end_time} has been cancelled.",
+    "reminder": "Your booking of {room_name} starts at {start_time} ({date}, until {end_time}).",
+    "waitlist": ("{room_name} on {date}, {start_time} - {end_time} came free and is held for you until "
+                 "{held_until}. Pay for it under My Bookings before then to keep it."),
+}
+_DETAILS_SQL = """
+    SELECT r.id AS reservation_id, r.user_id, r.date, r.start_time, r.end_time, r.held_until,
+           u.name, u.email, m.room_name
+    FROM reservations r JOIN users u ON u.id = r.user_id JOIN rooms m ON m.id = r.room_id
+"""
+
+
+def _queue(cur, kind, rows):
+    """Queue one `kind` notice per details row (users without an email are skipped); returns how many are new"""
+    now = timeslots.timestamp()
+    before = cur.connection.total_changes
+    cur.executemany("""
+        INSERT OR IGNORE INTO notifications (user_id, reservation_id, kind, recipient, subject, body, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [(row['user_id'], row['reservation_id'], kind, row['email'],
+           _SUBJECTS[kind].format(**row), f"Hello {row['name'] or ''},\n\n{_BODIES[kind].format(**row)}\n", now)
+          for row in rows if row['email']])
+    return cur.connection.total_changes - before
+
+
+def queue_notice(cur, kind, reservation_ids):
+    """Queue a `kind` notice for each reservation, in the caller's transaction; returns how many are new"""
+    if not reservation_ids:
+        return 0
+    cur = cur.connection.cursor()
+    cur.row_factory = sqlite3.Row
+    cur.execute(_DETAILS_SQL + f" WHERE r.id IN ({','.join('?' * len(reservation_ids))})", list(reservation_ids))
+    return _queue(cur, kind, [dict(row) for row in cur.fetchall()])
+
+
+def _booking_notices(conn, batch):
+    wanted = {"confirmed": [], "cancelled": []}
+    for event in batch:
+        payload = event["payload"]
+        if payload.get("old_status") == payload["status"]:
+            continue
+        if payload["status"] == "Confirmed":
+            wanted["confirmed"].append(event["entity_id"])
+        elif payload["status"] == "Cancelled" and payload.get("old_status") == "Confirmed":
+            wanted["cancelled"].append(event["entity_id"])
+    cur = conn.cursor()
+    for kind, ids in wanted.items():
+        queue_notice(cur, kind, ids)
+
+
+def queue_booking_notices(conn, batch_size=events.BATCH_SIZE):
+    """Queue confirmations and cancellations from the events outbox; returns how many events were read"""
+    events.subscribe(conn, CONSUMER)
+    return events.consume(conn, CONSUMER, _booking_notices, batch_size,
+                          types=("reservation.created", "reservation.updated"))
+
+
+def queue_reminders(conn, lead_minutes=REMINDER_MINUTES):
+    """Queue a reminder for every confirmed booking starting within lead_minutes; returns how many (committed)"""
+    now = timeslots.now()
+    until = now + timedelta(minutes=lead_minutes)
+    cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
+    # Row-value bounds keep this one range scan of idx_reservations_confirmed_start, across midnight too
+    cur.execute(_DETAILS_SQL + """
+        WHERE r.status = 'Confirmed'
+          AND (r.date, r.start_minute) > (?, ?) AND (r.date, r.start_minute) <= (?, ?)
+    """, (now.strftime("%Y-%m-%d"), now.hour * 60 + now.minute, until.strftime("%Y-%m-%d"), until.hour * 60 + until.minute))
+    rows = [dict(row) for row in cur.fetchall()]
+    if not rows:
+        return 0
+    if not conn.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")
+    queued = _queue(cur, "reminder", rows)
+    conn.commit()
+    return queued
+
+
+class Mailer:
+    """Sends EmailMessages over one SMTP connection, reopened only when the server has dropped it"""
+
+    def __init__(self, host=MAIL_HOST, port=MAIL_PORT, sender=SENDER, timeout=10):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.timeout = timeout
+        self.connections = 0
+        self._smtp = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+        self._smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        self.connections += 1
+        return self._smtp
+
+    def send(self, messages):
+        """
+        Send [(id, EmailMessage)]: ({id: None if sent, else why it was refused}, error). If the
+        server cannot be reached or drops the connection, error says so and the rest are left out.
+        """
+        results = {}
+        with self._lock:
+            try:
+                smtp = self._connection()
+                for message_id, message in messages:
+                    try:
+                        smtp.send_message(message)
+                        results[message_id] = None
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                        results[message_id] = str(e)
+            except (smtplib.SMTPException, OSError) as e:
+                self._smtp = None
+                return results, f"{type(e).__name__}: {e}"
+        return results, None
+
+    def close(self):
+        with self._lock:
+            if self._smtp is not None:
+                try:
+                    self._smtp.quit()
+                except (smtplib.SMTPException, OSError):
+                    pass
+                self._smtp = None
+
+
+def _message(row, sender):
+    message = EmailMessage()
+    message["From"] = sender
+    message["To"] = row['recipient']
+    message["Subject"] = row['subject']
+    message["X-Notification-Id"] = str(row['id'])
+    message.set_content(row['body'])
+    return message
+
+
+def deliver(conn, mailer, batch_size=BATCH_SIZE, max_batches=None):
+    """Send queued notifications batch by batch: {sent, failed, deferred}"""
+    totals = {"sent": 0, "failed": 0, "deferred": 0}
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        cur.execute("""
+            SELECT id, recipient, subject, body, attempts FROM notifications
+            WHERE status = 'queued' ORDER BY id LIMIT ?
+        """, (batch_size,))
+        rows = cur.fetchall()
+        if not rows:
+            break
+        results, error = mailer.send([(row[0], _message(row, mailer.sender)) for row in rows])
+        now = timeslots.timestamp()
+        cur = conn.cursor()
+        if not conn.in_transaction:
+            cur.execute("BEGIN IMMEDIATE")
+        for row in rows:
+            attempts = row['attempts'] + 1
+            if row['id'] not in results:
+                status = 'failed' if attempts >= MAX_ATTEMPTS else 'queued'
+                reason = error
+            else:
+                reason = results[row['id']]
+                status = 'sent' if reason is None else 'failed'
+            cur.execute("UPDATE notifications SET status=?, attempts=?, error=?, sent_at=? WHERE id=?",
+                        (status, attempts, reason, now if status == 'sent' else None, row['id']))
+            key = "sent" if status == 'sent' else "failed" if status == 'failed' else "deferred"
+            totals[key] += 1
+        conn.commit()
+        batches += 1
+        if error or len(rows) < batch_size:
+            break
+    return totals
+
+
+def run(conn, mailer):
+    """One scheduler pass: queue booking notices and reminders, then send: {processed, events, reminders, sent, ...}"""
+    read = queue_booking_notices(conn)
+    reminders = queue_reminders(conn)
+    totals = deliver(conn, mailer)
+    return {"processed": totals["sent"], "events": read, "reminders": reminders, **totals}
+
+
+# ================= LOCAL SMTP SINK =================
+class _SinkHandler(socketserver.StreamRequestHandler):
+    def _reply(self, text):
+        self.wfile.write(text.encode() + b"\r\n")
+
+    def handle(self):
+        self.server.connections += 1
+        self._reply("220 localhost SMTP sink")
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command[:4].upper()
+            if verb == "EHLO":
+                self._reply("250-localhost\r\n250 8BITMIME")    # one write: a split reply stalls on delayed ACKs
+            elif verb in ("HELO", "NOOP"):
+                self._reply("250 OK")
+            elif verb == "MAIL":
+                recipients = []
+                self._reply("250 OK")
+            elif verb == "RCPT":
+                address = command.partition(":")[2].strip().strip("<>")
+                if address in self.server.refuse:
+                    self._reply("550 No such user")
+                else:
+                    recipients.append(address)
+                    self._reply("250 OK")
+            elif verb == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                for line in iter(self.rfile.readline, b""):
+                    if line in (b".\r\n", b".\n"):
+                        break
+                    data.append(line[1:] if line.startswith(b"..") else line)
+                message = message_from_bytes(b"".join(data))
+                with self.server.lock:
+                    self.server.messages.append(message)
+                if self.server.echo:
+                    print(f" {timeslots.timestamp()}  to {', '.join(recipients)}: {message['Subject']}")
+                self._reply("250 OK")
+            elif verb == "RSET":
+                recipients = []
+                self._reply("250 OK")
+            elif verb == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+class Sink(socketserver.ThreadingTCPServer):
+    """SMTP server that accepts everything (but the `refuse` addresses) and keeps it in .messages"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="localhost", port=0, refuse=(), echo=False):
+        super().__init__((host, port), _SinkHandler)
+        self.messages = []
+        self.refuse = set(refuse)
+        self.echo = echo
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self.shutdown()
+            self._thread = None
+        self.server_close()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["sink"]:
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else MAIL_PORT
+        print(f" SMTP sink listening on localhost:{port} (Ctrl+C to stop)")
+        sink = Sink(port=port, echo=True)
+        try:
+            sink.serve_forever()
+        except KeyboardInterrupt:
+            sink.server_close()
+    elif sys.argv[1:2] == ["send"]:
+        conn = sqlite3.connect(os.path.join(os.path.dirname(os.path.abspath(__file__)), "reservation_system.db"))
+        conn.row_factory = sqlite3.Row
+        mailer = Mailer()
+        print(f" {run(conn, mailer)}")
+        mailer.close()
+        conn.close()
+    else:
+        print("Usage: python notify.py sink [port] | send")
@@ -0,0 +1,174 @@
+"""
+Patron write operations: book, pay, top up, edit, cancel, and the waitlist.
+Each takes a connection, runs in the caller's transaction (opening one
+with BEGIN IMMEDIATE if needed), raises ValueError with a message for the
+patron, and returns a plain dict. The web routes run them through a
+writer (writer.py): in-process by default, or in the single-writer
+coordinator process, which is why arguments and results are only plain
+values.
+"""
+
+import time
+
+import availability
+import holds
+import inventory
+import ledger
+import pricing
+import timeslots
+import waitlist
+
+
+def _begin(conn):
+    cur = conn.cursor()
+    if not conn.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")
+    return cur
+
+
+def create_booking(conn, user_id, room_id, date, start_time, end_time, num_people=1, movable=False):
+    """
+    Check the window, quote it and insert a Pending reservation held for holds.HOLD_MINUTES:
+    {reservation_id, total_cost, held_until}
+    """
+    cur = _begin(conn)
+    holds.expire_for_window(cur, room_id, date)
+    availability.check_window(cur, room_id, date, start_time, end_time)
+    quote = pricing.quote_booking(cur, room_id, date, start_time, end_time)
+    now = timeslots.timestamp()
+    held_until = holds.hold_until()
+    cur.execute("""
+        INSERT INTO reservations (user_id, room_id, date, start_time, end_time, num_people, status,
+                                  quoted_rate, quoted_hours, room_cost, equipment_cost, total_cost,
+                                  movable, held_until, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, 'Pending', ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (user_id, room_id, date, start_time, end_time, num_people,
+          quote['quoted_rate'], quote['quoted_hours'], quote['room_cost'],
+          quote['equipment_cost'], quote['total_cost'], 1 if movable else 0, held_until, now, now))
+    return {"reservation_id": cur.lastrowid, "total_cost": quote['total_cost'], "held_until": held_until}
+
+
+def pay_booking(conn, user_id, reservation_id, payment_method, bank_name=None, account_number=None,
+                account_holder=None, transaction_id=None):
+    """
+    Charge the wallet ('System Balance') or the bank account and confirm: {transaction_id, total_cost}.
+    transaction_id is the payment backend's reference when the charge went through payqueue.py.
+    """
+    cur = _begin(conn)
+    cur.execute("SELECT * FROM reservations WHERE id=? AND user_id=?", (reservation_id, user_id))
+    reservation = cur.fetchone()
+    if not reservation:
+        raise ValueError("Reservation not found")
+    if reservation['status'] != 'Pending':
+        raise ValueError(f"This booking is already {reservation['status'].lower()}; nothing to pay")
+    if holds.lapsed(reservation):
+        # The slot was released when the hold ran out; it can still be had if nobody took it
+        try:
+            availability.check_window(cur, reservation['room_id'], reservation['date'],
+                                      reservation['start_time'], reservation['end_time'], exclude_id=reservation_id)
+        except ValueError:
+            raise ValueError("Your hold on this slot ran out and it has been booked by someone else")
+    quote = pricing.stored_quote(reservation)
+    if quote is None:
+        quote = pricing.requote_reservation(cur, reservation_id) or pricing.make_quote(0, 0, 0)
+    total_cost = quote['total_cost']
+
+    # Seconds alone collide when two payments land in the same second (transaction_id is UNIQUE)
+    transaction_id = transaction_id or f"TXN-{int(time.time())}-{reservation_id}"
+    # The write lock is held, so the balance cannot change between the check and the transfer
+    if payment_method == 'System Balance':
+        source = ledger.wallet(user_id)
+        if ledger.balance(cur, source) < total_cost:
+            raise ValueError("Insufficient system wallet balance. Please top up or use online banking.")
+    else:
+        # External Bank Payment (Online Banking, etc)
+        source = ledger.bank(user_id)
+        if ledger.balance(cur, source) < total_cost:
+            raise ValueError("Insufficient funds in your external bank account.")
+    if total_cost > 0:
+        ledger.transfer(cur, source, ledger.REVENUE, total_cost, "Booking payment", transaction_id)
+    now = timeslots.timestamp()
+    cur.execute("""
+        INSERT INTO payments (
+            reservation_id, user_id, amount, payment_method,
+            bank_name, account_number, account_holder,
+            transaction_id, status, paid_at, created_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'completed', ?, ?)
+    """, (reservation_id, user_id, total_cost, payment_method,
+          bank_name, account_number, account_holder, transaction_id, now, now))
+    cur.execute("UPDATE reservations SET status='Confirmed', held_until=NULL WHERE id=?", (reservation_id,))
+    return {"transaction_id": transaction_id, "total_cost": total_cost}
+
+
+def top_up(conn, user_id, amount, bank_name):
+    """Move money from the external bank account to the wallet: {amount}"""
+    amount = float(amount)
+    if amount <= 0:
+        raise ValueError("Invalid amount")
+    cur = _begin(conn)
+    if ledger.balance(cur, ledger.bank(user_id)) < amount:
+        raise ValueError("Insufficient funds in external bank account")
+    ledger.transfer(cur, ledger.bank(user_id), ledger.wallet(user_id), amount, f"Top-up via {bank_name}")
+    cur.execute("""
+        INSERT INTO transactions (user_id, bank_name, amount, date, status)
+        VALUES (?, ?, ?, ?, 'SUCCESS')
+    """, (user_id, bank_name, amount, timeslots.timestamp()))
+    return {"amount": amount}
+
+
+def edit_booking(conn, user_id, booking_id, room_id, date, start_time, end_time):
+    """Move a booking to another room, day or time; an unpaid one is re-quoted: {reservation_id}"""
+    cur = _begin(conn)
+    cur.execute("SELECT status, room_id, date, start_time, end_time FROM reservations WHERE id=? AND user_id=?",
+                (booking_id, user_id))
+    booking = cur.fetchone()
+    if not booking:
+        raise ValueError("Booking not found")
+    availability.check_window(cur, room_id, date, start_time, end_time, booking_id)
+
+    # Equipment hold moves with the booking (checked in this transaction)
+    active = booking['status'] in availability.BLOCKING_STATUSES
+    if active:
+        inventory.release_equipment(cur, booking_id)
+    cur.execute("UPDATE reservations SET room_id=?, date=?, start_time=?, end_time=?, updated_at=? WHERE id=?",
+                (room_id, date, start_time, end_time, timeslots.timestamp(), booking_id))
+    if active:
+        inventory.claim_equipment(cur, booking_id)
+        waitlist.promote(conn, booking['room_id'], booking['date'], booking['start_time'], booking['end_time'])
+    if booking['status'] == 'Pending':
+        pricing.requote_reservation(cur, booking_id)
+    return {"reservation_id": booking_id}
+
+
+def cancel_booking(conn, user_id, booking_id):
+    """Cancel a booking, refunding its payment to the wallet: {refund}"""
+    cur = _begin(conn)
+    cur.execute("""
+        SELECT r.status, r.room_id, r.date, r.start_time, r.end_time,
+               p.amount, p.id AS payment_id, p.transaction_id
+        FROM reservations r
+        LEFT JOIN payments p ON p.reservation_id = r.id AND p.status = 'completed'
+        WHERE r.id = ? AND r.user_id = ?
+    """, (booking_id, user_id))
+    booking = cur.fetchone()
+    if not booking:
+        raise ValueError("Booking not found")
+    # A second cancel must not refund again
+    if booking['status'] == 'Cancelled':
+        raise ValueError("This booking is already cancelled")
+
+    refund = 0
+    if booking['payment_id'] and booking['amount']:
+        refund = booking['amount']
+        ledger.transfer(cur, ledger.REVENUE, ledger.wallet(user_id), refund, "Booking refund",
+                        booking['transaction_id'])
+        cur.execute("UPDATE payments SET status='refunded' WHERE id=?", (booking['payment_id'],))
+
+    # Return equipment to stock
+    if booking['status'] in availability.BLOCKING_STATUSES:
+        inventory.release_equipment(cur, booking_id)
+    cur.execute("UPDATE reservations SET status='Cancelled', held_until=NULL, updated_at=? WHERE id=?",
+                (timeslots.timestamp(), booking_id))
+    if booking['status'] in availability.BLOCKING_STATUSES:
+        waitlist.promote(conn, booking['room_id'], booking['date'], booking['start_time'], booking['end_time'])
+    return {"refund": refund}
@@ -0,0 +1,315 @@
+"""
+Asynchronous payment queue.
+Checkout with a bank payment method no longer waits on the bank inside
+the request: it inserts a payment_jobs row and answers straight away
+with a "processing" page that polls the job. A WorkerPool drains the
+queue in background threads:
+
+    claim   take the oldest queued job (or one whose worker vanished
+            LEASE_SECONDS ago) and mark it processing
+    charge  call the payment backend, holding no database lock
+    record  store the backend's reference on the job (charged_reference)
+    settle  record the payment and confirm the booking (pay_booking)
+            and mark the job succeeded, in one transaction
+
+A job is charged at most once: one that is claimed again after its
+worker died or failed to settle it already carries its reference, and
+goes straight to settle. If the reference cannot be recorded, the charge
+is refunded at once and the job is charged afresh when it is re-claimed.
+
+A declined charge fails the job; a backend that is unavailable puts it
+back in the queue until MAX_ATTEMPTS. If the charge went through but the
+booking can no longer be paid (cancelled meanwhile, not enough funds in
+the ledger), the job fails and the charge is refunded at the backend.
+
+Every database step is a writer operation (see writer.py), so the pool
+works the same with the in-process writer and the coordinator. A backend
+is any object with charge(job) -> reference and refund(reference);
+LocalBank stands in for a real bank with configurable latency and
+failure injection.
+"""
+
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+import holds
+import operations
+import timeslots
+
+log = logging.getLogger(__name__)
+
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+ACTIVE_STATUSES = ("queued", "processing")
+
+
+class Declined(Exception):
+    """The backend refused the charge; retrying will not help"""
+
+
+class Unavailable(Exception):
+    """The backend could not be reached; the job is tried again"""
+
+
+def _job(row):
+    return {key: row[key] for key in row.keys()} if row else None
+
+
+def enqueue(conn, user_id, reservation_id, payment_method, bank_name=None, account_number=None,
+            account_holder=None):
+    """Queue a payment for a Pending booking: {job_id}. A booking already in the queue keeps its job."""
+    cur = operations._begin(conn)
+    cur.execute("SELECT status, held_until FROM reservations WHERE id=? AND user_id=?", (reservation_id, user_id))
+    reservation = cur.fetchone()
+    if not reservation:
+        raise ValueError("Reservation not found")
+    cur.execute(f"""
+        SELECT id FROM payment_jobs
+        WHERE reservation_id=? AND status IN ({','.join('?' * len(ACTIVE_STATUSES))})
+    """, (reservation_id, *ACTIVE_STATUSES))
+    active = cur.fetchone()
+    if active:
+        return {"job_id": active[0]}
+    if reservation[0] != 'Pending':
+        raise ValueError(f"This booking is already {reservation[0].lower()}; nothing to pay")
+    if reservation[1] is not None and not holds.lapsed(reservation):
+        # The bank may take a while; keep the slot for it
+        cur.execute("UPDATE reservations SET held_until=? WHERE id=?", (holds.hold_until(), reservation_id))
+    now = timeslots.timestamp()
+    cur.execute("""
+        INSERT INTO payment_jobs (reservation_id, user_id, payment_method, bank_name, account_number,
+                                  account_holder, status, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?)
+    """, (reservation_id, user_id, payment_method, bank_name, account_number, account_holder, now, now))
+    return {"job_id": cur.lastrowid}
+
+
+def claim(conn, worker=None):
+    """Mark the next job processing and return it (a plain dict), or None when the queue is empty"""
+    stale = (timeslots.now() - timedelta(seconds=LEASE_SECONDS)).strftime("%Y-%m-%d %H:%M:%S")
+    query = """
+        SELECT * FROM payment_jobs
+        WHERE status = 'queued' OR (status = 'processing' AND claimed_at < ?)
+        ORDER BY id LIMIT 1
+    """
+    # Idle workers poll; look before taking the write lock so an empty queue costs a read
+    if not conn.in_transaction and conn.execute(query, (stale,)).fetchone() is None:
+        return None
+    cur = operations._begin(conn)
+    cur.execute(query, (stale,))
+    job = _job(cur.fetchone())
+    if job is None:
+        return None
+    now = timeslots.timestamp()
+    cur.execute("""
+        UPDATE payment_jobs SET status='processing', attempts=attempts + 1, worker=?, claimed_at=?, updated_at=?
+        WHERE id=?
+    """, (worker, now, now, job['id']))
+    job.update(status='processing', attempts=job['attempts'] + 1, worker=worker, claimed_at=now)
+    return job
+
+
+def _finish(cur, job_id, status, error=None, transaction_id=None):
+    cur.execute("UPDATE payment_jobs SET status=?, error=?, transaction_id=?, updated_at=? WHERE id=?",
+                (status, error, transaction_id, timeslots.timestamp(), job_id))
+
+
+def record_charge(conn, job_id, reference):
+    """
+    Store a charge's reference on its job: {reference} of the charge that counts, the first one
+    recorded (a worker whose lease ran out mid-charge finds another's and refunds its own)
+    """
+    cur = operations._begin(conn)
+    cur.execute("UPDATE payment_jobs SET charged_reference=?, updated_at=? "
+                "WHERE id=? AND charged_reference IS NULL", (reference, timeslots.timestamp(), job_id))
+    cur.execute("SELECT charged_reference FROM payment_jobs WHERE id=?", (job_id,))
+    row = cur.fetchone()
+    if not row:
+        raise ValueError("Payment job not found")
+    return {"reference": row[0]}
+
+
+def settle(conn, job_id, reference):
+    """Record a charged job's payment and confirm the booking: {status, transaction_id or error}"""
+    cur = operations._begin(conn)
+    cur.execute("SELECT * FROM payment_jobs WHERE id=?", (job_id,))
+    job = cur.fetchone()
+    if not job:
+        raise ValueError("Payment job not found")
+    if job['status'] != 'processing':
+        return {"status": job['status'], "transaction_id": job['transaction_id'], "error": job['error']}
+    # pay_booking's refusals must not undo marking the job failed
+    cur.execute("SAVEPOINT settle")
+    try:
+        paid = operations.pay_booking(conn, job['user_id'], job['reservation_id'], job['payment_method'],
+                                      job['bank_name'], job['account_number'], job['account_holder'],
+                                      transaction_id=reference)
+    except ValueError as e:
+        cur.execute("ROLLBACK TO settle")
+        cur.execute("RELEASE settle")
+        _finish(cur, job_id, 'failed', error=str(e))
+        return {"status": "failed", "transaction_id": None, "error": str(e)}
+    cur.execute("RELEASE settle")
+    _finish(cur, job_id, 'succeeded', transaction_id=paid['transaction_id'])
+    return {"status": "succeeded", "transaction_id": paid['transaction_id'], "error": None}
+
+
+def retry(conn, job_id, error):
+    """Put a job back in the queue after a transient failure, or fail it after MAX_ATTEMPTS: {status}"""
+    cur = operations._begin(conn)
+    cur.execute("SELECT attempts FROM payment_jobs WHERE id=?", (job_id,))
+    row = cur.fetchone()
+    if not row:
+        raise ValueError("Payment job not found")
+    status = 'failed' if row[0] >= MAX_ATTEMPTS else 'queued'
+    _finish(cur, job_id, status, error=error)
+    return {"status": status}
+
+
+def fail(conn, job_id, error):
+    """Fail a job for good: {status}"""
+    _finish(operations._begin(conn), job_id, 'failed', error=error)
+    return {"status": "failed"}
+
+
+def job_status(cur, job_id, user_id):
+    """The job row for its owner, or None"""
+    cur.execute("SELECT * FROM payment_jobs WHERE id=? AND user_id=?", (job_id, user_id))
+    return cur.fetchone()
+
+
+class LocalBank:
+    """
+    Stand-in payment backend: every call waits `latency` seconds, and a
+    share of charges is declined (decline_rate) or times out (outage_rate)
+    """
+
+    def __init__(self, latency=0.0, decline_rate=0.0, outage_rate=0.0, seed=None):
+        self.latency = latency
+        self.decline_rate = decline_rate
+        self.outage_rate = outage_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.charged = []
+        self.refunded = []
+
+    def charge(self, job):
+        time.sleep(self.latency)
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.outage_rate:
+            raise Unavailable("The bank did not respond")
+        if roll < self.outage_rate + self.decline_rate:
+            raise Declined("The bank declined the payment")
+        reference = f"TXN-{int(time.time())}-J{job['id']}-{uuid.uuid4().hex[:6].upper()}"
+        self.charged.append(reference)
+        return reference
+
+    def refund(self, reference):
+        time.sleep(self.latency)
+        self.refunded.append(reference)
+
+
+class WorkerPool:
+    """Background threads that drain payment_jobs through `writes` (a writer) and `backend`"""
+
+    def __init__(self, writes, backend, workers=4, poll_interval=1.0):
+        self.writes = writes
+        self.backend = backend
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.processed = 0
+        self._wake = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the workers (once; later calls do nothing)"""
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            self._threads = [threading.Thread(target=self._work, args=(f"payments-{n}",), daemon=True)
+                             for n in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+
+    def wake(self):
+        """A job was queued in this process: one idle worker takes it without waiting for the next poll"""
+        with self._wake:
+            self._wake.notify()
+
+    def stop(self):
+        self._stop.set()
+        with self._wake:
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _work(self, name):
+        while not self._stop.is_set():
+            try:
+                job = self.writes.call("claim_payment", worker=name)
+            except (ValueError, sqlite3.Error, EOFError, OSError) as e:
+                # A coordinator that went away (EOFError/OSError) is reconnected on the next call;
+                # until then the worker backs off like an idle one rather than dying
+                log.warning("%s could not claim a payment job: %s", name, e)
+                job = None
+            if job is None:
+                # Jobs queued by other processes are picked up on the next poll
+                with self._wake:
+                    self._wake.wait(self.poll_interval)
+                continue
+            try:
+                self.process(job)
+            except Exception:
+                # The job stays processing and is claimed again once its lease runs out;
+                # a recorded charge is settled then rather than charged again
+                pass
+
+    def process(self, job):
+        """Charge one claimed job (unless a charge for it is already recorded) and settle it"""
+        reference = job.get('charged_reference')
+        if reference is None:
+            reference = self._charge(job)
+            if reference is None:
+                return
+        try:
+            outcome = self.writes.call("settle_payment", job_id=job['id'], reference=reference)
+        except ValueError:
+            # The job (and its booking) was deleted while the bank was charging
+            self.backend.refund(reference)
+            return
+        # Failed, or settled by another worker after this one's lease ran out: give the money back
+        if outcome['transaction_id'] != reference:
+            self.backend.refund(reference)
+        self.processed += 1
+
+    def _charge(self, job):
+        """Charge the backend and record the reference; None if there is nothing to settle"""
+        try:
+            reference = self.backend.charge(job)
+        except Declined as e:
+            self.writes.call("fail_payment", job_id=job['id'], error=str(e))
+            return None
+        except Exception as e:
+            # Anything else from the backend (timeouts, connection errors) is worth another try
+            self.writes.call("retry_payment", job_id=job['id'], error=str(e) or type(e).__name__)
+            return None
+        try:
+            recorded = self.writes.call("record_charge", job_id=job['id'], reference=reference)['reference']
+        except Exception:
+            # Unrecorded, the charge would be made again on re-claim: give it back now
+            self.backend.refund(reference)
+            raise
+        if recorded != reference:
+            self.backend.refund(reference)
+            return None
+        return reference
@@ -0,0 +1,248 @@
+"""
+Booking price quotes.
+The quote (rate snapshot, hours, room cost, equipment cost, total) is
+computed once when a reservation is created and stored on the reservation
+row. Checkout and receipt read the stored quote instead of recomputing it.
+
+Room cost comes from a rate table: every room has its base price_per_hour,
+overridden by room_rates rules for peak/off-peak hours and weekdays. The
+table is expanded into a NumPy array of cumulative costs
+(room x weekday x slot boundary) on the current slot grid, so any window
+for any number of rooms is priced with two array lookups and one subtraction.
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+import timeslots
+from timeslots import calculate_hours, label_minutes
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def weekday_of(date):
+    """Weekday (Mon=0) of a YYYY-MM-DD string"""
+    return datetime.strptime(date, "%Y-%m-%d").weekday()
+
+
+def weekdays_of(dates):
+    """Vectorised weekday_of for a sequence of YYYY-MM-DD strings"""
+    days = np.array(dates, dtype="datetime64[D]").astype(np.int64)
+    return (days + 3) % 7  # 1970-01-01 was a Thursday
+
+
+# ================= RATE TABLE =================
+class RateTable:
+    """Hourly rates for a set of rooms, expanded to room x weekday x slot"""
+
+    def __init__(self, room_ids, base_rates, rules=(), grid=None):
+        self.grid = grid or timeslots.grid()
+        self.room_ids = np.asarray(room_ids, dtype=np.int64)
+        self.room_index = {int(r): i for i, r in enumerate(self.room_ids)}
+        slot_starts = np.array(self.grid.minutes[:-1])
+        n_slots = self.grid.n_slots
+
+        rates = np.empty((len(self.room_ids), 7, n_slots))
+        rates[:] = np.asarray(base_rates, dtype=float).reshape(-1, 1, 1)
+
+        # Least specific first, so room/weekday specific rules win
+        for rule in sorted(rules, key=lambda r: ((r["room_id"] is not None) * 2 + (r["weekday"] is not None))):
+            if rule["room_id"] is None:
+                rows = slice(None)
+            elif int(rule["room_id"]) in self.room_index:
+                rows = self.room_index[int(rule["room_id"])]
+            else:
+                continue
+            days = slice(None) if rule["weekday"] is None else int(rule["weekday"])
+            slots = (slot_starts >= rule["start_minute"]) & (slot_starts < rule["end_minute"])
+            rates[rows, days, slots] = rule["rate"]
+
+        self.rates = rates
+        # cum[room, weekday, i] = cost of slots [0, i)
+        self.cum = np.zeros((len(self.room_ids), 7, n_slots + 1))
+        np.cumsum(rates * (self.grid.slot_minutes / 60), axis=2, out=self.cum[:, :, 1:])
+
+    @classmethod
+    def from_db(cls, cur, room_ids=None, grid=None):
+        """Load base prices and rate rules (optionally only for some rooms)"""
+        if room_ids is None:
+            cur.execute("SELECT id, COALESCE(price_per_hour, 0) AS rate FROM rooms ORDER BY id")
+        else:
+            ids = [int(r) for r in room_ids]
+            placeholders = ",".join("?" * len(ids))
+            cur.execute(f"SELECT id, COALESCE(price_per_hour, 0) AS rate FROM rooms WHERE id IN ({placeholders}) ORDER BY id", ids)
+        rooms = cur.fetchall()
+        cur.execute("SELECT room_id, weekday, start_minute, end_minute, rate FROM room_rates")
+        rules = [dict(r) for r in cur.fetchall()]
+        return cls([r["id"] for r in rooms], [r["rate"] for r in rooms], rules, grid)
+
+    def quote_window(self, weekday, start_idx, end_idx):
+        """Room cost of one window for every room (array aligned with room_ids)"""
+        return self.cum[:, weekday, end_idx] - self.cum[:, weekday, start_idx]
+
+    def quote_many(self, room_ids, weekdays, start_idx, end_idx):
+        """Room cost for many (room, weekday, window) combinations at once"""
+        rows = np.fromiter((self.room_index[int(r)] for r in room_ids), dtype=np.int64, count=len(room_ids))
+        weekdays = np.asarray(weekdays, dtype=np.int64)
+        start_idx = np.asarray(start_idx, dtype=np.int64)
+        end_idx = np.asarray(end_idx, dtype=np.int64)
+        return self.cum[rows, weekdays, end_idx] - self.cum[rows, weekdays, start_idx]
+
+
+def window_prices(cur, date, start_time, end_time):
+    """{room_id: room cost} for one date/window across all rooms"""
+    window = timeslots.grid().window(start_time, end_time)
+    if not window:
+        return {}
+    table = RateTable.from_db(cur)
+    costs = table.quote_window(weekday_of(date), *window)
+    return {int(r): round(float(c), 2) for r, c in zip(table.room_ids, costs)}
+
+
+# ================= QUOTES =================
+def equipment_cost(cur, equipment_ids):
+    """Total price of the given equipment, fetched in one query"""
+    try:
+        ids = [int(i) for i in equipment_ids]
+    except ValueError:
+        raise ValueError("Invalid equipment ID")
+    if not ids:
+        return 0
+    placeholders = ",".join("?" * len(set(ids)))
+    cur.execute(f"SELECT id, price FROM equipment WHERE id IN ({placeholders})", tuple(set(ids)))
+    prices = {row["id"]: row["price"] for row in cur.fetchall()}
+    missing = [i for i in ids if i not in prices]
+    if missing:
+        raise ValueError(f"Invalid equipment ID: {missing[0]}")
+    return sum(prices[i] for i in ids)
+
+
+def make_quote(hours, room_cost, equip_cost):
+    room_cost = round(float(room_cost), 2)
+    return {
+        "quoted_rate": round(room_cost / hours, 2) if hours else 0,
+        "quoted_hours": hours,
+        "room_cost": room_cost,
+        "equipment_cost": equip_cost,
+        "total_cost": round(room_cost + equip_cost, 2),
+    }
+
+
+def quote_booking(cur, room_id, date, start_time, end_time, equipment_ids=()):
+    """Build the quote for a new booking"""
+    window = timeslots.grid().window(start_time, end_time)
+    if not window:
+        raise ValueError("End time must be after start time")
+    try:
+        weekday = weekday_of(date)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid date")
+    table = RateTable.from_db(cur, [room_id])
+    if int(room_id) not in table.room_index:
+        raise ValueError("Invalid room ID")
+    room_cost = table.quote_many([room_id], [weekday], [window[0]], [window[1]])[0]
+    return make_quote(calculate_hours(start_time, end_time), room_cost, equipment_cost(cur, equipment_ids))
+
+
+def stored_quote(reservation):
+    """Quote saved on a reservation row, or None for rows booked before quotes existed"""
+    if reservation["total_cost"] is None:
+        return None
+    return {
+        "quoted_rate": reservation["quoted_rate"],
+        "quoted_hours": reservation["quoted_hours"],
+        "room_cost": reservation["room_cost"],
+        "equipment_cost": reservation["equipment_cost"] or 0,
+        "total_cost": reservation["total_cost"],
+    }
+
+
+def save_quote(cur, reservation_id, quote):
+    cur.execute("""
+        UPDATE reservations
+        SET quoted_rate=?, quoted_hours=?, room_cost=?, equipment_cost=?, total_cost=?
+        WHERE id=?
+    """, (quote["quoted_rate"], quote["quoted_hours"], quote["room_cost"],
+          quote["equipment_cost"], quote["total_cost"], reservation_id))
+
+
+def quote_rows(cur, rows):
+    """
+    Quote existing reservation rows (id, room_id, date, start_time,
+    end_time, equipment_cost) in one vectorised pass. Rows whose times are
+    off the current grid, or with an unknown date or room, are skipped. Returns {reservation_id: quote}.
+    """
+    grid = timeslots.grid()
+    valid = []
+    for r in rows:
+        if grid.window(r["start_time"], r["end_time"]):
+            try:
+                weekday_of(r["date"])
+                valid.append(r)
+            except (TypeError, ValueError):
+                pass
+    if not valid:
+        return {}
+    table = RateTable.from_db(cur, {r["room_id"] for r in valid if str(r["room_id"]).isdigit()})
+    valid = [r for r in valid if str(r["room_id"]).isdigit() and int(r["room_id"]) in table.room_index]
+    if not valid:
+        return {}
+    costs = table.quote_many(
+        [r["room_id"] for r in valid],
+        weekdays_of([r["date"] for r in valid]),
+        [grid.index[r["start_time"]] for r in valid],
+        [grid.index[r["end_time"]] for r in valid],
+    )
+    return {
+        r["id"]: make_quote(calculate_hours(r["start_time"], r["end_time"]), cost, r["equipment_cost"] or 0)
+        for r, cost in zip(valid, costs)
+    }
+
+
+# Rows booked before quotes were stored have no total_cost; their equipment_cost column reads its
+# default 0, so their equipment is summed from the linked rows instead
+RESERVATION_QUOTE_COLUMNS = """
+    r.id, r.room_id, r.date, r.start_time, r.end_time,
+    CASE WHEN r.total_cost IS NULL
+         THEN COALESCE((SELECT SUM(e.price)
+                        FROM reservation_equipment re
+                        JOIN equipment e ON re.equipment_id = e.id
+                        WHERE re.reservation_id = r.id), 0)
+         ELSE COALESCE(r.equipment_cost, 0)
+    END AS equipment_cost
+"""
+
+
+def quote_reservation(cur, reservation_id):
+    """Quote an existing reservation from the current rate table and its linked equipment"""
+    cur.execute(f"SELECT {RESERVATION_QUOTE_COLUMNS} FROM reservations r WHERE r.id=?", (reservation_id,))
+    return quote_rows(cur, cur.fetchall()).get(reservation_id)
+
+
+def requote_reservation(cur, reservation_id):
+    """Re-quote a single reservation in place (after its room or time changes)"""
+    quote = quote_reservation(cur, reservation_id)
+    if quote:
+        save_quote(cur, reservation_id, quote)
+    return quote
+
+
+def requote_pending(conn, room_id=None):
+    """
+    Re-price Pending reservations after a room's price or rate table changes.
+    All rows are quoted in one vectorised pass and written with executemany.
+    Runs inside the caller's transaction; returns the number re-quoted.
+    """
+    cur = conn.cursor()
+    room_filter = "" if room_id is None else " AND r.room_id=?"
+    params = () if room_id is None else (room_id,)
+    cur.execute(f"SELECT {RESERVATION_QUOTE_COLUMNS} FROM reservations r WHERE r.status='Pending'{room_filter}", params)
+    quotes = quote_rows(cur, cur.fetchall())
+    cur.executemany("""
+        UPDATE reservations
+        SET quoted_rate=?, quoted_hours=?, room_cost=?, equipment_cost=?, total_cost=?
+        WHERE id=?
+    """, [(q["quoted_rate"], q["quoted_hours"], q["room_cost"], q["equipment_cost"], q["total_cost"], rid)
+          for rid, q in quotes.items()])
+    return len(quotes)
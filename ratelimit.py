@@ -0,0 +1,128 @@
+"""
+Token-bucket rate limiting for expensive routes.
+Each (route, key) pair has a bucket holding up to `burst` tokens that
+refills at `per_minute` tokens a minute; a request takes one token or is
+refused with the number of seconds until the next token. Keys are the
+client IP and, once logged in, the user id, so one script cannot burn
+bcrypt or write locks for everybody else.
+
+Buckets live in a dict in this process by default (MemoryStore, a few
+microseconds per check). SqliteStore keeps them in a small table of a
+separate database file instead, so all workers on a host share one
+budget; one upsert per check decides and updates the bucket atomically.
+"""
+
+import math
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+Budget = namedtuple("Budget", "burst per_minute")
+
+
+class MemoryStore:
+    """Buckets in a dict of this process"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}    # key -> (tokens, updated, full_at)
+        self._lock = threading.Lock()
+
+    def take(self, key, burst, rate, now):
+        """Take a token; returns 0 if allowed, else seconds until one is available"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            tokens = burst if bucket is None else min(burst, bucket[0] + max(0.0, now - bucket[1]) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return wait
+
+    def _prune(self, now):
+        # A bucket that has refilled completely is the same as no bucket
+        self._buckets = {k: b for k, b in self._buckets.items() if b[2] > now}
+
+
+class SqliteStore:
+    """Buckets in a table shared by every process using the same file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit: every check is one statement; losing buckets on a crash is harmless
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, burst, rate, now):
+        """Take a token; returns 0 if allowed, else seconds until one is available"""
+        conn = self._conn()
+        params = {"key": key, "burst": burst, "rate": rate, "now": now}
+        cur = conn.execute("""
+            INSERT INTO rate_buckets (key, tokens, updated) VALUES (:key, :burst - 1, :now)
+            ON CONFLICT(key) DO UPDATE
+            SET tokens = MIN(:burst, tokens + MAX(0, :now - updated) * :rate) - 1, updated = :now
+            WHERE MIN(:burst, tokens + MAX(0, :now - updated) * :rate) >= 1
+        """, params)
+        if cur.rowcount:
+            return 0.0
+        row = conn.execute("""
+            SELECT MIN(:burst, tokens + MAX(0, :now - updated) * :rate) FROM rate_buckets WHERE key = :key
+        """, params).fetchone()
+        return (1 - row[0]) / rate if row else 0.0
+
+    def prune(self, now, max_age=3600):
+        """Drop buckets untouched for max_age seconds"""
+        self._conn().execute("DELETE FROM rate_buckets WHERE updated < ?", (now - max_age,))
+
+
+class RateLimiter:
+    def __init__(self, budgets, store=None, clock=time.time):
+        self.budgets = budgets
+        self.store = store or MemoryStore()
+        self.clock = clock
+        self.enabled = True
+        self.limited = {route: 0 for route in budgets}
+
+    def check(self, route, *keys):
+        """
+        Take a token for every key (e.g. 'ip:1.2.3.4', 'user:7') on a route.
+        Returns 0 if the request may go ahead, else whole seconds to wait.
+        Routes without a budget are not limited.
+        """
+        budget = self.budgets.get(route)
+        if budget is None or not self.enabled:
+            return 0
+        now = self.clock()
+        rate = budget.per_minute / 60.0
+        wait = max(self.store.take(f"{route}|{key}", budget.burst, rate, now) for key in keys)
+        if wait:
+            self.limited[route] += 1
+            return math.ceil(wait)
+        return 0
+
+    def metrics_text(self):
+        """Refused requests per route, Prometheus text format"""
+        lines = ["# HELP ratelimit_limited_total Requests refused by the rate limiter",
+                 "# TYPE ratelimit_limited_total counter"]
+        lines += [f'ratelimit_limited_total{{route="{route}"}} {count}' for route, count in self.limited.items()]
+        return "\n".join(lines) + "\n"
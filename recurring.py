@@ -0,0 +1,150 @@
+"""
+Recurring reservations.
+A series (every week, or every N days, until a date) is expanded in
+Python, checked against existing bookings with one set-based query, priced
+in one vectorised pass and inserted with executemany, all inside a single
+transaction. Every occurrence gets a line in the returned report, so the
+caller can show which dates were booked and which were skipped and why.
+"""
+
+import json
+from datetime import datetime, timedelta
+
+import availability
+import holds
+import pricing
+import timeslots
+
+MAX_OCCURRENCES = 366
+
+
+def expand_dates(first_date, until_date, interval_days=7):
+    """Dates of a series, first_date included, until_date inclusive"""
+    try:
+        start = datetime.strptime(first_date, "%Y-%m-%d").date()
+        until = datetime.strptime(until_date, "%Y-%m-%d").date()
+        interval_days = int(interval_days)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid repeat settings")
+    if interval_days < 1:
+        raise ValueError("Repeat interval must be at least 1 day")
+    if until < start:
+        raise ValueError("Repeat-until date must be on or after the first date")
+    count = (until - start).days // interval_days + 1
+    if count > MAX_OCCURRENCES:
+        raise ValueError(f"A series can have at most {MAX_OCCURRENCES} occurrences")
+    return [(start + timedelta(days=i * interval_days)).isoformat() for i in range(count)]
+
+
+def occurrence_conflicts(cur, room_id, dates, start_minute, end_minute):
+    """{date: reason} for every occurrence that cannot be booked"""
+    conflicts = {}
+
+    # Opening hours: at most one lookup per weekday in the series
+    by_weekday = {}
+    for d in dates:
+        by_weekday.setdefault(datetime.strptime(d, "%Y-%m-%d").weekday(), []).append(d)
+    for weekday, days in by_weekday.items():
+        opens, closes = availability.room_hours(cur, [room_id], weekday)
+        if opens[0] >= closes[0]:
+            reason = "Room closed"
+        elif start_minute < opens[0] or end_minute > closes[0]:
+            reason = (f"Room open {timeslots.format_minutes(opens[0])} - "
+                      f"{timeslots.format_minutes(closes[0])}")
+        else:
+            continue
+        conflicts.update((d, reason) for d in days)
+
+    # Maintenance closures covering any occurrence
+    cur.execute("""
+        SELECT DISTINCT d.value AS date FROM json_each(?) d
+        JOIN room_closures c ON c.room_id=? AND d.value BETWEEN c.start_date AND c.end_date
+    """, (json.dumps(dates), room_id))
+    for row in cur.fetchall():
+        conflicts[row["date"]] = "Room offline"
+
+    # Dates allocated by an open lottery can only be requested one at a time
+    cur.execute("""
+        SELECT DISTINCT d.value AS date FROM json_each(?) d
+        JOIN lottery_windows w ON w.status='open' AND d.value BETWEEN w.start_date AND w.end_date
+    """, (json.dumps(dates),))
+    for row in cur.fetchall():
+        conflicts.setdefault(row["date"], "Lottery date")
+
+    # Existing bookings: one query for the whole series
+    placeholders = ",".join("?" * len(availability.BLOCKING_STATUSES))
+    cur.execute(f"""
+        SELECT DISTINCT date FROM reservations
+        WHERE date IN (SELECT value FROM json_each(?)) AND room_id=?
+        AND status IN ({placeholders}) AND {holds.ACTIVE_HOLD_SQL} AND start_minute < ? AND end_minute > ?
+    """, (json.dumps(dates), room_id, *availability.BLOCKING_STATUSES, timeslots.timestamp(),
+          end_minute, start_minute))
+    for row in cur.fetchall():
+        conflicts.setdefault(row["date"], "Already booked")
+    return conflicts
+
+
+def book_series(conn, user_id, room_id, first_date, until_date, start_time, end_time,
+                interval_days=7, num_people=1, skip_conflicts=True):
+    """
+    Book every free occurrence of a series as Pending reservations, held until the payment
+    deadline (holds.payment_deadline).
+    With skip_conflicts=False nothing is booked if any occurrence conflicts.
+    Returns (series_id or None, report); the caller commits.
+    """
+    grid = timeslots.grid()
+    if not grid.window(start_time, end_time):
+        raise ValueError("End time must be after start time")
+    dates = expand_dates(first_date, until_date, interval_days)
+
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM rooms WHERE id=?", (room_id,))
+    if not cur.fetchone():
+        raise ValueError("Invalid room ID")
+
+    # Hold the write lock from the conflict check until the inserts
+    if not conn.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")
+
+    start_minute, end_minute = timeslots.label_minutes(start_time), timeslots.label_minutes(end_time)
+    conflicts = occurrence_conflicts(cur, room_id, dates, start_minute, end_minute)
+    report = [{"date": d, "status": "conflict", "reason": conflicts[d], "reservation_id": None}
+              if d in conflicts else
+              {"date": d, "status": "booked", "reason": "", "reservation_id": None}
+              for d in dates]
+    free = [d for d in dates if d not in conflicts]
+    if not free or (conflicts and not skip_conflicts):
+        for line in report:
+            if line["status"] == "booked":
+                line["status"], line["reason"] = "skipped", "Series not booked"
+        return None, report
+
+    now = timeslots.timestamp()
+    held_until = holds.payment_deadline()
+    cur.execute("""
+        INSERT INTO reservation_series (user_id, room_id, start_time, end_time, first_date, until_date,
+                                        interval_days, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (user_id, room_id, start_time, end_time, first_date, until_date, int(interval_days), now))
+    series_id = cur.lastrowid
+
+    # Price every occurrence in one vectorised pass
+    quotes = pricing.quote_rows(cur, [
+        {"id": d, "room_id": room_id, "date": d, "start_time": start_time, "end_time": end_time, "equipment_cost": 0}
+        for d in free
+    ])
+    cur.executemany("""
+        INSERT INTO reservations (user_id, room_id, date, start_time, end_time, num_people, status,
+                                  quoted_rate, quoted_hours, room_cost, equipment_cost, total_cost,
+                                  series_id, held_until, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, 'Pending', ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(user_id, room_id, d, start_time, end_time, num_people,
+           quotes[d]["quoted_rate"], quotes[d]["quoted_hours"], quotes[d]["room_cost"],
+           quotes[d]["equipment_cost"], quotes[d]["total_cost"], series_id, held_until, now, now)
+          for d in free])
+
+    cur.execute("SELECT id, date FROM reservations WHERE series_id=?", (series_id,))
+    ids = {row["date"]: row["id"] for row in cur.fetchall()}
+    for line in report:
+        line["reservation_id"] = ids.get(line["date"])
+    return series_id, report
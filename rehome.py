@@ -0,0 +1,108 @@
+"""
+Re-homing displaced bookings.
+When a room goes offline its bookings can usually move to another room
+with enough capacity that is free for the same slots. For each date the
+occupancy of every available room is loaded once (availability.DayOccupancy)
+and bookings are placed greedily, hardest first (largest group, then
+longest), each into the free room with the tightest capacity that fits.
+Every placement is painted onto the matrix so later bookings see it.
+
+Moves keep the booking's date, time, price and equipment; only room_id
+changes. plan_moves() only reads, so it doubles as the dry run.
+"""
+
+import json
+
+import numpy as np
+
+import availability
+import timeslots
+
+
+def _displaced(cur, reservation_ids):
+    placeholders = ",".join("?" * len(availability.BLOCKING_STATUSES))
+    cur.execute(f"""
+        SELECT r.id, r.room_id, rm.room_name, r.date, r.start_time, r.end_time,
+               r.start_minute, r.end_minute, COALESCE(r.num_people, 1) AS num_people
+        FROM reservations r LEFT JOIN rooms rm ON rm.id = r.room_id
+        WHERE r.id IN (SELECT value FROM json_each(?)) AND r.status IN ({placeholders})
+        ORDER BY r.date, r.id
+    """, (json.dumps(sorted({int(i) for i in reservation_ids})), *availability.BLOCKING_STATUSES))
+    return [dict(row) for row in cur.fetchall()]
+
+
+def _hardest_first(booking):
+    length = (booking["end_minute"] or 0) - (booking["start_minute"] or 0)
+    return -booking["num_people"], -length, booking["id"]
+
+
+def plan_moves(cur, reservation_ids):
+    """
+    Report line per Pending/Confirmed booking in reservation_ids:
+    {id, date, start_time, end_time, num_people, from_room, from_room_name,
+     to_room, to_room_name, status 'moved'/'unplaced', reason}.
+    Nothing is written.
+    """
+    bookings = _displaced(cur, reservation_ids)
+    if not bookings:
+        return []
+    sources = {b["room_id"] for b in bookings}
+
+    # Candidate rooms: available, not one of the rooms being emptied
+    cur.execute("SELECT id, room_name, capacity FROM rooms WHERE status='available' ORDER BY id")
+    rooms = [r for r in cur.fetchall() if r["id"] not in sources]
+    room_ids = [r["id"] for r in rooms]
+    names = {r["id"]: r["room_name"] for r in rooms}
+    capacity = np.array([r["capacity"] or 0 for r in rooms], dtype=np.int64)
+
+    by_date = {}
+    for b in bookings:
+        b.update(from_room=b.pop("room_id"), from_room_name=b.pop("room_name"),
+                 to_room=None, to_room_name=None, status="unplaced", reason="")
+        by_date.setdefault(b["date"], []).append(b)
+
+    for date, day in by_date.items():
+        # room_ids is sorted, so capacity lines up with the occupancy rows
+        occupancy = availability.DayOccupancy.load(cur, date, room_ids) if room_ids else None
+        for b in sorted(day, key=_hardest_first):
+            if occupancy is None:
+                b["reason"] = "No other rooms available"
+                continue
+            if b["start_minute"] is None or b["end_minute"] is None:
+                b["reason"] = "Invalid booking time"
+                continue
+            first, last = occupancy.span(b["start_minute"], b["end_minute"])
+            if first >= last:
+                b["reason"] = "Outside opening hours"
+                continue
+            free = ~occupancy.busy[:, first:last].any(axis=1)
+            fits = free & (capacity >= b["num_people"])
+            if not fits.any():
+                b["reason"] = "No free room with enough capacity" if free.any() else "No free room at that time"
+                continue
+            # Tightest fit: smallest capacity that holds the group (lowest id on ties)
+            row = int(np.argmin(np.where(fits, capacity, np.iinfo(np.int64).max)))
+            occupancy.busy[row, first:last] = True
+            b["to_room"] = int(occupancy.room_ids[row])
+            b["to_room_name"] = names[b["to_room"]]
+            b["status"] = "moved"
+    return bookings
+
+
+def apply_moves(cur, plan):
+    """Move every 'moved' line of a plan; returns the number of bookings moved"""
+    now = timeslots.timestamp()
+    moves = [(line["to_room"], now, line["id"], line["from_room"]) for line in plan if line["status"] == "moved"]
+    cur.executemany("UPDATE reservations SET room_id=?, updated_at=? WHERE id=? AND room_id=?", moves)
+    return len(moves)
+
+
+def rehome_bookings(conn, reservation_ids, dry_run=False):
+    """Plan and (unless dry_run) apply moves under one write lock; the caller commits"""
+    cur = conn.cursor()
+    if not dry_run and not conn.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")
+    plan = plan_moves(cur, reservation_ids)
+    if not dry_run:
+        apply_moves(cur, plan)
+    return plan
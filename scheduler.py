@@ -0,0 +1,268 @@
+"""
+In-process job scheduler with leader election across web workers.
+Every worker process starts a Scheduler, but only the one holding the
+lease row in scheduler_lease runs jobs. The leader renews the lease
+every LEASE_SECONDS / 3; if it dies, the lease runs out and the first
+worker to see that takes over. A worker whose renewal fails stops
+running jobs before its lease could have passed to someone else.
+
+Jobs are registered with a cron expression (minute hour day month
+weekday, with *, */n, a-b and lists, or @hourly / @daily / @weekly) and
+run in a small thread pool, each on its own connection. A job is a
+function of a connection; whatever it returns goes to job_runs along
+with when it started, how long it took and any error: an int is the
+number of rows it handled, a dict is stored as JSON (its 'processed'
+entry, if any, as the count).
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import timeslots
+
+LEASE_SECONDS = 30
+TICK_SECONDS = 1.0
+WORKERS = 4
+
+_ALIASES = {"@hourly": "0 * * * *", "@daily": "0 0 * * *", "@weekly": "0 0 * * 0"}
+_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))    # weekday 7 is Sunday too
+
+
+def _field(text, low, high):
+    values = set()
+    for part in text.split(","):
+        step = 1
+        if "/" in part:
+            part, step = part.split("/")
+            step = int(step)
+        if part == "*":
+            first, last = low, high
+        elif "-" in part:
+            first, last = (int(p) for p in part.split("-"))
+        else:
+            first = last = int(part)
+        if first < low or last > high or first > last or step < 1:
+            raise ValueError(f"'{text}' is out of range {low}-{high}")
+        values.update(range(first, last + 1, step))
+    return values
+
+
+class Cron:
+    """A cron schedule at minute resolution; weekday 0 is Sunday"""
+
+    def __init__(self, expr):
+        self.expr = expr
+        fields = _ALIASES.get(expr, expr).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: '{expr}'")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _field(text, low, high) for text, (low, high) in zip(fields, _RANGES))
+        self.weekdays = {day % 7 for day in weekdays}
+
+    def matches(self, moment):
+        return (moment.minute in self.minutes and moment.hour in self.hours and moment.day in self.days
+                and moment.month in self.months and (moment.weekday() + 1) % 7 in self.weekdays)
+
+    def next_after(self, moment):
+        """First matching minute strictly after moment (naive or aware, kept as given)"""
+        t = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        give_up = t + timedelta(days=366 * 8)     # long enough for 29 February on a given weekday
+        while t < give_up:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif t.day not in self.days or (t.weekday() + 1) % 7 not in self.weekdays:
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"'{self.expr}' never matches")
+
+
+class Job:
+    def __init__(self, name, cron, func):
+        self.name = name
+        self.cron = Cron(cron)
+        self.func = func
+        self.next_run = None
+        self.running = False
+
+
+def record_run(conn, job, started_at, duration_ms, processed, detail=None, error=None, runner=None):
+    """One row of job_runs; committed"""
+    conn.execute("""
+        INSERT INTO job_runs (job, started_at, duration_ms, processed, detail, error, runner)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (job, started_at, duration_ms, processed, detail, error, runner))
+    conn.commit()
+
+
+def run_job(conn, name, func, runner=None):
+    """Run func(conn) once and record it in job_runs; returns its result (None if it failed)"""
+    started_at = timeslots.timestamp()
+    t = time.perf_counter()
+    result = processed = detail = error = None
+    try:
+        result = func(conn)
+    except Exception as e:
+        # A broken job is recorded and tried again next time; it must not take the scheduler down
+        if conn.in_transaction:
+            conn.rollback()
+        error = f"{type(e).__name__}: {e}"
+    duration_ms = round((time.perf_counter() - t) * 1000, 1)
+    if isinstance(result, int):
+        processed = result
+    elif isinstance(result, dict):
+        processed = result.get("processed")
+        detail = json.dumps(result, default=str)
+    elif result is not None:
+        detail = str(result)
+    record_run(conn, name, started_at, duration_ms, processed, detail, error, runner)
+    return result
+
+
+def acquire_lease(conn, holder, lease_seconds=LEASE_SECONDS, now=None):
+    """Take or renew the scheduler lease; True if holder has it until now + lease_seconds"""
+    now = time.time() if now is None else now
+    conn.execute("""
+        INSERT INTO scheduler_lease (id, holder, expires_at) VALUES (1, :holder, :expires)
+        ON CONFLICT(id) DO UPDATE SET holder = :holder, expires_at = :expires
+        WHERE scheduler_lease.holder = :holder OR scheduler_lease.expires_at < :now
+    """, {"holder": holder, "expires": now + lease_seconds, "now": now})
+    conn.commit()
+    row = conn.execute("SELECT holder FROM scheduler_lease WHERE id = 1").fetchone()
+    return row is not None and row[0] == holder
+
+
+def release_lease(conn, holder):
+    conn.execute("DELETE FROM scheduler_lease WHERE id = 1 AND holder = ?", (holder,))
+    conn.commit()
+
+
+class Scheduler:
+    def __init__(self, connect, workers=WORKERS, lease_seconds=LEASE_SECONDS, tick=TICK_SECONDS, holder=None):
+        self.connect = connect
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.tick = tick
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.jobs = {}
+        self._leader_until = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def register(self, name, cron, func):
+        """Run func(conn) on the cron schedule (while this process is the leader)"""
+        self.jobs[name] = Job(name, cron, func)
+
+    @property
+    def is_leader(self):
+        return time.time() < self._leader_until
+
+    def start(self):
+        """Start the scheduler thread (once; later calls do nothing)"""
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Stop scheduling, wait for running jobs and hand the lease back"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self._pool.shutdown(wait=True)
+        if self.is_leader:
+            conn = self.connect()
+            try:
+                release_lease(conn, self.holder)
+            except sqlite3.Error:
+                pass
+            finally:
+                conn.close()
+        self._leader_until = 0.0
+
+    def _elect(self, conn):
+        was_leader = self.is_leader
+        try:
+            attempt = time.time()
+            if acquire_lease(conn, self.holder, self.lease_seconds, attempt):
+                # Stop a little before the lease could pass to another worker
+                self._leader_until = attempt + self.lease_seconds * 2 / 3
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+        if self.is_leader and not was_leader:
+            # A new leader starts from the next scheduled time, not runs missed while nobody led
+            now = timeslots.now()
+            for job in self.jobs.values():
+                job.next_run = job.cron.next_after(now)
+
+    def _loop(self):
+        conn = self.connect()
+        renew_at = 0.0
+        try:
+            while not self._stop.is_set():
+                if time.time() >= renew_at:
+                    self._elect(conn)
+                    renew_at = time.time() + self.lease_seconds / 3
+                if self.is_leader:
+                    now = timeslots.now()
+                    for job in self.jobs.values():
+                        if job.next_run is not None and job.next_run <= now and not job.running:
+                            job.running = True
+                            job.next_run = job.cron.next_after(now)
+                            self._pool.submit(self._run, job)
+                self._stop.wait(self.tick)
+        finally:
+            conn.close()
+
+    def _run(self, job):
+        conn = self.connect()
+        try:
+            run_job(conn, job.name, job.func, self.holder)
+        except sqlite3.Error:
+            pass    # could not even record the run; the next one will
+        finally:
+            job.running = False
+            conn.close()
+
+
+def history(cur, job=None, limit=50):
+    """Latest job_runs rows, newest first, optionally for one job"""
+    if job:
+        cur.execute("SELECT * FROM job_runs WHERE job=? ORDER BY id DESC LIMIT ?", (job, limit))
+    else:
+        cur.execute("SELECT * FROM job_runs ORDER BY id DESC LIMIT ?", (limit,))
+    return cur.fetchall()
+
+
+def metrics_text(cur):
+    """Prometheus text: runs, failures and last duration per job"""
+    cur.execute("""
+        SELECT job, COUNT(*), SUM(error IS NOT NULL),
+               (SELECT duration_ms FROM job_runs j2 WHERE j2.job = j.job ORDER BY id DESC LIMIT 1)
+        FROM job_runs j GROUP BY job ORDER BY job
+    """)
+    rows = cur.fetchall()
+    lines = ["# TYPE scheduler_job_runs_total counter"]
+    lines += [f'scheduler_job_runs_total{{job="{job}"}} {runs}' for job, runs, _, _ in rows]
+    lines.append("# TYPE scheduler_job_failures_total counter")
+    lines += [f'scheduler_job_failures_total{{job="{job}"}} {failed}' for job, _, failed, _ in rows]
+    lines.append("# TYPE scheduler_job_last_duration_ms gauge")
+    lines += [f'scheduler_job_last_duration_ms{{job="{job}"}} {last}' for job, _, _, last in rows]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,375 @@
+"""
+Schema upgrades for features added after the original migration
+(see migrate_database.py). Every step is idempotent, so it is safe to
+run on app start, from setup_db.py and from the CLI's setup_db().
+"""
+
+import sqlite3
+
+import events
+import inventory
+import ledger
+from timeslots import END_OF_DAY, DAY_MINUTES
+
+
+def column_exists(cur, table, column):
+    cur.execute(f"PRAGMA table_xinfo({table})")  # includes generated columns
+    return any(col[1] == column for col in cur.fetchall())
+
+
+def add_column(cur, table, column, definition):
+    """Add a column if it does not exist yet"""
+    if not column_exists(cur, table, column):
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def label_minutes_sql(column):
+    """SQL expression turning a '01:30 PM' label column into minutes past midnight"""
+    return f"""
+        CASE WHEN {column} = '{END_OF_DAY}' THEN {DAY_MINUTES}
+             WHEN {column} LIKE '__:__ _M' THEN
+                 (CAST(substr({column}, 1, 2) AS INTEGER) % 12
+                  + CASE WHEN substr({column}, 7, 2) = 'PM' THEN 12 ELSE 0 END) * 60
+                 + CAST(substr({column}, 4, 2) AS INTEGER)
+        END"""
+
+
+def table_exists(cur, table):
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,))
+    return cur.fetchone() is not None
+
+
+def ensure_schema(conn):
+    """Bring an existing database up to date with the current features"""
+    cur = conn.cursor()
+
+    # Price quote stored at booking time (checkout/receipt read it directly)
+    add_column(cur, "reservations", "quoted_rate", "REAL")
+    add_column(cur, "reservations", "quoted_hours", "INTEGER")
+    add_column(cur, "reservations", "room_cost", "REAL")
+    add_column(cur, "reservations", "equipment_cost", "REAL DEFAULT 0")
+    add_column(cur, "reservations", "total_cost", "REAL")
+
+    # Peak/off-peak rate rules (NULL room_id / weekday = applies to all)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS room_rates(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room_id INTEGER,
+            weekday INTEGER,
+            start_minute INTEGER NOT NULL,
+            end_minute INTEGER NOT NULL,
+            rate REAL NOT NULL,
+            label TEXT,
+            FOREIGN KEY (room_id) REFERENCES rooms(id)
+        )
+    """)
+
+    # Slot size and default opening hours drive the booking grid
+    add_column(cur, "booking_rules", "slot_minutes", "INTEGER DEFAULT 60")
+    add_column(cur, "booking_rules", "open_minute", "INTEGER DEFAULT 480")
+    add_column(cur, "booking_rules", "close_minute", "INTEGER DEFAULT 1200")
+
+    # Room-specific opening hours (NULL weekday = every day, open = close means closed)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS room_hours(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room_id INTEGER NOT NULL,
+            weekday INTEGER,
+            open_minute INTEGER NOT NULL,
+            close_minute INTEGER NOT NULL,
+            FOREIGN KEY (room_id) REFERENCES rooms(id)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_room_hours_room ON room_hours(room_id, weekday)")
+
+    # Maintenance closures: the room is offline for every date in the range
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS room_closures(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room_id INTEGER NOT NULL,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            reason TEXT,
+            created_at TEXT,
+            FOREIGN KEY (room_id) REFERENCES rooms(id)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_room_closures_room ON room_closures(room_id, start_date)")
+
+    # Minutes past midnight derived from the time labels, so conflict checks
+    # compare numbers instead of '12:00 PM' > '01:00 PM' strings
+    add_column(cur, "reservations", "start_minute",
+               f"INTEGER GENERATED ALWAYS AS ({label_minutes_sql('start_time')}) VIRTUAL")
+    add_column(cur, "reservations", "end_minute",
+               f"INTEGER GENERATED ALWAYS AS ({label_minutes_sql('end_time')}) VIRTUAL")
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reservations_date_room
+        ON reservations(date, room_id, start_minute, end_minute)
+    """)
+
+    # Equipment stock and per-15-minute usage counters
+    add_column(cur, "equipment", "quantity", "INTEGER DEFAULT 1")
+    backfill_usage = not table_exists(cur, "equipment_usage")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS equipment_usage(
+            equipment_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            block_minute INTEGER NOT NULL,
+            used INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (equipment_id, date, block_minute),
+            FOREIGN KEY (equipment_id) REFERENCES equipment(id)
+        ) WITHOUT ROWID
+    """)
+    if backfill_usage:
+        inventory.rebuild_usage(cur)
+
+    # Recurring bookings: one series row, one reservation per occurrence
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS reservation_series(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            room_id INTEGER NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            first_date TEXT NOT NULL,
+            until_date TEXT NOT NULL,
+            interval_days INTEGER NOT NULL,
+            created_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (room_id) REFERENCES rooms(id)
+        )
+    """)
+    add_column(cur, "reservations", "series_id", "INTEGER REFERENCES reservation_series(id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reservations_series ON reservations(series_id)")
+
+    # Bookings the patron lets the library move to another room (defragmentation)
+    add_column(cur, "reservations", "movable", "INTEGER DEFAULT 0")
+
+    # Checkout holds: a Pending booking stops blocking its slot after held_until (holds.py)
+    add_column(cur, "reservations", "held_until", "TEXT")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reservations_held ON reservations(held_until) WHERE status='Pending'")
+    # Unheld Pending bookings expire by how long they have been left untouched
+    cur.execute("DROP INDEX IF EXISTS idx_reservations_pending_created")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reservations_pending_updated ON reservations(updated_at) "
+                "WHERE status='Pending'")
+
+    # "Any room for N people" walks available rooms smallest first
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_rooms_status_capacity ON rooms(status, capacity, id)")
+
+    # Lottery windows: requests for these dates are queued and drawn in one batch
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS lottery_windows(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            draw_at TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'open',
+            drawn_at TEXT,
+            created_at TEXT
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS booking_requests(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            window_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            room_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            num_people INTEGER DEFAULT 1,
+            status TEXT NOT NULL DEFAULT 'queued',
+            reason TEXT,
+            reservation_id INTEGER,
+            created_at TEXT,
+            UNIQUE (window_id, user_id, room_id, date, start_time),
+            FOREIGN KEY (window_id) REFERENCES lottery_windows(id),
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (room_id) REFERENCES rooms(id)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_booking_requests_user ON booking_requests(user_id, status)")
+
+    # Bulk operations look up payments and equipment links by reservation
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_payments_reservation ON payments(reservation_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reservation_equipment_reservation "
+                "ON reservation_equipment(reservation_id)")
+
+    # Append-only double-entry wallet ledger (amounts in cents) with balance snapshots
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ledger_entries(
+            id INTEGER PRIMARY KEY,
+            txn TEXT NOT NULL,
+            account TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            memo TEXT,
+            reference TEXT,
+            created_at TEXT
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ledger_entries_account ON ledger_entries(account, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ledger_entries_txn ON ledger_entries(txn)")
+    for event in ("UPDATE", "DELETE"):
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS ledger_entries_no_{event.lower()}
+            BEFORE {event} ON ledger_entries
+            BEGIN SELECT RAISE(ABORT, 'ledger entries are append-only'); END
+        """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ledger_snapshots(
+            account TEXT NOT NULL,
+            last_entry_id INTEGER NOT NULL,
+            balance INTEGER NOT NULL,
+            taken_at TEXT,
+            PRIMARY KEY (account, last_entry_id)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ledger_snapshots_last ON ledger_snapshots(last_entry_id)")
+    # Balances held in bank/user_bank_acc before the ledger become opening entries
+    ledger.open_missing_accounts(cur)
+
+    # Outcomes of patron POSTs by form token, so a resubmitted form is answered without redoing it
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS idempotency_keys(
+            key TEXT PRIMARY KEY,
+            user_id INTEGER,
+            operation TEXT NOT NULL,
+            result TEXT NOT NULL,
+            created_at TEXT,
+            expires_at TEXT NOT NULL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at)")
+
+    # Bank payments waiting for (or being charged by) a payment worker
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS payment_jobs(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            reservation_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            payment_method TEXT,
+            bank_name TEXT,
+            account_number TEXT,
+            account_holder TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            claimed_at TEXT,
+            transaction_id TEXT,
+            error TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            FOREIGN KEY (reservation_id) REFERENCES reservations(id)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_payment_jobs_status ON payment_jobs(status, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_payment_jobs_reservation ON payment_jobs(reservation_id)")
+    # The backend's reference, stored as soon as a charge goes through and before it is settled
+    add_column(cur, "payment_jobs", "charged_reference", "TEXT")
+
+    # One row per run of a background job: how long it took and how much it did
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS job_runs(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job TEXT NOT NULL,
+            started_at TEXT,
+            duration_ms REAL,
+            processed INTEGER DEFAULT 0,
+            detail TEXT,
+            error TEXT
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_job_runs_job ON job_runs(job, id)")
+    add_column(cur, "job_runs", "runner", "TEXT")
+
+    # Single row naming the worker process whose scheduler runs the jobs, until expires_at (epoch seconds)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS scheduler_lease(
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+
+    # Outbox of row changes, appended by triggers (see events.py), and each consumer's position in it
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS events(
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            entity_id INTEGER,
+            payload TEXT NOT NULL,
+            created_at TEXT
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS event_cursors(
+            consumer TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT
+        )
+    """)
+    # Outgoing email, one row per booking notice (see notify.py)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS notifications(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            reservation_id INTEGER,
+            kind TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            subject TEXT,
+            body TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TEXT,
+            sent_at TEXT,
+            UNIQUE (reservation_id, kind)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_notifications_status ON notifications(status, id)")
+    # Reminders look up confirmed bookings by start, one range over this index
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reservations_confirmed_start
+        ON reservations(date, start_minute) WHERE status = 'Confirmed'
+    """)
+
+    # Patrons waiting for a booked window; cancellations promote them (see waitlist.py)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS waitlist(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            room_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            num_people INTEGER DEFAULT 1,
+            status TEXT NOT NULL DEFAULT 'waiting',
+            reservation_id INTEGER,
+            created_at TEXT,
+            promoted_at TEXT,
+            start_minute INTEGER GENERATED ALWAYS AS ({label_minutes_sql('start_time')}) VIRTUAL,
+            end_minute INTEGER GENERATED ALWAYS AS ({label_minutes_sql('end_time')}) VIRTUAL,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (room_id) REFERENCES rooms(id)
+        )
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_waitlist_waiting
+        ON waitlist(room_id, date, start_minute) WHERE status = 'waiting'
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_waitlist_user ON waitlist(user_id)")
+
+    # Last, so the trigger payloads cover every column added above
+    events.install_triggers(cur)
+
+    conn.commit()
+    cur.close()
+
+
+if __name__ == "__main__":
+    import os
+    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+    conn = sqlite3.connect(os.path.join(BASE_DIR, "reservation_system.db"))
+    ensure_schema(conn)
+    conn.close()
+    print(" Schema is up to date")
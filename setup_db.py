@@ -8,7 +8,10 @@ import bcrypt
 import os
 import sys
 from datetime import datetime
-import pytz
+
+import ledger
+import timeslots
+from schema import ensure_schema
 
 # Configuration
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -20,11 +23,6 @@ def get_connection():
     conn.row_factory = sqlite3.Row
     return conn
 
-def get_malaysia_time():
-    """Get current time in Malaysia timezone"""
-    malaysia_tz = pytz.timezone("Asia/Kuala_Lumpur")
-    return datetime.now(malaysia_tz).strftime("%Y-%m-%d %H:%M:%S")
-
 def create_tables():
     """Create all database tables"""
     print("Creating tables...")
@@ -179,6 +177,9 @@ def create_tables():
     
     conn.commit()
     cursor.close()
+    
+    # Columns and tables added by later features
+    ensure_schema(conn)
     conn.close()
     print("✓ Tables created successfully.")
 
@@ -192,7 +193,7 @@ def create_admin():
     cursor.execute("SELECT id FROM users WHERE username = 'admin'")
     admin = cursor.fetchone()
     
-    now = get_malaysia_time()
+    now = timeslots.timestamp()
     
     if admin:
         # Update admin password
@@ -215,6 +216,7 @@ def create_admin():
         # Create bank accounts for admin
         cursor.execute("INSERT INTO bank (user_id, balance) VALUES (?, ?)", (admin_id, 0))
         cursor.execute("INSERT INTO user_bank_acc (user_id, bank_balance) VALUES (?, ?)", (admin_id, 1000))
+        ledger.open_account(cursor, admin_id, 0, 1000)
         
         print("✓ Admin user created.")
     
@@ -252,7 +254,7 @@ def create_sample_rooms():
     if count > 0:
         print(f"✓ {count} rooms already exist. Skipping.")
     else:
-        now = get_malaysia_time()
+        now = timeslots.timestamp()
         rooms = [
             ('Study Room A', 4, 5.0, 'available', now, now),
             ('Conference Room 1', 12, 15.0, 'available', now, now),
@@ -287,14 +289,14 @@ def create_sample_equipment():
         print(f"✓ {count} equipment items already exist. Skipping.")
     else:
         equipment = [
-            ('Microphone', 5),
-            ('Projector', 10),
-            ('Speaker', 7),
-            ('Whiteboard', 3),
-            ('Laptop', 15),
+            ('Microphone', 5, 4),
+            ('Projector', 10, 2),
+            ('Speaker', 7, 3),
+            ('Whiteboard', 3, 5),
+            ('Laptop', 15, 6),
         ]
         
-        cursor.executemany("INSERT INTO equipment (name, price) VALUES (?, ?)", equipment)
+        cursor.executemany("INSERT INTO equipment (name, price, quantity) VALUES (?, ?, ?)", equipment)
         print(f"✓ Created {len(equipment)} equipment items.")
     
     conn.commit()
@@ -0,0 +1,91 @@
+"""
+Test script for admission.py
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import admission
+
+
+def test_limits():
+    """Test 1: In-flight limit, waiting in line, and shedding on a full queue or timeout"""
+    print("\nTEST 1: Admission Limits")
+    gate = admission.Gate("test-limits", max_in_flight=2, max_queue=1, max_wait=0.2)
+    release = threading.Event()
+    peak = []
+
+    def hold():
+        with gate.admit():
+            peak.append(gate.stats()["in_flight"])
+            release.wait(5)
+
+    holders = [threading.Thread(target=hold) for _ in range(2)]
+    for t in holders:
+        t.start()
+    while gate.stats()["in_flight"] < 2:
+        time.sleep(0.001)
+
+    # Third request waits in line; a fourth finds the line full and is shed at once
+    waiter = threading.Thread(target=hold)
+    waiter.start()
+    while gate.stats()["queue_depth"] < 1:
+        time.sleep(0.001)
+    started = time.monotonic()
+    try:
+        gate.enter()
+        assert False, "admitted past a full queue"
+    except admission.Shed as shed:
+        assert shed.reason == "queue_full" and shed.retry_after == gate.retry_after
+    assert time.monotonic() - started < 0.05
+
+    release.set()
+    for t in holders + [waiter]:
+        t.join()
+    stats = gate.stats()
+    assert max(peak) <= 2 and stats["in_flight"] == 0 and stats["queue_depth"] == 0
+    assert stats["admitted"] == 3 and stats["shed"] == {"queue_full": 1, "timeout": 0}
+
+    # A request that waits longer than max_wait is shed, and the body never runs
+    gate.enter()
+    gate.enter()
+    ran = []
+    try:
+        with gate.admit():
+            ran.append(True)
+        assert False, "admitted past max_wait"
+    except admission.Shed as shed:
+        assert shed.reason == "timeout"
+    assert not ran and gate.stats()["shed"]["timeout"] == 1
+    gate.leave()
+    gate.leave()
+
+
+def test_metrics():
+    """Test 2: Metrics text reports queue depth and shed counts per gate"""
+    print("\nTEST 2: Admission Metrics")
+    gate = admission.Gate("test-metrics", max_in_flight=1, max_queue=0)
+    with gate.admit():
+        try:
+            gate.enter()
+        except admission.Shed:
+            pass
+        text = admission.metrics_text()
+    assert 'admission_in_flight{gate="test-metrics"} 1' in text
+    assert 'admission_queue_depth{gate="test-metrics"} 0' in text
+    assert 'admission_shed_total{gate="test-metrics",reason="queue_full"} 1' in text
+    assert 'admission_admitted_total{gate="test-metrics"} 1' in text
+    assert "# TYPE admission_shed_total counter" in text
+
+
+def run_all_tests():
+    return testdb.run_tests((test_limits, test_metrics))
+
+
+if __name__ == "__main__":
+    run_all_tests()
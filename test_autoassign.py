@@ -0,0 +1,91 @@
+"""
+Test script for autoassign.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+import sqlite3
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import autoassign
+
+
+def add_rooms(cur, capacities):
+    cur.executemany("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES (?, ?, 10, 'available')",
+                    [(f"Room {i}", c) for i, c in enumerate(capacities)])
+    cur.execute("SELECT id FROM rooms ORDER BY id")
+    return [r["id"] for r in cur.fetchall()]
+
+
+def test_smallest_fit():
+    """Test 1: Smallest free room that holds the group"""
+    print("\nTEST 1: Smallest Fit")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        big, small, medium, tiny = add_rooms(cur, [12, 4, 6, 2])
+        conn.commit()
+
+        def book(n):
+            rid, room = autoassign.book_any_room(conn, 1, "2030-01-07", "09:00 AM", "10:00 AM", n)
+            conn.commit()
+            return room["id"]
+
+        assert book(3) == small
+        assert book(3) == medium      # small is taken now
+        assert book(1) == tiny
+        assert book(2) == big
+        for bad in (2, 20, 0, "x"):
+            try:
+                book(bad)
+                assert False, f"booked {bad}"
+            except ValueError:
+                pass
+        cur.execute("SELECT num_people, status, total_cost FROM reservations ORDER BY id")
+        assert [tuple(r) for r in cur.fetchall()] == [(3, "Pending", 10.0), (3, "Pending", 10.0),
+                                                      (1, "Pending", 10.0), (2, "Pending", 10.0)]
+
+
+def test_concurrent_requests():
+    """Test 2: Concurrent requests never share a room"""
+    print("\nTEST 2: Concurrent Requests")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        path = db.path
+        add_rooms(conn.cursor(), [4] * 6)
+        conn.commit()
+        conn.close()
+
+        picked, errors = [], []
+
+        def worker():
+            c = sqlite3.connect(path, timeout=10)
+            c.row_factory = sqlite3.Row
+            try:
+                _, room = autoassign.book_any_room(c, 1, "2030-01-07", "09:00 AM", "11:00 AM", 2)
+                c.commit()
+                picked.append(room["id"])
+            except ValueError as e:
+                errors.append(str(e))
+            finally:
+                c.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(picked) == 6 and len(set(picked)) == 6, picked
+        assert len(errors) == 2 and all("free" in e for e in errors), errors
+
+
+def run_all_tests():
+    return testdb.run_tests((test_smallest_fit, test_concurrent_requests))
+
+
+if __name__ == "__main__":
+    run_all_tests()
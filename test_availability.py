@@ -0,0 +1,109 @@
+"""
+Test script for availability.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import timeslots
+import availability
+
+
+def add_room(cur, name="Room"):
+    cur.execute("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES (?, 4, 10.0, 'available')", (name,))
+    return cur.lastrowid
+
+
+def book(cur, room_id, date, start, end, status="Confirmed"):
+    cur.execute("""
+        INSERT INTO reservations (user_id, room_id, date, start_time, end_time, status)
+        VALUES (1, ?, ?, ?, ?, ?)
+    """, (room_id, date, start, end, status))
+    return cur.lastrowid
+
+
+def expect_error(fn, *args):
+    try:
+        fn(*args)
+    except ValueError as e:
+        return str(e)
+    assert False, f"{fn.__name__}{args} did not raise"
+
+
+def test_minute_columns():
+    """Test 1: Numeric conflict check across noon"""
+    print("\nTEST 1: Minute Columns")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        room = add_room(cur)
+        book(cur, room, "2030-01-07", "11:00 AM", "01:00 PM")
+        cur.execute("SELECT start_minute, end_minute FROM reservations")
+        assert tuple(cur.fetchone()) == (660, 780)
+
+        # '12:00 PM' sorts after '01:00 PM' as a string; minutes get it right
+        assert "already booked" in expect_error(availability.check_window, cur, room, "2030-01-07", "12:00 PM", "02:00 PM")
+        availability.check_window(cur, room, "2030-01-07", "01:00 PM", "02:00 PM")
+        availability.check_window(cur, room, "2030-01-08", "12:00 PM", "02:00 PM")
+
+
+def test_check_window():
+    """Test 2: Room hours, cancelled bookings and edits"""
+    print("\nTEST 2: Check Window")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        room = add_room(cur)
+        # Open 10-4 every day, closed on Saturdays (2030-01-12)
+        cur.execute("INSERT INTO room_hours (room_id, weekday, open_minute, close_minute) VALUES (?, NULL, 600, 960)", (room,))
+        cur.execute("INSERT INTO room_hours (room_id, weekday, open_minute, close_minute) VALUES (?, 5, 0, 0)", (room,))
+
+        assert "open 10:00 AM - 04:00 PM" in expect_error(availability.check_window, cur, room, "2030-01-07", "09:00 AM", "11:00 AM")
+        assert "closed" in expect_error(availability.check_window, cur, room, "2030-01-12", "11:00 AM", "12:00 PM")
+        assert "Invalid time" in expect_error(availability.check_window, cur, room, "2030-01-07", "10:30 AM", "11:00 AM")
+
+        booking = book(cur, room, "2030-01-07", "10:00 AM", "12:00 PM", "Pending")
+        book(cur, room, "2030-01-07", "12:00 PM", "02:00 PM", "Cancelled")
+        availability.check_window(cur, room, "2030-01-07", "12:00 PM", "02:00 PM")
+        # Editing a booking does not conflict with itself
+        availability.check_window(cur, room, "2030-01-07", "11:00 AM", "01:00 PM", booking)
+
+
+def test_occupancy():
+    """Test 3: Occupancy matrix on a 30-minute grid"""
+    print("\nTEST 3: Occupancy")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        a, b, c = add_room(cur, "A"), add_room(cur, "B"), add_room(cur, "C")
+        cur.execute("INSERT INTO room_hours (room_id, weekday, open_minute, close_minute) VALUES (?, NULL, 480, 720)", (c,))
+        book(cur, a, "2030-01-07", "09:00 AM", "10:30 AM")
+        book(cur, b, "2030-01-07", "09:00 AM", "10:00 AM", "Cancelled")
+        book(cur, b, "2030-01-08", "09:00 AM", "10:00 AM")
+
+        previous = timeslots.grid()
+        try:
+            timeslots.set_grid(timeslots.SlotGrid(30, 480, 1200))
+            assert availability.free_rooms(cur, "2030-01-07", "10:00 AM", "11:00 AM") == [b, c]
+            assert availability.free_rooms(cur, "2030-01-07", "10:30 AM", "11:00 AM") == [a, b, c]
+            assert availability.free_rooms(cur, "2030-01-07", "11:30 AM", "12:30 PM") == [a, b]
+
+            occupancy = availability.DayOccupancy.load(cur, "2030-01-07")
+            assert occupancy.busy.shape == (3, 24)
+            free_a = occupancy.free_slots(a)
+            assert "08:30 AM" in free_a and "09:00 AM" not in free_a and "10:00 AM" not in free_a
+            assert "10:30 AM" in free_a
+        finally:
+            timeslots.set_grid(previous)
+
+
+def run_all_tests():
+    return testdb.run_tests((test_minute_columns, test_check_window, test_occupancy))
+
+
+if __name__ == "__main__":
+    run_all_tests()
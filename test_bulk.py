@@ -0,0 +1,193 @@
+"""
+Test script for bulk.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import bulk
+import holds
+import inventory
+import ledger
+import operations
+import timeslots
+import waitlist
+
+
+def book(cur, user_id, start, end, status, paid=None):
+    cur.execute("""
+        INSERT INTO reservations (user_id, room_id, date, start_time, end_time, status)
+        VALUES (?, 1, '2030-01-07', ?, ?, ?)
+    """, (user_id, start, end, status))
+    rid = cur.lastrowid
+    if paid:
+        cur.execute("""
+            INSERT INTO payments (reservation_id, user_id, amount, payment_method, status)
+            VALUES (?, ?, ?, 'wallet', 'completed')
+        """, (rid, user_id, paid))
+    return rid
+
+
+def balance(cur, user_id):
+    return ledger.balance(cur, ledger.wallet(user_id))
+
+
+def test_confirm_and_validation():
+    """Test 1: Confirm touches only Pending bookings"""
+    print("\nTEST 1: Bulk Confirm")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        a = book(cur, 1, "09:00 AM", "10:00 AM", "Pending")
+        b = book(cur, 1, "10:00 AM", "11:00 AM", "Cancelled")
+        c = book(cur, 1, "11:00 AM", "12:00 PM", "Pending")
+        conn.commit()
+
+        summary = bulk.bulk_update(conn, "confirm", [str(a), b, c, c])
+        conn.commit()
+        assert (summary["selected"], summary["changed"], summary["skipped"]) == (3, 2, 1)
+        cur.execute("SELECT status FROM reservations ORDER BY id")
+        assert [r["status"] for r in cur.fetchall()] == ["Confirmed", "Cancelled", "Confirmed"]
+
+        for action, ids in (("archive", [a]), ("confirm", []), ("confirm", ["x"])):
+            try:
+                bulk.bulk_update(conn, action, ids)
+                assert False, f"accepted {action} {ids}"
+            except ValueError:
+                pass
+
+
+def test_cancel_and_delete():
+    """Test 2: Cancel refunds per user and releases stock; delete refunds what is still paid and removes everything"""
+    print("\nTEST 2: Bulk Cancel and Delete")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        cur.executemany("INSERT INTO bank (user_id, balance) VALUES (?, 0)", [(7,), (8,)])
+        cur.execute("INSERT INTO equipment (name, price, quantity) VALUES ('Projector', 10, 1)")
+        projector = cur.lastrowid
+        a = book(cur, 7, "09:00 AM", "10:00 AM", "Confirmed", paid=20.0)
+        b = book(cur, 7, "10:00 AM", "11:00 AM", "Confirmed", paid=15.5)
+        c = book(cur, 8, "11:00 AM", "12:00 PM", "Pending")
+        d = book(cur, 8, "12:00 PM", "01:00 PM", "Cancelled", paid=40.0)
+        inventory.reserve_equipment(cur, a, [projector])
+        inventory.reserve_equipment(cur, c, [projector])
+        conn.commit()
+
+        summary = bulk.bulk_update(conn, "cancel", [a, b, c, d])
+        conn.commit()
+        assert (summary["changed"], summary["skipped"]) == (3, 1)
+        assert summary["refunds"] == {7: 35.5} and summary["refunded"] == 35.5
+        assert balance(cur, 7) == 35.5 and balance(cur, 8) == 0
+        cur.execute("SELECT status FROM payments ORDER BY reservation_id")
+        assert [r["status"] for r in cur.fetchall()] == ["refunded", "refunded", "completed"]
+        cur.execute("SELECT COUNT(*) FROM equipment_usage")
+        assert cur.fetchone()[0] == 0
+
+        # Cancelling again refunds nothing
+        assert bulk.bulk_update(conn, "cancel", [a, b])["refunds"] == {}
+
+        # Deleting refunds what is still paid (e) but not what was refunded already (a, b, d)
+        e = book(cur, 8, "09:00 AM", "10:00 AM", "Confirmed", paid=12.0)
+        inventory.reserve_equipment(cur, e, [projector])
+        cur.execute("INSERT INTO payment_jobs (reservation_id, user_id, status) VALUES (?, 8, 'queued')", (c,))
+        conn.commit()
+        summary = bulk.bulk_update(conn, "delete", [a, b, c, d, e])
+        conn.commit()
+        assert summary["changed"] == 5 and summary["refunds"] == {8: 12.0}
+        assert balance(cur, 7) == 35.5 and balance(cur, 8) == 12.0
+        for table in ("reservations", "payments", "payment_jobs", "reservation_equipment", "equipment_usage"):
+            cur.execute(f"SELECT COUNT(*) FROM {table}")
+            assert cur.fetchone()[0] == 0, table
+
+
+def test_confirm_outlives_hold():
+    """Test 3: A held booking confirmed in bulk keeps its slot after the hold would have lapsed"""
+    print("\nTEST 3: Bulk Confirm vs Hold Expiry")
+    with testdb.temp_db(rooms=1, users=2, wallet=100) as db:
+        conn = db.conn
+        cur = conn.cursor()
+        with timeslots.frozen_time(datetime(2030, 1, 6, 12, 0)):
+            rid = operations.create_booking(conn, 1, 1, "2030-01-07", "09:00 AM", "10:00 AM")["reservation_id"]
+            conn.commit()
+            bulk.bulk_update(conn, "confirm", [rid])
+            conn.commit()
+        cur.execute("SELECT status, held_until FROM reservations WHERE id=?", (rid,))
+        assert tuple(cur.fetchone()) == ("Confirmed", None)
+
+        # A Confirmed row left with a stale held_until still blocks too
+        cur.execute("UPDATE reservations SET held_until='2030-01-06 12:10:00' WHERE id=?", (rid,))
+        conn.commit()
+        with timeslots.frozen_time(datetime(2030, 1, 6, 12, holds.HOLD_MINUTES + 5)):
+            message = testdb.expect_error(operations.create_booking, conn, 2, 1, "2030-01-07", "09:00 AM", "10:00 AM")
+            conn.rollback()
+            assert message == "Room already booked in this time range", message
+            assert holds.sweep(conn)["processed"] == 0
+        cur.execute("SELECT COUNT(*) FROM reservations")
+        assert cur.fetchone()[0] == 1
+
+
+def test_confirm_lapsed_hold():
+    """Test 5: Bulk confirm expires a lapsed hold whose window was rebooked, and confirms one still free"""
+    print("\nTEST 5: Bulk Confirm of Lapsed Holds")
+    with testdb.temp_db(rooms=1, users=2, wallet=100) as db:
+        conn = db.conn
+        cur = conn.cursor()
+        with timeslots.frozen_time(datetime(2030, 1, 6, 12, 0)):
+            taken = operations.create_booking(conn, 1, 1, "2030-01-07", "09:00 AM", "10:00 AM")["reservation_id"]
+            free = operations.create_booking(conn, 1, 1, "2030-01-08", "09:00 AM", "10:00 AM")["reservation_id"]
+            conn.commit()
+        with timeslots.frozen_time(datetime(2030, 1, 6, 12, holds.HOLD_MINUTES + 5)):
+            rebooked = operations.create_booking(conn, 2, 1, "2030-01-07", "09:00 AM", "10:00 AM")["reservation_id"]
+            conn.commit()
+            # The rebooking expired the first hold; put it back as an unswept lapsed hold
+            cur.execute("UPDATE reservations SET status='Pending', held_until='2030-01-06 12:10:00' WHERE id=?",
+                        (taken,))
+            conn.commit()
+
+            summary = bulk.bulk_update(conn, "confirm", [taken, free, rebooked])
+            conn.commit()
+        assert (summary["changed"], summary["skipped"], summary["skipped_ids"]) == (2, 1, [taken])
+        cur.execute("SELECT id, status FROM reservations ORDER BY id")
+        assert [tuple(row) for row in cur.fetchall()] == [
+            (taken, "Expired"), (free, "Confirmed"), (rebooked, "Confirmed")]
+
+
+def test_cancel_promotes():
+    """Test 4: Bulk cancel and delete hand each freed window to the waitlist"""
+    print("\nTEST 4: Bulk Cancel Promotes Waiters")
+    with testdb.temp_db(rooms=1, users=3, wallet=100) as db:
+        conn = db.conn
+        cur = conn.cursor()
+        with timeslots.frozen_time(datetime(2030, 1, 6, 12, 0)):
+            first = operations.create_booking(conn, 1, 1, "2030-01-07", "09:00 AM", "10:00 AM")["reservation_id"]
+            second = operations.create_booking(conn, 1, 1, "2030-01-07", "10:00 AM", "11:00 AM")["reservation_id"]
+            operations.pay_booking(conn, 1, first, "System Balance")
+            conn.commit()
+            waitlist.join(conn, 2, 1, "2030-01-07", "09:00 AM", "10:00 AM")
+            waitlist.join(conn, 3, 1, "2030-01-07", "10:00 AM", "11:00 AM")
+            conn.commit()
+
+            summary = bulk.bulk_update(conn, "cancel", [first])
+            conn.commit()
+            assert summary["promoted"] == 1 and summary["refunds"] == {1: 10}
+            assert bulk.bulk_update(conn, "delete", [second])["promoted"] == 1
+            conn.commit()
+        cur.execute("SELECT user_id, start_time, status FROM reservations WHERE user_id != 1 ORDER BY user_id")
+        assert [tuple(row) for row in cur.fetchall()] == [(2, "09:00 AM", "Pending"), (3, "10:00 AM", "Pending")]
+        cur.execute("SELECT DISTINCT status FROM waitlist")
+        assert [row[0] for row in cur.fetchall()] == ["promoted"]
+
+
+def run_all_tests():
+    return testdb.run_tests((test_confirm_and_validation, test_cancel_and_delete, test_confirm_outlives_hold,
+                             test_cancel_promotes, test_confirm_lapsed_hold))
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,77 @@
+"""
+Test script for defrag.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import numpy as np
+
+import defrag
+
+
+def add_room(cur, capacity=4):
+    cur.execute("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES ('Room', ?, 10, 'available')",
+                (capacity,))
+    return cur.lastrowid
+
+
+def book(cur, room_id, start, end, movable=1, num_people=2):
+    cur.execute("""
+        INSERT INTO reservations (user_id, room_id, date, start_time, end_time, num_people, status, movable)
+        VALUES (1, ?, '2030-01-07', ?, ?, ?, 'Confirmed', ?)
+    """, (room_id, start, end, num_people, movable))
+    return cur.lastrowid
+
+
+def test_free_runs():
+    """Test 1: Longest free run per room"""
+    print("\nTEST 1: Free Runs")
+    busy = np.array([[0, 0, 1, 0, 0, 0],
+                     [1, 1, 1, 1, 1, 1],
+                     [0, 0, 0, 0, 0, 0]], dtype=bool)
+    assert defrag.longest_free_runs(busy).tolist() == [3, 0, 6]
+    assert defrag.block_stats(busy, 3) == {"rooms_with_block": 2, "longest_block": 6, "free_slots": 11}
+
+
+def test_repack_day():
+    """Test 2: Scattered flexible bookings are packed into one room"""
+    print("\nTEST 2: Repack Day")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        a, b, c = add_room(cur), add_room(cur), add_room(cur, capacity=2)
+        first = book(cur, a, "09:00 AM", "10:00 AM")
+        second = book(cur, b, "11:00 AM", "12:00 PM")
+        third = book(cur, c, "02:00 PM", "03:00 PM")
+        fixed = book(cur, b, "05:00 PM", "06:00 PM", movable=0)
+        big = book(cur, a, "03:00 PM", "04:00 PM", num_people=4)
+        conn.commit()
+
+        # A whole 12-hour day free: no room has one before; everything joins the fixed booking in b
+        plan = defrag.defragment(conn, "2030-01-07", min_block=12)
+        assert plan["before"]["rooms_with_block"] == 0
+        assert plan["after"]["rooms_with_block"] == 2, plan["after"]
+        assert {(m["id"], m["to_room"]) for m in plan["moves"]} == {(first, b), (third, b), (big, b)}
+        cur.execute("SELECT COUNT(*) FROM reservations WHERE room_id=?", (a,))
+        assert cur.fetchone()[0] == 2   # preview wrote nothing
+
+        defrag.defragment(conn, "2030-01-07", min_block=12, apply=True)
+        conn.commit()
+        cur.execute("SELECT id, room_id FROM reservations ORDER BY id")
+        assert [tuple(r) for r in cur.fetchall()] == [(first, b), (second, b), (third, b), (fixed, b), (big, b)]
+
+        # Nothing left to improve
+        assert defrag.defragment(conn, "2030-01-07", min_block=12)["moves"] == []
+
+
+def run_all_tests():
+    return testdb.run_tests((test_free_runs, test_repack_day))
+
+
+if __name__ == "__main__":
+    run_all_tests()
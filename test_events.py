@@ -0,0 +1,111 @@
+"""
+Test script for events.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import events
+import operations
+import timeslots
+
+
+def test_triggers():
+    """Test 1: Committed changes append events in order; rolled-back changes leave none"""
+    print("\nTEST 1: Outbox Triggers")
+    with testdb.temp_db(rooms=1, users=1, wallet=100) as db:
+        conn = db.conn
+        cur = conn.cursor()
+        start = events.read(cur)[-1]["seq"]
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 0)):
+            rid = operations.create_booking(conn, 1, 1, "2030-01-07", "09:00 AM", "11:00 AM")["reservation_id"]
+            conn.commit()
+            operations.pay_booking(conn, 1, rid, "System Balance", "Maybank", "12345678", "Pat")
+            conn.commit()
+            try:
+                operations.create_booking(conn, 1, 1, "2030-01-07", "10:00 AM", "11:00 AM")
+                assert False, "overlapping booking accepted"
+            except ValueError:
+                conn.rollback()
+            operations.cancel_booking(conn, 1, rid)
+            conn.commit()
+        emitted = events.read(cur, start)
+        assert [event["type"] for event in emitted] == [
+            "reservation.created",
+            "wallet.entry", "payment.created", "reservation.updated",      # pay from the wallet
+            "wallet.entry", "payment.updated", "reservation.updated",      # cancel: refund to the wallet
+        ], [event["type"] for event in emitted]
+        assert [event["seq"] for event in emitted] == sorted(event["seq"] for event in emitted)
+        cancelled = emitted[6]
+        assert (cancelled["payload"]["status"], cancelled["payload"]["old_status"], cancelled["entity_id"]) == \
+            ("Cancelled", "Confirmed", rid)
+        # bank details stay out of the outbox
+        assert "account_number" not in emitted[2]["payload"] and emitted[2]["payload"]["amount"] == 20
+        assert [(emitted[n]["entity_id"], emitted[n]["payload"]["amount"]) for n in (1, 4)] == [(1, -2000), (1, 2000)]
+
+        cur.execute("DELETE FROM rooms WHERE id=1")
+        conn.commit()
+        deleted = events.read(cur, emitted[-1]["seq"])
+        assert [(event["type"], event["payload"]["room_name"]) for event in deleted] == [("room.deleted", "Room 1")]
+
+
+def test_consumer():
+    """Test 2: Consumers resume from their cursor in batches; a failing batch is retried; read events are purged"""
+    print("\nTEST 2: Cursor Consumer")
+    with testdb.temp_db(rooms=1, users=1, wallet=100) as db:
+        conn = db.conn
+        cur = conn.cursor()
+        events.consume(conn, "rooms", lambda conn, batch: None)     # start after the setup rows
+        cur.executemany("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES (?, 4, 10, 'available')",
+                        [(f"Room {n}",) for n in range(25)])
+        conn.commit()
+
+        seen, calls = [], []
+
+        def collect(conn, batch):
+            calls.append(len(batch))
+            seen.extend(event["payload"]["room_name"] for event in batch)
+            # the handler's own writes commit with the cursor
+            conn.execute("UPDATE rooms SET status='indexed' WHERE id=?", (batch[-1]["entity_id"],))
+        assert events.consume(conn, "rooms", collect, batch_size=10, types=("room.created",)) == 25
+        assert calls == [10, 10, 5] and seen == [f"Room {n}" for n in range(25)]
+        # the handler's updates are events too, read along with the later batches and skipped;
+        # only the last one is still ahead of the cursor
+        assert events.lag(cur) == {"rooms": 1}
+        assert events.consume(conn, "rooms", collect, types=("room.created",)) == 0
+        assert events.lag(cur) == {"rooms": 0}
+
+        def broken(conn, batch):
+            raise RuntimeError("downstream is down")
+        cur.execute("UPDATE rooms SET capacity=6 WHERE id=2")
+        conn.commit()
+        try:
+            events.consume(conn, "audit", broken)
+            assert False, "handler error swallowed"
+        except RuntimeError:
+            pass
+        assert events.position(cur, "audit") == 0
+        assert events.consume(conn, "audit", lambda conn, batch: None, batch_size=1000) == events.read(cur)[-1]["seq"]
+
+        # Both consumers are done, but only events past the retention period go
+        events.consume(conn, "rooms", collect, types=("room.created",))
+        assert events.purge(conn) == 0
+        with timeslots.frozen_time(datetime(2099, 1, 1)):
+            cur.execute("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES ('New', 4, 10, 'available')")
+            conn.commit()
+            total = cur.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+            assert events.purge(conn, batch_size=7) == total - 1
+        assert [event["payload"]["room_name"] for event in events.read(cur)] == ["New"]
+
+
+def run_all_tests():
+    return testdb.run_tests((test_triggers, test_consumer))
+
+
+if __name__ == "__main__":
+    run_all_tests()
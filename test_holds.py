@@ -0,0 +1,175 @@
+"""
+Test script for holds.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import availability
+import holds
+import inventory
+import lottery
+import operations
+import timeslots
+import waitlist
+
+
+def statuses(cur):
+    cur.execute("SELECT status FROM reservations ORDER BY id")
+    return [row[0] for row in cur.fetchall()]
+
+
+def test_hold_lifecycle():
+    """Test 1: A hold blocks its slot until it lapses; then the slot is free, lazily expired, or still payable"""
+    print("\nTEST 1: Hold Lifecycle")
+    with testdb.temp_db(rooms=1, users=2, wallet=100) as db:
+        conn = db.conn
+        cur = conn.cursor()
+        cur.execute("INSERT INTO equipment (name, price, quantity) VALUES ('Projector', 0, 1)")
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 0)):
+            first = operations.create_booking(conn, 1, 1, "2030-01-07", "09:00 AM", "11:00 AM")
+            inventory.reserve_equipment(cur, first["reservation_id"], [1])
+            conn.commit()
+            assert first["held_until"] == "2030-01-01 09:10:00"
+            try:
+                operations.create_booking(conn, 2, 1, "2030-01-07", "10:00 AM", "11:00 AM")
+                assert False, "booked over a live hold"
+            except ValueError:
+                conn.rollback()
+            second = operations.create_booking(conn, 1, 1, "2030-01-08", "09:00 AM", "10:00 AM")
+            conn.commit()
+
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 11)):
+            # Lapsed: free to every availability check before anything is cleaned up
+            assert availability.free_rooms(cur, "2030-01-07", "09:00 AM", "11:00 AM") == [1]
+            availability.check_window(cur, 1, "2030-01-07", "09:00 AM", "11:00 AM")
+            # Its equipment comes back once the hold is expired
+            assert inventory.equipment_availability(cur, "2030-01-07", "09:00 AM", "11:00 AM") == {1: 0}
+            # Booking the day expires the lapsed hold there and returns its equipment
+            operations.create_booking(conn, 2, 1, "2030-01-07", "10:00 AM", "11:00 AM")
+            conn.commit()
+            assert statuses(cur) == ["Expired", "Pending", "Pending"]
+            assert inventory.equipment_availability(cur, "2030-01-07", "09:00 AM", "10:00 AM") == {1: 1}
+            try:
+                operations.pay_booking(conn, 1, first["reservation_id"], "System Balance")
+                assert False, "paid an expired hold"
+            except ValueError:
+                conn.rollback()
+            # Lapsed but nobody took the slot: paying still confirms it
+            operations.pay_booking(conn, 1, second["reservation_id"], "System Balance")
+            conn.commit()
+            cur.execute("SELECT status, held_until FROM reservations WHERE id=?", (second["reservation_id"],))
+            assert tuple(cur.fetchone()) == ("Confirmed", None)
+
+
+def test_sweep():
+    """Test 2: Lapsed holds and stale Pending bookings expire in batches; lapsed holds stop counting for max_active"""
+    print("\nTEST 2: Sweep")
+    with testdb.temp_db(rooms=1, users=2, wallet=100) as db:
+        conn = db.conn
+        cur = conn.cursor()
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 0)):
+            for day in range(1, 8):
+                operations.create_booking(conn, 1, 1, f"2030-02-{day:02d}", "09:00 AM", "10:00 AM")
+            conn.commit()
+        # A booking without a hold (CLI "Pay Later", admin) is left alone
+        cur.execute("INSERT INTO reservations (user_id, room_id, date, start_time, end_time, status) "
+                    "VALUES (2, 1, '2030-02-10', '09:00 AM', '10:00 AM', 'Pending')")
+        conn.commit()
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 5)):
+            assert holds.expire_lapsed(conn) == 0
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 20)):
+            # Seven lapsed holds are not seven active bookings against max_active (2)
+            window = lottery.create_window(cur, "2030-03-01", "2030-03-01", "2030-02-01 12:00")
+            lottery.queue_request(cur, window, 1, 1, "2030-03-01", "09:00 AM", "10:00 AM")
+            assert lottery.draw(conn, window, seed=1)["won"] == 1
+            conn.commit()
+        # Unheld and two days old: stale, unless its payment is still in the queue
+        cur.executemany("INSERT INTO reservations (user_id, room_id, date, start_time, end_time, status, created_at, "
+                        "updated_at) VALUES (2, 1, ?, '09:00 AM', '10:00 AM', 'Pending', '2029-12-30 09:00:00', "
+                        "'2029-12-30 09:00:00')",
+                        [("2030-02-11",), ("2030-02-12",)])
+        cur.execute("INSERT INTO payment_jobs (reservation_id, user_id, status) "
+                    "SELECT id, 2, 'processing' FROM reservations WHERE date='2030-02-12'")
+        conn.commit()
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 30)):
+            result = holds.sweep(conn, max_age_hours=24, batch_size=3)
+            assert (result["lapsed"], result["stale"]) == (7, 1)
+            # the unaged booking and the lottery win stay Pending
+            assert statuses(cur) == ["Expired"] * 7 + ["Pending", "Pending", "Expired", "Pending"]
+            assert result["processed"] == 8
+
+
+def test_sweep_exemptions():
+    """Test 3: Series and lottery wins lapse at their payment deadline; the sweeps spare bookings being charged and promote waiters"""
+    print("\nTEST 3: Sweep Deadlines, Exemptions and Promotion")
+    with testdb.temp_db(rooms=1, users=3, wallet=100) as db:
+        conn = db.conn
+        cur = conn.cursor()
+        old = "2029-12-30 09:00:00"
+        cur.execute("INSERT INTO reservation_series (user_id, room_id, start_time, end_time, first_date, until_date, "
+                    "interval_days) VALUES (2, 1, '09:00 AM', '10:00 AM', '2030-02-10', '2030-02-17', 7)")
+        # A series occurrence past its deadline, a lottery win before it, and an unheld booking gone stale
+        for date, series_id, held_until in (("2030-02-10", 1, "2030-01-01 09:20:00"),
+                                            ("2030-02-11", None, "2030-01-02 09:00:00"),
+                                            ("2030-02-12", None, None)):
+            cur.execute("INSERT INTO reservations (user_id, room_id, date, start_time, end_time, status, series_id, "
+                        "held_until, created_at, updated_at) "
+                        "VALUES (2, 1, ?, '09:00 AM', '10:00 AM', 'Pending', ?, ?, ?, ?)",
+                        (date, series_id, held_until, old, old))
+        cur.execute("INSERT INTO booking_requests (window_id, user_id, room_id, date, start_time, end_time, status, "
+                    "reservation_id) VALUES (1, 2, 1, '2030-02-11', '09:00 AM', '10:00 AM', 'won', 2)")
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 0)):
+            charging = operations.create_booking(conn, 1, 1, "2030-02-01", "09:00 AM", "10:00 AM")["reservation_id"]
+            lapsing = operations.create_booking(conn, 1, 1, "2030-02-02", "09:00 AM", "10:00 AM")["reservation_id"]
+            cur.execute("INSERT INTO payment_jobs (reservation_id, user_id, status) VALUES (?, 1, 'processing')",
+                        (charging,))
+            conn.commit()
+            waitlist.join(conn, 3, 1, "2030-02-02", "09:00 AM", "10:00 AM")
+            conn.commit()
+
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 30)):
+            assert holds.sweep(conn) == {"processed": 3, "lapsed": 2, "stale": 1}
+        assert statuses(cur) == ["Expired", "Pending", "Expired", "Pending", "Expired", "Pending"]
+        # The lapsed hold's window went to the waiter
+        cur.execute("SELECT user_id, date, held_until FROM reservations WHERE id=6")
+        assert tuple(cur.fetchone()) == (3, "2030-02-02", "2030-01-01 10:30:00")
+        cur.execute("SELECT status FROM waitlist")
+        assert cur.fetchone()[0] == "promoted"
+        assert charging == 4 and lapsing == 5
+
+
+def test_charging_hold():
+    """Test 4: A lapsed hold whose payment is being charged keeps its slot"""
+    print("\nTEST 4: Charging Hold")
+    with testdb.temp_db(rooms=1, users=2, wallet=100) as db:
+        conn = db.conn
+        cur = conn.cursor()
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 0)):
+            held = operations.create_booking(conn, 1, 1, "2030-01-07", "09:00 AM", "11:00 AM")["reservation_id"]
+            cur.execute("INSERT INTO payment_jobs (reservation_id, user_id, status) VALUES (?, 1, 'processing')",
+                        (held,))
+            conn.commit()
+
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 11)):
+            assert availability.free_rooms(cur, "2030-01-07", "09:00 AM", "11:00 AM") == []
+            try:
+                operations.create_booking(conn, 2, 1, "2030-01-07", "10:00 AM", "11:00 AM")
+                assert False, "booked over a hold being charged"
+            except ValueError:
+                conn.rollback()
+            assert holds.expire_for_window(cur, 1, "2030-01-07") == 0
+            assert statuses(cur) == ["Pending"]
+
+
+def run_all_tests():
+    return testdb.run_tests((test_hold_lifecycle, test_sweep, test_sweep_exemptions, test_charging_hold))
+
+
+if __name__ == "__main__":
+    run_all_tests()
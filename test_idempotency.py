@@ -0,0 +1,91 @@
+"""
+Test script for idempotency.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import idempotency
+import ledger
+import timeslots
+import writer
+
+
+def test_replayed_writes():
+    """Test 1: A repeated key returns the first result; pay and cancel refuse a second run without one"""
+    print("\nTEST 1: Replayed Writes")
+    with testdb.temp_db(rooms=1, users=1, bank=100) as db:
+        connect = db.connect
+        writes = writer.LocalWriter(connect)
+        for _ in range(3):
+            assert writes.call("top_up", user_id=1, amount=40, bank_name="Maybank",
+                               idempotency_key="k-topup") == {"amount": 40.0}
+        rid = writes.call("create_booking", user_id=1, room_id=1, date="2030-01-07",
+                          start_time="09:00 AM", end_time="11:00 AM")["reservation_id"]
+        for _ in range(2):
+            paid = writes.call("pay_booking", user_id=1, reservation_id=rid, payment_method="System Balance",
+                               idempotency_key="k-pay")
+        for _ in range(2):
+            assert writes.call("cancel_booking", user_id=1, booking_id=rid,
+                               idempotency_key="k-cancel") == {"refund": 20}
+
+        # Without a key the status checks stop the double charge and the double refund
+        for op, kwargs in (("pay_booking", dict(user_id=1, reservation_id=rid, payment_method="System Balance")),
+                           ("cancel_booking", dict(user_id=1, booking_id=rid)),
+                           ("top_up", dict(user_id=2, amount=1, bank_name="X", idempotency_key="k-topup")),
+                           ("cancel_booking", dict(user_id=1, booking_id=rid, idempotency_key="k-pay"))):
+            try:
+                writes.call(op, **kwargs)
+                assert False, f"accepted {op} {kwargs}"
+            except ValueError:
+                pass
+
+        conn = connect()
+        cur = conn.cursor()
+        assert ledger.balance(cur, ledger.wallet(1)) == 40 and ledger.balance(cur, ledger.bank(1)) == 60
+        assert cur.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == 1
+        assert cur.execute("SELECT transaction_id FROM payments").fetchone()[0] == paid["transaction_id"]
+        assert cur.execute("SELECT COUNT(*) FROM idempotency_keys").fetchone()[0] == 3
+        conn.close()
+
+
+def test_expiry_and_purge():
+    """Test 2: Expired keys no longer replay and are purged in batches"""
+    print("\nTEST 2: Key Expiry and Purge")
+    with testdb.temp_db(users=1, bank=100) as db:
+        conn = db.conn
+        def credit(conn, user_id, amount):
+            ledger.transfer(conn.cursor(), ledger.EXTERNAL, ledger.wallet(user_id), amount, "Credit")
+            return {"amount": amount}
+
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 0)):
+            for n in range(7):
+                idempotency.run(conn, f"k{n}", 1, "credit", credit, dict(user_id=1, amount=1))
+            conn.commit()
+        with timeslots.frozen_time(datetime(2030, 1, 1, 20, 0)):
+            idempotency.run(conn, "k0", 1, "credit", credit, dict(user_id=1, amount=1))
+            idempotency.run(conn, "fresh", 1, "credit", credit, dict(user_id=1, amount=1))
+            conn.commit()
+        assert ledger.balance(conn.cursor(), ledger.wallet(1)) == 8
+
+        with timeslots.frozen_time(datetime(2030, 1, 2, 10, 0)):
+            # k0 expired, so it runs again and its row is renewed
+            idempotency.run(conn, "k0", 1, "credit", credit, dict(user_id=1, amount=1))
+            conn.commit()
+            assert ledger.balance(conn.cursor(), ledger.wallet(1)) == 9
+            assert idempotency.purge_expired(conn, batch_size=2) == 6
+        keys = [row[0] for row in conn.execute("SELECT key FROM idempotency_keys ORDER BY key")]
+        assert keys == ["fresh", "k0"], keys
+
+
+def run_all_tests():
+    return testdb.run_tests((test_replayed_writes, test_expiry_and_purge))
+
+
+if __name__ == "__main__":
+    run_all_tests()
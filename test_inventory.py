@@ -0,0 +1,95 @@
+"""
+Test script for inventory.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import inventory
+
+
+def book(cur, date, start, end, status="Pending"):
+    cur.execute("""
+        INSERT INTO reservations (user_id, room_id, date, start_time, end_time, status)
+        VALUES (1, 1, ?, ?, ?, ?)
+    """, (date, start, end, status))
+    return cur.lastrowid
+
+
+def usage(cur, equipment_id, date):
+    cur.execute("SELECT block_minute, used FROM equipment_usage WHERE equipment_id=? AND date=? ORDER BY block_minute",
+                (equipment_id, date))
+    return [tuple(r) for r in cur.fetchall()]
+
+
+def test_stock_limit():
+    """Test 1: Two bookings cannot take the only projector"""
+    print("\nTEST 1: Stock Limit")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        cur.execute("INSERT INTO equipment (name, price, quantity) VALUES ('Projector', 10, 1)")
+        projector = cur.lastrowid
+        cur.execute("INSERT INTO equipment (name, price, quantity) VALUES ('Speaker', 7, 2)")
+        speaker = cur.lastrowid
+        conn.commit()
+
+        first = book(cur, "2030-01-07", "09:00 AM", "10:00 AM")
+        inventory.reserve_equipment(cur, first, [projector, speaker])
+        conn.commit()
+        assert usage(cur, projector, "2030-01-07") == [(540, 1), (555, 1), (570, 1), (585, 1)]
+
+        # Overlapping booking wanting the projector is rejected and rolled back
+        second = book(cur, "2030-01-07", "09:30 AM", "11:00 AM")
+        try:
+            inventory.reserve_equipment(cur, second, [projector])
+            assert False, "second projector booking accepted"
+        except ValueError as e:
+            assert "Projector" in str(e)
+        conn.rollback()
+        assert usage(cur, projector, "2030-01-07")[-1] == (585, 1)
+
+        # Back-to-back is fine, and the second speaker is still free
+        third = book(cur, "2030-01-07", "10:00 AM", "11:00 AM")
+        inventory.reserve_equipment(cur, third, [projector, speaker])
+        conn.commit()
+        free = inventory.equipment_availability(cur, "2030-01-07", "09:00 AM", "11:00 AM")
+        assert free == {projector: 0, speaker: 1}
+
+
+def test_release_and_rebuild():
+    """Test 2: Cancel releases stock; rebuild matches incremental counters"""
+    print("\nTEST 2: Release and Rebuild")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        cur.execute("INSERT INTO equipment (name, price, quantity) VALUES ('Laptop', 15, 3)")
+        laptop = cur.lastrowid
+        a = book(cur, "2030-01-08", "08:00 AM", "10:00 AM")
+        inventory.reserve_equipment(cur, a, [laptop, laptop])
+        b = book(cur, "2030-01-08", "09:00 AM", "11:00 AM")
+        inventory.reserve_equipment(cur, b, [laptop])
+        conn.commit()
+        incremental = usage(cur, laptop, "2030-01-08")
+        assert max(used for _, used in incremental) == 3
+
+        assert inventory.rebuild_usage(cur) == len(incremental)
+        assert usage(cur, laptop, "2030-01-08") == incremental
+
+        inventory.release_equipment(cur, a)
+        cur.execute("UPDATE reservations SET status='Cancelled' WHERE id=?", (a,))
+        conn.commit()
+        assert usage(cur, laptop, "2030-01-08") == [(m, 1) for m in range(540, 660, 15)]
+        assert inventory.equipment_availability(cur, "2030-01-08", "08:00 AM", "11:00 AM") == {laptop: 2}
+
+
+def run_all_tests():
+    return testdb.run_tests((test_stock_limit, test_release_and_rebuild))
+
+
+if __name__ == "__main__":
+    run_all_tests()
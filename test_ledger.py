@@ -0,0 +1,109 @@
+"""
+Test script for ledger.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import ledger
+import operations
+import schema
+
+
+def test_balances_and_snapshots():
+    """Test 1: Balances are snapshot + tail; entries are append-only; verify() catches bad data"""
+    print("\nTEST 1: Ledger Balances and Snapshots")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        ledger.open_account(cur, 1, wallet_balance=0, bank_balance=100)
+        operations.top_up(conn, 1, 40, "Maybank")
+        conn.commit()
+        assert ledger.balance(cur, ledger.wallet(1)) == 40 and ledger.balance(cur, ledger.bank(1)) == 60
+
+        assert ledger.take_snapshot(conn) == 3    # external, bank:1, wallet:1
+        conn.commit()
+        assert ledger.take_snapshot(conn) == 0    # nothing moved since
+        for _ in range(3):
+            ledger.transfer(cur, ledger.wallet(1), ledger.REVENUE, 0.1, "Coffee")
+        conn.commit()
+        # 40 - 3 * 0.10 in cents, no float drift
+        assert ledger.balance(cur, ledger.wallet(1)) == 39.7
+        assert ledger.take_snapshot(conn) == 2
+        conn.commit()
+        cur.execute("SELECT balance FROM ledger_snapshots WHERE account='wallet:1' ORDER BY last_entry_id")
+        assert [r["balance"] for r in cur.fetchall()] == [4000, 3970]
+        assert ledger.balance(cur, ledger.wallet(1)) == 39.7 and ledger.balance(cur, ledger.REVENUE) == 0.3
+        assert ledger.verify(cur) == []
+
+        for statement in ("UPDATE ledger_entries SET amount = 0", "DELETE FROM ledger_entries"):
+            try:
+                cur.execute(statement)
+                assert False, f"ran {statement}"
+            except sqlite3.IntegrityError:
+                pass
+        for amount in (0, -5):
+            try:
+                ledger.transfer(cur, ledger.wallet(1), ledger.REVENUE, amount, "Nothing")
+                assert False, f"posted {amount}"
+            except ValueError:
+                pass
+
+        # A one-legged entry, a wrong snapshot and an overdraft are all reported
+        cur.execute("INSERT INTO ledger_entries (txn, account, amount) VALUES ('broken', 'wallet:2', -500)")
+        cur.execute("""
+            INSERT INTO ledger_snapshots (account, last_entry_id, balance)
+            SELECT 'wallet:1', MAX(id), 1 FROM ledger_entries
+        """)
+        problems = ledger.verify(cur)
+        assert len(problems) == 3, problems
+
+
+def test_opening_balances():
+    """Test 2: Old bank rows become opening entries once; payments and refunds go through revenue"""
+    print("\nTEST 2: Opening Balances")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        cur.executemany("INSERT INTO bank (user_id, balance) VALUES (?, ?)", [(1, 25), (2, 0)])
+        cur.executemany("INSERT INTO user_bank_acc (user_id, bank_balance) VALUES (?, ?)", [(1, 1000), (2, 10)])
+        conn.commit()
+        schema.ensure_schema(conn)
+        schema.ensure_schema(conn)
+        assert [ledger.balance(cur, ledger.wallet(u)) for u in (1, 2)] == [25, 0]
+        assert [ledger.balance(cur, ledger.bank(u)) for u in (1, 2)] == [1000, 10]
+        assert ledger.balance(cur, ledger.EXTERNAL) == -1035
+
+        cur.execute("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES ('Room', 4, 10, 'available')")
+        conn.commit()
+        rid = operations.create_booking(conn, 2, 1, "2030-01-07", "09:00 AM", "11:00 AM")["reservation_id"]
+        conn.commit()
+        for method in ("System Balance", "Online Banking"):
+            try:
+                operations.pay_booking(conn, 2, rid, method)
+                assert False, f"paid 20 from 10 with {method}"
+            except ValueError:
+                conn.rollback()
+        operations.top_up(conn, 2, 10, "CIMB")
+        operations.top_up(conn, 1, 500, "CIMB")
+        operations.pay_booking(conn, 1, operations.create_booking(
+            conn, 1, 1, "2030-01-08", "09:00 AM", "10:00 AM")["reservation_id"], "Online Banking")
+        conn.commit()
+        assert ledger.balance(cur, ledger.bank(1)) == 490 and ledger.balance(cur, ledger.REVENUE) == 10
+        assert operations.cancel_booking(conn, 1, 2)["refund"] == 10
+        conn.commit()
+        assert ledger.balance(cur, ledger.wallet(1)) == 535 and ledger.balance(cur, ledger.REVENUE) == 0
+        assert ledger.verify(cur) == []
+
+
+def run_all_tests():
+    return testdb.run_tests((test_balances_and_snapshots, test_opening_balances))
+
+
+if __name__ == "__main__":
+    run_all_tests()
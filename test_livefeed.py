@@ -0,0 +1,137 @@
+"""
+Test script for livefeed.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import livefeed
+import operations
+import timeslots
+
+
+def test_deltas():
+    """Test 1: Bookings, cancels and edits reach the subscribers of the room days they touch, as changed slots only"""
+    print("\nTEST 1: Slot Deltas")
+    with testdb.temp_db(rooms=2, users=1, wallet=100) as db:
+        conn = db.conn
+        broker = livefeed.Broker(db.connect)
+        poller = db.connect()
+        try:
+            with timeslots.frozen_time(datetime(2030, 1, 6, 12, 0)):
+                first, slots = broker.subscribe(1, "2030-01-07")
+                second, _ = broker.subscribe(1, "2030-01-07")
+                other, _ = broker.subscribe(2, "2030-01-07")
+                later, _ = broker.subscribe(1, "2030-01-08")
+                assert set(slots.values()) == {"free"} and list(slots)[:2] == ["08:00 AM", "09:00 AM"]
+                assert broker.poll(poller) == 0
+
+                rid = operations.create_booking(conn, 1, 1, "2030-01-07", "09:00 AM", "11:00 AM")["reservation_id"]
+                conn.commit()
+                assert broker.poll(poller) == 1
+                assert first.take(0) == second.take(0) == {"09:00 AM": "taken", "10:00 AM": "taken"}
+                assert other.take(0) == {} and later.take(0) == {}
+
+                # Paying changes no slot
+                operations.pay_booking(conn, 1, rid, "System Balance")
+                conn.commit()
+                assert broker.poll(poller) == 0
+                # A patron edit moves the booking to the next day: both days change
+                conn.execute("UPDATE reservations SET date='2030-01-08', start_time='09:00 AM', end_time='10:00 AM' "
+                             "WHERE id=?", (rid,))
+                conn.commit()
+                assert broker.poll(poller) == 2
+                assert later.take(0) == {"09:00 AM": "taken"}
+                operations.cancel_booking(conn, 1, rid)
+                conn.commit()
+                assert broker.poll(poller) == 1
+                # the edit's delta for the first day is still unread
+                assert first.take(0) == {"09:00 AM": "free", "10:00 AM": "free"}
+                assert later.take(0) == {"09:00 AM": "free"}
+
+                for subscriber in (first, second, other):
+                    broker.unsubscribe(subscriber)
+                assert broker.stats()["topics"] == 1
+                broker.unsubscribe(later)
+                assert broker.stats() == {"subscribers": 0, "topics": 0, "polls": 5, "deltas": 4}
+                assert broker.poll(poller) == 0 and later.closed
+        finally:
+            poller.close()
+
+
+def test_stream():
+    """Test 2: A stream sends a snapshot, deltas pushed by the running broker and keep-alives, then ends"""
+    print("\nTEST 2: Event Stream")
+    with testdb.temp_db(rooms=2, users=1, wallet=100) as db:
+        conn = db.conn
+        broker = livefeed.Broker(db.connect, poll_seconds=0.02).start()
+        try:
+            with timeslots.frozen_time(datetime(2030, 1, 6, 12, 0)):
+                body = livefeed.stream(broker, 1, "2030-01-07", heartbeat=5, lifetime=10)
+                assert next(body).startswith("retry: 2000\nevent: snapshot\ndata: {")
+                watchers = [broker.subscribe(1, "2030-01-07")[0] for _ in range(500)]
+                assert broker.stats()["subscribers"] == 501
+
+                operations.create_booking(conn, 1, 1, "2030-01-07", "01:00 PM", "02:00 PM")
+                conn.commit()
+                message = next(body)
+                assert message == ('event: delta\ndata: {"room_id": 1, "date": "2030-01-07", '
+                                   '"slots": {"01:00 PM": "taken"}}\n\n'), message
+                # one reload of the room's day, fanned out to every subscriber
+                assert broker.stats()["deltas"] == 1
+                assert all(watcher.take(0) == {"01:00 PM": "taken"} for watcher in watchers)
+                for watcher in watchers:
+                    broker.unsubscribe(watcher)
+
+                quiet = livefeed.stream(broker, 2, "2030-01-07", heartbeat=0.05, lifetime=0.2)
+                messages = list(quiet)
+                assert messages[0].startswith("retry:") and set(messages[1:]) == {": keep-alive\n\n"}
+                body.close()
+                assert broker.stats()["subscribers"] == 0
+            assert "livefeed_deltas_total 1" in livefeed.metrics_text(broker)
+        finally:
+            broker.stop()
+
+
+def test_polling_and_late_snapshot():
+    """Test 3: Polling mode answers one snapshot with a retry; a snapshot older than the broker's outbox position is reloaded"""
+    print("\nTEST 3: Polling Snapshot and Late Subscribers")
+    with testdb.temp_db(rooms=2, users=1, wallet=100) as db:
+        conn = db.conn
+        with timeslots.frozen_time(datetime(2030, 1, 6, 12, 0)):
+            operations.create_booking(conn, 1, 2, "2030-01-07", "09:00 AM", "10:00 AM")
+            conn.commit()
+            body = livefeed.snapshot(conn.cursor(), 2, "2030-01-07", 15)
+            assert body.startswith("retry: 15000\nevent: snapshot\ndata: {") and body.endswith("\n\n")
+            assert '"09:00 AM": "taken"' in body and '"10:00 AM": "free"' in body
+
+            broker = livefeed.Broker(db.connect)
+            poller = db.connect()
+            try:
+                watcher, _ = broker.subscribe(1, "2030-01-07")
+                # As if a poll had read past this subscriber's snapshot while it was being taken
+                broker._seq += 1
+                late, slots = broker.subscribe(2, "2030-01-07")
+                assert slots["09:00 AM"] == "taken" and slots["11:00 AM"] == "free"
+                # A change the outbox will not report (a closure) still reaches it on the next poll
+                conn.execute("INSERT INTO room_closures (room_id, start_date, end_date) "
+                             "VALUES (2, '2030-01-07', '2030-01-07')")
+                conn.commit()
+                assert broker.poll(poller) == 1
+                assert late.take(0)["11:00 AM"] == "taken" and watcher.take(0) == {}
+                assert broker.poll(poller) == 0
+            finally:
+                poller.close()
+
+
+def run_all_tests():
+    return testdb.run_tests((test_deltas, test_stream, test_polling_and_late_snapshot))
+
+
+if __name__ == "__main__":
+    run_all_tests()
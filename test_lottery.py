@@ -0,0 +1,115 @@
+"""
+Test script for lottery.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import autoassign
+import lottery
+import recurring
+import timeslots
+
+
+def add_rooms(cur, count):
+    cur.executemany("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES (?, 4, 10, 'available')",
+                    [(f"Room {i}",) for i in range(count)])
+    cur.execute("SELECT id FROM rooms ORDER BY id")
+    return [r["id"] for r in cur.fetchall()]
+
+
+def outcomes(cur, user_id):
+    cur.execute("SELECT status, reason FROM booking_requests WHERE user_id=? ORDER BY id", (user_id,))
+    return [(r["status"], r["reason"]) for r in cur.fetchall()]
+
+
+def test_draw():
+    """Test 1: The draw shares contested slots, honours max_active and books winners"""
+    print("\nTEST 1: Lottery Draw")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        a, b = add_rooms(cur, 2)
+        window = lottery.create_window(cur, "2030-01-07", "2030-01-09", "2030-01-01 10:00")
+        # Users 1 and 2 want the same two slots, in opposite order of preference
+        for user_id, slots in ((1, ["09:00 AM", "10:00 AM"]), (2, ["10:00 AM", "09:00 AM"])):
+            for start in slots:
+                end = timeslots.format_minutes(timeslots.label_minutes(start) + 60)
+                lottery.queue_request(cur, window, user_id, a, "2030-01-07", start, end)
+        # User 3 asks for more than max_active (2) uncontested slots
+        for start, end in (("09:00 AM", "10:00 AM"), ("10:00 AM", "11:00 AM"), ("11:00 AM", "12:00 PM")):
+            lottery.queue_request(cur, window, 3, b, "2030-01-08", start, end)
+        try:
+            lottery.queue_request(cur, window, 3, b, "2030-01-08", "09:00 AM", "10:00 AM")
+            assert False, "accepted a duplicate request"
+        except ValueError:
+            pass
+        conn.commit()
+
+        result = lottery.draw(conn, window, seed=7)
+        conn.commit()
+        assert result == {"won": 4, "lost": 3}, result
+        # Snake draft: whoever picks first, each of users 1 and 2 gets one of the two slots
+        for user_id in (1, 2):
+            statuses = [s for s, _ in outcomes(cur, user_id)]
+            assert sorted(statuses) == ["lost", "won"], (user_id, statuses)
+            assert ("lost", "Room already booked in this time range") in outcomes(cur, user_id)
+        assert outcomes(cur, 3) == [("won", ""), ("won", ""), ("lost", "Booking limit reached")]
+
+        cur.execute("""
+            SELECT COUNT(*) FROM booking_requests q JOIN reservations r ON r.id = q.reservation_id
+            WHERE q.status='won' AND r.status='Pending' AND r.total_cost > 0 AND r.held_until > ?
+        """, (timeslots.timestamp(),))
+        assert cur.fetchone()[0] == 4
+        cur.execute("SELECT status FROM lottery_windows WHERE id=?", (window,))
+        assert cur.fetchone()["status"] == "drawn"
+        try:
+            lottery.draw(conn, window)
+            assert False, "drew a lottery twice"
+        except ValueError:
+            conn.rollback()
+
+        # Losers get a better chance next time
+        nxt = lottery.create_window(cur, "2030-02-04", "2030-02-04", "2030-02-01 10:00")
+        assert lottery.user_weights(cur, [1, 3, 4], nxt) == {1: 2, 3: 2, 4: 1}
+
+
+def test_windows_and_guards():
+    """Test 2: Window validation; lottery dates cannot be grabbed by series or auto-assign"""
+    print("\nTEST 2: Lottery Windows")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        (room,) = add_rooms(cur, 1)
+        for start, end, draw_at in (("2030-01-09", "2030-01-07", "2030-01-01 10:00"),
+                                    ("2030-01-07", "2030-01-09", "2030-01-07 08:00"),
+                                    ("2030-01-07", "2030-01-09", "soon")):
+            try:
+                lottery.create_window(cur, start, end, draw_at)
+                assert False, f"accepted {start} {end} {draw_at}"
+            except ValueError:
+                pass
+        window = lottery.create_window(cur, "2030-01-07", "2030-01-09", "2030-01-01T10:00")
+        conn.commit()
+        assert lottery.open_window_for(cur, "2030-01-08")["id"] == window
+        assert lottery.open_window_for(cur, "2030-01-10") is None
+
+        conflicts = recurring.occurrence_conflicts(cur, room, ["2030-01-07", "2030-01-14"], 540, 600)
+        assert conflicts == {"2030-01-07": "Lottery date"}, conflicts
+        try:
+            autoassign.book_any_room(conn, 1, "2030-01-08", "09:00 AM", "10:00 AM", 1)
+            assert False, "auto-assigned a lottery date"
+        except ValueError:
+            pass
+
+
+def run_all_tests():
+    return testdb.run_tests((test_draw, test_windows_and_guards))
+
+
+if __name__ == "__main__":
+    run_all_tests()
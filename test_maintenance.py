@@ -0,0 +1,103 @@
+"""
+Test script for maintenance.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import availability
+import ledger
+import maintenance
+import recurring
+
+
+def add_room(cur):
+    cur.execute("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES ('Room', 4, 10, 'available')")
+    return cur.lastrowid
+
+
+def book(cur, user_id, room_id, date, status="Confirmed", paid=None):
+    cur.execute("""
+        INSERT INTO reservations (user_id, room_id, date, start_time, end_time, status)
+        VALUES (?, ?, ?, '09:00 AM', '10:00 AM', ?)
+    """, (user_id, room_id, date, status))
+    rid = cur.lastrowid
+    if paid:
+        cur.execute("""
+            INSERT INTO payments (reservation_id, user_id, amount, payment_method, status)
+            VALUES (?, ?, ?, 'wallet', 'completed')
+        """, (rid, user_id, paid))
+    return rid
+
+
+def test_take_offline():
+    """Test 1: Closure cancels bookings in range and refunds per user"""
+    print("\nTEST 1: Take Room Offline")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        room, other = add_room(cur), add_room(cur)
+        cur.executemany("INSERT INTO bank (user_id, balance) VALUES (?, 5)", [(7,), (8,)])
+        ledger.open_missing_accounts(cur)
+        a = book(cur, 7, room, "2030-01-07", paid=10.0)
+        b = book(cur, 7, room, "2030-01-09", paid=12.5)
+        c = book(cur, 8, room, "2030-01-08", status="Pending")
+        d = book(cur, 8, room, "2030-01-10", paid=30.0)      # after the closure
+        e = book(cur, 8, other, "2030-01-08", paid=30.0)     # other room
+        conn.commit()
+
+        summary = maintenance.take_offline(conn, room, "2030-01-07", "2030-01-09", "Repainting")
+        conn.commit()
+        assert [bk["id"] for bk in summary["bookings"]] == [a, c, b]
+        assert [bk["refund"] for bk in summary["bookings"]] == [10.0, 0, 12.5]
+        assert summary["refunds"] == {7: 22.5} and summary["refunded"] == 22.5
+        assert [ledger.balance(cur, ledger.wallet(u)) for u in (7, 8)] == [27.5, 5]
+        cur.execute("SELECT id, status FROM reservations ORDER BY id")
+        assert [r["status"] for r in cur.fetchall()] == ["Cancelled", "Cancelled", "Cancelled", "Confirmed", "Confirmed"]
+
+        for bad in (("2030-01-09", "2030-01-07"), ("soon", "2030-01-07")):
+            try:
+                maintenance.take_offline(conn, room, *bad)
+                assert False, f"accepted {bad}"
+            except ValueError:
+                pass
+        conn.rollback()
+        assert len(maintenance.list_closures(cur, room)) == 1
+
+
+def test_closure_blocks_availability():
+    """Test 2: Offline dates are unavailable until the closure is removed"""
+    print("\nTEST 2: Closure Blocks Availability")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        room, other = add_room(cur), add_room(cur)
+        summary = maintenance.take_offline(conn, room, "2030-01-08", "2030-01-08")
+        conn.commit()
+        assert summary["bookings"] == []
+
+        assert availability.free_rooms(cur, "2030-01-08", "09:00 AM", "10:00 AM") == [other]
+        assert availability.free_rooms(cur, "2030-01-09", "09:00 AM", "10:00 AM") == [room, other]
+        try:
+            availability.check_window(cur, room, "2030-01-08", "09:00 AM", "10:00 AM")
+            assert False, "booked an offline room"
+        except ValueError as e:
+            assert "offline" in str(e)
+        conflicts = recurring.occurrence_conflicts(cur, room, ["2030-01-01", "2030-01-08"], 540, 600)
+        assert conflicts == {"2030-01-08": "Room offline"}
+
+        assert maintenance.remove_closure(cur, summary["closure_id"]) == 1
+        conn.commit()
+        availability.check_window(cur, room, "2030-01-08", "09:00 AM", "10:00 AM")
+
+
+def run_all_tests():
+    return testdb.run_tests((test_take_offline, test_closure_blocks_availability))
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,131 @@
+"""
+Test script for notify.py
+Runs against a temporary database from testdb.temp_db() and a local SMTP sink
+"""
+
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import ledger
+import notify
+import operations
+import timeslots
+
+
+def add_patrons(conn):
+    """A named room and three patrons, one without an email address"""
+    conn.execute("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES ('Study Room', 4, 10, 'available')")
+    conn.executemany("INSERT INTO users (name, email, username, password, role) VALUES (?, ?, ?, 'x', 'student')",
+                     [("Pat", "pat@example.com", "pat"), ("Sam", "sam@example.com", "sam"), ("Nomail", None, "nomail")])
+    for user_id in (1, 2, 3):
+        ledger.open_account(conn.cursor(), user_id, 100, 0)
+    conn.commit()
+
+
+def book(conn, user_id, date, start, end):
+    rid = operations.create_booking(conn, user_id, 1, date, start, end)["reservation_id"]
+    operations.pay_booking(conn, user_id, rid, "System Balance")
+    conn.commit()
+    return rid
+
+
+def notices(cur):
+    cur.execute("SELECT reservation_id, kind, status FROM notifications ORDER BY id")
+    return [tuple(row) for row in cur.fetchall()]
+
+
+def test_notices_and_delivery():
+    """Test 1: Confirm, cancel and reminder notices are queued once and sent in batches over one connection"""
+    print("\nTEST 1: Notices and Batched Delivery")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        add_patrons(conn)
+        cur = conn.cursor()
+        sink = notify.Sink(refuse={"sam@example.com"}).start()
+        mailer = notify.Mailer("localhost", sink.port)
+        try:
+            with timeslots.frozen_time(datetime(2030, 1, 7, 8, 0)):
+                notify.queue_booking_notices(conn)      # subscribes at the end of the outbox
+                first = book(conn, 1, "2030-01-07", "09:00 AM", "10:00 AM")
+                second = book(conn, 1, "2030-01-07", "11:00 AM", "12:00 PM")
+                refused = book(conn, 2, "2030-01-08", "09:00 AM", "10:00 AM")
+                book(conn, 3, "2030-01-09", "09:00 AM", "10:00 AM")     # no email address: nothing queued
+                operations.cancel_booking(conn, 1, second)
+                conn.commit()
+                for _ in range(2):
+                    notify.queue_booking_notices(conn)
+                assert notices(cur) == [(first, "confirmed", "queued"), (second, "confirmed", "queued"),
+                                        (refused, "confirmed", "queued"), (second, "cancelled", "queued")]
+
+                # 09:00 starts within the hour; 11:00 was cancelled
+                assert notify.queue_reminders(conn) == 1
+                assert notify.queue_reminders(conn) == 0
+
+                totals = notify.deliver(conn, mailer, batch_size=2)
+                assert totals == {"sent": 4, "failed": 1, "deferred": 0}, totals
+                assert notify.deliver(conn, mailer) == {"sent": 0, "failed": 0, "deferred": 0}
+            assert notices(cur)[-1] == (first, "reminder", "sent")
+            assert [row[2] for row in notices(cur)] == ["sent", "sent", "failed", "sent", "sent"]
+            subjects = [message["Subject"] for message in sink.messages]
+            assert subjects == ["Booking confirmed: Study Room on 2030-01-07"] * 2 + [
+                "Booking cancelled: Study Room on 2030-01-07", "Reminder: Study Room at 09:00 AM on 2030-01-07"]
+            assert sink.messages[0]["To"] == "pat@example.com" and "Hello Pat" in sink.messages[0].get_payload()
+            # three batches, one connection
+            assert mailer.connections == 1 and sink.connections == 1
+        finally:
+            mailer.close()
+            sink.stop()
+
+
+def test_outage_and_reminder_window():
+    """Test 2: Mail waits in the queue while the server is down; reminders cover bookings just past midnight"""
+    print("\nTEST 2: SMTP Outage and Reminder Window")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        add_patrons(conn)
+        cur = conn.cursor()
+        sink = notify.Sink()
+        port = sink.port
+        sink.server_close()
+        mailer = notify.Mailer("localhost", port, timeout=2)
+        try:
+            with timeslots.frozen_time(datetime(2030, 1, 6, 23, 30)):
+                notify.queue_booking_notices(conn)
+                # Admin bookings are inserted Confirmed, outside the patron grid
+                cur.executemany("INSERT INTO reservations (user_id, room_id, date, start_time, end_time, status) "
+                                "VALUES (?, 1, ?, ?, ?, 'Confirmed')",
+                                [(1, "2030-01-06", "11:00 PM", "12:00 AM (next day)"),
+                                 (2, "2030-01-07", "12:00 AM", "01:00 AM"),
+                                 (2, "2030-01-07", "01:00 AM", "02:00 AM")])     # more than an hour away
+                conn.commit()
+                late, early = 1, 2
+                result = notify.run(conn, mailer)
+                # the 11:00 PM booking has already started
+                assert (result["events"], result["reminders"]) == (3, 1), result
+                assert result["deferred"] == 4 and result["sent"] == 0
+                assert notices(cur)[-1] == (early, "reminder", "queued")
+                cur.execute("SELECT attempts, error FROM notifications")
+                assert all(row[0] == 1 and "ConnectionRefusedError" in row[1] for row in cur.fetchall())
+
+                sink = notify.Sink(port=port).start()
+                result = notify.run(conn, mailer)
+                assert (result["sent"], result["events"], result["reminders"]) == (4, 0, 0), result
+                assert late in [row[0] for row in notices(cur)]
+            assert len(sink.messages) == 4
+            cur.execute("SELECT COUNT(*) FROM notifications WHERE status='sent' AND error IS NULL AND attempts=2")
+            assert cur.fetchone()[0] == 4
+        finally:
+            mailer.close()
+            sink.stop()
+
+
+def run_all_tests():
+    return testdb.run_tests((test_notices_and_delivery, test_outage_and_reminder_window))
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,230 @@
+"""
+Test script for payqueue.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+import sqlite3
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import bulk
+import ledger
+import payqueue
+import timeslots
+import writer
+
+
+def book(writes, day):
+    return writes.call("create_booking", user_id=1, room_id=1, date=f"2030-01-{day:02d}",
+                       start_time="09:00 AM", end_time="11:00 AM")["reservation_id"]
+
+
+def statuses(path):
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT status, error FROM payment_jobs ORDER BY id").fetchall()
+    conn.close()
+    return rows
+
+
+class FailingSettle:
+    """A writer whose first settle_payment fails after the bank has charged"""
+
+    def __init__(self, writes):
+        self.writes = writes
+        self.failed = False
+
+    def call(self, op, **kwargs):
+        if op == "settle_payment" and not self.failed:
+            self.failed = True
+            raise sqlite3.OperationalError("database is locked")
+        return self.writes.call(op, **kwargs)
+
+
+def test_job_outcomes():
+    """Test 1: Charged jobs confirm the booking; declines, outages and cancelled bookings fail cleanly"""
+    print("\nTEST 1: Payment Job Outcomes")
+    with testdb.temp_db(rooms=1, users=1, bank=100) as db:
+        writes, path = writer.LocalWriter(db.connect), db.path
+        bank = payqueue.LocalBank()
+        pool = payqueue.WorkerPool(writes, bank)
+        rids = [book(writes, day) for day in (7, 8, 9, 10)]
+        jobs = [writes.call("queue_payment", user_id=1, reservation_id=rid, payment_method="Online Banking",
+                            bank_name="Maybank")["job_id"] for rid in rids]
+        # Paying again while queued keeps the same job
+        assert writes.call("queue_payment", user_id=1, reservation_id=rids[0],
+                           payment_method="Online Banking")["job_id"] == jobs[0]
+
+        pool.process(writes.call("claim_payment", worker="t"))            # succeeds
+        bank.decline_rate = 1.0
+        pool.process(writes.call("claim_payment", worker="t"))            # declined
+        bank.decline_rate, bank.outage_rate = 0.0, 1.0
+        for _ in range(payqueue.MAX_ATTEMPTS):                            # times out, then gives up
+            pool.process(writes.call("claim_payment", worker="t"))
+        bank.outage_rate = 0.0
+        writes.call("cancel_booking", user_id=1, booking_id=rids[3])
+        pool.process(writes.call("claim_payment", worker="t"))            # booking gone by the time it settles
+        assert writes.call("claim_payment", worker="t") is None
+
+        assert [status for status, _ in statuses(path)] == ["succeeded", "failed", "failed", "failed"]
+        assert "declined" in statuses(path)[1][1] and "already cancelled" in statuses(path)[3][1]
+        assert len(bank.charged) == 2 and bank.refunded == bank.charged[1:]
+        conn = sqlite3.connect(path)
+        assert conn.execute("SELECT transaction_id FROM payments").fetchall() == [(bank.charged[0],)]
+        assert [r[0] for r in conn.execute("SELECT status FROM reservations ORDER BY id")] == \
+            ["Confirmed", "Pending", "Pending", "Cancelled"]
+        assert ledger.balance(conn.cursor(), ledger.bank(1)) == 80
+        conn.close()
+        try:
+            writes.call("queue_payment", user_id=1, reservation_id=rids[0], payment_method="Online Banking")
+            assert False, "queued a confirmed booking"
+        except ValueError:
+            pass
+
+
+class DroppedCoordinator:
+    """A writer whose first claim_payment calls lose the connection, as a restarting coordinator does"""
+
+    def __init__(self, writes, drops=2):
+        self.writes = writes
+        self.drops = drops
+
+    def call(self, op, **kwargs):
+        if op == "claim_payment" and self.drops:
+            self.drops -= 1
+            raise EOFError
+        return self.writes.call(op, **kwargs)
+
+
+def test_worker_pool():
+    """Test 2: Queuing returns at once while the pool charges a slow bank in parallel; lost jobs are reclaimed"""
+    print("\nTEST 2: Worker Pool")
+    with testdb.temp_db(rooms=1, users=1, bank=100) as db:
+        writes, path = writer.LocalWriter(db.connect), db.path
+        conn = sqlite3.connect(path)
+        ledger.open_account(conn.cursor(), 1, 0, 1000)
+        conn.commit()
+        conn.close()
+        pool = payqueue.WorkerPool(writes, payqueue.LocalBank(latency=0.2), workers=4, poll_interval=0.05)
+        rids = [book(writes, day) for day in range(1, 9)]
+        t = time.perf_counter()
+        for rid in rids:
+            writes.call("queue_payment", user_id=1, reservation_id=rid, payment_method="Online Banking")
+        assert time.perf_counter() - t < 0.2
+        pool.start()
+        pool.start()
+        deadline = time.time() + 5
+        while pool.processed < len(rids) and time.time() < deadline:
+            time.sleep(0.02)
+        elapsed = time.perf_counter() - t
+        pool.stop()
+        assert pool.processed == len(rids), pool.processed
+        # 8 charges of 0.2 s on 4 workers: about 0.4 s, not 1.6 s
+        assert elapsed < 1.2, elapsed
+        assert all(status == "succeeded" for status, _ in statuses(path))
+
+        # A job whose worker died is claimed again once its lease runs out
+        rid = book(writes, 20)
+        writes.call("queue_payment", user_id=1, reservation_id=rid, payment_method="Online Banking")
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 0)):
+            assert writes.call("claim_payment", worker="lost")["attempts"] == 1
+            assert writes.call("claim_payment", worker="t") is None
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 10)):
+            job = writes.call("claim_payment", worker="t")
+        assert job["reservation_id"] == rid and job["attempts"] == 2
+
+
+def test_reclaimed_charge():
+    """Test 3: A job re-claimed after its charge went through is settled with that charge, not charged again"""
+    print("\nTEST 3: Re-claimed Charge")
+    with testdb.temp_db(rooms=1, users=1, bank=100) as db:
+        writes, path = writer.LocalWriter(db.connect), db.path
+        bank = payqueue.LocalBank()
+        pool = payqueue.WorkerPool(FailingSettle(writes), bank)
+        rid = book(writes, 7)
+        writes.call("queue_payment", user_id=1, reservation_id=rid, payment_method="Online Banking")
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 0)):
+            job = writes.call("claim_payment", worker="t")
+            try:
+                pool.process(job)
+                assert False, "settle did not fail"
+            except sqlite3.OperationalError:
+                pass
+        assert statuses(path) == [("processing", None)] and len(bank.charged) == 1
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 10)):
+            job = writes.call("claim_payment", worker="t")
+        assert job["charged_reference"] == bank.charged[0]
+        pool.process(job)
+        assert statuses(path) == [("succeeded", None)]
+        assert len(bank.charged) == 1 and bank.refunded == []
+        conn = sqlite3.connect(path)
+        assert conn.execute("SELECT transaction_id FROM payments").fetchall() == [(bank.charged[0],)]
+        conn.close()
+
+        # A worker whose lease ran out mid-charge finds the other worker's charge recorded and refunds its own
+        rid = book(writes, 8)
+        job_id = writes.call("queue_payment", user_id=1, reservation_id=rid, payment_method="Online Banking")["job_id"]
+        job = writes.call("claim_payment", worker="slow")
+        writes.call("record_charge", job_id=job_id, reference="TXN-OTHER")
+        assert payqueue.WorkerPool(writes, bank)._charge(job) is None
+        assert bank.refunded == [bank.charged[1]]
+
+
+def test_lost_coordinator():
+    """Test 4: A worker that loses the coordinator while claiming backs off and carries on"""
+    print("\nTEST 4: Lost Coordinator")
+    with testdb.temp_db(rooms=1, users=1, bank=100) as db:
+        writes, path = writer.LocalWriter(db.connect), db.path
+        pool = payqueue.WorkerPool(DroppedCoordinator(writes), payqueue.LocalBank(), workers=1, poll_interval=0.05)
+        rid = book(writes, 7)
+        writes.call("queue_payment", user_id=1, reservation_id=rid, payment_method="Online Banking")
+        pool.start()
+        deadline = time.time() + 5
+        while pool.processed < 1 and time.time() < deadline:
+            time.sleep(0.02)
+        pool.stop()
+        assert pool.processed == 1 and pool.writes.drops == 0
+        assert statuses(path) == [("succeeded", None)]
+
+
+def test_deleted_while_charged():
+    """Test 5: Deleting a booking whose charge went through but is not settled leaves the job to refund it"""
+    print("\nTEST 5: Deleted While Charged")
+    with testdb.temp_db(rooms=1, users=1, bank=100) as db:
+        writes, path = writer.LocalWriter(db.connect), db.path
+        bank = payqueue.LocalBank()
+        pool = payqueue.WorkerPool(FailingSettle(writes), bank)
+        charged, queued = book(writes, 7), book(writes, 8)
+        for rid in (charged, queued):
+            writes.call("queue_payment", user_id=1, reservation_id=rid, payment_method="Online Banking")
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 0)):
+            try:
+                pool.process(writes.call("claim_payment", worker="t"))
+                assert False, "settle did not fail"
+            except sqlite3.OperationalError:
+                pass
+
+        conn = db.connect()
+        deleted, refunds = bulk.delete_reservations(conn.cursor(), f"[{charged}, {queued}]")
+        conn.commit()
+        conn.close()
+        assert (deleted, refunds) == (2, {})
+        # The uncharged job is gone; the charged one is re-claimed, fails to settle and is refunded
+        assert statuses(path) == [("processing", None)]
+        with timeslots.frozen_time(datetime(2030, 1, 1, 9, 10)):
+            pool.process(writes.call("claim_payment", worker="t"))
+        assert statuses(path) == [("failed", "Reservation not found")]
+        assert bank.refunded == bank.charged and len(bank.charged) == 1
+
+
+def run_all_tests():
+    return testdb.run_tests((test_job_outcomes, test_worker_pool, test_reclaimed_charge, test_lost_coordinator,
+                             test_deleted_while_charged))
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,128 @@
+"""
+Test script for pricing.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import pricing
+
+
+def add_room(cur, name="Room", capacity=4, price=10.0):
+    cur.execute("""
+        INSERT INTO rooms (room_name, capacity, price_per_hour, status)
+        VALUES (?, ?, ?, 'available')
+    """, (name, capacity, price))
+    return cur.lastrowid
+
+
+def test_calculate_hours():
+    """Test 1: Hours between slots"""
+    print("\nTEST 1: Calculate Hours")
+    assert pricing.calculate_hours("08:00 AM", "09:00 AM") == 1
+    assert pricing.calculate_hours("10:00 AM", "03:00 PM") == 5
+    assert pricing.calculate_hours("bad", "09:00 AM") == 0
+
+
+def test_quote_booking():
+    """Test 2: Quote with equipment"""
+    print("\nTEST 2: Quote Booking")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        cur.executemany("INSERT INTO equipment (name, price) VALUES (?, ?)", [("Projector", 10), ("Speaker", 7)])
+        conn.commit()
+
+        room_id = add_room(cur, price=5.0)
+        quote = pricing.quote_booking(cur, room_id, "2030-01-07", "08:00 AM", "11:00 AM", ["1", "2"])
+        assert quote["quoted_hours"] == 3
+        assert quote["room_cost"] == 15.0
+        assert quote["equipment_cost"] == 17
+        assert quote["total_cost"] == 32.0
+
+        for bad in (["99"], ["x"]):
+            try:
+                pricing.quote_booking(cur, room_id, "2030-01-07", "08:00 AM", "09:00 AM", bad)
+                assert False, "invalid equipment accepted"
+            except ValueError:
+                pass
+
+
+def test_requote_pending():
+    """Test 3: Batch re-quote after a price change"""
+    print("\nTEST 3: Re-quote Pending Bookings")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        room_id = add_room(cur, price=10.0)
+        for status in ("Pending", "Confirmed"):
+            quote = pricing.quote_booking(cur, room_id, "2030-01-01", "08:00 AM", "10:00 AM")
+            cur.execute("""
+                INSERT INTO reservations (user_id, room_id, date, start_time, end_time, status)
+                VALUES (1, ?, '2030-01-01', '08:00 AM', '10:00 AM', ?)
+            """, (room_id, status))
+            pricing.save_quote(cur, cur.lastrowid, quote)
+        # Legacy booking without a stored quote
+        cur.execute("""
+            INSERT INTO reservations (user_id, room_id, date, start_time, end_time, status)
+            VALUES (1, ?, '2030-01-02', '08:00 AM', '11:00 AM', 'Pending')
+        """, (room_id,))
+        # Legacy booking with a 10-unit projector linked (its equipment_cost column reads the default 0)
+        cur.execute("""
+            INSERT INTO reservations (user_id, room_id, date, start_time, end_time, status)
+            VALUES (1, ?, '2030-01-03', '08:00 AM', '10:00 AM', 'Pending')
+        """, (room_id,))
+        legacy = cur.lastrowid
+        cur.execute("INSERT INTO equipment (name, price, quantity) VALUES ('Projector', 10, 1)")
+        cur.execute("INSERT INTO reservation_equipment (reservation_id, equipment_id) VALUES (?, ?)",
+                    (legacy, cur.lastrowid))
+        assert pricing.quote_reservation(cur, legacy)["total_cost"] == 30.0
+        cur.execute("UPDATE rooms SET price_per_hour=20.0 WHERE id=?", (room_id,))
+
+        assert pricing.requote_pending(conn, room_id) == 3
+        conn.commit()
+
+        cur.execute("SELECT status, equipment_cost, total_cost FROM reservations ORDER BY id")
+        totals = [(r["status"], r["equipment_cost"], r["total_cost"]) for r in cur.fetchall()]
+        assert totals == [("Pending", 0, 40.0), ("Confirmed", 0, 20.0), ("Pending", 0, 60.0),
+                          ("Pending", 10.0, 50.0)], totals
+        # Once quoted, the stored equipment cost is used
+        cur.execute("DELETE FROM reservation_equipment")
+        assert pricing.quote_reservation(cur, legacy)["total_cost"] == 50.0
+
+
+def test_rate_table():
+    """Test 4: Peak/off-peak rate rules"""
+    print("\nTEST 4: Rate Table")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        a = add_room(cur, "A", price=10.0)
+        b = add_room(cur, "B", price=4.0)
+        # All rooms: 12:00-14:00 peak; room B on Saturdays is flat 1.0
+        cur.execute("INSERT INTO room_rates (room_id, weekday, start_minute, end_minute, rate) VALUES (NULL, NULL, 720, 840, 20.0)")
+        cur.execute("INSERT INTO room_rates (room_id, weekday, start_minute, end_minute, rate) VALUES (?, 5, 480, 1200, 1.0)", (b,))
+        conn.commit()
+
+        # 2030-01-07 is a Monday, 2030-01-12 a Saturday
+        prices = pricing.window_prices(cur, "2030-01-07", "11:00 AM", "02:00 PM")
+        assert prices == {a: 50.0, b: 44.0}
+        prices = pricing.window_prices(cur, "2030-01-12", "11:00 AM", "02:00 PM")
+        assert prices == {a: 50.0, b: 3.0}
+
+        table = pricing.RateTable.from_db(cur)
+        costs = table.quote_many([a, b, b], pricing.weekdays_of(["2030-01-07", "2030-01-07", "2030-01-12"]),
+                                 [0, 0, 0], [1, 1, 1])
+        assert list(costs) == [10.0, 4.0, 1.0]
+
+
+def run_all_tests():
+    return testdb.run_tests((test_calculate_hours, test_quote_booking, test_requote_pending, test_rate_table))
+
+
+if __name__ == "__main__":
+    run_all_tests()
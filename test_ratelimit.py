@@ -0,0 +1,89 @@
+"""
+Test script for ratelimit.py
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import ratelimit
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def exercise(store):
+    clock = FakeClock()
+    limiter = ratelimit.RateLimiter({"login": ratelimit.Budget(burst=3, per_minute=6)}, store, clock)
+
+    # Burst of 3, then refused until a token refills (one every 10 seconds)
+    assert [limiter.check("login", "ip:a") for _ in range(3)] == [0, 0, 0]
+    assert limiter.check("login", "ip:a") == 10
+    clock.now += 4
+    assert limiter.check("login", "ip:a") == 6
+    clock.now += 6
+    assert limiter.check("login", "ip:a") == 0
+    assert limiter.check("login", "ip:a") == 10
+
+    # Keys and routes are independent; unbudgeted routes are never limited
+    assert limiter.check("login", "ip:b") == 0
+    assert limiter.check("register", "ip:a") == 0
+    # With several keys the tightest one decides
+    assert limiter.check("login", "ip:c", "user:1") == 0
+    assert limiter.check("login", "ip:a", "user:1") == 10
+
+    # A long idle period refills only up to the burst
+    clock.now += 3600
+    assert [limiter.check("login", "ip:a") for _ in range(4)] == [0, 0, 0, 10]
+    assert limiter.limited == {"login": 5}
+    assert 'ratelimit_limited_total{route="login"} 5' in limiter.metrics_text()
+
+
+def test_memory_store():
+    """Test 1: In-process buckets refill at the budgeted rate up to the burst"""
+    print("\nTEST 1: Memory Store")
+    exercise(ratelimit.MemoryStore())
+
+    # Buckets that have refilled are pruned once the dict grows too large
+    store = ratelimit.MemoryStore(max_keys=2)
+    store.take("a", 2, 1.0, 0.0)
+    store.take("b", 2, 1.0, 0.0)
+    store.take("c", 2, 1.0, 5.0)
+    assert set(store._buckets) == {"c"}
+
+
+def test_sqlite_store():
+    """Test 2: Buckets shared through SQLite behave the same across store instances"""
+    print("\nTEST 2: SQLite Store")
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        exercise(ratelimit.SqliteStore(path))
+
+        # A second store (another worker) sees the same buckets
+        first, second = ratelimit.SqliteStore(path), ratelimit.SqliteStore(path)
+        assert first.take("k", 2, 1.0, 0.0) == 0 and second.take("k", 2, 1.0, 0.0) == 0
+        assert first.take("k", 2, 1.0, 0.0) == 1.0
+        second.prune(7200.0)
+        assert first.take("k", 2, 1.0, 0.0) == 0
+    finally:
+        os.remove(path)
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def run_all_tests():
+    return testdb.run_tests((test_memory_store, test_sqlite_store))
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,87 @@
+"""
+Test script for recurring.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import recurring
+import timeslots
+
+
+def add_room(cur, price=10.0):
+    cur.execute("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES ('Room', 4, ?, 'available')", (price,))
+    return cur.lastrowid
+
+
+def test_expand_dates():
+    """Test 1: Series expansion"""
+    print("\nTEST 1: Expand Dates")
+    assert recurring.expand_dates("2030-01-07", "2030-01-28") == ["2030-01-07", "2030-01-14", "2030-01-21", "2030-01-28"]
+    assert recurring.expand_dates("2030-01-07", "2030-01-12", 3) == ["2030-01-07", "2030-01-10"]
+    assert len(recurring.expand_dates("2030-01-07", "2030-12-30")) == 52
+    for bad in (("2030-01-07", "2030-01-01", 7), ("2030-01-07", "2030-02-01", 0),
+                ("2030-01-07", "2035-01-01", 1), ("bad", "2030-02-01", 7)):
+        try:
+            recurring.expand_dates(*bad)
+            assert False, f"accepted {bad}"
+        except ValueError:
+            pass
+
+
+def test_book_series():
+    """Test 2: Series with conflicts and closed days"""
+    print("\nTEST 2: Book Series")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        room = add_room(cur, 5.0)
+        # Existing booking on the 3rd Monday overlaps; the 2nd Monday is outside the window;
+        # the hold on the 4th Monday has lapsed
+        cur.execute("""
+            INSERT INTO reservations (user_id, room_id, date, start_time, end_time, status, held_until)
+            VALUES (2, ?, '2030-01-21', '12:00 PM', '01:00 PM', 'Confirmed', NULL),
+                   (2, ?, '2030-01-14', '02:00 PM', '03:00 PM', 'Confirmed', NULL),
+                   (2, ?, '2030-01-28', '11:00 AM', '12:00 PM', 'Pending', '2020-01-01 00:00:00')
+        """, (room, room, room))
+        conn.commit()
+
+        series_id, report = recurring.book_series(conn, 1, room, "2030-01-07", "2030-02-04", "11:00 AM", "01:00 PM")
+        conn.commit()
+        assert series_id is not None
+        assert [(l["date"], l["status"]) for l in report] == [
+            ("2030-01-07", "booked"), ("2030-01-14", "booked"), ("2030-01-21", "conflict"),
+            ("2030-01-28", "booked"), ("2030-02-04", "booked")]
+        assert report[2]["reason"] == "Already booked"
+
+        cur.execute("SELECT date, status, total_cost FROM reservations WHERE series_id=? ORDER BY date", (series_id,))
+        rows = [tuple(r) for r in cur.fetchall()]
+        assert rows == [(d, "Pending", 10.0) for d in ("2030-01-07", "2030-01-14", "2030-01-28", "2030-02-04")]
+        assert all(l["reservation_id"] for l in report if l["status"] == "booked")
+        # Every occurrence is held until the same payment deadline
+        cur.execute("SELECT DISTINCT held_until FROM reservations WHERE series_id=?", (series_id,))
+        deadlines = [r[0] for r in cur.fetchall()]
+        assert len(deadlines) == 1 and deadlines[0] > timeslots.timestamp()
+
+        # Rebooking the same series conflicts everywhere; all-or-nothing books nothing
+        cur.execute("INSERT INTO room_hours (room_id, weekday, open_minute, close_minute) VALUES (?, 1, 0, 0)", (room,))
+        series_id, report = recurring.book_series(conn, 1, room, "2030-01-08", "2030-01-15", "11:00 AM", "12:00 PM",
+                                                  interval_days=1, skip_conflicts=False)
+        conn.commit()
+        assert series_id is None
+        assert report[0]["reason"] == "Room closed" and report[7]["reason"] == "Room closed"
+        assert report[1]["status"] == "skipped"
+        cur.execute("SELECT COUNT(*) FROM reservations")
+        assert cur.fetchone()[0] == 7
+
+
+def run_all_tests():
+    return testdb.run_tests((test_expand_dates, test_book_series))
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,91 @@
+"""
+Test script for rehome.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import maintenance
+import rehome
+
+
+def add_room(cur, name, capacity, status="available"):
+    cur.execute("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES (?, ?, 10, ?)",
+                (name, capacity, status))
+    return cur.lastrowid
+
+
+def book(cur, room_id, start, end, num_people, date="2030-01-07"):
+    cur.execute("""
+        INSERT INTO reservations (user_id, room_id, date, start_time, end_time, num_people, status)
+        VALUES (1, ?, ?, ?, ?, ?, 'Confirmed')
+    """, (room_id, date, start, end, num_people))
+    return cur.lastrowid
+
+
+def test_plan_moves():
+    """Test 1: Tightest fit, hardest first, placements block each other"""
+    print("\nTEST 1: Plan Moves")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        source = add_room(cur, "Source", 10)
+        small = add_room(cur, "Small", 2)
+        medium = add_room(cur, "Medium", 6)
+        large = add_room(cur, "Large", 12)
+        add_room(cur, "Broken", 20, status="maintenance")
+        book(cur, medium, "01:00 PM", "02:00 PM", 1)           # Medium busy after lunch
+        a = book(cur, source, "09:00 AM", "11:00 AM", 2)       # fits Small
+        b = book(cur, source, "09:00 AM", "10:00 AM", 5)       # Medium
+        c = book(cur, source, "10:00 AM", "11:00 AM", 4)       # Medium again once b ends
+        d = book(cur, source, "01:00 PM", "02:00 PM", 5)       # Medium busy -> Large
+        e = book(cur, source, "01:00 PM", "02:00 PM", 15)      # too big for any available room
+        conn.commit()
+
+        plan = rehome.plan_moves(cur, [a, b, c, d, e])
+        result = {line["id"]: (line["status"], line["to_room"]) for line in plan}
+        assert result == {a: ("moved", small), b: ("moved", medium), c: ("moved", medium),
+                          d: ("moved", large), e: ("unplaced", None)}, result
+        assert [l["reason"] for l in plan if l["id"] == e] == ["No free room with enough capacity"]
+
+        # Dry run writes nothing; applying moves the placed bookings only
+        rehome.rehome_bookings(conn, [a, b], dry_run=True)
+        cur.execute("SELECT COUNT(*) FROM reservations WHERE room_id=?", (source,))
+        assert cur.fetchone()[0] == 5
+        rehome.rehome_bookings(conn, [a, b, c, d, e])
+        conn.commit()
+        cur.execute("SELECT id FROM reservations WHERE room_id=?", (source,))
+        assert [r["id"] for r in cur.fetchall()] == [e]
+
+
+def test_offline_with_rehome():
+    """Test 2: Taking a room offline moves what fits and cancels the rest"""
+    print("\nTEST 2: Offline With Re-homing")
+    with testdb.temp_db() as db:
+        conn = db.conn
+        cur = conn.cursor()
+        source = add_room(cur, "Source", 8)
+        spare = add_room(cur, "Spare", 8)
+        a = book(cur, source, "09:00 AM", "10:00 AM", 3)
+        b = book(cur, source, "09:00 AM", "10:00 AM", 3, date="2030-01-08")
+        book(cur, spare, "09:00 AM", "10:00 AM", 1, date="2030-01-08")
+        conn.commit()
+
+        summary = maintenance.take_offline(conn, source, "2030-01-07", "2030-01-08", rehome_bookings=True)
+        conn.commit()
+        assert (summary["moved"], summary["cancelled"]) == (1, 1)
+        assert [bk["moved_to"] for bk in summary["bookings"]] == ["Spare", None]
+        cur.execute("SELECT id, room_id, status FROM reservations WHERE id IN (?, ?) ORDER BY id", (a, b))
+        assert [tuple(r) for r in cur.fetchall()] == [(a, spare, "Confirmed"), (b, source, "Cancelled")]
+
+
+def run_all_tests():
+    return testdb.run_tests((test_plan_moves, test_offline_with_rehome))
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,117 @@
+"""
+Test script for scheduler.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import scheduler
+import timeslots
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_cron_and_runs():
+    """Test 1: Cron expressions find the next matching minute; every run, failed or not, lands in job_runs"""
+    print("\nTEST 1: Cron Schedules and Run History")
+    start = datetime(2030, 1, 1, 9, 7, 30)     # a Tuesday
+    assert scheduler.Cron("* * * * *").next_after(start) == datetime(2030, 1, 1, 9, 8)
+    assert scheduler.Cron("*/15 * * * *").next_after(start) == datetime(2030, 1, 1, 9, 15)
+    assert scheduler.Cron("@hourly").next_after(start) == datetime(2030, 1, 1, 10, 0)
+    assert scheduler.Cron("0 3 * * *").next_after(start) == datetime(2030, 1, 2, 3, 0)
+    assert scheduler.Cron("30 8-17 * * 1-5").next_after(datetime(2030, 1, 4, 17, 45)) == datetime(2030, 1, 7, 8, 30)
+    assert scheduler.Cron("0 0 1 3 *").next_after(start) == datetime(2030, 3, 1, 0, 0)
+    assert scheduler.Cron("0 0 * * 7").matches(datetime(2030, 1, 6))     # Sunday, either way
+    for bad in ("* * * *", "60 * * * *", "5-1 * * * *", "0 0 31 2 *"):
+        try:
+            scheduler.Cron(bad).next_after(start)
+            assert False, f"'{bad}' should be rejected"
+        except ValueError:
+            pass
+
+    with testdb.temp_db() as db:
+        conn = sqlite3.connect(db.path)
+        try:
+            assert scheduler.run_job(conn, "count", lambda c: 3) == 3
+            assert scheduler.run_job(conn, "sweep", lambda c: {"processed": 2, "lapsed": 2}) == {"processed": 2, "lapsed": 2}
+
+            def broken(c):
+                c.execute("BEGIN IMMEDIATE")
+                c.execute("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES ('X', 1, 1, 'available')")
+                raise RuntimeError("disk on fire")
+            assert scheduler.run_job(conn, "broken", broken) is None
+            rows = conn.execute("SELECT job, processed, detail, error FROM job_runs ORDER BY id").fetchall()
+            assert rows == [("count", 3, None, None), ("sweep", 2, '{"processed": 2, "lapsed": 2}', None),
+                            ("broken", None, None, "RuntimeError: disk on fire")], rows
+            # the failed job's writes were rolled back
+            assert conn.execute("SELECT COUNT(*) FROM rooms").fetchone()[0] == 0
+            text = scheduler.metrics_text(conn.cursor())
+            assert 'scheduler_job_failures_total{job="broken"} 1' in text
+        finally:
+            conn.close()
+
+
+def test_leader_election():
+    """Test 2: Of two schedulers on one database only the lease holder runs jobs; the other takes over when it stops"""
+    print("\nTEST 2: Leader Election")
+    with testdb.temp_db() as db:
+        path = db.path
+        clock = [timeslots.MALAYSIA_TZ.localize(datetime(2030, 1, 1, 9, 0, 30))]
+        timeslots.set_clock(lambda: clock[0])
+
+        def connect():
+            conn = sqlite3.connect(path, timeout=5)
+            conn.row_factory = sqlite3.Row
+            return conn
+        runs = []
+        workers = [scheduler.Scheduler(connect, lease_seconds=0.6, tick=0.02, holder=name) for name in ("w1", "w2")]
+        for worker in workers:
+            worker.register("tick", "* * * * *", lambda conn, w=worker: runs.append(w.holder))
+        try:
+            for worker in workers:
+                worker.start()
+            assert wait_for(lambda: any(w.is_leader for w in workers))
+            time.sleep(0.3)
+            assert sum(w.is_leader for w in workers) == 1
+            leader, follower = sorted(workers, key=lambda w: not w.is_leader)
+            # Nothing runs for the minute already under way; each new minute runs once, on the leader
+            assert runs == []
+            for minute in (1, 2):
+                clock[0] += timedelta(minutes=1)
+                assert wait_for(lambda: len(runs) == minute)
+            time.sleep(0.2)
+            assert runs == [leader.holder] * 2
+
+            leader.stop()
+            assert wait_for(lambda: follower.is_leader)
+            clock[0] += timedelta(minutes=1)
+            assert wait_for(lambda: len(runs) == 3)
+            assert runs[-1] == follower.holder
+            conn = connect()
+            history = [(row["job"], row["runner"]) for row in scheduler.history(conn.cursor(), "tick")]
+            conn.close()
+            assert history == [("tick", follower.holder)] + [("tick", leader.holder)] * 2
+        finally:
+            for worker in workers:
+                worker.stop()
+            timeslots.set_clock(None)
+
+
+def run_all_tests():
+    return testdb.run_tests((test_cron_and_runs, test_leader_election))
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,82 @@
+"""
+Test script for timeslots.py
+"""
+
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import timeslots
+
+
+def test_slot_grid():
+    """Test 1: Slot lookups"""
+    print("\nTEST 1: Slot Grid")
+    assert timeslots.slot_index("08:00 AM") == 0
+    assert timeslots.slot_index("08:00 PM") == len(timeslots.grid().labels) - 1
+    assert timeslots.slot_index("09:00 PM") is None
+    assert timeslots.grid().start_labels[0] == "08:00 AM" and timeslots.grid().end_labels[-1] == "08:00 PM"
+    assert timeslots.calculate_hours("10:00 AM", "03:00 PM") == 5
+    assert timeslots.calculate_hours("10:00 AM", "bad") == 0
+
+
+def test_normalize_time():
+    """Test 2: Form time formats"""
+    print("\nTEST 2: Normalize Time")
+    assert timeslots.normalize_time("01:00 PM") == "01:00 PM"
+    assert timeslots.normalize_time("13:00") == "01:00 PM"
+    assert timeslots.normalize_time("08:00:00") == "08:00 AM"
+    assert timeslots.normalize_time("07:00") is None
+    assert timeslots.normalize_time(None) is None
+
+
+def test_configurable_grid():
+    """Test 3: 15/30-minute grids"""
+    print("\nTEST 3: Configurable Grid")
+    half = timeslots.SlotGrid(30, 9 * 60, 17 * 60)
+    assert half.n_slots == 16
+    assert half.start_labels[:2] == ["09:00 AM", "09:30 AM"] and half.end_labels[-1] == "05:00 PM"
+    assert half.window("09:30 AM", "11:00 AM") == (1, 4)
+    assert half.window("11:00 AM", "09:30 AM") is None
+
+    day = timeslots.SlotGrid(15, 0, timeslots.DAY_MINUTES)
+    assert day.n_slots == 96 and len(day.index) == 97
+    assert timeslots.label_minutes(day.labels[-1]) == timeslots.DAY_MINUTES
+
+    for bad in ((20, 480, 1200), (30, 480, 1195), (60, 1200, 480)):
+        try:
+            timeslots.SlotGrid(*bad)
+            assert False, f"invalid grid accepted: {bad}"
+        except ValueError:
+            pass
+
+    previous = timeslots.grid()
+    try:
+        timeslots.set_grid(half)
+        assert timeslots.calculate_hours("09:00 AM", "10:30 AM") == 1.5
+        assert timeslots.normalize_time("13:30") == "01:30 PM"
+        assert timeslots.normalize_time("08:00 AM") is None
+    finally:
+        timeslots.set_grid(previous)
+
+
+def test_frozen_clock():
+    """Test 4: Frozen clock"""
+    print("\nTEST 4: Frozen Clock")
+    with timeslots.frozen_time(datetime(2030, 1, 7, 9, 30)):
+        assert timeslots.timestamp() == "2030-01-07 09:30:00"
+        assert timeslots.timestamp("%Y-%m-%d %H:%M") == "2030-01-07 09:30"
+        assert timeslots.today() == "2030-01-07"
+        assert timeslots.now().tzinfo is not None
+    assert timeslots.today() != "2030-01-07"
+
+
+def run_all_tests():
+    return testdb.run_tests((test_slot_grid, test_normalize_time, test_configurable_grid, test_frozen_clock))
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,113 @@
+"""
+Test script for waitlist.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import operations
+import timeslots
+import waitlist
+
+
+def book(conn, user_id, start, end, date="2030-01-07"):
+    rid = operations.create_booking(conn, user_id, 1, date, start, end)["reservation_id"]
+    operations.pay_booking(conn, user_id, rid, "System Balance")
+    conn.commit()
+    return rid
+
+
+def join(conn, user_id, start, end, date="2030-01-07"):
+    entry = waitlist.join(conn, user_id, 1, date, start, end)
+    conn.commit()
+    return entry
+
+
+def test_join_and_promote():
+    """Test 1: Cancelling hands the slot to the first waiter who fits, as a held Pending booking with an email"""
+    print("\nTEST 1: Join and Promote on Cancel")
+    with testdb.temp_db(rooms=1, users=4, wallet=100) as db:
+        conn = db.conn
+        cur = conn.cursor()
+        with timeslots.frozen_time(datetime(2030, 1, 6, 12, 0)):
+            taken = book(conn, 1, "09:00 AM", "11:00 AM")
+            book(conn, 1, "11:00 AM", "12:00 PM")
+            for window in (("01:00 PM", "02:00 PM"), ("08:00 AM", "09:00 AM")):
+                try:
+                    join(conn, 2, *window)
+                    assert False, "joined the waitlist for a free slot"
+                except ValueError as e:
+                    conn.rollback()
+                    assert "free" in str(e)
+
+            # User 2 waits for 10-12: still partly taken by the 11:00 booking after the cancel
+            assert join(conn, 2, "10:00 AM", "12:00 PM") == {"waitlist_id": 1, "position": 1}
+            assert join(conn, 3, "09:00 AM", "10:00 AM")["position"] == 1      # no overlap with user 2
+            assert join(conn, 4, "09:00 AM", "11:00 AM")["position"] == 3
+            try:
+                join(conn, 4, "09:00 AM", "11:00 AM")
+                assert False, "joined the same slot twice"
+            except ValueError:
+                conn.rollback()
+
+            assert operations.cancel_booking(conn, 1, taken) == {"refund": 20}
+            conn.commit()
+
+        cur.execute("SELECT id, user_id, status, reservation_id FROM waitlist ORDER BY id")
+        rows = [tuple(row) for row in cur.fetchall()]
+        assert [row[:3] for row in rows] == [(1, 2, "waiting"), (2, 3, "promoted"), (3, 4, "waiting")], rows
+        cur.execute("SELECT user_id, start_time, end_time, status, held_until FROM reservations WHERE id=?",
+                    (rows[1][3],))
+        assert tuple(cur.fetchone()) == (3, "09:00 AM", "10:00 AM", "Pending", "2030-01-06 13:00:00")
+        cur.execute("SELECT reservation_id, kind FROM notifications")
+        assert [tuple(row) for row in cur.fetchall()] == [(rows[1][3], "waitlist")]
+        assert waitlist.position(cur, 3) == 2      # only user 2 is still ahead
+
+        assert [entry["status"] for entry in waitlist.for_user(cur, 4)] == ["waiting"]
+        waitlist.leave(conn, 4, 3)
+        conn.commit()
+        try:
+            waitlist.leave(conn, 4, 3)
+            assert False, "left the waitlist twice"
+        except ValueError:
+            conn.rollback()
+
+
+def test_rollback_and_index():
+    """Test 2: A rolled-back cancel promotes nobody; the waiter lookup runs on the partial index"""
+    print("\nTEST 2: Rollback and Indexed Lookup")
+    with testdb.temp_db(rooms=1, users=4, wallet=100) as db:
+        conn = db.conn
+        cur = conn.cursor()
+        with timeslots.frozen_time(datetime(2030, 1, 6, 12, 0)):
+            taken = book(conn, 1, "09:00 AM", "10:00 AM")
+            join(conn, 2, "09:00 AM", "10:00 AM")
+            operations.cancel_booking(conn, 1, taken)
+            conn.rollback()
+            cur.execute("SELECT status FROM waitlist")
+            assert cur.fetchone()[0] == "waiting"
+
+            # Admin delete: the row goes, then promote() runs before the commit
+            cur.execute("DELETE FROM reservations WHERE id=?", (taken,))
+            promoted = waitlist.promote(conn, 1, "2030-01-07", "09:00 AM", "10:00 AM")
+            conn.commit()
+            assert [(entry["waitlist_id"], entry["user_id"]) for entry in promoted] == [(1, 2)]
+            assert waitlist.promote(conn, 1, "2030-01-07", "09:00 AM", "10:00 AM") == []
+
+        cur.execute("EXPLAIN QUERY PLAN SELECT id FROM waitlist WHERE room_id = 1 AND date = '2030-01-07' "
+                    "AND status = 'waiting' AND start_minute < 600 AND end_minute > 540 ORDER BY id LIMIT 20")
+        plan = " ".join(row[3] for row in cur.fetchall())
+        assert "idx_waitlist_waiting" in plan, plan
+
+
+def run_all_tests():
+    return testdb.run_tests((test_join_and_promote, test_rollback_and_index))
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,177 @@
+"""
+Test script for operations.py and writer.py
+Runs against a temporary database from testdb.temp_db()
+"""
+
+import os
+import sys
+import sqlite3
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testdb
+import ledger
+import lottery
+import writer
+
+
+def add_bank_rows(conn):
+    """The legacy balance rows the wallet screens still read"""
+    conn.execute("INSERT INTO bank (user_id, balance) VALUES (1, 0)")
+    conn.execute("INSERT INTO user_bank_acc (user_id, bank_balance) VALUES (1, 100)")
+    conn.commit()
+
+
+def balances(path):
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    row = (ledger.balance(cur, ledger.wallet(1)), ledger.balance(cur, ledger.bank(1)))
+    conn.close()
+    return row
+
+
+def explode(conn, user_id):
+    """A writer operation that fails half-way with something other than ValueError"""
+    conn.execute("UPDATE users SET name='changed' WHERE id=?", (user_id,))
+    raise KeyError("boom")
+
+
+def booking_flow(writes, path):
+    booking = writes.call("create_booking", user_id=1, room_id=1, date="2030-01-07",
+                          start_time="09:00 AM", end_time="11:00 AM")
+    assert booking["total_cost"] == 20
+    rid = booking["reservation_id"]
+    for op, kwargs in (("create_booking", dict(user_id=1, room_id=1, date="2030-01-07",
+                                               start_time="10:00 AM", end_time="11:00 AM")),
+                       ("pay_booking", dict(user_id=1, reservation_id=rid, payment_method="System Balance")),
+                       ("top_up", dict(user_id=1, amount=500, bank_name="Maybank")),
+                       ("cancel_booking", dict(user_id=2, booking_id=rid))):
+        try:
+            writes.call(op, **kwargs)
+            assert False, f"accepted {op} {kwargs}"
+        except ValueError:
+            pass
+    assert writes.call("top_up", user_id=1, amount=30, bank_name="Maybank") == {"amount": 30.0}
+    paid = writes.call("pay_booking", user_id=1, reservation_id=rid, payment_method="System Balance")
+    assert paid["total_cost"] == 20 and paid["transaction_id"].startswith("TXN-")
+    assert tuple(balances(path)) == (10, 70)
+    assert writes.call("cancel_booking", user_id=1, booking_id=rid) == {"refund": 20}
+    assert tuple(balances(path)) == (30, 70)
+
+
+def test_local_writer():
+    """Test 1: Book, pay, top up and cancel in-process, refusals leave nothing behind"""
+    print("\nTEST 1: Local Writer")
+    with testdb.temp_db(rooms=1, users=1, bank=100) as db:
+        add_bank_rows(db.conn)
+        booking_flow(writer.LocalWriter(db.connect), db.path)
+        conn = db.conn
+        assert conn.execute("SELECT COUNT(*) FROM reservations").fetchone()[0] == 1
+        assert conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == 1
+
+
+def test_coordinator():
+    """Test 2: The coordinator runs the same operations, one savepoint per operation in a batch"""
+    print("\nTEST 2: Writer Coordinator")
+    writer.OPERATIONS["explode"] = explode
+    try:
+        coordinator_flow()
+    finally:
+        del writer.OPERATIONS["explode"]
+
+
+def coordinator_flow():
+    with testdb.temp_db(rooms=1, users=1, bank=100) as db:
+        path = db.path
+        add_bank_rows(db.conn)
+        address = os.path.join(tempfile.mkdtemp(), "writer.sock")
+        # A refused operation in a batch only undoes itself
+        conn = sqlite3.connect(path, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        replies = writer.run_batch(conn, [
+            ("top_up", dict(user_id=1, amount=10, bank_name="A")),
+            ("top_up", dict(user_id=1, amount=1000, bank_name="B")),
+            ("drop_tables", {}),
+            ("explode", dict(user_id=1)),
+            ("top_up", dict(user_id=1, amount=5, bank_name="C")),
+        ])
+        assert [ok for ok, _ in replies] == [True, False, False, False, True]
+        assert replies[3][1] == "Write failed: KeyError: 'boom'"
+        assert conn.execute("SELECT name FROM users WHERE id=1").fetchone()[0] == "User 1"
+        conn.close()
+        assert tuple(balances(path)) == (15, 85)
+        conn = sqlite3.connect(path)
+        ledger.transfer(conn.cursor(), ledger.wallet(1), ledger.bank(1), 15, "Reset")
+        conn.execute("DELETE FROM transactions")
+        conn.commit()
+        conn.close()
+
+        coordinator = writer.Coordinator(path, address)
+        ready = threading.Event()
+        threading.Thread(target=coordinator.serve, args=(ready,), daemon=True).start()
+        assert ready.wait(5)
+        booking_flow(writer.WriterClient(address), path)
+        # An operation that blows up answers its caller and leaves the writer running
+        try:
+            writer.WriterClient(address).call("explode", user_id=1)
+            assert False, "explode succeeded"
+        except ValueError as e:
+            assert "KeyError" in str(e)
+
+        # Concurrent callers share transactions
+        client = writer.WriterClient(address)
+        threads = [threading.Thread(target=client.call, args=("top_up",),
+                                    kwargs=dict(user_id=1, amount=1, bank_name="T")) for _ in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert tuple(balances(path)) == (50, 50)
+        assert coordinator.operations == 29 and coordinator.batches <= 29
+
+
+def test_routed_operations():
+    """Test 3: Any-room, series, lottery and edit bookings run as writer operations with plain results"""
+    print("\nTEST 3: Routed Patron Operations")
+    with testdb.temp_db(rooms=2, users=1, bank=100) as db:
+        writes = writer.LocalWriter(db.connect)
+        rid, room = writes.call("book_any_room", user_id=1, date="2030-01-07", start_time="09:00 AM",
+                                end_time="10:00 AM", num_people=2)
+        assert room["room_name"] == "Room 1" and type(room) is dict
+        series_id, report = writes.call("book_series", user_id=1, room_id=2, first_date="2030-01-07",
+                                        until_date="2030-01-21", start_time="01:00 PM", end_time="02:00 PM")
+        assert series_id == 1 and [line["status"] for line in report] == ["booked"] * 3
+
+        assert writes.call("edit_booking", user_id=1, booking_id=rid, room_id=2, date="2030-01-07",
+                           start_time="10:00 AM", end_time="12:00 PM") == {"reservation_id": rid}
+        cur = db.conn.cursor()
+        cur.execute("SELECT room_id, start_time, total_cost FROM reservations WHERE id=?", (rid,))
+        assert tuple(cur.fetchone()) == (2, "10:00 AM", 20)
+        try:
+            writes.call("edit_booking", user_id=1, booking_id=rid, room_id=2, date="2030-01-07",
+                        start_time="01:00 PM", end_time="02:00 PM")
+            assert False, "moved onto a series occurrence"
+        except ValueError:
+            pass
+
+        try:
+            writes.call("enter_lottery", user_id=1, room_id=1, date="2030-03-01", start_time="09:00 AM",
+                        end_time="10:00 AM")
+            assert False, "entered a lottery that is not open"
+        except ValueError:
+            pass
+        lottery.create_window(cur, "2030-03-01", "2030-03-01", "2030-02-01 12:00")
+        db.conn.commit()
+        entry = writes.call("enter_lottery", user_id=1, room_id=1, date="2030-03-01", start_time="09:00 AM",
+                            end_time="10:00 AM")
+        assert entry == {"request_id": 1, "draw_at": "2030-02-01 12:00:00"}
+
+
+def run_all_tests():
+    return testdb.run_tests((test_local_writer, test_coordinator, test_routed_operations))
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,93 @@
+"""
+Shared setup for the test scripts.
+temp_db() builds a fully migrated database in a temp file (through
+setup_db.create_tables(), as a fresh install would), optionally seeds
+rooms, patrons and their opening balances, and removes the file
+afterwards. run_tests() is the driver behind every script's
+`python test_x.py`; pytest collects the test_ functions directly.
+"""
+
+import os
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+
+import ledger
+import setup_db
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+class TempDB:
+    """A temp database: .path, an open .conn, and connect() for more connections (other threads, writers)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = connect(path)
+
+    def connect(self):
+        return connect(self.path)
+
+
+@contextmanager
+def temp_db(rooms=0, users=0, wallet=0, bank=0):
+    """
+    Yield a TempDB seeded with `rooms` rooms ('Room 1'.., capacity 4, 10/hour) and `users`
+    patrons ('user1'.. with user1@example.com..), each with `wallet` and `bank` opening balances
+    """
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    original = setup_db.DB_PATH
+    setup_db.DB_PATH = path
+    try:
+        setup_db.create_tables()
+    finally:
+        setup_db.DB_PATH = original
+    db = TempDB(path)
+    try:
+        cur = db.conn.cursor()
+        cur.executemany("INSERT INTO rooms (room_name, capacity, price_per_hour, status) VALUES (?, 4, 10, 'available')",
+                        [(f"Room {n}",) for n in range(1, rooms + 1)])
+        cur.executemany("INSERT INTO users (name, email, username, password, role) VALUES (?, ?, ?, 'x', 'student')",
+                        [(f"User {n}", f"user{n}@example.com", f"user{n}") for n in range(1, users + 1)])
+        for user_id in range(1, users + 1):
+            ledger.open_account(cur, user_id, wallet, bank)
+        db.conn.commit()
+        yield db
+    finally:
+        db.conn.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def expect_error(fn, *args, **kwargs):
+    """The message of the ValueError fn raises (fails the test if it does not)"""
+    try:
+        fn(*args, **kwargs)
+    except ValueError as e:
+        return str(e)
+    raise AssertionError(f"{fn.__name__} did not raise")
+
+
+def run_tests(tests):
+    """Run test functions in order, print a summary; True when all passed"""
+    results = []
+    for test in tests:
+        try:
+            test()
+            results.append((test.__doc__, True))
+        except AssertionError as e:
+            print(f" {test.__doc__} failed: {e}")
+            results.append((test.__doc__, False))
+
+    print("\n" + "="*60)
+    passed = sum(1 for _, ok in results if ok)
+    for name, ok in results:
+        print(f"  {name}: {'PASSED' if ok else 'FAILED'}")
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return passed == len(results)
@@ -0,0 +1,195 @@
+"""
+Booking slot grid and clock.
+One place owns the time slot grid (with O(1) label <-> index lookups
+and precomputed lists for templates) and the Malaysia-time clock. The
+timezone is resolved once; the clock can be swapped or frozen so tests
+and benchmarks get deterministic timestamps.
+
+The grid's slot size and opening hours come from booking_rules
+(slot_minutes, open_minute, close_minute); load_grid() reads them and
+makes that grid current for the process.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytz
+
+# ================= SLOT GRID =================
+DEFAULT_SLOT_MINUTES = 60
+DEFAULT_OPEN_MINUTE = 8 * 60
+DEFAULT_CLOSE_MINUTE = 20 * 60
+SLOT_SIZES = (15, 30, 60)
+DAY_MINUTES = 24 * 60
+END_OF_DAY = "12:00 AM (next day)"
+
+_label_cache = {END_OF_DAY: DAY_MINUTES}
+
+
+def format_minutes(minutes):
+    """810 -> '01:30 PM'"""
+    if minutes == DAY_MINUTES:
+        return END_OF_DAY
+    hour, minute = divmod(int(minutes), 60)
+    return f"{(hour - 1) % 12 + 1:02d}:{minute:02d} {'AM' if hour % 24 < 12 else 'PM'}"
+
+
+def label_minutes(label):
+    """'01:30 PM' -> 810"""
+    minutes = _label_cache.get(label)
+    if minutes is None:
+        t = datetime.strptime(label, "%I:%M %p")
+        minutes = _label_cache[label] = t.hour * 60 + t.minute
+    return minutes
+
+
+def hours_from_minutes(minutes):
+    """Whole hours stay ints (3), partial hours become floats (1.5)"""
+    return minutes // 60 if minutes % 60 == 0 else minutes / 60
+
+
+class SlotGrid:
+    """Slot boundaries from open to close in steps of slot_minutes"""
+
+    def __init__(self, slot_minutes=DEFAULT_SLOT_MINUTES, open_minute=DEFAULT_OPEN_MINUTE,
+                 close_minute=DEFAULT_CLOSE_MINUTE):
+        if slot_minutes not in SLOT_SIZES:
+            raise ValueError(f"Slot size must be one of {', '.join(map(str, SLOT_SIZES))} minutes")
+        if not 0 <= open_minute < close_minute <= DAY_MINUTES or (close_minute - open_minute) % slot_minutes:
+            raise ValueError("Opening hours must be a whole number of slots within one day")
+        self.slot_minutes = slot_minutes
+        self.open_minute = open_minute
+        self.close_minute = close_minute
+        self.minutes = list(range(open_minute, close_minute + 1, slot_minutes))
+        self.labels = [format_minutes(m) for m in self.minutes]
+        self.index = {label: i for i, label in enumerate(self.labels)}
+        self.minute_labels = dict(zip(self.minutes, self.labels))
+        self.n_slots = len(self.minutes) - 1
+        # Precomputed option lists for the booking forms
+        self.start_labels = self.labels[:-1]
+        self.end_labels = self.labels[1:]
+
+    def slot_index(self, label):
+        """Boundary index of a label, or None if it is not on the grid"""
+        return self.index.get(label)
+
+    def window(self, start_time, end_time):
+        """(start, end) boundary indices of a valid window, else None"""
+        start = self.index.get(start_time)
+        end = self.index.get(end_time)
+        if start is None or end is None or end <= start:
+            return None
+        return start, end
+
+    def boundary(self, minute):
+        """Boundary index of a minute-of-day (None if off-grid)"""
+        offset = minute - self.open_minute
+        if offset % self.slot_minutes or not 0 <= offset <= self.close_minute - self.open_minute:
+            return None
+        return offset // self.slot_minutes
+
+    def __repr__(self):
+        return (f"SlotGrid({self.slot_minutes} min, {format_minutes(self.open_minute)}"
+                f" - {format_minutes(self.close_minute)})")
+
+
+_grid = SlotGrid()
+
+
+def grid():
+    """The slot grid currently in effect"""
+    return _grid
+
+
+def set_grid(new_grid):
+    global _grid
+    _grid = new_grid or SlotGrid()
+    return _grid
+
+
+def grid_from_rules(cur):
+    """Build the grid configured in booking_rules (defaults if unset)"""
+    cur.execute("SELECT slot_minutes, open_minute, close_minute FROM booking_rules WHERE id=1")
+    row = cur.fetchone()
+    if not row:
+        return SlotGrid()
+    return SlotGrid(row[0] or DEFAULT_SLOT_MINUTES,
+                    DEFAULT_OPEN_MINUTE if row[1] is None else row[1],
+                    DEFAULT_CLOSE_MINUTE if row[2] is None else row[2])
+
+
+def load_grid(cur):
+    """Make the grid configured in booking_rules current"""
+    return set_grid(grid_from_rules(cur))
+
+
+def slot_index(label):
+    """Index of a slot label, or None if it is not on the grid"""
+    return _grid.index.get(label)
+
+
+def normalize_time(value):
+    """Accept '08:00 AM', '08:00' or '08:00:00' and return the grid label (None if off-grid)"""
+    if value in _grid.index:
+        return value
+    for fmt in ("%H:%M", "%H:%M:%S"):
+        try:
+            t = datetime.strptime(value.strip(), fmt)
+        except (AttributeError, ValueError):
+            continue
+        return _grid.minute_labels.get(t.hour * 60 + t.minute)
+    return None
+
+
+def calculate_hours(start_time, end_time):
+    """Hours between two slot labels (0 if either is off the grid)"""
+    start = _grid.index.get(start_time)
+    end = _grid.index.get(end_time)
+    if start is None or end is None:
+        return 0
+    return hours_from_minutes((end - start) * _grid.slot_minutes)
+
+
+# ================= CLOCK =================
+MALAYSIA_TZ = pytz.timezone("Asia/Kuala_Lumpur")
+
+
+def system_clock():
+    return datetime.now(MALAYSIA_TZ)
+
+
+_clock = system_clock
+
+
+def now():
+    """Current Malaysia time (timezone aware)"""
+    return _clock()
+
+
+def timestamp(fmt="%Y-%m-%d %H:%M:%S"):
+    """Current Malaysia time as the string stored in the database"""
+    return _clock().strftime(fmt)
+
+
+def today():
+    """Current Malaysia date as YYYY-MM-DD"""
+    return _clock().strftime("%Y-%m-%d")
+
+
+def set_clock(clock):
+    """Replace the clock with any zero-argument callable returning an aware datetime"""
+    global _clock
+    _clock = clock or system_clock
+
+
+@contextmanager
+def frozen_time(moment):
+    """Freeze now() at a fixed moment (naive datetimes are taken as Malaysia time)"""
+    if moment.tzinfo is None:
+        moment = MALAYSIA_TZ.localize(moment)
+    previous = _clock
+    set_clock(lambda: moment)
+    try:
+        yield moment
+    finally:
+        set_clock(previous)
@@ -0,0 +1,119 @@
+"""
+Waitlist for taken slots.
+A patron who finds a window booked can wait for it instead of polling
+the rooms page: join() records (room, date, start, end) in `waitlist`,
+refusing windows that are free or not bookable at all.
+
+Whenever a booking gives up its slot (patron or CLI cancel, admin
+delete) the caller runs promote() in the same transaction. It looks up
+the waiters for that room and day whose window overlaps the freed one,
+oldest first, through the partial (room_id, date, start_minute) index
+of waiting rows, so a cancellation costs the same however long other
+waitlists grow. Each waiter whose whole window is now free gets a
+Pending booking held for PROMOTION_HOLD_MINUTES (and an email, see
+notify.py); one whose window is still partly taken keeps waiting. At
+most PROMOTE_SCAN waiters are looked at per freed slot.
+"""
+
+from datetime import timedelta
+
+import availability
+import notify
+import operations
+import timeslots
+
+PROMOTION_HOLD_MINUTES = 60
+PROMOTE_SCAN = 20
+
+
+def join(conn, user_id, room_id, date, start_time, end_time, num_people=1):
+    """Wait for a booked window: {waitlist_id, position}"""
+    cur = operations._begin(conn)
+    if date < timeslots.today():
+        raise ValueError("That date has passed")
+    try:
+        availability.check_window(cur, room_id, date, start_time, end_time)
+    except availability.Conflict:
+        pass
+    else:
+        raise ValueError("This slot is free: book it now instead of waiting")
+    cur.execute("""
+        SELECT id FROM waitlist
+        WHERE user_id=? AND room_id=? AND date=? AND start_time=? AND end_time=? AND status='waiting'
+    """, (user_id, room_id, date, start_time, end_time))
+    if cur.fetchone():
+        raise ValueError("You are already on the waitlist for this slot")
+    cur.execute("""
+        INSERT INTO waitlist (user_id, room_id, date, start_time, end_time, num_people, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (user_id, room_id, date, start_time, end_time, num_people, timeslots.timestamp()))
+    waitlist_id = cur.lastrowid
+    return {"waitlist_id": waitlist_id, "position": position(cur, waitlist_id)}
+
+
+def leave(conn, user_id, waitlist_id):
+    """Stop waiting: {waitlist_id}"""
+    cur = operations._begin(conn)
+    cur.execute("UPDATE waitlist SET status='withdrawn' WHERE id=? AND user_id=? AND status='waiting'",
+                (waitlist_id, user_id))
+    if cur.rowcount == 0:
+        raise ValueError("Not on the waitlist")
+    return {"waitlist_id": waitlist_id}
+
+
+def position(cur, waitlist_id):
+    """1 + the waiters ahead of this one for an overlapping window of the same room and day"""
+    cur.execute("""
+        SELECT COUNT(*) + 1 FROM waitlist w
+        JOIN waitlist mine ON mine.id = ?
+        WHERE w.status = 'waiting' AND w.room_id = mine.room_id AND w.date = mine.date
+        AND w.start_minute < mine.end_minute AND w.end_minute > mine.start_minute AND w.id < mine.id
+    """, (waitlist_id,))
+    return cur.fetchone()[0]
+
+
+def for_user(cur, user_id):
+    """A patron's waitlist entries, newest first, with their position while waiting"""
+    cur.execute("""
+        SELECT w.*, rm.room_name FROM waitlist w JOIN rooms rm ON rm.id = w.room_id
+        WHERE w.user_id = ? ORDER BY w.id DESC
+    """, (user_id,))
+    entries = [dict(row) for row in cur.fetchall()]
+    for entry in entries:
+        entry['position'] = position(cur, entry['id']) if entry['status'] == 'waiting' else None
+    return entries
+
+
+def promote(conn, room_id, date, start_time, end_time):
+    """
+    Give the freed window to the waiters who now fit, oldest first, in the caller's
+    transaction: [{waitlist_id, user_id, reservation_id}]
+    """
+    cur = operations._begin(conn)
+    if date < timeslots.today():
+        return []
+    start, end = timeslots.label_minutes(start_time), timeslots.label_minutes(end_time)
+    cur.execute("""
+        SELECT id, user_id, start_time, end_time, num_people FROM waitlist
+        WHERE room_id = ? AND date = ? AND status = 'waiting' AND start_minute < ? AND end_minute > ?
+        ORDER BY id LIMIT ?
+    """, (room_id, date, end, start, PROMOTE_SCAN))
+    promoted = []
+    held_until = (timeslots.now() + timedelta(minutes=PROMOTION_HOLD_MINUTES)).strftime("%Y-%m-%d %H:%M:%S")
+    for waiter in cur.fetchall():
+        # A waiter whose window is still partly taken stays in line
+        cur.execute("SAVEPOINT promote")
+        try:
+            booking = operations.create_booking(conn, waiter[1], room_id, date, waiter[2], waiter[3], waiter[4])
+        except ValueError:
+            cur.execute("ROLLBACK TO promote")
+            cur.execute("RELEASE promote")
+            continue
+        cur.execute("RELEASE promote")
+        reservation_id = booking['reservation_id']
+        cur.execute("UPDATE reservations SET held_until=? WHERE id=?", (held_until, reservation_id))
+        cur.execute("UPDATE waitlist SET status='promoted', reservation_id=?, promoted_at=? WHERE id=?",
+                    (reservation_id, timeslots.timestamp(), waiter[0]))
+        notify.queue_notice(cur, "waitlist", [reservation_id])
+        promoted.append({"waitlist_id": waiter[0], "user_id": waiter[1], "reservation_id": reservation_id})
+    return promoted
@@ -0,0 +1,220 @@
+"""
+Single-writer coordinator for patron write operations.
+SQLite lets one connection write at a time. With several web workers each
+opening its own write transaction, all but one sit in the busy handler
+and throughput falls apart under load. In coordinator mode the workers
+send operations (see operations.py) over a local socket to one process
+that owns the only write connection. It takes whatever requests are
+waiting, runs them in one transaction - each inside a SAVEPOINT, so a
+refused operation only undoes itself - commits once, and answers every
+caller. Reads stay in the workers.
+
+    python writer.py [address]     # start the coordinator
+
+LocalWriter runs the same operations in the calling process, one
+transaction each; the web app uses it unless WRITER_ADDRESS is set.
+Either way an idempotency_key argument makes a resubmitted operation
+return its first result instead of running again (see idempotency.py).
+
+Every patron write goes through here. Staff screens (admin booking
+edits and deletes, bulk actions, closures, lottery draws) and the CLI
+write on their own connection instead: they are rare next to patron
+traffic, wait out the coordinator's short transactions in SQLite's busy
+handler, and several of them run many statements that must see each
+other's effects in one transaction, which OPERATIONS does not model.
+"""
+
+import os
+import queue
+import sqlite3
+import sys
+import threading
+from multiprocessing.connection import Client, Listener
+
+import autoassign
+import idempotency
+import lottery
+import operations
+import payqueue
+import recurring
+import timeslots
+import waitlist
+from schema import ensure_schema
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ADDRESS = os.path.join(BASE_DIR, "writer.sock")
+MAX_BATCH = 64
+
+OPERATIONS = {
+    "create_booking": operations.create_booking,
+    "book_any_room": autoassign.book_any_room,
+    "book_series": recurring.book_series,
+    "enter_lottery": lottery.enter,
+    "pay_booking": operations.pay_booking,
+    "top_up": operations.top_up,
+    "edit_booking": operations.edit_booking,
+    "cancel_booking": operations.cancel_booking,
+    "join_waitlist": waitlist.join,
+    "leave_waitlist": waitlist.leave,
+    "queue_payment": payqueue.enqueue,
+    "claim_payment": payqueue.claim,
+    "record_charge": payqueue.record_charge,
+    "settle_payment": payqueue.settle,
+    "retry_payment": payqueue.retry,
+    "fail_payment": payqueue.fail,
+}
+
+
+def apply(conn, op, kwargs):
+    """Run one named operation on conn, once per idempotency_key if one is given"""
+    if op not in OPERATIONS:
+        raise ValueError(f"Unknown operation {op}")
+    kwargs = dict(kwargs)
+    key = kwargs.pop("idempotency_key", None)
+    if key:
+        return idempotency.run(conn, key, kwargs.get("user_id"), op, OPERATIONS[op], kwargs)
+    return OPERATIONS[op](conn, **kwargs)
+
+
+class LocalWriter:
+    """Run each operation in its own transaction on a fresh connection"""
+
+    def __init__(self, connect):
+        self.connect = connect
+
+    def call(self, op, **kwargs):
+        conn = self.connect()
+        try:
+            result = apply(conn, op, kwargs)
+            conn.commit()
+            return result
+        finally:
+            conn.close()
+
+
+class WriterClient:
+    """Send operations to the coordinator; one socket per calling thread"""
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None):
+        self.address = address
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def call(self, op, **kwargs):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = Client(self.address, authkey=self.authkey)
+        try:
+            conn.send((op, kwargs))
+            ok, value = conn.recv()
+        except (EOFError, OSError):
+            self._local.conn = None
+            raise
+        if not ok:
+            raise ValueError(value)
+        return value
+
+
+def run_batch(conn, batch):
+    """
+    Run [(op, kwargs)] in one transaction, each under its own savepoint.
+    Returns [(ok, result or error message)] in the same order. Whatever an
+    operation raises only undoes that operation; its caller gets the message.
+    """
+    replies = []
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for op, kwargs in batch:
+            conn.execute("SAVEPOINT op")
+            try:
+                replies.append((True, apply(conn, op, kwargs)))
+            except ValueError as e:
+                conn.execute("ROLLBACK TO op")
+                replies.append((False, str(e)))
+            except Exception as e:
+                conn.execute("ROLLBACK TO op")
+                replies.append((False, f"Write failed: {type(e).__name__}: {e}"))
+            conn.execute("RELEASE op")
+        conn.execute("COMMIT")
+    except sqlite3.Error as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        return [(False, f"Write failed: {e}")] * len(batch)
+    return replies
+
+
+class Coordinator:
+    def __init__(self, db_path, address=DEFAULT_ADDRESS, authkey=None, max_batch=MAX_BATCH):
+        self.db_path = db_path
+        self.address = address
+        self.authkey = authkey
+        self.max_batch = max_batch
+        self.pending = queue.Queue()
+        self.batches = 0
+        self.operations = 0
+
+    def _connect(self):
+        # Autocommit mode: run_batch issues BEGIN/COMMIT itself
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _read(self, client):
+        """Queue every request of one client connection"""
+        try:
+            while True:
+                request = client.recv()
+                if not (isinstance(request, tuple) and len(request) == 2 and isinstance(request[1], dict)):
+                    client.send((False, "Malformed request"))
+                    continue
+                op, kwargs = request
+                self.pending.put((op, kwargs, client))
+        except (EOFError, OSError):
+            client.close()
+
+    def _write(self):
+        conn = self._connect()
+        while True:
+            batch = [self.pending.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                replies = run_batch(conn, [(op, kwargs) for op, kwargs, _ in batch])
+            except Exception as e:
+                # Never leave callers waiting; start the next batch on a fresh connection
+                replies = [(False, f"Write failed: {e}")] * len(batch)
+                conn.close()
+                conn = self._connect()
+            self.batches += 1
+            self.operations += len(batch)
+            for (_, _, client), reply in zip(batch, replies):
+                try:
+                    client.send(reply)
+                except OSError:
+                    pass    # caller went away; its operation stands
+
+    def serve(self, ready=None):
+        conn = self._connect()
+        ensure_schema(conn)
+        timeslots.load_grid(conn.cursor())
+        conn.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+        with Listener(self.address, authkey=self.authkey) as listener:
+            threading.Thread(target=self._write, daemon=True).start()
+            if ready is not None:
+                ready.set()
+            while True:
+                client = listener.accept()
+                threading.Thread(target=self._read, args=(client,), daemon=True).start()
+
+
+if __name__ == "__main__":
+    db = os.path.join(BASE_DIR, "reservation_system.db")
+    address = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_ADDRESS
+    print(f"Writer coordinator for {db} listening on {address}")
+    Coordinator(db, address).serve()
@@ -46,7 +46,14 @@ os.environ['FLASK_ENV'] = 'production'
 # ============================================
 # Import your Flask app from app.py
 # The variable must be named 'application' for PythonAnywhere
-from app import app as application
+# start_services() migrates the database and starts this worker's background
+# threads (payment workers, job scheduler, live availability broker); importing
+# app alone starts nothing. Only the worker holding the lease in scheduler_lease
+# runs the jobs (see scheduler.py)
+# Keep app.LIVE_STREAM off here: a streaming booking page would hold one of the
+# few sync workers for minutes. Pages poll every app.LIVE_POLL_SECONDS instead
+from app import app as application, start_services
+start_services()
 
 # ============================================
 # OPTIONAL: Application startup checks